@@ -75,11 +75,14 @@ import traceback
 from io import open
 
 from twisted.internet import reactor  # @UnresolvedImport
-from twisted.internet.task import LoopingCall  #@UnresolvedImport
 from twisted.internet.defer import Deferred, fail  #@UnresolvedImport
 
 #------------------------------------------------------------------------------
 
+from lib import timer_wheel
+
+#------------------------------------------------------------------------------
+
 _Debug = True
 _DebugLevel = 10
 
@@ -97,6 +100,7 @@ _Counter = 0  # : Increment by one for every new object, the idea is to keep uni
 _Index = {}  # : Index dictionary, unique id (string) to index (int)
 _Objects = {}  # : Objects dictionary to store all state machines objects
 _StateChangedCallback = None  # : Called when some state were changed
+_TimerWheel = None  # : All state machines timers are running here, see ``timers()``
 
 #------------------------------------------------------------------------------
 
@@ -198,6 +202,30 @@ def communicate(index, event, *args, **kwargs):
     A.automat(event, *args, **kwargs)
     return d
 
+
+def timers():
+    """
+    Returns the timer wheel shared by all state machines, creates it at first call.
+    """
+    global _TimerWheel
+    if _TimerWheel is None:
+        _TimerWheel = timer_wheel.TimerWheel()
+    return _TimerWheel
+
+
+def timers_stats():
+    """
+    Returns number of running state machines timers and timer events firing lag statistics.
+    """
+    return timers().get_stats()
+
+
+def _fire_timer(index, name):
+    A = objects().get(index, None)
+    if not A:
+        return
+    A.timerEvent(name, A.timers.get(name, (None, ))[0])
+
 #------------------------------------------------------------------------------
 
 
@@ -554,20 +582,25 @@ class Automat(object):
         """
         Stop all state machine timers.
         """
-        for name, timer in self._timers.items():  # @UnusedVariable
-            if timer.running:
-                timer.stop()
-        self._timers.clear()
+        wheel = timers()
+        for timer in self._timers.values():
+            wheel.stop(timer)
 
     def startTimers(self):
         """
         Start all state machine timers.
+        Timer objects are created only once and re-used every time the state is changed.
         """
+        wheel = timers()
         for name, (interval, states) in self.timers.items():
             if len(states) > 0 and self.state not in states:
                 continue
-            self._timers[name] = LoopingCall(self.timerEvent, name, interval)
-            self._timers[name].start(interval, self.instant_timers)
+            timer = self._timers.get(name)
+            if timer is None:
+                timer = self._timers[name] = timer_wheel.Timer(_fire_timer, self.index, name)
+            wheel.start(timer, interval)
+            if self.instant_timers:
+                self.timerEvent(name, interval)
             # self.log(self.debug_level * 4, '%s.startTimers timer %s started' % (self, name))
 
     def restartTimers(self):
@@ -586,9 +619,9 @@ class Automat(object):
 
     def getTimers(self):
         """
-        Get internal timers dictionary.
+        Get internal dictionary of currently running timers.
         """
-        return self._timers
+        return {name: timer for name, timer in self._timers.items() if timer.active()}
 
     def exc(self, msg='', to_logfile=False):
         """
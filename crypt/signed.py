@@ -40,6 +40,16 @@ Packet Fields are all strings (no integers, objects, etc)
     - RemoteID : want full IDURL for other party so troublemaker could not
                 use his packets to mess up other nodes by sending it to them
     - Signature : signature on Hash is always by CreatorID
+
+Packets can be serialized in two formats:
+    - JSON : all fields are packed into a JSON document, binary Payload is encoded with latin1 and escaped
+    - binary : versioned and length-prefixed fields, Payload is carried raw at the end
+
+``Unserialize()`` detects the format automatically. Every JSON packet also advertises
+the binary format version supported by the creator in the "a" field which older nodes ignore,
+so the format to be used for a given contact is negotiated when packets are received from him,
+see ``RegisterBinaryFormat()``. Only after that the version is also placed in the "b" field which
+is covered by the signature: packets for not negotiated contacts are hashed exactly as before.
 """
 
 #------------------------------------------------------------------------------
@@ -58,6 +68,7 @@ _LogSignVerify = False
 
 import os
 import sys
+import struct
 
 from twisted.internet import threads
 
@@ -84,6 +95,14 @@ from userid import id_url
 
 #------------------------------------------------------------------------------
 
+_BinaryFormatVersion = 1
+_BinaryFormatPrefix = b'\x00BDP'
+_BinaryFormatFields = ('m', 'o', 'c', 'i', 'd', 'r', 'k', 's', 'b', 'a', 'p', )
+
+_ContactsBinaryFormats = {}
+
+#------------------------------------------------------------------------------
+
 
 class Packet(object):
     """
@@ -100,7 +119,8 @@ class Packet(object):
     make all network working.
     """
 
-    def __init__(self, Command, OwnerID, CreatorID, PacketID, Payload, RemoteID, KeyID=None, Date=None, Signature=None, ):
+    def __init__(self, Command, OwnerID, CreatorID, PacketID, Payload, RemoteID, KeyID=None, Date=None, Signature=None,
+                 BinaryFormat=None, SupportedBinaryFormat=None, ):
         """
         Init all fields and sign the packet.
         """
@@ -123,6 +143,16 @@ class Packet(object):
         self.RemoteID = id_url.field(RemoteID)
         # which private key to use to generate signature
         self.KeyID = strng.to_text(KeyID or my_id.getGlobalID(key_alias='master'))
+        # binary format version supported by the creator of that packet, it is signed together with other fields,
+        # but only if remote peer already told us that he supports binary format as well:
+        # older nodes are not aware of that field and would not be able to verify the signature
+        if BinaryFormat is None:
+            BinaryFormat = 0 if Signature else (_BinaryFormatVersion if IsBinaryFormatSupported(self.RemoteID) else 0)
+        self.BinaryFormat = int(BinaryFormat)
+        # binary format version which the creator is able to read, not signed and ignored by older nodes
+        if SupportedBinaryFormat is None:
+            SupportedBinaryFormat = self.BinaryFormat if Signature else _BinaryFormatVersion
+        self.SupportedBinaryFormat = max(int(SupportedBinaryFormat), self.BinaryFormat)
         if Signature:
             self.Signature = Signature
         else:
@@ -175,6 +205,9 @@ class Packet(object):
             stufftosum += self.RemoteID.original()
             stufftosum += sep
             stufftosum += strng.to_bin(self.KeyID)
+            if self.BinaryFormat:
+                stufftosum += sep
+                stufftosum += strng.to_bin(str(self.BinaryFormat))
         except Exception as exc:
             lg.exc()
             raise exc
@@ -322,10 +355,12 @@ class Packet(object):
         """
         return packetid.SupplierNumber(self.PacketID)
 
-    def Serialize(self):
+    def Serialize(self, binary=False):
         """
         Create a string from packet object.
         This is useful when need to save the packet on disk or send via network.
+        If ``binary`` is True the packet is packed in binary format, only nodes
+        supporting it are able to read it, see ``IsBinaryFormatSupported()``.
         """
         dct = {
             'm': self.Command,
@@ -337,7 +372,16 @@ class Packet(object):
             'r': self.RemoteID.original(),
             'k': self.KeyID,
             's': self.Signature,
-        }        
+        }
+        if binary:
+            dct['b'] = self.BinaryFormat
+            dct['a'] = self.SupportedBinaryFormat
+            return PackBinary(dct)
+        if self.BinaryFormat:
+            dct['b'] = self.BinaryFormat
+        elif self.SupportedBinaryFormat:
+            # let the remote peer know that creator can also read binary packets
+            dct['a'] = self.SupportedBinaryFormat
         src = serialization.DictToBytes(dct, encoding='latin1')
         # if _Debug:
         #     lg.out(_DebugLevel, 'signed.Serialize %d bytes %s(%s) %s/%s/%s KeyID=%s\n%r' % (
@@ -363,14 +407,21 @@ class PacketZeroSigned(Packet):
 
 def Unserialize(data):
     """
-    We expect here a string containing a whole packet object in text form.
+    We expect here a string containing a whole packet object in text or binary form.
     Will return a real object in the memory from given string.
     All class fields are loaded, signature can be verified to be sure - it was truly original string.
     """
     if data is None:
         return None
 
-    dct = serialization.BytesToDict(data, keys_to_text=True, encoding='latin1')
+    if IsBinary(data):
+        try:
+            dct = UnpackBinary(data)
+        except:
+            lg.exc()
+            return None
+    else:
+        dct = serialization.BytesToDict(data, keys_to_text=True, encoding='latin1')
 
     # if _Debug:
     #     lg.out(_DebugLevel, 'signed.Unserialize %d bytes : %r' % (len(data), dct['s']))
@@ -385,6 +436,8 @@ def Unserialize(data):
         RemoteID = dct['r']
         KeyID = strng.to_text(dct['k'])
         Signature = dct['s']
+        BinaryFormat = int(dct.get('b', 0) or 0)
+        SupportedBinaryFormat = int(dct.get('a', 0) or 0)
     except:
         lg.exc()
         return None
@@ -400,6 +453,8 @@ def Unserialize(data):
             RemoteID=RemoteID,
             KeyID=KeyID,
             Signature=Signature,
+            BinaryFormat=BinaryFormat,
+            SupportedBinaryFormat=SupportedBinaryFormat,
         )
     except:
         if _Debug:
@@ -419,9 +474,83 @@ def Unserialize(data):
 
     # if _Debug:
     #     lg.args(_DebugLevel, Command=Command, PacketID=PacketID, OwnerID=OwnerID, CreatorID=CreatorID, RemoteID=RemoteID)
-
     return newobject
 
+#------------------------------------------------------------------------------
+
+def IsBinary(data):
+    """
+    Return True if input bytes are holding a packet in binary format.
+    """
+    return data[:len(_BinaryFormatPrefix)] == _BinaryFormatPrefix
+
+
+def PackBinary(dct):
+    """
+    Pack packet fields into bytes:
+
+        <prefix><version:1 byte>[<field length:4 bytes><field value>]...
+
+    Fields are placed in the order of ``_BinaryFormatFields``, Payload is the last one.
+    """
+    parts = [_BinaryFormatPrefix, struct.pack('>B', _BinaryFormatVersion), ]
+    for field_name in _BinaryFormatFields:
+        value = strng.to_bin(dct[field_name])
+        parts.append(struct.pack('>I', len(value)))
+        parts.append(value)
+    return b''.join(parts)
+
+
+def UnpackBinary(data):
+    """
+    Opposite to ``PackBinary()``, returns a dictionary with packet fields.
+    """
+    view = memoryview(data)
+    pos = len(_BinaryFormatPrefix)
+    if len(view) < pos + 1:
+        raise ValueError('binary packet is too short')
+    version = struct.unpack('>B', view[pos:pos + 1])[0]
+    if version > _BinaryFormatVersion:
+        raise ValueError('unsupported binary packet format version: %d' % version)
+    pos += 1
+    dct = {}
+    for field_name in _BinaryFormatFields:
+        if len(view) < pos + 4:
+            raise ValueError('binary packet is truncated')
+        field_length = struct.unpack('>I', view[pos:pos + 4])[0]
+        pos += 4
+        if len(view) < pos + field_length:
+            raise ValueError('binary packet is truncated')
+        dct[field_name] = view[pos:pos + field_length].tobytes()
+        pos += field_length
+    return dct
+
+#------------------------------------------------------------------------------
+
+def RegisterBinaryFormat(idurl, binary_format):
+    """
+    Remember which binary format version given contact supports, 0 means binary format is not supported.
+    Called for every incoming packet after its signature was verified, see ``packet_in.handle()``.
+    """
+    global _ContactsBinaryFormats
+    idurl_bin = id_url.to_bin(idurl)
+    if not idurl_bin:
+        return
+    binary_format = min(binary_format or 0, _BinaryFormatVersion)
+    if binary_format:
+        _ContactsBinaryFormats[idurl_bin] = binary_format
+    else:
+        _ContactsBinaryFormats.pop(idurl_bin, None)
+
+
+def IsBinaryFormatSupported(idurl):
+    """
+    Return True if packets to given contact can be sent in binary format.
+    """
+    if not idurl:
+        return False
+    return _ContactsBinaryFormats.get(id_url.to_bin(idurl), 0) > 0
+
 
 def MakePacket(Command, OwnerID, CreatorID, PacketID, Payload, RemoteID):
     """
@@ -248,11 +248,13 @@ class ListFilesOrator(automat.Automat):
         """
         Action method.
         """
+        from storage import backup_matrix
         supplier_idurl = args[0]
         if _Debug:
             lg.out(_DebugLevel, 'list_files_orator.doRequestFilesOneSupplier from %s' % supplier_idurl)
         outpacket = p2p_service.SendListFiles(
             target_supplier=supplier_idurl,
+            manifest=backup_matrix.GetSupplierManifest(contactsdb.supplier_position(supplier_idurl)),
         )
         if outpacket:
             _RequestedListFilesPacketIDs.add(outpacket.PacketID)
@@ -262,6 +264,7 @@ class ListFilesOrator(automat.Automat):
     def _do_request(self, x=None):
         global _ReceivedListFilesCounter
         global _RequestedListFilesPacketIDs
+        from storage import backup_matrix
         _ReceivedListFilesCounter = 0
         _RequestedListFilesPacketIDs.clear()
         for idurl in contactsdb.suppliers():
@@ -271,6 +274,7 @@ class ListFilesOrator(automat.Automat):
                         lg.out(_DebugLevel, 'list_files_orator._do_request  ListFiles() from my supplier %s' % idurl)
                     outpacket = p2p_service.SendListFiles(
                         target_supplier=idurl,
+                        manifest=backup_matrix.GetSupplierManifest(contactsdb.supplier_position(idurl)),
                     )
                     if outpacket:
                         _RequestedListFilesPacketIDs.add(outpacket.PacketID)
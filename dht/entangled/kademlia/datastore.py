@@ -19,7 +19,10 @@ from __future__ import absolute_import
 try:
     from UserDict import DictMixin
 except ImportError:
-    from collections import MutableMapping as DictMixin
+    try:
+        from collections.abc import MutableMapping as DictMixin
+    except ImportError:
+        from collections import MutableMapping as DictMixin
 
 import sqlite3
 import os
@@ -39,8 +42,14 @@ PROTOCOL_VERSION = 1
 
 PICKLE_PROTOCOL = 2
 
+SCHEMA_VERSION = 1
+
 _Debug = False
 
+_UpsertSupported = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+_Columns = 'key, value, lastPublished, originallyPublished, originalPublisherID, expireSeconds, revision'
+
 
 class DataStore(DictMixin):
     """
@@ -82,6 +91,24 @@ class DataStore(DictMixin):
         """
         """
 
+    def iterItems(self, originallyPublishedBefore=None, lastPublishedBefore=None):
+        """
+        Iterate over stored records, every record is a dictionary same as returned by C{getItem}.
+
+        If any of the time limits is given only records originally published or last published
+        before that moment are returned.
+        """
+        for key in self.keys():
+            item = self.getItem(key)
+            if item is None:
+                continue
+            if originallyPublishedBefore is None and lastPublishedBefore is None:
+                yield item
+            elif originallyPublishedBefore is not None and item['originallyPublished'] <= originallyPublishedBefore:
+                yield item
+            elif lastPublishedBefore is not None and item['lastPublished'] <= lastPublishedBefore:
+                yield item
+
     def setItem(self, key, value, lastPublished, originallyPublished, originalPublisherID, **kwargs):
         """
         Set the value of the (key, value) pair identified by C{key}; this
@@ -128,7 +155,7 @@ class DictDataStore(DataStore):
 
     def __init__(self):
         # Dictionary format:
-        # { <key>: (<value>, <lastPublished>, <originallyPublished> <originalPublisherID>) }
+        # { <key>: (<value>, <lastPublished>, <originallyPublished> <originalPublisherID>, <expireSeconds>, <revision>) }
         self._dict = {}
 
     def keys(self):
@@ -169,7 +196,14 @@ class DictDataStore(DataStore):
         should set the "last published" value for the (key, value) pair to the
         current time.
         """
-        self._dict[key] = (value, lastPublished, originallyPublished, originalPublisherID)
+        self._dict[key] = (
+            value,
+            lastPublished,
+            originallyPublished,
+            originalPublisherID,
+            kwargs.get('expireSeconds', constants.dataExpireSecondsDefaut),
+            kwargs.get('revision', None) or 0,
+        )
 
     def __getitem__(self, key):
         """
@@ -187,11 +221,13 @@ class DictDataStore(DataStore):
         try:
             row = self._dict[key]
             result = dict(
-                key=row[0].encode(),
-                value=row[1],
-                lastPublished=row[2],
-                originallyPublished=row[3],
-                originalPublisherID=None if not row[4] else row[4].encode(),
+                key=key,
+                value=row[0],
+                lastPublished=row[1],
+                originallyPublished=row[2],
+                originalPublisherID=row[3] or None,
+                expireSeconds=row[4],
+                revision=row[5],
             )
         except:
             return None
@@ -202,6 +238,10 @@ class DictDataStore(DataStore):
 class SQLiteVersionedJsonDataStore(DataStore):
     """
     SQLite database-based datastore.
+
+    Records are indexed by C{key}, so reading and writing of a single record does not scan the whole table.
+    Tables created by older versions without primary key are migrated when the file is opened,
+    see C{SCHEMA_VERSION}.
     """
 
     def __init__(self, dbFile=':memory:'):
@@ -211,22 +251,19 @@ class SQLiteVersionedJsonDataStore(DataStore):
         @type dbFile: str
         """
         self.dbFile = dbFile
-        createDB = not os.path.exists(dbFile)
         if _Debug:
-            print('[DHT DB] dbFile=%r   createDB=%r' % (dbFile, createDB, ))
-        self._db = sqlite3.connect(dbFile)
+            print('[DHT DB] dbFile=%r   exists=%r' % (dbFile, os.path.exists(dbFile), ))
+        # republishing of the data is walking through the records in a deferred thread
+        self._db = sqlite3.connect(dbFile, check_same_thread=False)
         self._db.isolation_level = None
         self._db.text_factory = encoding.to_text
-        if createDB:
-            self.create_table()
-            if _Debug:
-                print('[DHT DB]  Created empty table for DHT records')
+        self.create_table()
         self._cursor = self._db.cursor()
 
     def _dbQuery(self, key, columnName):
         try:
             self._cursor.execute("SELECT %s FROM data WHERE key=:reqKey" % columnName, {
-                'reqKey': key,
+                'reqKey': encoding.to_text(key),
             })
             row = self._cursor.fetchone()
             value = row[0]
@@ -235,6 +272,26 @@ class SQLiteVersionedJsonDataStore(DataStore):
         else:
             return value
 
+    def _rowToItem(self, row):
+        v = row[1]
+        if isinstance(v, buffer):
+            v = encoding.to_text(v)
+
+        v = json.loads(v)
+
+        # TODO: check / verify v['k'] against key_hex
+        # TODO: check / verify v['v'] against PROTOCOL_VERSION
+
+        return dict(
+            key=row[0],
+            value=v['d'],
+            lastPublished=row[2],
+            originallyPublished=row[3],
+            originalPublisherID=row[4] or None,
+            expireSeconds=row[5],
+            revision=row[6],
+        )
+
     def __getitem__(self, key):
         v = self._dbQuery(key, 'value')
         v = json.loads(v)
@@ -242,11 +299,48 @@ class SQLiteVersionedJsonDataStore(DataStore):
 
     def __delitem__(self, key):
         self._cursor.execute("DELETE FROM data WHERE key=:reqKey", {
-            'reqKey': key,
+            'reqKey': encoding.to_text(key),
+        })
+
+    def __contains__(self, key):
+        self._cursor.execute("SELECT 1 FROM data WHERE key=:reqKey", {
+            'reqKey': encoding.to_text(key),
         })
+        return self._cursor.fetchone() is not None
 
     def create_table(self):
-        self._db.execute('CREATE TABLE data(key, value, lastPublished, originallyPublished, originalPublisherID, expireSeconds, revision)')
+        """
+        Creates the table or migrates records from the table of an older version.
+        """
+        schema_version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if schema_version >= SCHEMA_VERSION:
+            return
+        table_exists = self._db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='data'").fetchone() is not None
+        self._db.execute('BEGIN')
+        try:
+            if table_exists:
+                self._db.execute('ALTER TABLE data RENAME TO data_old')
+            self._db.execute(
+                'CREATE TABLE data(key TEXT PRIMARY KEY, value, lastPublished INTEGER, originallyPublished INTEGER, '
+                'originalPublisherID, expireSeconds INTEGER, revision INTEGER)'
+            )
+            self._db.execute('CREATE INDEX data_last_published ON data(lastPublished)')
+            self._db.execute('CREATE INDEX data_originally_published ON data(originallyPublished)')
+            if table_exists:
+                # old table may contain same key many times, the latest row wins
+                self._db.execute(
+                    'INSERT OR REPLACE INTO data(key, value, lastPublished, originallyPublished, originalPublisherID, expireSeconds, revision) '
+                    'SELECT key, value, lastPublished, originallyPublished, originalPublisherID, expireSeconds, revision FROM data_old ORDER BY rowid'
+                )
+                self._db.execute('DROP TABLE data_old')
+            self._db.execute('PRAGMA user_version=%d' % SCHEMA_VERSION)
+        except:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+        if _Debug:
+            print('[DHT DB] %r schema version %d %s' % (
+                self.dbFile, SCHEMA_VERSION, 'migrated' if table_exists else 'created'))
 
     def keys(self):
         """
@@ -309,105 +403,81 @@ class SQLiteVersionedJsonDataStore(DataStore):
                 **kwargs):
         key_hex = encoding.to_text(key)
         new_revision = kwargs.get('revision', None)
-        if new_revision is None:
-            new_revision = self.revision(key) + 1
-        self._cursor.execute("select key from data where key=:reqKey", {'reqKey': key_hex})
         opID = originalPublisherID or None
-        if self._cursor.fetchone() is None:
-            self._cursor.execute('INSERT INTO data(key, value, lastPublished, originallyPublished, originalPublisherID, expireSeconds, revision) VALUES (?, ?, ?, ?, ?, ?, ?)', (
-                key_hex,
-                json.dumps({'k': key_hex, 'd': value, 'v': PROTOCOL_VERSION, }, ),
-                lastPublished,
-                originallyPublished,
-                opID,
-                expireSeconds,
-                new_revision,
-            ))
-            if _Debug:
-                print('[DHT DB] %r setItem  stored new value for key [%s] with revision %d' % (self.dbFile, key, new_revision))
+        params = {
+            'key': key_hex,
+            'value': json.dumps({'k': key_hex, 'd': value, 'v': PROTOCOL_VERSION, }, ),
+            'lastPublished': lastPublished,
+            'originallyPublished': originallyPublished,
+            'originalPublisherID': opID,
+            'expireSeconds': expireSeconds,
+            'revision': new_revision,
+        }
+        # when revision is not given the stored one is incremented in the same statement
+        if _UpsertSupported:
+            self._cursor.execute(
+                'INSERT INTO data(key, value, lastPublished, originallyPublished, originalPublisherID, expireSeconds, revision) '
+                'VALUES (:key, :value, :lastPublished, :originallyPublished, :originalPublisherID, :expireSeconds, COALESCE(:revision, 1)) '
+                'ON CONFLICT(key) DO UPDATE SET value=excluded.value, lastPublished=excluded.lastPublished, '
+                'originallyPublished=excluded.originallyPublished, originalPublisherID=excluded.originalPublisherID, '
+                'expireSeconds=excluded.expireSeconds, revision=COALESCE(:revision, data.revision + 1)',
+                params,
+            )
         else:
-            self._cursor.execute('UPDATE data SET value=?, lastPublished=?, originallyPublished=?, originalPublisherID=?, expireSeconds=?, revision=? WHERE key=?', (
-                json.dumps({'k': key_hex, 'd': value, 'v': PROTOCOL_VERSION, }, ),
-                lastPublished,
-                originallyPublished,
-                opID,
-                expireSeconds,
-                new_revision,
-                key_hex,
-            ))
-            if _Debug:
-                print('[DHT DB] %r setItem  updated existing value for key [%s] with revision %d' % (self.dbFile, key, new_revision))
+            self._cursor.execute(
+                'INSERT OR REPLACE INTO data(key, value, lastPublished, originallyPublished, originalPublisherID, expireSeconds, revision) '
+                'VALUES (:key, :value, :lastPublished, :originallyPublished, :originalPublisherID, :expireSeconds, '
+                'COALESCE(:revision, (SELECT revision FROM data WHERE key=:key) + 1, 1))',
+                params,
+            )
+        if _Debug:
+            print('[DHT DB] %r setItem  stored value for key [%s] with revision %r' % (self.dbFile, key, new_revision))
 
     def getItem(self, key):
-        key_hex = key
         key_hex = encoding.to_text(key)
-        self._cursor.execute("SELECT * FROM data WHERE key=:reqKey", {
+        self._cursor.execute("SELECT %s FROM data WHERE key=:reqKey" % _Columns, {
             'reqKey': key_hex,
         })
-
         row = self._cursor.fetchone()
         if not row:
             if _Debug:
-                print('[DHT DB] %r getItem [%s]  return None : did not found key in dataStore' % (self.dbfile, key))
+                print('[DHT DB] %r getItem [%s]  return None : did not found key in dataStore' % (self.dbFile, key))
             return None
 
-        v = row[1]
-        if isinstance(v, buffer):
-            v = encoding.to_text(v)
-
-        v = json.loads(v)
-        
-        # TODO: check / verify v['k'] against key_hex
-        # TODO: check / verify v['v'] against PROTOCOL_VERSION
-
-        value = v['d']
-
-        key_orig = row[0]
-
         # TODO: check / verify key_orig against key
 
-        opID = row[4] or None
-
-        result = dict(
-            key=key_orig,
-            value=value,
-            lastPublished=row[2],
-            originallyPublished=row[3],
-            originalPublisherID=opID,
-            expireSeconds=row[5],
-            revision=row[6],
-        )
-
+        result = self._rowToItem(row)
         if _Debug:
             print('[DHT DB] %r getItem   found one record for key [%s], revision is %d' % (self.dbFile, key, row[6]))
         return result
 
     def getAllItems(self):
-        self._cursor.execute("SELECT * FROM data")
-        rows = self._cursor.fetchall()
         items = []
-        for row in rows:
-
-            v = row[1]
-            if isinstance(v, buffer):
-                v = encoding.to_text(v)
-
-            v = json.loads(v)
-            
-            # TODO: check / verify v['k'] against key_hex
-            # TODO: check / verify v['v'] against PROTOCOL_VERSION
-    
-            value = v['d']
-
-            _k = row[0]
-            _opID = row[4] or None
-
-            items.append(dict(
-                value=value,
-                lastPublished=row[2],
-                originallyPublished=row[3],
-                originalPublisherID=_opID,
-                expireSeconds=row[5],
-                revision=row[6],
-            ))
+        for item in self.iterItems():
+            item.pop('key')
+            items.append(item)
         return items
+
+    def iterItems(self, originallyPublishedBefore=None, lastPublishedBefore=None):
+        """
+        Walks through the records with a single query, see L{DataStore.iterItems}.
+        """
+        query = "SELECT %s FROM data" % _Columns
+        params = {}
+        conditions = []
+        if originallyPublishedBefore is not None:
+            conditions.append('originallyPublished <= :originallyPublishedBefore')
+            params['originallyPublishedBefore'] = originallyPublishedBefore
+        if lastPublishedBefore is not None:
+            conditions.append('lastPublished <= :lastPublishedBefore')
+            params['lastPublishedBefore'] = lastPublishedBefore
+        if conditions:
+            query += ' WHERE ' + ' OR '.join(conditions)
+        # separate cursor, so other calls to the data store are not interrupting the walk
+        cursor = self._db.cursor()
+        try:
+            cursor.execute(query, params)
+            for row in cursor:
+                yield self._rowToItem(row)
+        finally:
+            cursor.close()
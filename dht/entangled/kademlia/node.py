@@ -656,18 +656,11 @@ class Node(object):
         #     self._counter('rpc_node_findValue')
         if _Debug:
             print('[DHT NODE] SINGLE rpcmethod.findValue %r' % key)
-        if key in self._dataStore:
-            exp = None
-            expireSecondsCall = getattr(self._dataStore, 'expireSeconds')
-            if expireSecondsCall:
-                exp = expireSecondsCall(key)
-            originalPublishTimeCall = getattr(self._dataStore, 'originalPublishTime')
-            published = None
-            if originalPublishTimeCall:
-                published = originalPublishTimeCall(key)
+        item = self._dataStore.getItem(key)
+        if item is not None:
             if _Debug:
-                print('[DHT NODE]  SINGLE    found key in local dataStore %r' % self._dataStore[key])
-            return {key: self._dataStore[key], 'expireSeconds': exp, 'originallyPublished': published, }
+                print('[DHT NODE]  SINGLE    found key in local dataStore %r' % item['value'])
+            return {key: item['value'], 'expireSeconds': item['expireSeconds'], 'originallyPublished': item['originallyPublished'], }
         if _Debug:
             print('[DHT NODE] SINGLE     NOT found key in local dataStore')
         return self.findNode(key, **kwargs)
@@ -987,15 +980,18 @@ class Node(object):
         if _Debug:
             print('[DHT NODE]  SINGLE republishData called, node: %r' % self.id)
         expiredKeys = []
-        for key in self._dataStore.keys():
+        now = int(time.time())
+        # only records which must be republished, replicated or removed are read from the datastore
+        for itemData in self._dataStore.iterItems(
+            originallyPublishedBefore=now - constants.dataExpireTimeout,
+            lastPublishedBefore=now - constants.replicateInterval,
+        ):
+            key = itemData['key']
             if _Debug:
                 print('[DHT NODE]  SINGLE    %r' % key)
             # Filter internal variables stored in the datastore
             if key == 'nodeState':
                 continue
-            
-            now = int(time.time())
-            itemData = self._dataStore.getItem(key)
             originallyPublished = itemData['originallyPublished']
             originalPublisherID = itemData['originalPublisherID']
             lastPublished = itemData['lastPublished']
@@ -1024,7 +1020,7 @@ class Node(object):
                     twisted.internet.reactor.callFromThread(  # @UndefinedVariable
                         self.iterativeStore,
                         key=key,
-                        value=self._dataStore[key],
+                        value=itemData['value'],
                         originalPublisherID=originalPublisherID,
                         age=age,
                         expireSeconds=expireSeconds,
@@ -1527,18 +1523,11 @@ class MultiLayerNode(Node):
             return []
         if _Debug:
             print('[DHT NODE]    rpcmethod.findValue %r layerID=%r : %r' % (key, layerID, kwargs))
-        if key in self._dataStores[layerID]:
-            exp = None
-            expireSecondsCall = getattr(self._dataStores[layerID], 'expireSeconds')
-            if expireSecondsCall:
-                exp = expireSecondsCall(key)
-            originalPublishTimeCall = getattr(self._dataStores[layerID], 'originalPublishTime')
-            published = None
-            if originalPublishTimeCall:
-                published = originalPublishTimeCall(key)
+        item = self._dataStores[layerID].getItem(key)
+        if item is not None:
             if _Debug:
-                print('[DHT NODE]        found key in local dataStore %r' % self._dataStores[layerID][key])
-            return {key: self._dataStores[layerID][key], 'expireSeconds': exp, 'originallyPublished': published, }
+                print('[DHT NODE]        found key in local dataStore %r' % item['value'])
+            return {key: item['value'], 'expireSeconds': item['expireSeconds'], 'originallyPublished': item['originallyPublished'], }
         if _Debug:
             print('[DHT NODE]        NOT found key in local dataStore')
         return self.findNode(key, **kwargs)
@@ -1835,15 +1824,18 @@ class MultiLayerNode(Node):
         if _Debug:
             print('[DHT NODE]    republishData called, node: %r' % self.layers[layerID])
         expiredKeys = []
-        for key in self._dataStores[layerID].keys():
+        now = int(time.time())
+        # only records which must be republished, replicated or removed are read from the datastore
+        for itemData in self._dataStores[layerID].iterItems(
+            originallyPublishedBefore=now - constants.dataExpireTimeout,
+            lastPublishedBefore=now - constants.replicateInterval,
+        ):
+            key = itemData['key']
             if _Debug:
                 print('[DHT NODE]        %r' % key)
             # Filter internal variables stored in the datastore
             if key == 'nodeState':
                 continue
-            
-            now = int(time.time())
-            itemData = self._dataStores[layerID].getItem(key)
             originallyPublished = itemData['originallyPublished']
             originalPublisherID = itemData['originalPublisherID']
             lastPublished = itemData['lastPublished']
@@ -1873,7 +1865,7 @@ class MultiLayerNode(Node):
                     twisted.internet.reactor.callFromThread(  # @UndefinedVariable
                         self.iterativeStore,
                         key=key,
-                        value=self._dataStore[key],
+                        value=itemData['value'],
                         originalPublisherID=originalPublisherID,
                         age=age,
                         expireSeconds=expireSeconds,
@@ -3575,6 +3575,27 @@ def customer_reject(customer_id):
     return OK('customer "%s" rejected, "%s" bytes were freed' % (customer_idurl, consumed_by_cutomer))
 
 
+def customers_files_manifest_rebuild():
+    """
+    Walks all customers folders on local disc and builds again the index of stored files,
+    which is used to respond to ListFiles() requests from customers.
+
+    ###### HTTP
+        curl -X POST 'localhost:8180/customer/manifest/rebuild/v1'
+
+    ###### WebSocket
+        websocket.send('{"command": "api_call", "method": "customers_files_manifest_rebuild", "kwargs": {} }');
+    """
+    if not driver.is_on('service_supplier'):
+        return ERROR('service_supplier() is not started')
+    from supplier import files_manifest
+    results = files_manifest.rebuild_all()
+    return RESULT([{
+        'customer_id': customer_dir_name,
+        'items': items,
+    } for customer_dir_name, items in results.items()])
+
+
 def customers_ping():
     """
     Check current on-line status of all customers.
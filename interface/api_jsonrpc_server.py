@@ -301,6 +301,9 @@ class BitDustJsonRPCServer(JSONRPCServer):
     def jsonrpc_customer_reject(self, idurl):
         return api.customer_reject(idurl)
 
+    def jsonrpc_customers_files_manifest_rebuild(self):
+        return api.customers_files_manifest_rebuild()
+
     def jsonrpc_customers_ping(self):
         return api.customers_ping()
 
@@ -1018,6 +1018,12 @@ class BitDustRESTHTTPServer(JsonAPIResource):
             idurl_or_global_id=data.get('global_id') or data.get('idurl') or data.get('id'),
         )
 
+    @POST('^/cu/mr$')
+    @POST('^/v1/customer/manifest/rebuild$')
+    @POST('^/customer/manifest/rebuild/v1$')
+    def customer_manifest_rebuild_v1(self, request):
+        return api.customers_files_manifest_rebuild()
+
     @POST('^/cu/png$')
     @POST('^/v1/customer/ping$')
     @POST('^/customer/ping/v1$')
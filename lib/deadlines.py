@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# deadlines.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (deadlines.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+
+"""
+..
+
+module:: deadlines
+
+Keeps a heap of deadlines for many objects and runs only one reactor delayed call
+pointing to the closest one.
+When deadline is reached callback is executed only for the objects which are actually expired,
+so the cost does not depend on how many objects are tracked at the moment.
+
+Every object can have only one deadline: registering it again will replace previous one.
+Removed and replaced entries stay in the heap and are skipped when popped.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+#------------------------------------------------------------------------------
+
+import time
+import heapq
+
+#------------------------------------------------------------------------------
+
+from twisted.internet import reactor  # @UnresolvedImport
+
+#------------------------------------------------------------------------------
+
+from logs import lg
+
+#------------------------------------------------------------------------------
+
+
+class DeadlineScheduler(object):
+
+    def __init__(self, callback, clock=None, precision=0):
+        """
+        The `callback` will be called with a single argument - the object which deadline was reached.
+        Use `clock` to pass another `IReactorTime` provider, `twisted.internet.task.Clock` in tests.
+        Deadlines closer than `precision` seconds to each other are fired together.
+        """
+        self.callback = callback
+        self.clock = clock or reactor
+        self.precision = precision
+        self.heap = []
+        self.entries = {}
+        self.counter = 0
+        self.task = None
+        self.task_time = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, obj):
+        return id(obj) in self.entries
+
+    def now(self):
+        if self.clock is reactor:
+            return time.time()
+        return self.clock.seconds()
+
+    def register(self, obj, deadline):
+        """
+        Set absolute `deadline` moment (in seconds, same as `time.time()`) for given object.
+        """
+        self.counter += 1
+        entry = [deadline, self.counter, obj, ]
+        old_entry = self.entries.pop(id(obj), None)
+        if old_entry:
+            old_entry[2] = None
+        self.entries[id(obj)] = entry
+        heapq.heappush(self.heap, entry)
+        if self.task_time is None or deadline < self.task_time:
+            self._schedule()
+
+    def unregister(self, obj):
+        """
+        Forget the deadline of given object, returns False if it was not registered.
+        """
+        entry = self.entries.pop(id(obj), None)
+        if not entry:
+            return False
+        entry[2] = None
+        if not self.entries:
+            self.stop()
+        return True
+
+    def stop(self):
+        """
+        Cancel the delayed call and forget all registered deadlines.
+        """
+        if self.task and self.task.active():
+            self.task.cancel()
+        self.task = None
+        self.task_time = None
+        for entry in self.entries.values():
+            entry[2] = None
+        self.entries.clear()
+        self.heap = []
+
+    def _schedule(self):
+        while self.heap and self.heap[0][2] is None:
+            heapq.heappop(self.heap)
+        if self.task and self.task.active():
+            self.task.cancel()
+        self.task = None
+        self.task_time = None
+        if not self.heap:
+            return
+        self.task_time = self.heap[0][0]
+        delay = max(0, self.task_time - self.now())
+        self.task = self.clock.callLater(delay, self._on_timer)
+
+    def _on_timer(self):
+        self.task = None
+        self.task_time = None
+        expired = []
+        limit = self.now() + self.precision
+        while self.heap and self.heap[0][0] <= limit:
+            _, _, obj = heapq.heappop(self.heap)
+            if obj is None:
+                continue
+            self.entries.pop(id(obj), None)
+            expired.append(obj)
+        for obj in expired:
+            try:
+                self.callback(obj)
+            except:
+                lg.exc()
+        if self.task is None:
+            self._schedule()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# timer_wheel.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (timer_wheel.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+
+"""
+..
+
+module:: timer_wheel
+
+Hierarchical timing wheel for many periodic timers driven by a single reactor delayed call.
+
+Time is split into ticks of `TimerWheel.tick` seconds. There are `WHEEL_LEVELS` wheels of
+`WHEEL_SIZE` slots: the first wheel keeps timers which expire within next `WHEEL_SIZE` ticks,
+every next wheel covers `WHEEL_SIZE` times longer period. When the first wheel makes a full turn,
+timers from the corresponding slot of the next wheel are moved down ("cascaded").
+
+Starting and stopping a timer only adds or removes it from one slot, so it costs the same
+for any number of running timers. A `Timer` object is created once by the owner and re-used
+every time it is started again, reactor delayed call is re-scheduled only when the closest
+non-empty slot changes.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+#------------------------------------------------------------------------------
+
+import math
+
+#------------------------------------------------------------------------------
+
+from twisted.internet import reactor  # @UnresolvedImport
+
+#------------------------------------------------------------------------------
+
+from logs import lg
+
+#------------------------------------------------------------------------------
+
+WHEEL_BITS = 6
+WHEEL_SIZE = 1 << WHEEL_BITS
+WHEEL_MASK = WHEEL_SIZE - 1
+WHEEL_LEVELS = 4
+
+#------------------------------------------------------------------------------
+
+
+class Timer(object):
+    """
+    Periodic timer, `callback(*args)` is executed every `interval` seconds while timer is running.
+    """
+
+    __slots__ = ('callback', 'args', 'ticks', 'expires', 'slot', )
+
+    def __init__(self, callback, *args):
+        self.callback = callback
+        self.args = args
+        self.ticks = 0
+        self.expires = 0
+        self.slot = None
+
+    def active(self):
+        return self.slot is not None
+
+
+class TimerWheel(object):
+
+    def __init__(self, clock=None, tick=0.01):
+        """
+        Use `clock` to pass another `IReactorTime` provider, `twisted.internet.task.Clock` in tests.
+        """
+        self.clock = clock or reactor
+        self.tick = tick
+        self.base = None
+        self.current = 0
+        self.count = 0
+        self.wheels = [[set() for _ in range(WHEEL_SIZE)] for _ in range(WHEEL_LEVELS)]
+        self.task = None
+        self.task_tick = None
+        self.running = False
+        self.stats = {
+            'started': 0,
+            'fired': 0,
+            'wakeups': 0,
+            'lag_total': 0.0,
+            'lag_max': 0.0,
+        }
+
+    def __len__(self):
+        return self.count
+
+    def now_tick(self):
+        # small addition protects from waking up right before the tick because of float rounding
+        return int((self.clock.seconds() - self.base) / self.tick + 0.001)
+
+    def start(self, timer, interval):
+        """
+        Start given timer or restart it if it is already running, first call will happen after `interval` seconds.
+        """
+        if self.base is None:
+            self.base = self.clock.seconds()
+        if timer.slot is not None:
+            timer.slot.discard(timer)
+            self.count -= 1
+        if not self.count and not self.running:
+            # nothing was running, wheel did not turn for a while
+            self.current = max(self.current, self.now_tick())
+        timer.ticks = max(1, int(math.ceil(interval / self.tick - 0.001)))
+        timer.expires = self.now_tick() + timer.ticks
+        self._place(timer)
+        self.stats['started'] += 1
+        if self.running:
+            # delayed call will be re-scheduled after all expired timers are processed
+            return
+        if self.task_tick is None or timer.expires < self.task_tick:
+            self._schedule()
+
+    def stop(self, timer):
+        """
+        Stop given timer, returns False if it was not running.
+        """
+        if timer.slot is None:
+            return False
+        timer.slot.discard(timer)
+        timer.slot = None
+        self.count -= 1
+        if not self.count and not self.running:
+            self._cancel()
+        return True
+
+    def clear(self):
+        """
+        Stop all timers and cancel the reactor delayed call.
+        """
+        for wheel in self.wheels:
+            for slot in wheel:
+                for timer in slot:
+                    timer.slot = None
+                slot.clear()
+        self.count = 0
+        self._cancel()
+
+    def get_stats(self):
+        """
+        Returns a dictionary with number of running timers and firing lag statistics.
+        """
+        result = dict(self.stats)
+        result['timers'] = self.count
+        result['lag_avg'] = (self.stats['lag_total'] / self.stats['fired']) if self.stats['fired'] else 0.0
+        return result
+
+    def _place(self, timer):
+        delta = timer.expires - self.current
+        if delta < 0:
+            level, expires = 0, self.current
+        elif delta < WHEEL_SIZE:
+            level, expires = 0, timer.expires
+        else:
+            level, expires = 1, timer.expires
+            while level < WHEEL_LEVELS - 1 and delta >= (1 << (WHEEL_BITS * (level + 1))):
+                level += 1
+            if delta >= (1 << (WHEEL_BITS * WHEEL_LEVELS)):
+                expires = self.current + (1 << (WHEEL_BITS * WHEEL_LEVELS)) - 1
+        timer.slot = self.wheels[level][(expires >> (WHEEL_BITS * level)) & WHEEL_MASK]
+        timer.slot.add(timer)
+        self.count += 1
+
+    def _cascade(self, tick):
+        for level in range(1, WHEEL_LEVELS):
+            index = (tick >> (WHEEL_BITS * level)) & WHEEL_MASK
+            slot = self.wheels[level][index]
+            if slot:
+                self.wheels[level][index] = set()
+                for timer in slot:
+                    timer.slot = None
+                    self.count -= 1
+                    self._place(timer)
+            if index != 0:
+                break
+
+    def _next_tick(self):
+        """
+        Returns closest tick when some timer expires or some timers must be cascaded.
+        """
+        result = None
+        first_wheel = self.wheels[0]
+        for tick in range(self.current, self.current + WHEEL_SIZE):
+            if first_wheel[tick & WHEEL_MASK]:
+                result = tick
+                break
+        tick = (self.current + WHEEL_MASK) & ~WHEEL_MASK
+        second_wheel = self.wheels[1]
+        for _ in range(WHEEL_SIZE):
+            if result is not None and tick >= result:
+                break
+            index = (tick >> WHEEL_BITS) & WHEEL_MASK
+            if index == 0 or second_wheel[index]:
+                return tick
+            tick += WHEEL_SIZE
+        return result if result is not None else tick
+
+    def _advance(self, now_tick):
+        while self.count:
+            tick = self._next_tick()
+            if tick > now_tick:
+                break
+            self.current = tick
+            if tick & WHEEL_MASK == 0:
+                self._cascade(tick)
+            slot = self.wheels[0][tick & WHEEL_MASK]
+            while slot:
+                timer = slot.pop()
+                timer.slot = None
+                self.count -= 1
+                self._fire(timer, now_tick)
+            self.current = tick + 1
+        self.current = max(self.current, now_tick + 1)
+
+    def _fire(self, timer, now_tick):
+        lag = max(0.0, self.clock.seconds() - self.base - timer.expires * self.tick)
+        self.stats['fired'] += 1
+        self.stats['lag_total'] += lag
+        if lag > self.stats['lag_max']:
+            self.stats['lag_max'] = lag
+        # same as LoopingCall : calls missed because of a delay are skipped
+        timer.expires += timer.ticks * ((now_tick - timer.expires) // timer.ticks + 1)
+        self._place(timer)
+        try:
+            timer.callback(*timer.args)
+        except:
+            lg.exc()
+
+    def _schedule(self):
+        if not self.count:
+            self._cancel()
+            return
+        tick = self._next_tick()
+        if self.task_tick == tick and self.task and self.task.active():
+            return
+        delay = max(0, self.base + tick * self.tick - self.clock.seconds())
+        self.task_tick = tick
+        if self.task and self.task.active():
+            self.task.reset(delay)
+        else:
+            self.task = self.clock.callLater(delay, self._on_wakeup)
+
+    def _cancel(self):
+        if self.task and self.task.active():
+            self.task.cancel()
+        self.task = None
+        self.task_tick = None
+
+    def _on_wakeup(self):
+        self.task = None
+        self.task_tick = None
+        self.stats['wakeups'] += 1
+        self.running = True
+        try:
+            self._advance(self.now_tick())
+        finally:
+            self.running = False
+        self._schedule()
@@ -68,6 +68,8 @@ CMD_ACK = b'k'
 CMD_ALIVE = b'a'
 CMD_STUN = b's'
 CMD_MYIPPORT = b'm'
+CMD_PROBE = b'b'
+CMD_PROBE_ACK = b'c'
 
 #------------------------------------------------------------------------------
 
@@ -270,6 +272,9 @@ class CommandsProtocol(BasicProtocol):
         * 'a' = ``ALIVE``       periodically need to send an empty packet to keep session alive.
         * 's' = ``STUN``        request remote peer for my external IP:PORT.
         * 'm' = ``MYIPPORT``    response to ``STUN`` packet, payload will contain IP:PORT of remote peer
+        * 'b' = ``PROBE``       a big datagram to check which size can be delivered to remote peer,
+                                payload starts with a full datagram size and filled up with zeros
+        * 'c' = ``PROBE_ACK``   response to ``PROBE`` packet, payload contains the size of received datagram
     """
 
     SoftwareVersion = b'1'
@@ -320,24 +325,15 @@ class CommandsProtocol(BasicProtocol):
 
     def sendCommand(self, command, data, address):
         payloadsz = len(data)
-        outp = BytesIO()
         try:
-            outp.write(self.SoftwareVersion)
-            outp.write(strng.to_bin(command))
-            outp.write(strng.to_bin(data))
-            # datagram = ''.join((
-            #     self.SoftwareVersion,
-            #     command,
-            #     data))
+            datagram = self.SoftwareVersion + strng.to_bin(command) + strng.to_bin(data)
             if _Debug:
                 lg.out(_DebugLevel, '>>> [%s] (%d bytes) to %s, total %d bytes sent' % (
                     command, payloadsz + 2, address, self.bytes_out))
-            result = self.sendDatagram(outp.getvalue(), address)
+            result = self.sendDatagram(datagram, address)
         except:
-            outp.close()
             lg.exc()
             return None
-        outp.close()
         self.bytes_out += payloadsz + 2
         # if command in [CMD_DATA, CMD_ACK]:
         return result
@@ -51,6 +51,8 @@ from io import open
 
 AppData = ''
 
+_RemovedPaths = []
+
 #------------------------------------------------------------------------------
 
 def sharedPath(filename, subdir='logs'):
@@ -101,6 +103,16 @@ def printlog(txt):
     except:
         pass
 
+
+def pop_removed_paths():
+    """
+    Returns list of files and folders removed since last call.
+    """
+    global _RemovedPaths
+    result = _RemovedPaths
+    _RemovedPaths = []
+    return result
+
 #------------------------------------------------------------------------------
 
 from logs import lg
@@ -182,6 +194,7 @@ def SpaceTime():
                     continue
                 try:
                     os.remove(path)
+                    _RemovedPaths.append(path)
                     printlog('SpaceTime %r file removed (cur:%s, max: %s)' % (path, str(currentV), str(maxspaceV)))
                 except:
                     printlog('SpaceTime ERROR removing %r' % path)
@@ -205,6 +218,7 @@ def SpaceTime():
         if os.path.isdir(path):
             try:
                 bpio._dir_remove(path)
+                _RemovedPaths.append(path)
                 printlog('SpaceTime %r dir removed (%s)' % (path, remove_list[path]))
             except:
                 printlog('SpaceTime ERROR removing %r' % path)
@@ -216,6 +230,7 @@ def SpaceTime():
             pass
         try:
             os.remove(path)
+            _RemovedPaths.append(path)
             printlog('SpaceTime %r file removed (%s)' % (path, remove_list[path]))
         except:
             printlog('SpaceTime ERROR removing %r' % path)
@@ -262,6 +277,7 @@ def UpdateCustomers():
         if os.path.isdir(path):
             try:
                 bpio._dir_remove(path)
+                _RemovedPaths.append(path)
                 printlog('UpdateCustomers %r folder removed (%s)' % (path, remove_list[path], ))
             except:
                 printlog('UpdateCustomers ERROR removing %r' % path)
@@ -273,6 +289,7 @@ def UpdateCustomers():
             pass
         try:
             os.remove(path)
+            _RemovedPaths.append(path)
             printlog('UpdateCustomers %r file removed (%s)' % (path, remove_list[path], ))
         except:
             printlog('UpdateCustomers ERROR removing %r' % path)
@@ -308,6 +325,7 @@ def Validate():
                 if not packetsrc:
                     try:
                         os.remove(path)  # if is is no good it is of no use to anyone
+                        _RemovedPaths.append(path)
                         printlog('Validate %r removed (empty file)' % path)
                     except:
                         printlog('Validate ERROR removing %r' % path)
@@ -316,6 +334,7 @@ def Validate():
                 if p is None:
                     try:
                         os.remove(path)  # if is is no good it is of no use to anyone
+                        _RemovedPaths.append(path)
                         printlog('Validate %r removed (unserialize error)' % path)
                     except:
                         printlog('Validate ERROR removing %r')
@@ -326,6 +345,7 @@ def Validate():
                 if not result:
                     try:
                         os.remove(path)  # if is is no good it is of no use to anyone
+                        _RemovedPaths.append(path)
                         printlog('Validate %r removed (invalid packet)' % path)
                     except:
                         printlog('Validate ERROR removing %r' % path)
@@ -90,6 +90,7 @@ def reset(conf_obj):
     conf_obj.setDefaultValue('services/backups/max-block-size', diskspace.MakeStringFromBytes(settings.DefaultBackupMaxBlockSize()))
     conf_obj.setDefaultValue('services/backups/max-copies', '2')
     conf_obj.setDefaultValue('services/backups/keep-local-copies-enabled', 'true')
+    conf_obj.setDefaultValue('services/backups/shared-memory-raid-enabled', 'true')
     conf_obj.setDefaultValue('services/backups/wait-suppliers-enabled', 'true')
 
     conf_obj.setDefaultValue('services/blockchain/enabled', 'false')
@@ -136,6 +137,7 @@ def reset(conf_obj):
     conf_obj.setDefaultValue('services/employer/candidates', '')
 
     conf_obj.setDefaultValue('services/gateway/enabled', 'true')
+    conf_obj.setDefaultValue('services/gateway/in-memory-packet-size', '65536')
 
     conf_obj.setDefaultValue('services/http-connections/enabled', 'false')
     conf_obj.setDefaultValue('services/http-connections/http-port', settings.DefaultHTTPPort())
@@ -219,8 +221,11 @@ def reset(conf_obj):
 
     conf_obj.setDefaultValue('services/rebuilding/enabled', 'true')
     conf_obj.setDefaultValue('services/rebuilding/child-processes-enabled', 'false')
+    conf_obj.setDefaultValue('services/rebuilding/child-processes-persistent-enabled', 'true')
 
     conf_obj.setDefaultValue('services/restores/enabled', 'true')
+    conf_obj.setDefaultValue('services/restores/prefetch-blocks', '4')
+    conf_obj.setDefaultValue('services/restores/in-memory-enabled', 'true')
 
     conf_obj.setDefaultValue('services/shared-data/enabled', 'true')
 
@@ -248,4 +253,5 @@ def reset(conf_obj):
     conf_obj.setDefaultValue('services/udp-transport/receiving-enabled', 'true')
     conf_obj.setDefaultValue('services/udp-transport/sending-enabled', 'true')
     conf_obj.setDefaultValue('services/udp-transport/priority', 20)
+    conf_obj.setDefaultValue('services/udp-transport/max-datagram-size', 1472)
 
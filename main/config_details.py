@@ -98,10 +98,30 @@ def raw():
     This increases data reliability, rebuilding performance and decrease network load,
     but consumes space on your HDD.
     Every one Mb of source data uploaded will consume two Mb on your local HDD.
+{services/backups/shared-memory-raid-enabled} pass blocks to RAID workers via shared memory
+    Enable this to keep every encrypted block in the shared memory of the OS while it is split into Data and Parity pieces.
+    This way blocks are not written to temporary files on your HDD, if shared memory is not available on the machine the HDD is used.
 {services/backups/wait-suppliers-enabled} wait suppliers 24 hours
     If you disabled storing of local data of your backups but one day a critical amount of your suppliers become unreliable - your data may be lost completely.
     Enable this option to wait for 24 hours after finishing any backup and perform a check all of your suppliers before removing the locally backed up data for this copy.
 
+{services/restores} restores settings
+    Restores setting.
+{services/restores/prefetch-blocks} prefetch blocks
+    How many next blocks to request from suppliers while current block is being restored.
+    Higher values hide the network latency and increase the speed of restore, but use more space in the local backups folder.
+    A "0" value means blocks are requested one by one.
+{services/restores/in-memory-enabled} restore blocks in memory
+    Enable this to keep received pieces in memory and restore every block directly from them.
+    Pieces are written to your local HDD only if "keep local copies" option is enabled.
+
+{services/rebuilding} rebuilding settings
+    Settings of the service which is rebuilding and repairing your data stored on remote suppliers.
+{services/rebuilding/child-processes-persistent-enabled} keep RAID child processes running
+    Enable this to keep child processes which split and restore blocks running between tasks.
+    This saves time needed to start a new process for every backup or restore, but keeps some memory allocated.
+    If disabled, idle child processes are stopped after one minute.
+
 {services/supplier} supplier service
     "Supplier" service settings.
 {services/supplier/donated} donated space
@@ -131,6 +151,11 @@ def raw():
     Right now we have only few testing nodes in the network, so high values is not working yet.
     WARNING! You will lost all your existing backups after changing suppliers number.
 
+{services/gateway} gateway service
+    "Gateway" service settings.
+{services/gateway/in-memory-packet-size} in-memory outgoing packet size limit
+    Outgoing packets smaller than that value in bytes are kept in memory and passed to the transports directly.
+    Bigger packets are written to temporary files on your HDD first. A value of "0" means all packets are written to HDD.
 {services/network} network service
     "Network" service settings.
 {services/network/receive-limit} incoming bandwidth limit
@@ -175,4 +200,7 @@ def raw():
     Disable this if you do not want to use UDP-transport for receiving packets from other users.
 {services/udp-transport/sending-enabled} enable udp sending
     Disable this if you do not want to use UDP-transport for sending packets to other users.
+{services/udp-transport/max-datagram-size} max datagram size
+    Largest UDP datagram in bytes to try with every remote peer, bigger datagrams are only used after a probe was delivered.
+    Set 508 to always use the smallest safe size.
 """
@@ -111,6 +111,7 @@ def defaults():
         'services/backups/keep-local-copies-enabled': TYPE_BOOLEAN,
         'services/backups/max-block-size': TYPE_DISK_SPACE,
         'services/backups/max-copies': TYPE_POSITIVE_INTEGER,
+        'services/backups/shared-memory-raid-enabled': TYPE_BOOLEAN,
         'services/backups/wait-suppliers-enabled': TYPE_BOOLEAN,
         'services/blockchain/enabled': TYPE_BOOLEAN,
         'services/blockchain/host': TYPE_STRING,
@@ -143,6 +144,7 @@ def defaults():
         'services/employer/replace-critically-offline-enabled': TYPE_BOOLEAN,
         'services/employer/candidates': TYPE_STRING,
         'services/gateway/enabled': TYPE_BOOLEAN,
+        'services/gateway/in-memory-packet-size': TYPE_POSITIVE_INTEGER,
         'services/http-connections/enabled': TYPE_BOOLEAN,
         'services/http-connections/http-port': TYPE_PORT_NUMBER,
         'services/http-transport/enabled': TYPE_BOOLEAN,
@@ -201,7 +203,10 @@ def defaults():
         'services/proxy-transport/router-lifetime-seconds': TYPE_POSITIVE_INTEGER,
         'services/rebuilding/enabled': TYPE_BOOLEAN,
         'services/rebuilding/child-processes-enabled': TYPE_BOOLEAN,
+        'services/rebuilding/child-processes-persistent-enabled': TYPE_BOOLEAN,
         'services/restores/enabled': TYPE_BOOLEAN,
+        'services/restores/prefetch-blocks': TYPE_POSITIVE_INTEGER,
+        'services/restores/in-memory-enabled': TYPE_BOOLEAN,
         'services/shared-data/enabled': TYPE_BOOLEAN,
         'services/supplier/donated-space': TYPE_DISK_SPACE,
         'services/supplier/enabled': TYPE_BOOLEAN,
@@ -220,4 +225,5 @@ def defaults():
         'services/udp-transport/receiving-enabled': TYPE_BOOLEAN,
         'services/udp-transport/sending-enabled': TYPE_BOOLEAN,
         'services/udp-transport/priority': TYPE_POSITIVE_INTEGER,
+        'services/udp-transport/max-datagram-size': TYPE_POSITIVE_INTEGER,
     }
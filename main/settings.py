@@ -743,6 +743,14 @@ def IdentityHistoryDir():
     return os.path.join(BaseDir(), "identityhistory")
 
 
+def IdentityHistorySnapshotFile():
+    """
+    In-memory index of all known idurl's is saved to that file, see ``lib.id_url`` module,
+    so it is not required to read and verify whole ``IdentityHistoryDir()`` folder on start.
+    """
+    return os.path.join(BaseDir(), "identityhistory.snapshot")
+
+
 def IdentityCacheDir():
     """
     See ``lib.identitycache`` module, this is a place to store user's identity
@@ -1079,6 +1087,14 @@ def BackupIndexFileName():
     return 'index'
 
 
+def BackupIndexJournalFileName():
+    """
+    Recent changes of the backup index are appended to that file,
+    it is also saved on suppliers together with ``BackupIndexFileName()`` file.
+    """
+    return 'index.journal'
+
+
 def BackupInfoFileFullPath():
     """
     Obsolete.
@@ -1100,6 +1116,13 @@ def BackupIndexFilePath():
     return os.path.join(MetaDataDir(), BackupIndexFileName())
 
 
+def BackupIndexJournalFilePath():
+    """
+    A full local path for ``BackupIndexJournalFileName`` file.
+    """
+    return os.path.join(MetaDataDir(), BackupIndexJournalFileName())
+
+
 def SupplierPath(supplier_idurl, customer_idurl, filename=None):
     """
     A location to given supplier's data.
@@ -1609,6 +1632,13 @@ def getBandInLimit():
     return config.conf().getInt('services/network/receive-limit', DefaultBandwidthInLimit())
 
 
+def getOutboxInMemoryPacketSize():
+    """
+    Outgoing packets smaller than that size in bytes are not written to the disk.
+    """
+    return config.conf().getInt('services/gateway/in-memory-packet-size', 1024 * 64)
+
+
 def enableIdServer(enable=None):
     """
     """
@@ -1818,6 +1848,13 @@ def enableUDPreceiving(enable=None):
     config.conf().setData('services/udp-transport/receiving-enabled', str(enable))
 
 
+def getUDPMaxDatagramSize():
+    """
+    Largest datagram size in bytes which transport_udp will probe with every remote peer.
+    """
+    return config.conf().getInt('services/udp-transport/max-datagram-size', 1472)
+
+
 def getUDPPort():
     """
     Get a port number for tranport_udp from user config.
@@ -2247,6 +2284,20 @@ def getBackupsMaxCopies():
     return config.conf().getInt('services/backups/max-copies', 2)
 
 
+def getRestorePrefetchBlocks():
+    """
+    Return a number of next blocks to be requested from suppliers while current block is restoring.
+    """
+    return config.conf().getInt('services/restores/prefetch-blocks', 4)
+
+
+def getRestoreInMemory():
+    """
+    Return True if received pieces must be kept in memory during restore, see ``getBackupsKeepLocalCopies()``.
+    """
+    return config.conf().getBool('services/restores/in-memory-enabled')
+
+
 def getBackupsKeepLocalCopies():
     """
     Return True if user wish to keep local backups.
@@ -2254,6 +2305,13 @@ def getBackupsKeepLocalCopies():
     return config.conf().getBool('services/backups/keep-local-copies-enabled')
 
 
+def getBackupsSharedMemoryRaid():
+    """
+    Return True if encrypted blocks should be passed to the RAID workers via shared memory.
+    """
+    return config.conf().getBool('services/backups/shared-memory-raid-enabled')
+
+
 def getGeneralWaitSuppliers():
     """
     Return True if user want to be sure that suppliers are reliable enough
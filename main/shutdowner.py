@@ -114,6 +114,7 @@ def shutdown(x=None):
         from interface import api_web_socket
         from interface import ftp_server
         from userid import my_id
+        from userid import id_url
         from contacts import identitydb
         from crypt import my_keys
         my_keys.shutdown()
@@ -144,6 +145,7 @@ def shutdown(x=None):
         for a in survived_automats:
             if a.name != 'shutdowner':
                 a.event('shutdown')
+        id_url.shutdown()
         settings.shutdown()
     except:
         lg.exc()
@@ -429,10 +429,12 @@ def ListFiles(request, info):
             request.RemoteID, request.OwnerID, request.CreatorID))
 
 
-def SendListFiles(target_supplier, customer_idurl=None, key_id=None, query_items=[], wide=False, callbacks={}, timeout=None):
+def SendListFiles(target_supplier, customer_idurl=None, key_id=None, query_items=[], manifest=None, wide=False, callbacks={}, timeout=None):
     """
     This is used as a request method from your supplier : if you send him a ListFiles() packet
     he will reply you with a list of stored files in a Files() packet.
+    Pass ``manifest`` dictionary with "epoch" and "revision" of the supplier's files manifest
+    received last time to get only recent changes, empty dictionary means "all files and current revision".
     """
     MyID = my_id.getLocalID()
     if not customer_idurl:
@@ -458,10 +460,13 @@ def SendListFiles(target_supplier, customer_idurl=None, key_id=None, query_items
     PacketID = "%s:%s" % (key_id, packetid.UniqueID(), )
     if not query_items:
         query_items = ['*', ]
-    Payload = serialization.DictToBytes({'items': query_items, })
+    query = {'items': query_items, }
+    if manifest is not None:
+        query['manifest'] = manifest
+    Payload = serialization.DictToBytes(query)
     if _Debug:
-        lg.out(_DebugLevel, "p2p_service.SendListFiles %r to %s with query : %r" % (
-            PacketID, nameurl.GetName(RemoteID), query_items, ))
+        lg.out(_DebugLevel, "p2p_service.SendListFiles %r to %s with query : %r, manifest : %r" % (
+            PacketID, nameurl.GetName(RemoteID), query_items, manifest, ))
     result = signed.Packet(
         Command=commands.ListFiles(),
         OwnerID=MyID,
@@ -59,8 +59,7 @@ _Debug = False
 
 import os
 import sys
-import copy
-import array
+import mmap
 
 #------------------------------------------------------------------------------
 
@@ -128,21 +127,6 @@ def WriteFile(filename, data):
 #------------------------------------------------------------------------------
 
 
-def ReadBinaryFileAsArray(filename):
-    """
-    """
-    if not os.path.isfile(filename):
-        return b''
-    if not os.access(filename, os.R_OK):
-        return b''
-
-    with open(filename, mode='rb') as f:
-        values = array.array('i', f.read())
-
-    values.byteswap()
-    return values
-
-
 def do_in_memory(filename, eccmapname, version, blockNumber, targetDir, threshold_control=None):
     try:
         if _Debug:
@@ -152,38 +136,45 @@ def do_in_memory(filename, eccmapname, version, blockNumber, targetDir, threshol
         myeccmap = raid.eccmap.eccmap(eccmapname)
         # any padding at end and block.Length fixes
         RoundupFile(filename, myeccmap.datasegments * INTSIZE)
-        wholefile = ReadBinaryFileAsArray(filename)
-        length = len(wholefile)
-        length = length * 4
-        seglength = (length + myeccmap.datasegments - 1) / myeccmap.datasegments
-
-        # dict of data segments
+        # input file is mapped into memory, so segments are written directly from the page cache
+        # without reading the whole block into the process memory
+        with open(filename, mode='rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        wholefile = None
         sds = {}
-        for seg_num, chunk in enumerate(raid.raidutils.chunks(wholefile, int(seglength / 4))):
-            FileName = targetDir + '/' + str(blockNumber) + '-' + str(seg_num) + '-Data'
-            with open(FileName, mode='wb') as f:
-                chunk_to_write = copy.copy(chunk)
-                chunk_to_write.byteswap()
-                sds[seg_num] = iter(chunk)
-                f.write(chunk_to_write)
-
-        psds_list = raid.raidutils.build_parity(
-            sds,
-            int(seglength / INTSIZE),
-            myeccmap.datasegments,
-            myeccmap,
-            myeccmap.paritysegments,
-            threshold_control=threshold_control,
-        )
-
-        dataNum = len(sds)
-        parityNum = len(psds_list)
-
-        for PSegNum, _ in psds_list.items():
-            FileName = targetDir + '/' + str(blockNumber) + '-' + str(PSegNum) + '-Parity'
-            with open(FileName, mode='wb') as f:
-                f.write(psds_list[PSegNum])
-
+        try:
+            wholefile = memoryview(mapped)
+            length = len(wholefile)
+            seglength = length // myeccmap.datasegments
+
+            for seg_num, chunk in enumerate(raid.raidutils.chunks(wholefile, seglength)):
+                FileName = targetDir + '/' + str(blockNumber) + '-' + str(seg_num) + '-Data'
+                with open(FileName, mode='wb') as f:
+                    sds[seg_num] = chunk
+                    f.write(chunk)
+
+            psds_list = raid.raidutils.build_parity(
+                sds,
+                seglength,
+                myeccmap,
+                threshold_control=threshold_control,
+            )
+
+            dataNum = len(sds)
+            parityNum = len(psds_list)
+
+            for PSegNum, _ in psds_list.items():
+                FileName = targetDir + '/' + str(blockNumber) + '-' + str(PSegNum) + '-Parity'
+                with open(FileName, mode='wb') as f:
+                    f.write(psds_list[PSegNum])
+
+        finally:
+            # all views must be released before the mapping can be closed
+            for chunk in sds.values():
+                raid.raidutils.release_view(chunk)
+            if wholefile is not None:
+                raid.raidutils.release_view(wholefile)
+            mapped.close()
         return dataNum, parityNum
 
     except:
@@ -191,6 +182,18 @@ def do_in_memory(filename, eccmapname, version, blockNumber, targetDir, threshol
         return -1, -1
 
 
+def do_in_memory_batch(tasks, threshold_control=None):
+    """
+    Runs ``do_in_memory()`` for several small blocks at once, to save on task round trips.
+    Every item in ``tasks`` is a list of positional arguments for ``do_in_memory()``,
+    returns a list of results in same order.
+    """
+    results = []
+    for task_params in tasks:
+        results.append(do_in_memory(*task_params, threshold_control=threshold_control))
+    return results
+
+
 def main():
     do_in_memory(
         filename=sys.argv[1],
@@ -37,6 +37,14 @@ BitDust raid_worker Automat
     <img src="raid_worker.png" style="max-width:100%;">
     </a>
 
+Child processes are kept running when the worker is idle if option
+"services/rebuilding/child-processes-persistent-enabled" is set, every process
+is warmed up right after start by importing all ``_MODULES``.
+
+Several small "make" tasks waiting in the queue are joined into one "make-batch" task.
+For every finished task the time spent in the queue and the execution time are collected,
+see ``get_stats()``.
+
 EVENTS:
     * :red:`init`
     * :red:`new-task`
@@ -105,6 +113,7 @@ _MODULES = (
     'logs.lg',
     'os',
     'sys',
+    'mmap',
     'copy',
     'array',
     'traceback',
@@ -113,14 +122,20 @@ _MODULES = (
 )
 
 _VALID_TASKS = {
-    'make': (make.do_in_memory, (make.RoundupFile, make.ReadBinaryFile, make.WriteFile, make.ReadBinaryFileAsArray, )),
+    'make': (make.do_in_memory, (make.RoundupFile, make.ReadBinaryFile, make.WriteFile, )),
+    'make-batch': (make.do_in_memory_batch, (make.do_in_memory, make.RoundupFile, make.ReadBinaryFile, make.WriteFile, )),
     'read': (read.raidread, (read.RebuildOne, read.ReadBinaryFile, )),
     'rebuild': (rebuild.rebuild, ()),
 }
 
+# "make" tasks for blocks smaller than that are joined together
+_BatchMaxBlockSize = 1024 * 1024
+_BatchMaxTasks = 8
+
 #------------------------------------------------------------------------------
 
 _RaidWorker = None
+_Stats = {}
 
 #------------------------------------------------------------------------------
 
@@ -158,9 +173,16 @@ def cancel_task(cmd, first_parameter):
     for task_id, task_data in A().activetasks.items():
         t_proc, t_cmd, t_params = task_data
         if cmd == t_cmd and first_parameter == t_params[0]:
-            if _Debug:
-                lg.out(_DebugLevel, 'raid_worker.cancel_task found started task %r, aborting process %r' % (task_id, t_proc.tid))
-            A().processor.cancel(t_proc.tid)
+            batch_size = len([t for t in A().activetasks.values() if t[0] is t_proc])
+            if batch_size > 1:
+                # job is also processing blocks of other tasks, so only the result of that task will be ignored
+                if _Debug:
+                    lg.out(_DebugLevel, 'raid_worker.cancel_task found started task %r in a batch of %d, result will be ignored' % (task_id, batch_size))
+                A().cancelled_tasks.add(task_id)
+            else:
+                if _Debug:
+                    lg.out(_DebugLevel, 'raid_worker.cancel_task found started task %r, aborting process %r' % (task_id, t_proc.tid))
+                A().processor.cancel(t_proc.tid)
             found = True
             break
     if not found:
@@ -168,6 +190,49 @@ def cancel_task(cmd, first_parameter):
         return False
     return True
 
+
+def get_stats():
+    """
+    Returns a dictionary with queue and execution time statistics for every kind of task.
+    """
+    result = {}
+    for cmd, st in _Stats.items():
+        result[cmd] = dict(st)
+        if st['count']:
+            result[cmd]['avg_queue_time'] = st['queue_time'] / float(st['count'])
+            result[cmd]['avg_exec_time'] = st['exec_time'] / float(st['count'])
+    return result
+
+
+def _update_stats(cmd, queue_time, exec_time, batch_size=1):
+    global _Stats
+    if cmd not in _Stats:
+        _Stats[cmd] = {
+            'count': 0,
+            'queue_time': 0.0,
+            'exec_time': 0.0,
+            'max_queue_time': 0.0,
+            'max_exec_time': 0.0,
+            'batched': 0,
+            'max_batch': 0,
+        }
+    st = _Stats[cmd]
+    st['count'] += 1
+    if batch_size > 1:
+        st['batched'] += 1
+    st['max_batch'] = max(st['max_batch'], batch_size)
+    st['queue_time'] += queue_time
+    st['exec_time'] += exec_time
+    st['max_queue_time'] = max(st['max_queue_time'], queue_time)
+    st['max_exec_time'] = max(st['max_exec_time'], exec_time)
+
+
+def warm_up():
+    """
+    Executed in every child process right after start, so all ``_MODULES`` are imported in advance.
+    """
+    return os.getpid()
+
 #------------------------------------------------------------------------------
 
 
@@ -213,6 +278,8 @@ class RaidWorker(automat.Automat):
         self.activetasks = {}
         self.processor = None
         self.callbacks = {}
+        self.task_times = {}
+        self.cancelled_tasks = set()
 
     def A(self, event, *args, **kwargs):
         #---AT_STARTUP---
@@ -244,7 +311,7 @@ class RaidWorker(automat.Automat):
                 self.state = 'CLOSED'
                 self.doKillProcess(*args, **kwargs)
                 self.doDestroyMe(*args, **kwargs)
-            elif event == 'timer-1min':
+            elif event == 'timer-1min' and not self.isPersistent(*args, **kwargs):
                 self.state = 'OFF'
                 self.doKillProcess(*args, **kwargs)
         #---WORK---
@@ -287,12 +354,23 @@ class RaidWorker(automat.Automat):
         """
         return len(self.activetasks) > 1
 
+    def isPersistent(self, *args, **kwargs):
+        """
+        Condition method.
+        """
+        if isinstance(self.processor, ThreadedRaidProcessor):
+            # threads do not cost much, no need to keep them
+            return False
+        return config.conf().getBool('services/rebuilding/child-processes-persistent-enabled')
+
     def doPopTask(self, *args, **kwargs):
         """
         Action method.
         """
         task_id, cmd, params, result = args[0]
         self.activetasks.pop(task_id)
+        self.task_times.pop(task_id, None)
+        self.cancelled_tasks.discard(task_id)
 
     def doInit(self, *args, **kwargs):
         """
@@ -323,6 +401,9 @@ class RaidWorker(automat.Automat):
                 loglevel=lg.get_loging_level(_DebugLevel),
                 logfile=settings.ParallelPLogFilename(),
             )
+            if self.isPersistent():
+                for _ in range(self.processor.get_ncpus()):
+                    self.processor.submit(warm_up, modules=_MODULES, callback=self._warm_up_done)
         # else:
         #     from raid import worker
         #     self.processor = worker.Manager(ncpus=ncpus)
@@ -345,6 +426,8 @@ class RaidWorker(automat.Automat):
         self.task_id += 1
         self.tasks.append((self.task_id, cmd, params))
         self.callbacks[self.task_id] = callback
+        # created, started, number of tasks in the batch
+        self.task_times[self.task_id] = [time.time(), None, 1, ]
 
     def doStartTask(self, *args, **kwargs):
         """
@@ -353,31 +436,45 @@ class RaidWorker(automat.Automat):
         global _VALID_TASKS
         global _MODULES
 
-        if len(self.activetasks) >= self.processor.get_ncpus():
+        if len(set(id(t[0]) for t in self.activetasks.values())) >= self.processor.get_ncpus():
             # lg.warn('SKIP active=%d cpus=%d' % (
             #         len(self.activetasks), self.processor.get_ncpus()))
             return
 
         try:
-            task_id, cmd, params = self.tasks.pop(0)
-            func, depfuncs = _VALID_TASKS[cmd]
+            batch = [self.tasks.pop(0), ]
+            task_id, cmd, params = batch[0]
+            if self._is_small_make_task(cmd, params):
+                while self.tasks and len(batch) < _BatchMaxTasks and self._is_small_make_task(self.tasks[0][1], self.tasks[0][2]):
+                    batch.append(self.tasks.pop(0))
+            if len(batch) > 1:
+                func, depfuncs = _VALID_TASKS['make-batch']
+                func_args = ([list(b[2]) for b in batch], )
+            else:
+                func, depfuncs = _VALID_TASKS[cmd]
+                func_args = params
         except:
             lg.exc()
             return
 
         proc = self.processor.submit(
             func,
-            args=params,
+            args=func_args,
             depfuncs=depfuncs,
             modules=_MODULES,
-            callback=lambda result: self._job_done(task_id, cmd, params, result),
+            callback=lambda result: self._job_done(batch, result),
             # error_callback=lambda err: self._job_failed(task_id, cmd, params, err),
         )
 
-        self.activetasks[task_id] = (proc, cmd, params)
+        started = time.time()
+        for b_task_id, b_cmd, b_params in batch:
+            self.activetasks[b_task_id] = (proc, b_cmd, b_params)
+            if b_task_id in self.task_times:
+                self.task_times[b_task_id][1] = started
+                self.task_times[b_task_id][2] = len(batch)
         if _Debug:
-            lg.out(_DebugLevel, 'raid_worker.doStartTask job_id=%r active=%d cpus=%d %s' % (
-                task_id, len(self.activetasks), self.processor.get_ncpus(), threading.currentThread().getName()))
+            lg.out(_DebugLevel, 'raid_worker.doStartTask job_id=%r batch=%d active=%d cpus=%d %s' % (
+                task_id, len(batch), len(self.activetasks), self.processor.get_ncpus(), threading.current_thread().getName()))
 
         # reactor.callLater(0, self.automat, 'task-started', task_id)  # @UndefinedVariable
         self.automat('task-started', task_id)
@@ -387,8 +484,19 @@ class RaidWorker(automat.Automat):
         Action method.
         """
         task_id, cmd, params, result = args[0]
+        if task_id in self.cancelled_tasks:
+            # task was cancelled while other tasks of the same batch were still running
+            result = None
         cb = self.callbacks.pop(task_id)
         reactor.callLater(0, cb, cmd, params, result)  # @UndefinedVariable
+        times = self.task_times.get(task_id)
+        if times and times[1] is not None:
+            queue_time = times[1] - times[0]
+            exec_time = time.time() - times[1]
+            _update_stats(cmd, queue_time, exec_time, batch_size=times[2])
+            if _Debug:
+                lg.out(_DebugLevel, 'raid_worker.doReportTaskDone task %r %r queue_time=%.3f exec_time=%.3f' % (
+                    task_id, cmd, queue_time, exec_time))
         if result is not None:
             if _Debug:
                 lg.out(_DebugLevel, 'raid_worker.doReportTaskDone callbacks: %d tasks: %d active: %d' % (
@@ -420,11 +528,31 @@ class RaidWorker(automat.Automat):
         del _RaidWorker
         _RaidWorker = None
 
-    def _job_done(self, task_id, cmd, params, result):
+    def _job_done(self, batch, result):
         if _Debug:
-            lg.out(_DebugLevel, 'raid_worker._job_done %r : %r active:%r cmd=%r params=%r %s' % (
-                task_id, result, list(self.activetasks.keys()), cmd, params, threading.currentThread().getName()))
-        reactor.callFromThread(self.automat, 'task-done', (task_id, cmd, params, result))  # @UndefinedVariable
+            lg.out(_DebugLevel, 'raid_worker._job_done %r : %r active:%r %s' % (
+                [b[0] for b in batch], result, list(self.activetasks.keys()), threading.current_thread().getName()))
+        if len(batch) == 1:
+            task_id, cmd, params = batch[0]
+            reactor.callFromThread(self.automat, 'task-done', (task_id, cmd, params, result))  # @UndefinedVariable
+            return
+        for i, (task_id, cmd, params) in enumerate(batch):
+            one_result = None
+            if result is not None and i < len(result) and result[i] is not None:
+                one_result = tuple(result[i])
+            reactor.callFromThread(self.automat, 'task-done', (task_id, cmd, params, one_result))  # @UndefinedVariable
+
+    def _warm_up_done(self, result):
+        if _Debug:
+            lg.out(_DebugLevel, 'raid_worker._warm_up_done child process %r is ready' % result)
+
+    def _is_small_make_task(self, cmd, params):
+        if cmd != 'make':
+            return False
+        try:
+            return os.path.getsize(params[0]) < _BatchMaxBlockSize
+        except:
+            return False
 
     # def _job_failed(self, task_id, cmd, params, err):
     #     lg.err('task %r FAILED : %r   active:%r cmd=%r params=%r' % (
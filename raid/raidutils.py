@@ -29,35 +29,106 @@
 
 """
 
-import array
+#------------------------------------------------------------------------------
 
+import binascii
 
-def build_parity(sds, iters, datasegments, myeccmap, paritysegments, threshold_control=None):
-    psds_list = {seg_num: array.array('i') for seg_num in range(myeccmap.paritysegments)}
+import six
 
-    for i in range(iters):
-        parities = {seg_num: 0 for seg_num in range(myeccmap.paritysegments)}
-        for DSegNum in range(datasegments):
-            b = next(sds[DSegNum])
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-            Map = myeccmap.DataToParity[DSegNum]
-            for PSegNum in Map:
-                if PSegNum > paritysegments:
-                    myeccmap.check()
-                    raise Exception("eccmap error")
+#------------------------------------------------------------------------------
 
-                parities[PSegNum] = parities[PSegNum] ^ b
+def _bytes_to_int(data):
+    if six.PY3:
+        return int.from_bytes(data, 'big')
+    return int(binascii.hexlify(data) or b'0', 16)
 
-                if threshold_control:
-                    if not threshold_control(1):
-                        raise Exception('task cancelled')
 
-        for PSegNum in range(myeccmap.paritysegments):
-            psds_list[PSegNum].append(parities[PSegNum])
+def _int_to_bytes(value, length):
+    if six.PY3:
+        return value.to_bytes(length, 'big')
+    return binascii.unhexlify('%0*x' % (length * 2, value))
+
+
+def xor_buffers(buffers, length=None):
+    """
+    XOR together all items from ``buffers`` (bytes, bytearray, array or memoryview objects)
+    and return the result as a single bytes object.
+
+    Only first ``length`` bytes of every buffer are used, by default length of the first buffer.
+    When NumPy is available the work is done on ``uint64`` views of the buffers,
+    otherwise every buffer is converted to a big Python integer.
+    Result is byte-identical to XOR-ing the buffers byte by byte.
+    """
+    if not buffers:
+        return b''
+    views = [memoryview(b).cast('B') if six.PY3 else memoryview(b) for b in buffers]
+    if length is None:
+        length = len(views[0])
+    for v in views:
+        if len(v) < length:
+            raise Exception('buffer is too short to XOR: %d < %d' % (len(v), length))
+    if length == 0:
+        return b''
+    if numpy is not None:
+        words = length // 8
+        tail = words * 8
+        result = numpy.frombuffer(views[0], dtype=numpy.uint8, count=length).copy()
+        result_words = result[:tail].view(numpy.uint64)
+        for v in views[1:]:
+            if words:
+                numpy.bitwise_xor(result_words, numpy.frombuffer(v, dtype=numpy.uint64, count=words), out=result_words)
+            if tail < length:
+                numpy.bitwise_xor(result[tail:], numpy.frombuffer(v, dtype=numpy.uint8, count=length)[tail:], out=result[tail:])
+        return result.tobytes()
+    value = 0
+    for v in views:
+        value ^= _bytes_to_int(v[:length].tobytes())
+    return _int_to_bytes(value, length)
 
-    for PSegNum in psds_list:
-        psds_list[PSegNum].byteswap()
 
+def release_view(view):
+    """
+    Release the buffer exported by ``view``, Python 2 memoryview does not lock the source object.
+    """
+    if six.PY3:
+        view.release()
+
+
+def build_parity(sds, seglength, myeccmap, threshold_control=None, chunksize=1024 * 1024):
+    """
+    Calculate all parity segments for given data segments.
+
+    Input ``sds`` is a dictionary of data segments (bytes-like objects of ``seglength`` bytes),
+    output is a dictionary with parity segment number as a key and bytes as a value.
+    Every parity segment is built in one pass over ``myeccmap.ParityToData``,
+    ``chunksize`` bytes at a time, ``threshold_control`` is called once per chunk.
+    """
+    psds_list = {}
+    for PSegNum in range(myeccmap.paritysegments):
+        Map = myeccmap.ParityToData[PSegNum]
+        for DSegNum in Map:
+            if DSegNum >= myeccmap.datasegments or DSegNum not in sds:
+                myeccmap.check()
+                raise Exception("eccmap error")
+        views = [memoryview(sds[DSegNum]) for DSegNum in Map]
+        parity = []
+        try:
+            for pos in range(0, seglength, chunksize):
+                chunklen = min(chunksize, seglength - pos)
+                parity.append(xor_buffers([v[pos:pos + chunklen] for v in views], chunklen))
+                if threshold_control:
+                    if not threshold_control(chunklen):
+                        raise Exception('task cancelled')
+        finally:
+            # data segments can be slices of a memory mapped file which is closed by the caller
+            for v in views:
+                release_view(v)
+        psds_list[PSegNum] = b''.join(parity)
     return psds_list
 
 
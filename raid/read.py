@@ -56,7 +56,6 @@
 
 from __future__ import absolute_import
 from __future__ import print_function
-import six
 from io import open
 from six.moves import range
 
@@ -81,6 +80,7 @@ if __name__ == '__main__':
 import logs.lg
 
 import raid.eccmap
+import raid.raidutils
 
 #------------------------------------------------------------------------------
 
@@ -98,7 +98,7 @@ def ReadBinaryFile(filename):
 
 
 def RebuildOne(inlist, listlen, outfilename, threshold_control=None):
-    readsize = 1  # vary from 1 byte to 4 bytes
+    readsize = 1024 * 1024  # whole segments are XOR-ed at once, chunk by chunk
     raidfiles = [''] * listlen  # just need a list of this size
     raidreads = [''] * listlen
     for filenum in range(listlen):
@@ -115,32 +115,23 @@ def RebuildOne(inlist, listlen, outfilename, threshold_control=None):
 
     rebuildfile = open(outfilename, "wb")
     progress = 0
-    while True:
-        for k in range(listlen):
-            raidreads[k] = raidfiles[k].read(2048)
-        if not raidreads[0]:
-            break
-        i = 0
-        while i < len(raidreads[0]):
-            xor = 0
-            for j in range(listlen):
-                b1 = ord(raidreads[j][i:i+1])
-                xor = xor ^ b1
-            if six.PY3:
-                out_byte = bytes([xor, ])
-            else:
-                out_byte = chr(xor)
-            rebuildfile.write(out_byte)
-            i += readsize
-            progress += 1
+    try:
+        while True:
+            for k in range(listlen):
+                raidreads[k] = raidfiles[k].read(readsize)
+            if not raidreads[0]:
+                break
+            chunklen = len(raidreads[0])
+            rebuildfile.write(raid.raidutils.xor_buffers(raidreads, chunklen))
+            progress += chunklen
 
             if threshold_control:
-                if not threshold_control(readsize):
+                if not threshold_control(chunklen):
                     raise Exception('task cancelled')
-
-    for filenum in range(listlen):
-        raidfiles[filenum].close()
-    rebuildfile.close()
+    finally:
+        for filenum in range(listlen):
+            raidfiles[filenum].close()
+        rebuildfile.close()
 
     if _Debug:
         with open('/tmp/raid.log', 'a') as logfile:
@@ -229,6 +220,45 @@ def raidread(
         return None
 
 
+def read_in_memory(eccmapname, data_segments, parity_segments, threshold_control=None):
+    """
+    Same as ``raidread()`` but all pieces are passed in memory and nothing is written to disk.
+
+    Input ``data_segments`` and ``parity_segments`` are dictionaries with segment number as a key
+    and bytes-like object (bytes, bytearray or memoryview) as a value.
+    Missing Data segments are recovered from Parity segments where possible.
+    Returns a tuple (number of good Data segments, restored block data) or None if failed.
+    """
+    try:
+        myeccmap = raid.eccmap.eccmap(eccmapname)
+        sds = dict(data_segments)
+        MakingProgress = True
+        while MakingProgress:
+            MakingProgress = False
+            for PSegNum in range(myeccmap.paritysegments):
+                if PSegNum not in parity_segments:
+                    continue
+                Map = myeccmap.ParityToData[PSegNum]
+                missing = [DSegNum for DSegNum in Map if DSegNum not in sds]
+                if len(missing) != 1:
+                    continue
+                buffers = [sds[DSegNum] for DSegNum in Map if DSegNum in sds]
+                buffers.append(parity_segments[PSegNum])
+                sds[missing[0]] = raid.raidutils.xor_buffers(buffers)
+                MakingProgress = True
+                if threshold_control:
+                    if not threshold_control(len(sds[missing[0]])):
+                        raise Exception('task cancelled')
+        good_segments = [sds[DSegNum] for DSegNum in range(myeccmap.datasegments) if DSegNum in sds]
+        if _Debug:
+            with open('/tmp/raid.log', 'a') as logfile:
+                logfile.write(u'read_in_memory eccmapname=%s GoodDSegs=%d\n' % (eccmapname, len(good_segments)))
+        return len(good_segments), b''.join(good_segments)
+    except:
+        logs.lg.exc()
+        return None
+
+
 def main():
     if (len(sys.argv) < 3):
         print("raidread needs an output filename and eccmap name")
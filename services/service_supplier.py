@@ -64,6 +64,8 @@ class SupplierService(LocalService):
         from storage import accounting
         from services import driver
         from supplier import customer_space
+        from supplier import files_manifest
+        files_manifest.init()
         callback.append_inbox_callback(self._on_inbox_packet_received)
         events.add_subscriber(customer_space.on_identity_url_changed, 'identity-url-changed')
         events.add_subscriber(customer_space.on_customer_accepted, 'existing-customer-accepted')
@@ -91,6 +93,7 @@ class SupplierService(LocalService):
         from main import events
         from services import driver
         from supplier import customer_space
+        from supplier import files_manifest
         events.remove_subscriber(self._on_dht_layer_connected, event_id='dht-layer-connected')
         if driver.is_on('service_entangled_dht'):
             from dht import dht_service
@@ -102,6 +105,7 @@ class SupplierService(LocalService):
         events.remove_subscriber(customer_space.on_customer_terminated, 'existing-customer-terminated')
         events.remove_subscriber(customer_space.on_identity_url_changed, 'identity-url-changed')
         callback.remove_inbox_callback(self._on_inbox_packet_received)
+        files_manifest.shutdown()
         return True
 
     def request(self, json_payload, newpacket, info):
@@ -64,7 +64,12 @@ For each block must be received delivery report: positive or negative.
 Process will be completed as soon as all data will be read from the folder
 and all blocks will receive a delivery report.
 
+Encryption of every block is done in a thread pool, so reactor is not blocked.
+Up to ``maxEncryptingBlocks`` blocks are encrypted at the same time,
+while the next blocks are read from the pipe and previous blocks are processed by ``raid_worker``.
+
 EVENTS:
+    * :red:`block-encrypt-started`
     * :red:`block-encrypted`
     * :red:`block-raid-done`
     * :red:`block-raid-started`
@@ -97,7 +102,8 @@ try:
 except:
     sys.exit('Error initializing twisted.internet.reactor in backup.py')
 
-from twisted.internet.defer import maybeDeferred, Deferred, succeed
+from twisted.internet import threads
+from twisted.internet.defer import Deferred, succeed
 
 #------------------------------------------------------------------------------
 
@@ -115,6 +121,7 @@ from lib import strng
 from userid import my_id
 from userid import global_id
 
+from system import bpio
 from system import nonblocking
 from system import tmpfile
 
@@ -138,7 +145,7 @@ class backup(automat.Automat):
     """
 
     timers = {
-        'timer-01sec': (0.1, ['RAID']),
+        'timer-01sec': (0.1, ['RAID', 'ENCRYPT', ]),
         'timer-001sec': (0.01, ['READ']),
     }
 
@@ -175,6 +182,9 @@ class backup(automat.Automat):
         self.currentBlockData = BytesIO()
         self.currentBlockSize = 0
         self.workBlocks = {}
+        self.encryptingBlocks = set()
+        # do not use all CPU cores at once, same as raid_worker
+        self.maxEncryptingBlocks = max(1, int(bpio.detect_number_of_cpu_cores() / 2.0))
         self.blockNumber = 0
         self.dataSent = 0
         self.blocksSent = 0
@@ -210,6 +220,8 @@ class backup(automat.Automat):
                 self.doDestroyMe(*args, **kwargs)
             elif ( event == 'read-success' or event == 'timer-001sec' ) and not self.isAborted(*args, **kwargs) and self.isPipeReady(*args, **kwargs) and not self.isEOF(*args, **kwargs) and not self.isReadingNow(*args, **kwargs) and not self.isBlockReady(*args, **kwargs):
                 self.doRead(*args, **kwargs)
+            elif event == 'block-encrypted':
+                self.doBlockPushAndRaid(*args, **kwargs)
             elif event == 'block-raid-done' and not self.isAborted(*args, **kwargs):
                 self.doPopBlock(*args, **kwargs)
                 self.doBlockReport(*args, **kwargs)
@@ -224,25 +236,31 @@ class backup(automat.Automat):
                 self.doClose(*args, **kwargs)
                 self.doReport(*args, **kwargs)
                 self.doDestroyMe(*args, **kwargs)
-            elif event == 'block-raid-started' and not self.isEOF(*args, **kwargs) and not self.isAborted(*args, **kwargs):
-                self.state = 'READ'
-                self.doNextBlock(*args, **kwargs)
-                self.doRead(*args, **kwargs)
+            elif event == 'block-encrypted' and not self.isAborted(*args, **kwargs):
+                self.doBlockPushAndRaid(*args, **kwargs)
             elif event == 'block-raid-done' and self.isMoreBlocks(*args, **kwargs) and not self.isAborted(*args, **kwargs):
                 self.doPopBlock(*args, **kwargs)
                 self.doBlockReport(*args, **kwargs)
                 self.doNotifyNewData(*args, **kwargs)
-            elif event == 'fail' or ( ( event == 'timer-01sec' or event == 'block-raid-done' or event == 'block-raid-started' ) and self.isAborted(*args, **kwargs) ):
+            elif event == 'fail' or ( ( event == 'timer-01sec' or event == 'block-raid-done' or event == 'block-raid-started' or event == 'block-encrypted' ) and self.isAborted(*args, **kwargs) ):
                 self.state = 'ABORTED'
                 self.doClose(*args, **kwargs)
                 self.doReport(*args, **kwargs)
                 self.doDestroyMe(*args, **kwargs)
         #---ENCRYPT---
         elif self.state == 'ENCRYPT':
-            if event == 'block-encrypted':
+            if event == 'block-encrypt-started' and not self.isEOF(*args, **kwargs) and self.isMoreEncryptSlots(*args, **kwargs) and not self.isAborted(*args, **kwargs):
+                self.state = 'READ'
+                self.doNextBlock(*args, **kwargs)
+                self.doRead(*args, **kwargs)
+            elif event == 'block-encrypt-started' and self.isEOF(*args, **kwargs):
                 self.state = 'RAID'
+            elif event == 'block-encrypted' and not self.isAborted(*args, **kwargs):
+                self.state = 'READ'
                 self.doBlockPushAndRaid(*args, **kwargs)
-            elif event == 'fail':
+                self.doNextBlock(*args, **kwargs)
+                self.doRead(*args, **kwargs)
+            elif event == 'fail' or ( ( event == 'timer-01sec' or event == 'block-encrypted' ) and self.isAborted(*args, **kwargs) ):
                 self.state = 'ABORTED'
                 self.doClose(*args, **kwargs)
                 self.doReport(*args, **kwargs)
@@ -299,8 +317,14 @@ class backup(automat.Automat):
         Condition method.
         """
         if _Debug:
-            lg.args(_DebugLevel, workBlocks=len(self.workBlocks))
-        return len(self.workBlocks) > 1
+            lg.args(_DebugLevel, workBlocks=len(self.workBlocks), encryptingBlocks=len(self.encryptingBlocks))
+        return len(self.workBlocks) + len(self.encryptingBlocks) > 1
+
+    def isMoreEncryptSlots(self, *args, **kwargs):
+        """
+        Condition method.
+        """
+        return len(self.encryptingBlocks) < self.maxEncryptingBlocks
 
     def doInit(self, *args, **kwargs):
         """
@@ -366,34 +390,50 @@ class backup(automat.Automat):
         """
         Action method.
         """
-        def _doBlock():
+        def _doBlock(blockNumber, lastBlock, raw_bytes, session_key_type):
             dt = time.time()
-            raw_bytes = self.currentBlockData.getvalue()
             block = encrypted.Block(
                 CreatorID=self.creatorIDURL,
                 BackupID=self.backupID,
-                BlockNumber=self.blockNumber,
-                SessionKey=key.NewSessionKey(session_key_type=key.SessionKeyType()),
-                SessionKeyType=key.SessionKeyType(),
-                LastBlock=self.stateEOF,
+                BlockNumber=blockNumber,
+                SessionKey=key.NewSessionKey(session_key_type=session_key_type),
+                SessionKeyType=session_key_type,
+                LastBlock=lastBlock,
                 Data=raw_bytes,
                 EncryptKey=self.keyID,
             )
-            del raw_bytes
             if _Debug:
                 lg.out(_DebugLevel, 'backup.doEncryptBlock blockNumber=%d size=%d atEOF=%s dt=%s EncryptKey=%s' % (
-                    self.blockNumber, self.currentBlockSize, self.stateEOF, str(time.time() - dt), self.keyID))
+                    blockNumber, len(raw_bytes), lastBlock, str(time.time() - dt), self.keyID))
             return block
 
-        d = maybeDeferred(_doBlock)
-        d.addCallback(lambda block: self.automat('block-encrypted', block))
-        d.addErrback(lambda err: self.automat('fail', err))
+        def _doneBlock(block):
+            if self.encryptingBlocks is None:
+                # backup was already destroyed
+                return None
+            self.automat('block-encrypted', block)
+            return None
+
+        def _failedBlock(err):
+            if self.encryptingBlocks is None:
+                return None
+            self.automat('fail', err)
+            return None
+
+        self.encryptingBlocks.add(self.blockNumber)
+        d = threads.deferToThread(  # @UndefinedVariable
+            _doBlock, self.blockNumber, self.stateEOF, self.currentBlockData.getvalue(), key.SessionKeyType())
+        d.addCallback(_doneBlock)
+        d.addErrback(_failedBlock)
+        self.automat('block-encrypt-started', self.blockNumber)
 
     def doBlockPushAndRaid(self, *args, **kwargs):
         """
         Action method.
         """
         newblock = args[0]
+        if newblock is not None:
+            self.encryptingBlocks.discard(newblock.BlockNumber)
         if newblock is None:
             self.abort()
             self.automat('fail')
@@ -406,11 +446,20 @@ class backup(automat.Automat):
             if _Debug:
                 lg.out(_DebugLevel, 'backup.doBlockPushAndRaid SKIP, terminating=True')
             return
-        fileno, filename = tmpfile.make('raid', extension='.raid')
         serializedblock = newblock.Serialize()
         blocklen = len(serializedblock)
-        os.write(fileno, strng.to_bin(blocklen) + b":" + serializedblock)
-        os.close(fileno)
+        # write the header and the block separately to not make one more copy of the whole block in memory
+        filename = tmpfile.make_from_chunks(
+            'raid',
+            [strng.to_bin(blocklen) + b":", serializedblock, ],
+            extension='.raid',
+            shared_memory=settings.getBackupsSharedMemoryRaid(),
+        )
+        if not filename:
+            self.abort()
+            self.automat('fail')
+            lg.warn('failed to write block %d to a temporary file, ABORTING' % newblock.BlockNumber)
+            return
         self.workBlocks[newblock.BlockNumber] = filename
         dt = time.time()
         outputpath = os.path.join(
@@ -503,6 +552,7 @@ class backup(automat.Automat):
         self.stateReading = False
         self.closed = False
         self.workBlocks = None
+        self.encryptingBlocks = None
         self.resultDefer = None
         self.finishCallback = None
         self.blockResultCallback = None
@@ -65,6 +65,7 @@ from twisted.internet.defer import Deferred
 from logs import lg
 
 from system import bpio
+from system import local_fs
 from system import tmpfile
 from system import dirsize
 
@@ -110,6 +111,10 @@ _Jobs = {}   # here are already started backups ( by backupID )
 _Tasks = []  # here are tasks to start backups in the future ( pathID )
 _LastTaskNumber = 0
 _RevisionNumber = 0
+_IndexBaseRevision = -1
+_IndexFileSize = 0
+_JournalFileSize = 0
+_JournalCompactionRatio = 0.5
 _LoadingFlag = False
 _TaskStartedCallbacks = {}
 _TaskFinishedCallbacks = {}
@@ -153,6 +158,15 @@ def commit(new_revision_number=None):
     else:
         _RevisionNumber += 1
 
+
+def base_revision():
+    """
+    Revision number of the index when it was completely written to the file last time.
+    All changes made after that moment are kept in the journal file.
+    """
+    global _IndexBaseRevision
+    return _IndexBaseRevision
+
 #------------------------------------------------------------------------------
 
 
@@ -205,7 +219,114 @@ def WriteIndex(filepath=None, encoding='utf-8'):
     )
     if _Debug:
         lg.args(_DebugLevel, size=len(src), filepath=filepath)
-    return bpio.WriteTextFile(filepath, src)
+    ret = bpio.WriteTextFile(filepath, src)
+    if ret and filepath == settings.BackupIndexFilePath():
+        StartIndexJournal(len(src))
+    return ret
+
+
+def StartIndexJournal(index_file_size=0):
+    """
+    The whole index was just written to the file, so start a new empty journal on top of it.
+    """
+    global _IndexBaseRevision
+    global _IndexFileSize
+    global _JournalFileSize
+    _IndexBaseRevision = revision()
+    _IndexFileSize = index_file_size
+    header = '%d\n' % _IndexBaseRevision
+    bpio.WriteTextFile(settings.BackupIndexJournalFilePath(), header)
+    _JournalFileSize = len(header)
+    backup_fs.ResetChanges()
+
+
+def WriteIndexJournal(changes, encoding='utf-8'):
+    """
+    Append changes made in the index to the journal file, see ``backup_fs.PopChanges()``.
+
+    The first line of the journal keeps revision number of the index file it is based on.
+    Every next line is a JSON record marked with the revision number when the change was made,
+    a record without "o" field only moves the revision forward.
+    """
+    global _JournalFileSize
+    lines = []
+    for customer_idurl, record in changes:
+        record = dict(record)
+        record['r'] = revision()
+        record['c'] = customer_idurl.to_id()
+        lines.append(jsn.dumps(record, separators=(',', ':'), encoding=encoding))
+    if not lines:
+        lines.append(jsn.dumps({'r': revision(), }, separators=(',', ':'), encoding=encoding))
+    src = '\n'.join(lines) + '\n'
+    if not local_fs.AppendBinaryFile(settings.BackupIndexJournalFilePath(), src, mode='a'):
+        return False
+    _JournalFileSize += len(src)
+    if _Debug:
+        lg.args(_DebugLevel, records=len(changes), revision=revision(), journal_size=_JournalFileSize)
+    return True
+
+
+def ParseIndexJournal(text_data, encoding='utf-8'):
+    """
+    Returns a tuple (base_revision, records) or None if the journal is not valid.
+    Reading stops on the first broken line, this can happen if the program was stopped while writing the file.
+    """
+    lines = text_data.split('\n')
+    try:
+        journal_base_revision = int(lines[0])
+    except:
+        lg.exc()
+        return None
+    records = []
+    for line in lines[1:]:
+        if not line.strip():
+            continue
+        try:
+            record = jsn.loads_text(line, encoding=encoding)
+            record['r'] = int(record['r'])
+        except:
+            lg.warn('found broken line in the index journal, skip the rest')
+            break
+        records.append(record)
+    return journal_base_revision, records
+
+
+def ReadIndexJournal(records, known_revision, decoding='utf-8'):
+    """
+    Repeat all changes from the journal made after ``known_revision`` on top of already loaded index.
+    Returns latest applied revision number, it never goes past a record which was skipped,
+    so the index is not considered as up to date with the revision it does not fully have.
+    """
+    latest_revision = known_revision
+    skipped_revision = None
+    backup_fs.SuspendJournal()
+    try:
+        for record in records:
+            if record['r'] <= known_revision:
+                continue
+            if 'o' in record:
+                customer_idurl = global_id.GlobalUserToIDURL(record['c'])
+                if not id_url.is_cached(customer_idurl):
+                    lg.warn('identity %r is not yet cached, skip reading related journal record' % customer_idurl)
+                    skipped_revision = record['r'] if skipped_revision is None else min(skipped_revision, record['r'])
+                    continue
+                try:
+                    backup_fs.ApplyChange(
+                        record,
+                        iter=backup_fs.fs(customer_idurl),
+                        iterID=backup_fs.fsID(customer_idurl),
+                        decoding=decoding,
+                    )
+                except:
+                    lg.exc()
+                    skipped_revision = record['r'] if skipped_revision is None else min(skipped_revision, record['r'])
+                    continue
+            latest_revision = max(latest_revision, record['r'])
+    finally:
+        backup_fs.ResumeJournal()
+    if skipped_revision is not None:
+        latest_revision = min(latest_revision, skipped_revision - 1)
+    return latest_revision
 
 
 def ReadIndex(text_data, encoding='utf-8'):
@@ -220,6 +341,15 @@ def ReadIndex(text_data, encoding='utf-8'):
     if _LoadingFlag:
         return False
     _LoadingFlag = True
+    backup_fs.SuspendJournal()
+    try:
+        return _ReadIndex(text_data, encoding=encoding)
+    finally:
+        backup_fs.ResumeJournal()
+        _LoadingFlag = False
+
+
+def _ReadIndex(text_data, encoding='utf-8'):
     backup_fs.Clear()
     count = 0
     try:
@@ -260,7 +390,6 @@ def ReadIndex(text_data, encoding='utf-8'):
         lg.out(_DebugLevel, 'backup_control.ReadIndex %d items loaded' % count)
     # local_site.update_backup_fs(backup_fs.ListAllBackupIDsSQL())
     # commit(new_revision)
-    _LoadingFlag = False
     return True
 
 
@@ -291,6 +420,8 @@ def Load(filepath=None):
     ret = ReadIndex(raw_data)
     if ret:
         commit(known_revision)
+        if filepath == settings.BackupIndexFilePath():
+            LoadIndexJournal(len(src))
         backup_fs.Scan()
         backup_fs.Calculate()
     else:
@@ -298,6 +429,34 @@ def Load(filepath=None):
     return ret
 
 
+def LoadIndexJournal(index_file_size=0):
+    """
+    Read local journal file and repeat recent changes on top of just loaded index.
+    If the journal does not match the index file a new empty journal is started.
+    """
+    global _IndexBaseRevision
+    global _IndexFileSize
+    global _JournalFileSize
+    journal_path = settings.BackupIndexJournalFilePath()
+    src = ''
+    if os.path.isfile(journal_path):
+        src = bpio.ReadTextFile(journal_path) or ''
+    journal = ParseIndexJournal(src) if src else None
+    if not journal or journal[0] != revision():
+        if src:
+            lg.warn('index journal is not matching with the index file, start a new journal')
+        StartIndexJournal(index_file_size)
+        return False
+    latest_revision = ReadIndexJournal(journal[1], known_revision=revision())
+    _IndexBaseRevision = journal[0]
+    _IndexFileSize = index_file_size
+    _JournalFileSize = len(src)
+    commit(latest_revision)
+    if _Debug:
+        lg.out(_DebugLevel, 'backup_control.LoadIndexJournal %d records applied, revision is %d' % (len(journal[1]), revision()))
+    return True
+
+
 def Save(filepath=None):
     """
     Save index data base to local file ( call ``WriteIndex()`` ) and notify
@@ -307,7 +466,14 @@ def Save(filepath=None):
     if _LoadingFlag:
         return False
     commit()
-    WriteIndex(filepath)
+    if filepath is None and _IndexBaseRevision >= 0 and _JournalFileSize <= _IndexFileSize * _JournalCompactionRatio:
+        # only recent changes are appended to the journal
+        changes = backup_fs.PopChanges()
+        if changes is None or not WriteIndexJournal(changes):
+            WriteIndex()
+    else:
+        # journal is too big comparing to the index file - time to compact it
+        WriteIndex(filepath)
     if driver.is_on('service_backup_db'):
         # TODO: switch to event
         from storage import index_synchronizer
@@ -375,7 +541,12 @@ def IncomingSupplierListFiles(newpacket, list_files_global_id):
         auto_create=False,
     )
     list_files_orator.IncomingListFiles(newpacket)
-    if remote_files_changed:
+    manifest_header = backup_matrix.ReadManifestHeader(list_files_raw)
+    if manifest_header and manifest_header[2] is not None:
+        # only recent changes were received, they are stored only if were applied to the known revision
+        if manifest_header[1] != manifest_header[2] and backup_matrix.IsSupplierManifestApplied(num, manifest_header):
+            backup_matrix.AppendLatestRawListFiles(supplier_idurl, list_files_raw)
+    elif remote_files_changed or manifest_header:
         backup_matrix.SaveLatestRawListFiles(supplier_idurl, list_files_raw)
     if _Debug:
         lg.args(_DebugLevel, supplier=nameurl.GetName(supplier_idurl), customer=nameurl.GetName(customer_idurl),
@@ -401,6 +572,21 @@ def IncomingSupplierListFiles(newpacket, list_files_global_id):
     return True
 
 
+def _ReadSupplierIndexData(newpacket):
+    b = encrypted.Unserialize(newpacket.Payload)
+    if b is None:
+        lg.out(2, 'backup_control._ReadSupplierIndexData ERROR reading data from %s' % newpacket.RemoteID)
+        return None
+    try:
+        session_key = key.DecryptLocalPrivateKey(b.EncryptedSessionKey)
+        padded_data = key.DecryptWithSessionKey(session_key, b.EncryptedData, session_key_type=b.SessionKeyType)
+        return strng.to_text(padded_data[:int(b.Length)])
+    except:
+        lg.out(2, 'backup_control._ReadSupplierIndexData ERROR reading data from %s' % newpacket.RemoteID)
+        lg.exc()
+    return None
+
+
 def IncomingSupplierBackupIndex(newpacket):
     """
     Called by ``p2p.p2p_service`` when a remote copy of our local index data
@@ -408,14 +594,11 @@ def IncomingSupplierBackupIndex(newpacket):
 
     The index is also stored on suppliers to be able to restore it.
     """
-    b = encrypted.Unserialize(newpacket.Payload)
-    if b is None:
-        lg.out(2, 'backup_control.IncomingSupplierBackupIndex ERROR reading data from %s' % newpacket.RemoteID)
+    src = _ReadSupplierIndexData(newpacket)
+    if src is None:
         return None
+    inpt = StringIO(src)
     try:
-        session_key = key.DecryptLocalPrivateKey(b.EncryptedSessionKey)
-        padded_data = key.DecryptWithSessionKey(session_key, b.EncryptedData, session_key_type=b.SessionKeyType)
-        inpt = StringIO(strng.to_text(padded_data[:int(b.Length)]))
         supplier_revision = inpt.readline().rstrip('\n')
         if supplier_revision:
             supplier_revision = int(supplier_revision)
@@ -424,10 +607,7 @@ def IncomingSupplierBackupIndex(newpacket):
     except:
         lg.out(2, 'backup_control.IncomingSupplierBackupIndex ERROR reading data from %s' % newpacket.RemoteID)
         lg.exc()
-        try:
-            inpt.close()
-        except:
-            pass
+        inpt.close()
         return None
     if revision() > supplier_revision:
         inpt.close()
@@ -450,6 +630,38 @@ def IncomingSupplierBackupIndex(newpacket):
         lg.warn('failed to read catalog index from supplier')
     return supplier_revision
 
+
+def IncomingSupplierBackupIndexJournal(newpacket):
+    """
+    Called by ``index_synchronizer()`` when a remote copy of the index journal is received from supplier.
+
+    Returns a tuple (journal_base_revision, latest_revision) or None. If the journal is based on same
+    index file as our local copy and have more recent changes - those changes are applied locally.
+    """
+    src = _ReadSupplierIndexData(newpacket)
+    if src is None:
+        return None
+    journal = ParseIndexJournal(src)
+    if journal is None:
+        lg.warn('failed to read catalog index journal from supplier')
+        return None
+    journal_base_revision, records = journal
+    latest_revision = max([journal_base_revision, ] + [r['r'] for r in records])
+    if journal_base_revision != base_revision() or latest_revision <= revision():
+        if _Debug:
+            lg.out(_DebugLevel, 'backup_control.IncomingSupplierBackupIndexJournal SKIP, supplier %s base=%d revision=%d, local base=%d revision=%d' % (
+                newpacket.RemoteID, journal_base_revision, latest_revision, base_revision(), revision(), ))
+        return journal_base_revision, latest_revision
+    commit(ReadIndexJournal(records, known_revision=revision()))
+    backup_fs.Scan()
+    backup_fs.Calculate()
+    WriteIndex()
+    control.request_update()
+    if _Debug:
+        lg.out(_DebugLevel, 'backup_control.IncomingSupplierBackupIndexJournal updated to revision %d from %s' % (
+            revision(), newpacket.RemoteID))
+    return journal_base_revision, latest_revision
+
 #------------------------------------------------------------------------------
 
 
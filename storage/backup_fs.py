@@ -61,6 +61,7 @@ Those dictionaries are trees - replicates the file system structure.
 from __future__ import absolute_import
 from __future__ import print_function
 from six.moves import range
+from six.moves import intern
 from io import StringIO
 
 #------------------------------------------------------------------------------
@@ -113,6 +114,8 @@ TYPES = {
     DIR: 'DIR',
 }
 
+_NoVersionInfo = (-1, -1, )
+
 #------------------------------------------------------------------------------
 
 _FileSystemIndexByName = {}
@@ -123,6 +126,14 @@ _DirsCount = 0
 _SizeFiles = 0
 _SizeFolders = 0
 _SizeBackups = 0
+_ChangedItems = {}
+_DeletedItems = []
+_JournalSuspended = 0
+_JournalBroken = False
+_DirtyPaths = set()
+_DirtyAll = True
+_MaxDirtyPaths = 10000
+_TotalsGeneration = 0
 
 #------------------------------------------------------------------------------
 
@@ -192,6 +203,156 @@ def customerIDURLFromRootItemID(iterID):
 
 #------------------------------------------------------------------------------
 
+
+def SuspendJournal():
+    """
+    Stop tracking changes in the index, used while the whole index is loaded from file.
+    Calls can be nested, every call must be followed by ``ResumeJournal()``.
+    """
+    global _JournalSuspended
+    _JournalSuspended += 1
+
+
+def ResumeJournal():
+    global _JournalSuspended
+    _JournalSuspended = max(0, _JournalSuspended - 1)
+
+
+def HasChanges():
+    """
+    Returns True if some items were modified since last call of ``PopChanges()`` or ``ResetChanges()``.
+    """
+    return bool(_ChangedItems or _DeletedItems or _JournalBroken)
+
+
+def ResetChanges():
+    """
+    Forget all tracked changes, called when the whole index was just written to the file.
+    """
+    global _JournalBroken
+    _ChangedItems.clear()
+    del _DeletedItems[:]
+    _JournalBroken = False
+
+
+def PopChanges(encoding='utf-8'):
+    """
+    Returns a list of records describing all changes since the last call, every record is a tuple::
+
+        (customer_idurl, {'o': 'del', 'i': path_id, })
+        (customer_idurl, {'o': 'put', 'd': <serialized item>, })
+
+    All deleted items goes first, parents are always put before their childs.
+    Returns None if some changes can not be described that way and the whole index must be saved.
+    """
+    if _JournalBroken:
+        ResetChanges()
+        return None
+    result = []
+    for customer_idurl, path_id in _DeletedItems:
+        result.append((customer_idurl, {'o': 'del', 'i': path_id, }, ))
+    updated = []
+    for item in _ChangedItems.values():
+        customer_idurl = _FindItemCustomer(item)
+        if customer_idurl is None:
+            # item was removed from the index after it was changed
+            continue
+        updated.append((item.path_id.count('/'), customer_idurl, item, ))
+    updated.sort(key=lambda u: u[0])
+    for _, customer_idurl, item in updated:
+        result.append((customer_idurl, {'o': 'put', 'd': item.serialize(encoding=encoding, to_json=True), }, ))
+    ResetChanges()
+    return result
+
+
+def ApplyChange(record, iter=None, iterID=None, decoding='utf-8'):
+    """
+    Repeat a single change made by ``PopChanges()`` on the given index tree.
+    """
+    if iter is None:
+        iter = fs()
+    if iterID is None:
+        iterID = fsID()
+    if record['o'] == 'del':
+        DeleteByID(record['i'], iter=iter, iterID=iterID)
+        return True
+    if record['o'] != 'put':
+        raise ValueError('Incorrect change record: %r' % record)
+    item = FSItemInfo()
+    item.unserialize(record['d'], decoding=decoding, from_json=True)
+    existing = GetByID(item.path_id, iterID=iterID)
+    if existing is not None:
+        if existing.type == item.type and existing.name() == item.name():
+            existing.size = item.size
+            existing.key_id = item.key_id
+            existing.versions = item.versions
+            _on_item_changed(existing)
+            return True
+        DeleteByID(item.path_id, iter=iter, iterID=iterID)
+    if item.type == DIR:
+        return SetDir(item, iter=iter, iterID=iterID)
+    return SetFile(item, iter=iter, iterID=iterID)
+
+
+def _FindItemCustomer(item):
+    for customer_idurl, rootIterID in _FileSystemIndexByID.items():
+        if GetByID(item.path_id, iterID=rootIterID) is item:
+            return customer_idurl
+    return None
+
+
+def _on_item_changed(item):
+    _mark_dirty(item.path_id)
+    if _JournalSuspended:
+        return
+    _ChangedItems[id(item)] = item
+
+
+def _on_item_resized(item):
+    # size is also stored in the index file, so that change must be written to the journal too
+    _on_item_changed(item)
+
+
+def _on_item_deleted(iterID, path_id):
+    global _JournalBroken
+    global _DirtyAll
+    for customer_idurl, rootIterID in _FileSystemIndexByID.items():
+        if rootIterID is iterID:
+            _mark_dirty(path_id.strip('/'))
+            if not _JournalSuspended:
+                _DeletedItems.append((customer_idurl, path_id.strip('/'), ))
+            return
+    # not a root item, can not describe that change in the journal
+    _DirtyAll = True
+    if not _JournalSuspended:
+        _JournalBroken = True
+
+
+def _mark_dirty(path_id):
+    """
+    Remember that cached totals of all folders on that path must be calculated again.
+    """
+    global _DirtyAll
+    if _DirtyAll:
+        return
+    if len(_DirtyPaths) >= _MaxDirtyPaths:
+        # too many changes, faster to calculate everything from scratch
+        _DirtyAll = True
+        _DirtyPaths.clear()
+        return
+    _DirtyPaths.add(path_id)
+
+
+def _intern(s):
+    if s is None:
+        return None
+    try:
+        return intern(s)
+    except TypeError:
+        return s
+
+#------------------------------------------------------------------------------
+
 def known_customers():
     """
     """
@@ -253,18 +414,47 @@ def sizebackups():
 #------------------------------------------------------------------------------
 
 
-class FSItemInfo():
+class FSItemInfo(object):
     """
     A class to represent a remote file or folder.
+
+    Index can keep millions of items, so this class is slotted and all strings are interned.
+    Versions are packed into a single flat tuple ``(version, maxblocknum, sizebytes, version, ...)``
+    which is None while item has no versions, usually there are just a few of them.
     """
 
+    __slots__ = ('unicodename', 'path_id', 'type', 'size', 'key_id', '_versions', '_totals', )
+
     def __init__(self, name='', path_id='', typ=UNKNOWN, key_id=None):
-        self.unicodename = strng.to_text(name)
-        self.path_id = path_id
+        self.unicodename = _intern(strng.to_text(name))
+        self.path_id = _intern(path_id)
         self.type = typ
         self.size = -1
-        self.key_id = key_id
-        self.versions = {}
+        self.key_id = _intern(key_id)
+        self._versions = None
+        self._totals = None
+
+    @property
+    def versions(self):
+        if self._versions is None:
+            return {}
+        packed = self._versions
+        return dict((packed[pos], (packed[pos + 1], packed[pos + 2], )) for pos in range(0, len(packed), 3))
+
+    @versions.setter
+    def versions(self, versions):
+        packed = []
+        for version, info in versions.items():
+            packed.extend((_intern(version), info[0], info[1], ))
+        self._versions = tuple(packed) or None
+
+    def _find_version(self, version):
+        if self._versions is None:
+            return -1
+        try:
+            return self._versions[0::3].index(version) * 3
+        except ValueError:
+            return -1
 
     def __repr__(self):
         return '<%s %s %d %s>' % (TYPES[self.type], misc.unicode_to_str_safe(self.name()), self.size, self.key_id)
@@ -279,7 +469,9 @@ class FSItemInfo():
         return self.size != -1
 
     def set_size(self, sz):
-        self.size = sz
+        if self.size != sz:
+            self.size = sz
+            _on_item_resized(self)
 
     def read_stats(self, path):
         if not bpio.pathExist(path):
@@ -294,7 +486,7 @@ class FSItemInfo():
             except:
                 lg.exc()
                 return False
-        self.size = int(s.st_size)
+        self.set_size(int(s.st_size))
         return True
 
     def read_versions(self, local_path):
@@ -343,30 +535,52 @@ class FSItemInfo():
         return totalSize
 
     def add_version(self, version):
-        self.versions[version] = [-1, -1]
+        self._put_version(version, _NoVersionInfo[0], _NoVersionInfo[1])
+        _on_item_changed(self)
 
     def set_version_info(self, version, maxblocknum, sizebytes):
-        self.versions[version] = [maxblocknum, sizebytes, ]
+        pos = self._find_version(version)
+        if pos >= 0 and self._versions[pos + 1:pos + 3] == (maxblocknum, sizebytes, ):
+            return
+        self._put_version(version, maxblocknum, sizebytes, pos)
+        _on_item_changed(self)
+
+    def _put_version(self, version, maxblocknum, sizebytes, pos=None):
+        if pos is None:
+            pos = self._find_version(version)
+        if pos < 0:
+            self._versions = (self._versions or ()) + (_intern(version), maxblocknum, sizebytes, )
+        else:
+            self._versions = self._versions[:pos + 1] + (maxblocknum, sizebytes, ) + self._versions[pos + 3:]
 
     def get_version_info(self, version):
-        return self.versions.get(version, [-1, -1])
+        pos = self._find_version(version)
+        if pos < 0:
+            return _NoVersionInfo
+        return self._versions[pos + 1:pos + 3]
 
     def get_version_size(self, version):
-        return self.versions.get(version, [-1, -1])[1]
+        return self.get_version_info(version)[1]
 
     def delete_version(self, version):
-        self.versions.pop(version, None)
+        pos = self._find_version(version)
+        if pos < 0:
+            return
+        self._versions = (self._versions[:pos] + self._versions[pos + 3:]) or None
+        _on_item_changed(self)
 
     def has_version(self, version):
-        return version in self.versions
+        return self._find_version(version) >= 0
 
     def any_version(self):
-        return len(self.versions) > 0
+        return self._versions is not None
 
     def list_versions(self, sorted=False, reverse=False):
+        if self._versions is None:
+            return []
         if sorted:
-            return misc.sorted_versions(list(self.versions.keys()), reverse)
-        return list(self.versions.keys())
+            return misc.sorted_versions(list(self._versions[0::3]), reverse)
+        return list(self._versions[0::3])
 
     def get_versions(self):
         return self.versions
@@ -379,7 +593,7 @@ class FSItemInfo():
     def pack_versions(self):
         out = []
         for version in self.list_versions(True):
-            info = self.versions[version]
+            info = self.get_version_info(version)
             out.append(version + ':' + str(info[0]) + ':' + str(info[1]))
         return ' '.join(out)
 
@@ -404,8 +618,8 @@ class FSItemInfo():
                 'k': self.key_id,
                 'v': [{
                     'n': v,
-                    'b': self.versions[v][0],
-                    's': self.versions[v][1],
+                    'b': self.get_version_info(v)[0],
+                    's': self.get_version_info(v)[1],
                 } for v in self.list_versions(sorted=True)]
             }
         e = strng.to_text(self.unicodename, encoding=encoding)
@@ -415,13 +629,13 @@ class FSItemInfo():
     def unserialize(self, src, decoding='utf-8', from_json=False):
         if from_json:
             try:
-                self.unicodename = strng.to_text(src['n'], encoding=decoding)
-                self.path_id = strng.to_text(src['i'], encoding=decoding)
+                self.unicodename = _intern(strng.to_text(src['n'], encoding=decoding))
+                self.path_id = _intern(strng.to_text(src['i'], encoding=decoding))
                 self.type = src['t']
                 self.size = src['s']
-                self.key_id = my_keys.latest_key_id(strng.to_text(src['k'], encoding=decoding))
+                self.key_id = _intern(my_keys.latest_key_id(strng.to_text(src['k'], encoding=decoding)))
                 self.versions = {
-                    strng.to_text(v['n']): [v['b'], v['s'], ] for v in src['v']
+                    strng.to_text(v['n']): (v['b'], v['s'], ) for v in src['v']
                 }
             except:
                 lg.exc()
@@ -435,9 +649,10 @@ class FSItemInfo():
         if not details or not name:
             raise Exception('Incorrect item format:\n%s' % src)
         try:
-            self.unicodename = name
+            self.unicodename = _intern(name)
             details = details.split(' ')
             self.path_id, self.type, self.size = details[:3]
+            self.path_id = _intern(self.path_id)
             self.type, self.size = int(self.type), int(self.size)
             self.unpack_versions(' '.join(details[3:]))
         except:
@@ -458,7 +673,7 @@ def MakeID(itr, randomized=True):
     for k in itr.keys():
         if k == 0:
             continue
-        if k == settings.BackupIndexFileName():
+        if k in (settings.BackupIndexFileName(), settings.BackupIndexJournalFileName(), ):
             continue
         try:
             if isinstance(itr[k], int):
@@ -531,6 +746,7 @@ def AddFile(path, read_stats=False, iter=None, iterID=None, key_id=None):
             iter[ii.name()] = {0: id}
             # also save index from opposite side
             iterID[id] = {INFO_KEY: ii}
+            _on_item_changed(ii)
         else:
             # get an existing ID from the index
             id = iter[name][0]
@@ -551,6 +767,7 @@ def AddFile(path, read_stats=False, iter=None, iterID=None, key_id=None):
         ii.read_stats(path)
     iter[ii.name()] = id
     iterID[id] = ii
+    _on_item_changed(ii)
     # finally make a complete backup id - this a relative path to the backed up file
     return resultID, iter, iterID
 
@@ -603,6 +820,7 @@ def AddDir(path, read_stats=False, iter=None, iterID=None, key_id=None, force_pa
                 ii.read_stats(p)
             iter[ii.name()] = {0: id}
             iterID[id] = {INFO_KEY: ii}
+            _on_item_changed(ii)
         else:
             id = iter[name][0]
             resultID += '/' + str(id)
@@ -612,7 +830,8 @@ def AddDir(path, read_stats=False, iter=None, iterID=None, key_id=None, force_pa
         if i == len(parts) - 1:
             if iterID[INFO_KEY].type != DIR:
                 lg.warn('not a dir: %s' % iterID[INFO_KEY])
-            iterID[INFO_KEY].type = DIR
+                iterID[INFO_KEY].type = DIR
+                _on_item_changed(iterID[INFO_KEY])
     return resultID.lstrip('/'), iter, iterID
 
 
@@ -661,6 +880,7 @@ def AddLocalPath(localpath, read_stats=False, iter=None, iterID=None, key_id=Non
                     if read_stats:
                         ii.read_stats(p)
                     iterID[id] = {INFO_KEY: ii}
+                    _on_item_changed(ii)
                     lastID = id
                 else:
                     id = iter[name][0]
@@ -672,6 +892,7 @@ def AddLocalPath(localpath, read_stats=False, iter=None, iterID=None, key_id=Non
                     ii.read_stats(p)
                 iter[ii.name()] = id
                 iterID[id] = ii
+                _on_item_changed(ii)
                 c += 1
                 lastID = id
         return c
@@ -707,6 +928,7 @@ def PutItem(name, parent_path_id, as_folder=False, iter=None, iterID=None, key_i
     ii = FSItemInfo(name=remote_path, path_id=resultID, typ=typ, key_id=key_id)
     iter[ii.name()] = newItemID
     iterID[newItemID] = ii
+    _on_item_changed(ii)
     return resultID, iter, iterID
 
 #------------------------------------------------------------------------------
@@ -731,6 +953,7 @@ def SetFile(item, iter=None, iterID=None):
             if item.name() not in iter:
                 iter[item.name()] = id
                 iterID[id] = item
+                _on_item_changed(item)
             return True
         found = False
         for name in iter.keys():
@@ -768,6 +991,7 @@ def SetDir(item, iter=None, iterID=None):
             if id not in iterID:
                 iterID[id] = {}
             iterID[id][INFO_KEY] = item
+            _on_item_changed(item)
             return True
         found = False
         for name in iter.keys():
@@ -891,6 +1115,7 @@ def DeleteByID(pathID, iter=None, iterID=None):
         iter = fs()
     if iterID is None:
         iterID = fsID()
+    rootIterID = iterID
     path = ''
     parts = pathID.strip('/').split('/')
     for j in range(len(parts)):
@@ -918,6 +1143,7 @@ def DeleteByID(pathID, iter=None, iterID=None):
         if j == len(parts) - 1:
             iterID.pop(id)
             iter.pop(name)
+            _on_item_deleted(rootIterID, pathID)
             return path
         iterID = iterID[id]
         iter = iter[name]
@@ -932,6 +1158,7 @@ def DeleteByPath(path, iter=None, iterID=None):
         iter = fs()
     if iterID is None:
         iterID = fsID()
+    rootIterID = iterID
     path_id = ''
     ppath = bpio.remotePath(path)
     parts = ppath.lstrip('/').split('/')
@@ -939,6 +1166,7 @@ def DeleteByPath(path, iter=None, iterID=None):
         path_id = iter[ppath]
         iter.pop(ppath)
         iterID.pop(path_id)
+        _on_item_deleted(rootIterID, str(path_id))
         return str(path_id)
     for j in range(len(parts)):
         name = parts[j]
@@ -961,6 +1189,7 @@ def DeleteByPath(path, iter=None, iterID=None):
         if j == len(parts) - 1:
             iter.pop(name)
             iterID.pop(id)
+            _on_item_deleted(rootIterID, path_id)
             return path_id.lstrip('/')
         iter = iter[name]
         iterID = iterID[id]
@@ -1909,77 +2138,102 @@ def ScanID(pathID, basedir=None, customer_idurl=None):
 
 def Calculate(iterID=None):
     """
-    Scan all items in the index and calculate folder and backups sizes.
+    Calculate folder and backups sizes in the index.
+
+    Totals of every folder are cached in the folder item, only folders on the path
+    to the items changed since the last call are visited again.
     """
     global _SizeFiles
     global _SizeFolders
     global _SizeBackups
     global _ItemsCount
     global _FilesCount
-    _ItemsCount = 0
-    _FilesCount = 0
-    _DirsCount = 0
-    _SizeFiles = 0
-    _SizeFolders = 0
-    _SizeBackups = 0
-
-    def recursive_calculate(i):
-        global _SizeFiles
-        global _SizeFolders
-        global _SizeBackups
-        global _ItemsCount
-        global _FilesCount
-        global _DirsCount
-        folder_size = 0
-        for id in i.keys():
-            if id == INFO_KEY:
-                continue
-            if isinstance(i[id], FSItemInfo):
-                if i[id].exist():
-                    folder_size += i[id].size
-                if i[id].type == FILE:
-                    _FilesCount += 1
-                    if i[id].exist():
-                        _SizeFiles += i[id].size
-                if i[id].type == DIR:
-                    _DirsCount += 1
-                    if i[id].exist():
-                        _SizeFolders += i[id].size
-                for version in i[id].list_versions():
-                    versionSize = i[id].get_version_info(version)[1]
-                    if versionSize > 0:
-                        _SizeBackups += versionSize
-                _ItemsCount += 1
-            elif isinstance(i[id], dict):
-                sub_folder_size = recursive_calculate(i[id])
-                if sub_folder_size != -1:
-                    folder_size += sub_folder_size
-            else:
-                raise Exception('Error, wrong item type in the index')
-        if INFO_KEY in i:
-            i[INFO_KEY].size = folder_size
-            if i[INFO_KEY].type == FILE:
-                _FilesCount += 1
-                if i[INFO_KEY].exist():
-                    _SizeFiles += i[INFO_KEY].size
-            if i[INFO_KEY].type == DIR:
-                _DirsCount += 1
-                if i[INFO_KEY].exist():
-                    _SizeFolders += i[INFO_KEY].size
-            for version in i[INFO_KEY].list_versions():
-                versionSize = i[INFO_KEY].get_version_info(version)[1]
-                if versionSize > 0:
-                    _SizeBackups += versionSize
-            _ItemsCount += 1
-        return folder_size
-
+    global _DirsCount
+    global _DirtyAll
+    global _TotalsGeneration
     if iterID is None:
         iterID = fsID()
-    ret = recursive_calculate(iterID)
+    if _DirtyAll:
+        _TotalsGeneration += 1
+        _DirtyAll = False
+    else:
+        roots = list(_FileSystemIndexByID.values())
+        if not any(r is iterID for r in roots):
+            roots.append(iterID)
+        for path_id in _DirtyPaths:
+            for rootIterID in roots:
+                _InvalidateTotals(rootIterID, path_id)
+    _DirtyPaths.clear()
+    totals = _CalculateTotals(iterID)
+    _ItemsCount, _FilesCount, _DirsCount, _SizeFiles, _SizeFolders, _SizeBackups = totals[1:]
     if _Debug:
         lg.out(_DebugLevel, 'backup_fs.Calculate %d %d %d %d' % (
             _ItemsCount, _FilesCount, _SizeFiles, _SizeBackups))
-    return ret
+    return totals[0]
+
+
+def _InvalidateTotals(iterID, path_id):
+    i = iterID
+    for part in path_id.split('/'):
+        try:
+            i = i[int(part)]
+        except (ValueError, KeyError, ):
+            return
+        if not isinstance(i, dict):
+            return
+        if INFO_KEY in i:
+            i[INFO_KEY]._totals = None
+
+
+def _ItemTotals(info):
+    """
+    Returns a tuple (items, files, dirs, size_files, size_folders, size_backups) for a single item.
+    """
+    size = info.size if info.exist() else 0
+    size_backups = 0
+    for version in info.list_versions():
+        versionSize = info.get_version_info(version)[1]
+        if versionSize > 0:
+            size_backups += versionSize
+    if info.type == FILE:
+        return (1, 1, 0, size, 0, size_backups, )
+    if info.type == DIR:
+        return (1, 0, 1, 0, size, size_backups, )
+    return (1, 0, 0, 0, 0, size_backups, )
+
+
+def _CalculateTotals(i):
+    """
+    Returns a tuple (folder_size, items, files, dirs, size_files, size_folders, size_backups) for the sub tree.
+    """
+    info = i.get(INFO_KEY)
+    if info is not None and info._totals is not None and info._totals[0] == _TotalsGeneration:
+        return info._totals[1]
+    totals = [0, 0, 0, 0, 0, 0, 0, ]
+    for id, sub in i.items():
+        if id == INFO_KEY:
+            continue
+        if isinstance(sub, FSItemInfo):
+            if sub.exist():
+                totals[0] += sub.size
+            sub_totals = _ItemTotals(sub)
+        elif isinstance(sub, dict):
+            sub_totals = _CalculateTotals(sub)
+            totals[0] += sub_totals[0]
+            sub_totals = sub_totals[1:]
+        else:
+            raise Exception('Error, wrong item type in the index')
+        for pos in range(6):
+            totals[pos + 1] += sub_totals[pos]
+    if info is not None:
+        info.size = totals[0]
+        own_totals = _ItemTotals(info)
+        for pos in range(6):
+            totals[pos + 1] += own_totals[pos]
+        totals = tuple(totals)
+        info._totals = (_TotalsGeneration, totals, )
+        return totals
+    return tuple(totals)
 
 #------------------------------------------------------------------------------
 
@@ -1988,8 +2242,13 @@ def Clear(customer_idurl=None):
     """
     Erase all items in the index.
     """
+    global _JournalBroken
+    global _DirtyAll
     fs(customer_idurl=customer_idurl).clear()
     fsID(customer_idurl=customer_idurl).clear()
+    _DirtyAll = True
+    if not _JournalSuspended:
+        _JournalBroken = True
 
 
 def Serialize(iterID=None, to_json=False, encoding='utf-8', filter_cb=None):
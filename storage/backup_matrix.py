@@ -64,7 +64,10 @@ _DebugLevel = 8
 #------------------------------------------------------------------------------
 
 import os
+import re
 import sys
+import time
+import heapq
 
 try:
     from twisted.internet import reactor  # @UnresolvedImport
@@ -76,6 +79,7 @@ except:
 from logs import lg
 
 from system import bpio
+from system import local_fs
 
 from lib import packetid
 from lib import misc
@@ -90,6 +94,7 @@ from services import driver
 from crypt import my_keys
 
 from storage import backup_fs
+from storage import blocks_matrix
 
 from userid import my_id
 from userid import global_id
@@ -109,6 +114,8 @@ _UpdatedBackupIDs = set()
 _RepaintingTask = None
 _RepaintingTaskDelay = 2.0
 _ListFilesQueryCallbacks = {}
+_SuppliersManifests = {}
+_FullListFilesPeriod = 60 * 60
 
 #------------------------------------------------------------------------------
 
@@ -148,7 +155,7 @@ def remote_files():
       0  : no info comes yet
       1  : this file exist on given remote machine
 
-    This is a dictionary of dictionaries of dictionaries of lists. :-)))
+    This is a dictionary of ``storage.blocks_matrix.BlocksMatrix`` objects, one per backup.
     Values can be accessed this way::
 
       remote_files()[backupID][blockNumber][dataORparity][supplierNumber]
@@ -202,6 +209,28 @@ def local_backup_size():
     global _LocalBackupSize
     return _LocalBackupSize
 
+
+def remote_matrix(backupID, create=False):
+    """
+    Returns ``BlocksMatrix`` object for given backup from "remote" matrix, or None if not exist.
+    """
+    matrix = remote_files().get(backupID)
+    if matrix is None and create:
+        matrix = blocks_matrix.BlocksMatrix(contactsdb.num_suppliers(customer_idurl=packetid.CustomerIDURL(backupID)))
+        remote_files()[backupID] = matrix
+    return matrix
+
+
+def local_matrix(backupID, create=False):
+    """
+    Returns ``BlocksMatrix`` object for given backup from "local" matrix, or None if not exist.
+    """
+    matrix = local_files().get(backupID)
+    if matrix is None and create:
+        matrix = blocks_matrix.BlocksMatrix(contactsdb.num_suppliers(customer_idurl=packetid.CustomerIDURL(backupID)))
+        local_files()[backupID] = matrix
+    return matrix
+
 #------------------------------------------------------------------------------
 
 
@@ -285,6 +314,58 @@ def DetectSupplierPosition(raw_list_file_text):
 
 #------------------------------------------------------------------------------
 
+def ReadManifestHeader(raw_list_file_text):
+    """
+    Suppliers are sending "R<epoch> <revision>" or "R<epoch> <revision> <since revision>" as a first line
+    when customer was asking about revision of the files manifest.
+    Returns tuple (epoch, revision, since revision) or None, since revision is None for the full list of files.
+    """
+    if not raw_list_file_text or not raw_list_file_text.startswith('R'):
+        return None
+    words = raw_list_file_text[1:raw_list_file_text.find('\n')].strip().split(' ')
+    try:
+        if len(words) == 2:
+            return words[0], int(words[1]), None
+        return words[0], int(words[1]), int(words[2])
+    except:
+        lg.warn('incorrect manifest header: %r' % words)
+    return None
+
+
+def GetSupplierManifest(supplier_num, customer_idurl=None):
+    """
+    Returns info about files manifest of given supplier to be sent in the ListFiles() request.
+    Empty dictionary means that all files must be sent,
+    this is also happens periodically to be sure remote info is fully in sync.
+    """
+    if not customer_idurl:
+        customer_idurl = my_id.getLocalID()
+    known = _SuppliersManifests.get((id_url.to_bin(customer_idurl), supplier_num))
+    if not known or time.time() - known['time'] > _FullListFilesPeriod:
+        return {}
+    return {'epoch': known['epoch'], 'revision': known['revision'], }
+
+
+def IsSupplierManifestApplied(supplier_num, manifest_header, customer_idurl=None):
+    """
+    Returns True if files manifest with given header was processed the last for that supplier,
+    recent changes which did not match known revision are rejected in ``process_raw_list_files()``.
+    """
+    if not customer_idurl:
+        customer_idurl = my_id.getLocalID()
+    known = _SuppliersManifests.get((id_url.to_bin(customer_idurl), supplier_num))
+    if not known or not manifest_header:
+        return False
+    return known['epoch'] == manifest_header[0] and known['revision'] == manifest_header[1]
+
+
+def ForgetSupplierManifest(supplier_num, customer_idurl=None):
+    if not customer_idurl:
+        customer_idurl = my_id.getLocalID()
+    _SuppliersManifests.pop((id_url.to_bin(customer_idurl), supplier_num), None)
+
+#------------------------------------------------------------------------------
+
 def process_line_key(line):
     return line.strip()
 
@@ -321,7 +402,7 @@ def process_line_file(line, current_key_alias=None, customer_idurl=None, is_in_s
         if not backup_fs.IsFileID(pth, iterID=backup_fs.fsID(customer_idurl)):
             if _Debug:
                 lg.out(_DebugLevel, '        AUTO CREATE FILE "%s" in the index' % pth)
-            if pth.strip('/') not in [settings.BackupIndexFileName(), ]:
+            if pth.strip('/') not in [settings.BackupIndexFileName(), settings.BackupIndexJournalFileName(), ]:
                 item = backup_fs.FSItemInfo(
                     name=pth.strip('/'),
                     path_id=pth.strip('/'),
@@ -353,6 +434,9 @@ def process_line_file(line, current_key_alias=None, customer_idurl=None, is_in_s
                 iterID=backup_fs.fsID(customer_idurl),
             )
             modified = True
+        elif pth.strip('/') in [settings.BackupIndexJournalFileName(), ]:
+            # recent changes of the index file, it is not tracked in the index itself
+            pass
         else:
             if is_in_sync:
                 # so we have some modifications in the index - it is not empty!
@@ -387,7 +471,7 @@ def process_line_dir(line, current_key_alias=None, customer_idurl=None, is_in_sy
         if not backup_fs.ExistsID(pth, iterID=backup_fs.fsID(customer_idurl)):
             if _Debug:
                 lg.out(_DebugLevel, '        AUTO CREATE DIR "%s" in the index' % pth)
-            if pth.strip('/') not in [settings.BackupIndexFileName(), ]: 
+            if pth.strip('/') not in [settings.BackupIndexFileName(), settings.BackupIndexJournalFileName(), ]: 
                 item = backup_fs.FSItemInfo(
                     name=pth.strip('/'),
                     path_id=pth.strip('/'),
@@ -532,20 +616,22 @@ def process_line_version(line, supplier_num, current_key_alias=None, customer_id
                 lg.exc()
                 return modified, backups2remove, paths2remove, found_backups, newfiles
     if backupID not in remote_files():
-        remote_files()[backupID] = {}
         if _Debug:
             lg.out(_DebugLevel, '            new remote entry for %s created in the memory' % backupID)
-    # +1 because range(2) give us [0,1] but we want [0,1,2]
-    for blockNum in range(maxBlockNum + 1):
-        if blockNum not in remote_files()[backupID]:
-            remote_files()[backupID][blockNum] = {
-                'D': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl),
-                'P': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl), }
-        for dataORparity in ['Data', 'Parity', ]:
-            # we set -1 if the file is missing and 1 if exist, so 0 mean "no info yet" ... smart!
-            bit = -1 if str(blockNum) in missingBlocksSet[dataORparity] else 1
-            remote_files()[backupID][blockNum][dataORparity[0]][supplier_num] = bit
-            newfiles += int((bit + 1) / 2)  # this should switch -1 or 1 to 0 or 1
+    matrix = remote_matrix(backupID, create=True)
+    for dataORparity in ['Data', 'Parity', ]:
+        # we set -1 if the file is missing and 1 if exist, so 0 mean "no info yet" ... smart!
+        # +1 because range(2) give us [0,1] but we want [0,1,2]
+        cells = bytearray(blocks_matrix.EXIST * (maxBlockNum + 1))
+        for blockNum in missingBlocksSet[dataORparity]:
+            try:
+                blockNum = int(blockNum)
+            except:
+                continue
+            if 0 <= blockNum <= maxBlockNum:
+                cells[blockNum] = blocks_matrix.encode(-1)
+        matrix.set_column(dataORparity[0], supplier_num, cells)
+        newfiles += cells.count(blocks_matrix.EXIST)
     # save max block number for this backup
     if backupID not in remote_max_block_numbers():
         remote_max_block_numbers()[backupID] = -1
@@ -563,6 +649,35 @@ def process_line_version(line, supplier_num, current_key_alias=None, customer_id
     return modified, backups2remove, paths2remove, found_backups, newfiles
 
 
+def process_line_removed(line, supplier_num, current_key_alias=None, customer_idurl=None):
+    """
+    Supplier reported that given path and everything inside it was removed: "X<path>",
+    only sent together with "R" header line when supplier sends recent changes.
+    Returns set of backup IDs which were affected.
+    """
+    pth = line.strip()
+    customer = global_id.UrlToGlobalID(customer_idurl)
+    affected = set()
+    if pth == '*':
+        prefix = packetid.MakeBackupID(customer=customer, path_id='', key_alias=current_key_alias)
+        affected.update([backupID for backupID in remote_files().keys() if backupID.startswith(prefix)])
+    else:
+        remotePath, _, versionName = pth.rpartition('/')
+        if packetid.IsCanonicalVersion(versionName):
+            backupID = packetid.MakeBackupID(customer=customer, path_id=remotePath, key_alias=current_key_alias, version=versionName)
+            if backupID in remote_files():
+                affected.add(backupID)
+        else:
+            prefix = packetid.MakeBackupID(customer=customer, path_id=pth, key_alias=current_key_alias)
+            affected.update([backupID for backupID in remote_files().keys() if backupID == prefix or backupID.startswith(prefix + '/')])
+    for backupID in affected:
+        ClearSupplierBackupRemoteInfo(supplier_num, backupID)
+        RepaintBackup(backupID)
+    if _Debug:
+        lg.out(_DebugLevel, '        PATH "%s" removed, %d backups affected' % (pth, len(affected)))
+    return affected
+
+
 def process_raw_list_files(supplier_num, list_files_text_body, customer_idurl=None, is_in_sync=None, auto_create=False):
     """
     Read ListFiles packet for given supplier and build a "remote" matrix. All
@@ -588,6 +703,18 @@ def process_raw_list_files(supplier_num, list_files_text_body, customer_idurl=No
       "F" for files
       "D" for folders
       "V" for stored data
+
+    If the first line is "R<epoch> <revision> <since revision>" only recent changes
+    were sent by the supplier, they are applied to the "remote" matrix in place:
+
+      R4f2c9a1b07de 1843 1790
+      Q*
+      Kmaster
+      X0/1/F20090709034221PM
+      V0/1/F20090709034221PM 3 0-1001 7463990
+      X0/0/123/4567
+
+    Here "X" means that path and everything inside it was removed from the supplier.
     """
     global _ListFilesQueryCallbacks
     from storage import backup_control
@@ -604,8 +731,21 @@ def process_raw_list_files(supplier_num, list_files_text_body, customer_idurl=No
             supplier_num, len(list_files_text_body), is_in_sync, backup_control.revision(), customer_idurl))
     backups2remove = set()
     paths2remove = set()
-    missed_backups = set(remote_files().keys())
-    oldfiles = ClearSupplierRemoteInfo(supplier_num, customer_idurl=customer_idurl)
+    manifest_key = (id_url.to_bin(customer_idurl), supplier_num, )
+    manifest_header = ReadManifestHeader(list_files_text_body)
+    is_delta = manifest_header is not None and manifest_header[2] is not None
+    if is_delta:
+        known = _SuppliersManifests.get(manifest_key)
+        if not known or known['epoch'] != manifest_header[0] or known['revision'] != manifest_header[2]:
+            lg.warn('received changes since revision %d of supplier %d manifest, but known revision is %r' % (
+                manifest_header[2], supplier_num, known, ))
+            _SuppliersManifests.pop(manifest_key, None)
+            return False, backups2remove, paths2remove, set()
+        missed_backups = set()
+        oldfiles = 0
+    else:
+        missed_backups = set(remote_files().keys())
+        oldfiles = ClearSupplierRemoteInfo(supplier_num, customer_idurl=customer_idurl)
     newfiles = 0
     remote_files_changed = False
     current_key_alias = 'master'
@@ -627,10 +767,25 @@ def process_raw_list_files(supplier_num, list_files_text_body, customer_idurl=No
         if _Debug:
             lg.out(_DebugLevel, '    %s %s' % (typ, line))
 
+        if typ == 'R':
+            continue
+
         if typ == 'Q':
             current_query = line.strip()
             continue
 
+        if typ == 'X':
+            if not is_delta:
+                lg.warn('unexpected line in the full list of files: %r' % line)
+                continue
+            missed_backups.update(process_line_removed(
+                line,
+                supplier_num=supplier_num,
+                current_key_alias=current_key_alias,
+                customer_idurl=customer_idurl,
+            ))
+            continue
+
         if typ == 'K':
             current_key_alias = process_line_key(line)
             continue
@@ -680,9 +835,15 @@ def process_raw_list_files(supplier_num, list_files_text_body, customer_idurl=No
         raise Exception('unexpected line received: %r' % line)
 
     inpt.close()
+    if manifest_header:
+        _SuppliersManifests[manifest_key] = {
+            'epoch': manifest_header[0],
+            'revision': manifest_header[1],
+            'time': _SuppliersManifests[manifest_key]['time'] if is_delta else time.time(),
+        }
     if _Debug:
-        lg.out(_DebugLevel, 'backup_matrix.process_raw_list_files remote_files_changed:%s old:%d new:%d backups2remove:%d paths2remove:%d missed_backups:%d remote_files:%d' % (
-            remote_files_changed, oldfiles, newfiles, len(backups2remove), len(paths2remove), len(missed_backups), len(remote_files())))
+        lg.out(_DebugLevel, 'backup_matrix.process_raw_list_files remote_files_changed:%s old:%d new:%d backups2remove:%d paths2remove:%d missed_backups:%d remote_files:%d delta:%s' % (
+            remote_files_changed, oldfiles, newfiles, len(backups2remove), len(paths2remove), len(missed_backups), len(remote_files()), is_delta))
     if remote_files_changed and is_in_sync:
         backup_control.Save()
     for query_key in query_results:
@@ -713,10 +874,29 @@ def SaveLatestRawListFiles(supplier_idurl, raw_data, customer_idurl=None):
     bpio.WriteTextFile(settings.SupplierListFilesFilename(supplier_idurl, customer_idurl), raw_data)
 
 
+def AppendLatestRawListFiles(supplier_idurl, raw_data, customer_idurl=None):
+    """
+    Recent changes received from given supplier are added to the end of already stored ListFiles packet.
+    """
+    if not customer_idurl:
+        customer_idurl = my_id.getLocalID()
+    filename = settings.SupplierListFilesFilename(supplier_idurl, customer_idurl)
+    if not os.path.isfile(filename):
+        lg.warn('ListFiles from %s was not stored yet, not possible to append recent changes' % supplier_idurl)
+        return False
+    if _Debug:
+        lg.out(_DebugLevel, 'backup_matrix.AppendLatestRawListFiles, %s, customer_idurl=%s' % (supplier_idurl, customer_idurl))
+    if not raw_data.endswith('\n'):
+        raw_data += '\n'
+    return local_fs.AppendBinaryFile(filename, raw_data, mode='a')
+
+
 def ReadLatestRawListFiles(customer_idurl=None):
     """
     Call ``process_raw_list_files()`` for every local file we have on hands and build
     whole "remote" matrix.
+    Stored file can contain the full list of files followed by several portions of recent changes,
+    every portion starts with "R" line.
     """
     if not customer_idurl:
         customer_idurl = my_id.getLocalID()
@@ -728,13 +908,14 @@ def ReadLatestRawListFiles(customer_idurl=None):
             if os.path.isfile(filename):
                 listFileText = bpio.ReadTextFile(filename).strip()
                 if listFileText:
-                    process_raw_list_files(
-                        supplier_num=contactsdb.supplier_position(idurl),
-                        list_files_text_body=listFileText,
-                        customer_idurl=customer_idurl,
-                        is_in_sync=False,
-                        auto_create=False,
-                    )
+                    for portion in re.split('\n(?=R)', listFileText):
+                        process_raw_list_files(
+                            supplier_num=contactsdb.supplier_position(idurl),
+                            list_files_text_body=portion,
+                            customer_idurl=customer_idurl,
+                            is_in_sync=False,
+                            auto_create=False,
+                        )
 
 #------------------------------------------------------------------------------
 
@@ -754,7 +935,7 @@ def ReadLocalFiles():
             return True
         if realpath.startswith('newblock-'):
             return False
-        if subpath in [settings.BackupIndexFileName(), settings.BackupInfoFileName(), settings.BackupInfoFileNameOld(), settings.BackupInfoEncryptedFileName()]:
+        if subpath in [settings.BackupIndexFileName(), settings.BackupIndexJournalFileName(), settings.BackupInfoFileName(), settings.BackupInfoFileNameOld(), settings.BackupInfoEncryptedFileName()]:
             return False
         try:
             version = subpath.split('/')[-2]
@@ -828,18 +1009,13 @@ def RemoteFileReport(backupID, blockNum, supplierNum, dataORparity, result):
             lg.out(_DebugLevel, 'backup_matrix.RemoteFileReport got too big supplier number, possible this is an old packet')
         return
     if backupID not in remote_files():
-        remote_files()[backupID] = {}
         lg.info('new remote entry for %s created in the memory' % backupID)
-    if blockNum not in remote_files()[backupID]:
-        remote_files()[backupID][blockNum] = {
-            'D': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl),
-            'P': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl), }
+    matrix = remote_matrix(backupID, create=True)
+    matrix.touch(blockNum)
     # save backed up block info into remote info structure, synchronize on hand info
     flag = 1 if result else 0
-    if dataORparity == 'Data':
-        remote_files()[backupID][blockNum]['D'][supplierNum] = flag
-    elif dataORparity == 'Parity':
-        remote_files()[backupID][blockNum]['P'][supplierNum] = flag
+    if dataORparity in ('Data', 'Parity', ):
+        matrix.set(dataORparity[0], blockNum, supplierNum, flag)
     else:
         lg.warn('incorrect backup ID: %s' % backupID)
     # if we know only 5 blocks stored on remote machine
@@ -885,16 +1061,12 @@ def LocalFileReport(packetID=None, backupID=None, blockNum=None, supplierNum=Non
         lg.warn('empty supplier at position %s for customer %s' % (supplierNum, customer_idurl, ))
         return
     localDest = os.path.join(settings.getLocalBackupsDir(), customer, filename)
-    if backupID not in local_files():
-        local_files()[backupID] = {}
-    if blockNum not in local_files()[backupID]:
-        local_files()[backupID][blockNum] = {
-            'D': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl),
-            'P': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl), }
+    matrix = local_matrix(backupID, create=True)
+    matrix.touch(blockNum)
     if not os.path.isfile(localDest):
-        local_files()[backupID][blockNum][dataORparity[0]][supplierNum] = 0
+        matrix.set(dataORparity[0], blockNum, supplierNum, 0)
         return
-    local_files()[backupID][blockNum][dataORparity[0]][supplierNum] = 1
+    matrix.set(dataORparity[0], blockNum, supplierNum, 1)
     if backupID not in local_max_block_numbers():
         local_max_block_numbers()[backupID] = -1
     if local_max_block_numbers()[backupID] < blockNum:
@@ -936,20 +1108,18 @@ def LocalBlockReport(backupID, blockNumber, result):
             packetID = packetid.MakePacketID(backupID, blockNum, supplierNum, dataORparity)
             local_file = os.path.join(settings.getLocalBackupsDir(), customer, packetID)
             if backupID not in local_files():
-                local_files()[backupID] = {}
                 repaint_flag = True
                 if _Debug:
                     lg.out(_DebugLevel, '    new local entry for %s created in the memory' % backupID)
-            if blockNum not in local_files()[backupID]:
-                local_files()[backupID][blockNum] = {
-                    'D': [0, ] * num_suppliers,
-                    'P': [0, ] * num_suppliers}
+            matrix = local_matrix(backupID, create=True)
+            if blockNum not in matrix:
+                matrix.touch(blockNum)
                 repaint_flag = True
             if not os.path.isfile(local_file):
-                local_files()[backupID][blockNum][dataORparity[0]][supplierNum] = 0
+                matrix.set(dataORparity[0], blockNum, supplierNum, 0)
                 repaint_flag = True
                 continue
-            local_files()[backupID][blockNum][dataORparity[0]][supplierNum] = 1
+            matrix.set(dataORparity[0], blockNum, supplierNum, 1)
             if backupID not in local_backup_size():
                 local_backup_size()[backupID] = 0
                 repaint_flag = True
@@ -986,6 +1156,9 @@ def ScanMissingBlocks(backupID):
     localMaxBlockNum = local_max_block_numbers().get(backupID, -1)
     remoteMaxBlockNum = remote_max_block_numbers().get(backupID, -1)
     supplierActiveArray = GetActiveArray(customer_idurl=customer_idurl)
+    # if supplier is not alive we can not send to him
+    # so no need to scan for missing blocks
+    activeSuppliers = [supplierNum for supplierNum in range(len(supplierActiveArray)) if supplierActiveArray[supplierNum] == 1]
 
     if backupID not in remote_files():
         if backupID not in local_files():
@@ -1000,50 +1173,26 @@ def ScanMissingBlocks(backupID):
             # need to scan all block numbers
             if _Debug:
                 lg.out(_DebugLevel, '    no remote info but found local info, maxBlockNum=%d' % localMaxBlockNum)
-            for blockNum in range(localMaxBlockNum + 1):
+            matrix = local_matrix(backupID)
+            for supplierNum in activeSuppliers:
                 # we check for Data and Parity packets
-                localData = GetLocalDataArray(backupID, blockNum)
-                localParity = GetLocalParityArray(backupID, blockNum)
-                for supplierNum in range(len(supplierActiveArray)):
-                    # if supplier is not alive we can not send to him
-                    # so no need to scan for missing blocks
-                    if supplierActiveArray[supplierNum] != 1:
-                        continue
-                    if localData[supplierNum] == 1:
-                        missingBlocks.add(blockNum)
-                    if localParity[supplierNum] == 1:
-                        missingBlocks.add(blockNum)
+                missingBlocks.update(matrix.blocks_where('D', supplierNum, 1, stop=localMaxBlockNum + 1))
+                missingBlocks.update(matrix.blocks_where('P', supplierNum, 1, stop=localMaxBlockNum + 1))
     else:
         # now we have some remote info
         # we take max block number from local and remote
         maxBlockNum = max(remoteMaxBlockNum, localMaxBlockNum)
         if _Debug:
             lg.out(_DebugLevel, '    found remote info, maxBlockNum=%d' % maxBlockNum)
-        # and increase by one because range(3) give us [0, 1, 2], but we want [0, 1, 2, 3]
-        for blockNum in range(maxBlockNum + 1):
-            # if we have few remote files, but many locals - we want to send all missed
-            if blockNum not in remote_files()[backupID]:
-                missingBlocks.add(blockNum)
-                continue
-            # take remote info for this block
-            remoteData = GetRemoteDataArray(backupID, blockNum)
-            remoteParity = GetRemoteParityArray(backupID, blockNum)
-            # now check every our supplier for every block
-            for supplierNum in range(len(supplierActiveArray)):
-                # if supplier is not alive we can not send to him
-                # so no need to scan for missing blocks
-                if supplierActiveArray[supplierNum] != 1:
-                    continue
-                if supplierNum >= len(remoteData) or supplierNum >= len(remoteParity):
-                    missingBlocks.add(blockNum)
-                    continue
-                if remoteData[supplierNum] != 1:    # -1 means missing
-                    missingBlocks.add(blockNum)     # 0 - no info yet
-                if remoteParity[supplierNum] != 1:  # 1 - file exist on remote supplier
-                    missingBlocks.add(blockNum)
+        matrix = remote_matrix(backupID)
+        # if we have few remote files, but many locals - we want to send all missed
+        missingBlocks.update(matrix.unknown_blocks(maxBlockNum + 1))
+        # now check every our supplier for every block:
+        # -1 means missing, 0 - no info yet, 1 - file exist on remote supplier
+        missingBlocks.update(matrix.incomplete_blocks(activeSuppliers, maxBlockNum + 1))
 
     if _Debug:
-        lg.out(_DebugLevel, '    missingBlocks=%s' % missingBlocks)
+        lg.out(_DebugLevel, '    missingBlocks=%d' % len(missingBlocks))
     return list(missingBlocks)
 
 
@@ -1064,17 +1213,13 @@ def ScanBlocksToRemove(backupID, check_all_suppliers=True):
     if backupID not in remote_files() or backupID not in local_files():
         # no info about this backup yet - skip
         return packets
-    for blockNum in range(localMaxBlockNum + 1):
-        localArray = {'Data': GetLocalDataArray(backupID, blockNum),
-                      'Parity': GetLocalParityArray(backupID, blockNum)}
-        remoteArray = {'Data': GetRemoteDataArray(backupID, blockNum),
-                       'Parity': GetRemoteParityArray(backupID, blockNum)}
-        if (0 in remoteArray['Data']) or (0 in remoteArray['Parity']):
-            # if some supplier do not have some data for that block - do not remove any local files for that block!
-            # we do remove the local files only when we sure all suppliers got the all data pieces
-            continue
-        if (-1 in remoteArray['Data']) or (-1 in remoteArray['Parity']):
-            # also if we do not have any info about this block for some supplier do not remove other local pieces
+    remote = remote_matrix(backupID)
+    local = local_matrix(backupID)
+    # if some supplier do not have some data for that block or we do not have any info about this block yet
+    # do not remove any local files for that block!
+    # we do remove the local files only when we sure all suppliers got the all data pieces
+    for blockNum in remote.complete_blocks(localMaxBlockNum + 1):
+        if blockNum not in local:
             continue
         for supplierNum in range(contactsdb.num_suppliers(customer_idurl=customer_idurl)):
             supplierIDURL = contactsdb.supplier(supplierNum, customer_idurl=customer_idurl)
@@ -1086,19 +1231,12 @@ def ScanBlocksToRemove(backupID, check_all_suppliers=True):
                 if io_throttle.HasPacketInSendQueue(supplierIDURL, packetID):
                     # if we do sending the packet at the moment - skip
                     continue
-                if supplierNum >= len(localArray[dataORparity]):
+                if supplierNum >= local.width:
                     lg.warn('wrong supplier %r position %d for customer %r' %(
                         supplierIDURL, supplierNum, customer_idurl))
                     continue
-                if localArray[dataORparity][supplierNum] == 1:
+                if local.get(dataORparity[0], blockNum, supplierNum) == 1:
                     packets.append(packetID)
-                    # lg.out(10, '    mark to remove %s, blockNum:%d remote:%s local:%s' % (packetID, blockNum, str(remoteArray), str(localArray)))
-#                if check_all_suppliers:
-#                    if localArray[dataORparity][supplierNum] == 1:
-#                        packets.append(packetID)
-#                else:
-#                    if remoteArray[dataORparity][supplierNum] == 1 and localArray[dataORparity][supplierNum] == 1:
-#                        packets.append(packetID)
     return packets
 
 
@@ -1115,44 +1253,35 @@ def ScanBlocksToSend(backupID, limit_per_supplier=None):
     bySupplier = {}
     for supplierNum in range(len(supplierActiveArray)):
         bySupplier[supplierNum] = set()
-    if backupID not in remote_files():
-        if _Debug:
+    remote = remote_matrix(backupID)
+    local = local_matrix(backupID)
+    if _Debug:
+        if remote is None:
             lg.out(_DebugLevel, 'backup_matrix.ScanBlocksToSend  backupID %r not found in remote files' % backupID)
-        for blockNum in range(localMaxBlockNum + 1):
-            localData = GetLocalDataArray(backupID, blockNum)
-            localParity = GetLocalParityArray(backupID, blockNum)
-            for supplierNum in range(len(supplierActiveArray)):
-                if supplierActiveArray[supplierNum] != 1:
-                    continue
-                if supplierNum >= len(localData) or supplierNum >= len(localParity):
-                    continue
-                if localData[supplierNum] == 1:
-                    bySupplier[supplierNum].add(packetid.MakePacketID(backupID, blockNum, supplierNum, 'Data'))
-                if localParity[supplierNum] == 1:
-                    bySupplier[supplierNum].add(packetid.MakePacketID(backupID, blockNum, supplierNum, 'Parity'))
-                if limit_per_supplier:
-                    if len(bySupplier[supplierNum]) > limit_per_supplier:
-                        break
-    else:
-        if _Debug:
+        else:
             lg.out(_DebugLevel, 'backup_matrix.ScanBlocksToSend  backupID %r was found in remote files' % backupID)
-        for blockNum in range(localMaxBlockNum + 1):
-            remoteData = GetRemoteDataArray(backupID, blockNum)
-            remoteParity = GetRemoteParityArray(backupID, blockNum)
-            localData = GetLocalDataArray(backupID, blockNum)
-            localParity = GetLocalParityArray(backupID, blockNum)
-            for supplierNum in range(len(supplierActiveArray)):
-                if supplierActiveArray[supplierNum] != 1:
-                    continue
-                if supplierNum >= len(remoteData) or supplierNum >= len(remoteParity):
-                    continue
-                if remoteData[supplierNum] != 1 and localData[supplierNum] == 1:
-                    bySupplier[supplierNum].add(packetid.MakePacketID(backupID, blockNum, supplierNum, 'Data'))
-                if remoteParity[supplierNum] != 1 and localParity[supplierNum] == 1:
-                    bySupplier[supplierNum].add(packetid.MakePacketID(backupID, blockNum, supplierNum, 'Parity'))
-                if limit_per_supplier:
-                    if len(bySupplier[supplierNum]) > limit_per_supplier:
-                        break
+    if local is None:
+        return bySupplier
+
+    def _pieces(supplierNum, dataORparity):
+        # local piece exist, but remote supplier do not have it yet
+        remoteCells = None if remote is None else remote.column(dataORparity[0], supplierNum, localMaxBlockNum + 1)
+        for blockNum in local.blocks_where(dataORparity[0], supplierNum, 1, stop=localMaxBlockNum + 1):
+            if remoteCells is None or remoteCells[blockNum:blockNum + 1] != blocks_matrix.EXIST:
+                yield blockNum, dataORparity
+
+    for supplierNum in range(len(supplierActiveArray)):
+        if supplierActiveArray[supplierNum] != 1:
+            continue
+        if supplierNum >= local.width:
+            continue
+        if remote is not None and supplierNum >= remote.width:
+            continue
+        for blockNum, dataORparity in heapq.merge(_pieces(supplierNum, 'Data'), _pieces(supplierNum, 'Parity')):
+            bySupplier[supplierNum].add(packetid.MakePacketID(backupID, blockNum, supplierNum, dataORparity))
+            if limit_per_supplier:
+                if len(bySupplier[supplierNum]) > limit_per_supplier:
+                    break
     return bySupplier
 
 #------------------------------------------------------------------------------
@@ -1237,6 +1366,7 @@ def ClearRemoteInfo():
     """
     remote_files().clear()
     remote_max_block_numbers().clear()
+    _SuppliersManifests.clear()
 
 
 def ClearSupplierRemoteInfo(supplierNum, customer_idurl=None):
@@ -1246,25 +1376,24 @@ def ClearSupplierRemoteInfo(supplierNum, customer_idurl=None):
     """
     if not customer_idurl:
         customer_idurl = my_id.getLocalID()
+    ForgetSupplierManifest(supplierNum, customer_idurl=customer_idurl)
     files = 0
-    for backupID in remote_files().keys():
+    for backupID, matrix in remote_files().items():
         _customer_idurl = packetid.CustomerIDURL(backupID)
         if _customer_idurl == customer_idurl:
-            for blockNum in remote_files()[backupID].keys():
-                try:
-                    if remote_files()[backupID][blockNum]['D'][supplierNum] == 1:
-                        files += 1
-                        remote_files()[backupID][blockNum]['D'][supplierNum] = 0
-                except:
-                    pass
-                try:
-                    if remote_files()[backupID][blockNum]['P'][supplierNum] == 1:
-                        files += 1
-                        remote_files()[backupID][blockNum]['P'][supplierNum] = 0
-                except:
-                    pass
+            files += matrix.clear_column(supplierNum)
     return files
 
+
+def ClearSupplierBackupRemoteInfo(supplierNum, backupID):
+    """
+    Same as ``ClearSupplierRemoteInfo()`` but only for single backup.
+    """
+    matrix = remote_matrix(backupID)
+    if matrix is None:
+        return 0
+    return matrix.clear_column(supplierNum)
+
 #------------------------------------------------------------------------------
 
 
@@ -1279,25 +1408,17 @@ def GetBackupStats(backupID):
     percentPerSupplier = 100.0 / contactsdb.num_suppliers(customer_idurl=customer_idurl)
     # ??? maxBlockNum = remote_max_block_numbers().get(backupID, -1)
     maxBlockNum = GetKnownMaxBlockNum(backupID)
+    matrix = remote_matrix(backupID)
     fileNumbers = [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
     totalNumberOfFiles = 0
-    for blockNum in remote_files()[backupID].keys():
-        for supplierNum in range(len(fileNumbers)):
-            if supplierNum < contactsdb.num_suppliers(customer_idurl=customer_idurl):
-                if supplierNum < len(remote_files()[backupID][blockNum]['D']):
-                    if remote_files()[backupID][blockNum]['D'][supplierNum] == 1:
-                        fileNumbers[supplierNum] += 1
-                        totalNumberOfFiles += 1
-                else:
-                    lg.warn('wrong supplier position %d for customer %r in backup Data matrix, backupID=%r' % (
-                        supplierNum, customer_idurl, backupID))
-                if supplierNum < len(remote_files()[backupID][blockNum]['P']):
-                    if remote_files()[backupID][blockNum]['P'][supplierNum] == 1:
-                        fileNumbers[supplierNum] += 1
-                        totalNumberOfFiles += 1
-                else:
-                    lg.warn('wrong supplier position %d for customer %r in backup Parity matrix, backupID=%r' % (
-                        supplierNum, customer_idurl, backupID))
+    for supplierNum in range(len(fileNumbers)):
+        if supplierNum >= matrix.width:
+            if len(matrix):
+                lg.warn('wrong supplier position %d for customer %r in backup matrix, backupID=%r' % (
+                    supplierNum, customer_idurl, backupID))
+            continue
+        fileNumbers[supplierNum] = matrix.count('D', supplierNum) + matrix.count('P', supplierNum)
+        totalNumberOfFiles += fileNumbers[supplierNum]
     statsArray = []
     for supplierNum in range(contactsdb.num_suppliers(customer_idurl=customer_idurl)):
         if maxBlockNum > -1:
@@ -1323,20 +1444,12 @@ def GetBackupLocalStats(backupID):
     if backupID not in local_files():
         return 0, 0, 0, maxBlockNum, [(0, 0)] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
     percentPerSupplier = 100.0 / contactsdb.num_suppliers(customer_idurl=customer_idurl)
+    matrix = local_matrix(backupID)
     totalNumberOfFiles = 0
     fileNumbers = [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    for blockNum in range(maxBlockNum + 1):
-        if blockNum not in list(local_files()[backupID].keys()):
-            continue
-#    for blockNum in local_files()[backupID].keys():
-        for supplierNum in range(len(fileNumbers)):
-            if supplierNum < contactsdb.num_suppliers(customer_idurl=customer_idurl):
-                if local_files()[backupID][blockNum]['D'][supplierNum] == 1:
-                    fileNumbers[supplierNum] += 1
-                    totalNumberOfFiles += 1
-                if local_files()[backupID][blockNum]['P'][supplierNum] == 1:
-                    fileNumbers[supplierNum] += 1
-                    totalNumberOfFiles += 1
+    for supplierNum in range(len(fileNumbers)):
+        fileNumbers[supplierNum] = matrix.count('D', supplierNum, stop=maxBlockNum + 1) + matrix.count('P', supplierNum, stop=maxBlockNum + 1)
+        totalNumberOfFiles += fileNumbers[supplierNum]
     statsArray = []
     for supplierNum in range(contactsdb.num_suppliers(customer_idurl=customer_idurl)):
         if maxBlockNum > -1:
@@ -1362,14 +1475,11 @@ def GetBackupBlocksAndPercent(backupID):
     if maxBlockNum == -1:
         return 0, 0
     customer_idurl = packetid.CustomerIDURL(backupID)
+    matrix = remote_matrix(backupID)
     # we count all remote files for this backup
     fileCounter = 0
-    for blockNum in remote_files()[backupID].keys():
-        for supplierNum in range(contactsdb.num_suppliers(customer_idurl=customer_idurl)):
-            if remote_files()[backupID][blockNum]['D'][supplierNum] == 1:
-                fileCounter += 1
-            if remote_files()[backupID][blockNum]['P'][supplierNum] == 1:
-                fileCounter += 1
+    for supplierNum in range(contactsdb.num_suppliers(customer_idurl=customer_idurl)):
+        fileCounter += matrix.count('D', supplierNum) + matrix.count('P', supplierNum)
     # +1 since zero based and *0.5 because Data and Parity
     return maxBlockNum + 1, 100.0 * 0.5 * fileCounter / ((maxBlockNum + 1) * contactsdb.num_suppliers(customer_idurl=customer_idurl))
 
@@ -1396,36 +1506,19 @@ def GetBackupRemoteStats(backupID, only_available_files=True):
         return -1, 0, -1, 0
     customer_idurl = packetid.CustomerIDURL(backupID)
     supplierCount = contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    fileCounter = 0
-    weakBlockNum = -1
-    lessSuppliers = supplierCount
     activeArray = GetActiveArray(customer_idurl=customer_idurl)
+    matrix = remote_matrix(backupID)
+    suppliers = [supplierNum for supplierNum in range(supplierCount) if activeArray[supplierNum] == 1 or not only_available_files]
     # we count all remote files for this backup - scan all blocks
-    for blockNum in range(maxBlockNum + 1):
-        if blockNum not in list(remote_files()[backupID].keys()):
-            lessSuppliers = 0
-            weakBlockNum = blockNum
-            continue
-        goodSuppliers = supplierCount
-        for supplierNum in range(supplierCount):
-            if activeArray[supplierNum] != 1 and only_available_files:
-                goodSuppliers -= 1
-                continue
-            try:
-                remote_files()[backupID][blockNum]['D'][supplierNum]
-                remote_files()[backupID][blockNum]['D'][supplierNum]
-            except:
-                goodSuppliers -= 1
-                continue
-            if remote_files()[backupID][blockNum]['D'][supplierNum] != 1 or remote_files()[backupID][blockNum]['P'][supplierNum] != 1:
-                goodSuppliers -= 1
-            if remote_files()[backupID][blockNum]['D'][supplierNum] == 1:
-                fileCounter += 1
-            if remote_files()[backupID][blockNum]['P'][supplierNum] == 1:
-                fileCounter += 1
-        if goodSuppliers < lessSuppliers:
-            lessSuppliers = goodSuppliers
-            weakBlockNum = blockNum
+    fileCounter = 0
+    for supplierNum in suppliers:
+        fileCounter += matrix.count('D', supplierNum, stop=maxBlockNum + 1) + matrix.count('P', supplierNum, stop=maxBlockNum + 1)
+    unknownBlocks = matrix.unknown_blocks(maxBlockNum + 1)
+    if unknownBlocks:
+        weakBlockNum = unknownBlocks[-1]
+        lessSuppliers = 0
+    else:
+        weakBlockNum, lessSuppliers = _FindWeakBlock(matrix, suppliers, supplierCount, maxBlockNum + 1)
     # +1 since zero based and *0.5 because Data and Parity
     return (
         maxBlockNum + 1,
@@ -1483,17 +1576,23 @@ def GetKnownMaxBlockNum(backupID):
                local_max_block_numbers().get(backupID, -1))
 
 
+def _GetBlockInfo(matrix, backupID, blockNum, dataORparity=None):
+    if matrix is None or blockNum not in matrix:
+        num_suppliers = contactsdb.num_suppliers(customer_idurl=packetid.CustomerIDURL(backupID))
+        if dataORparity:
+            return [0] * num_suppliers
+        return {'D': [0] * num_suppliers,
+                'P': [0] * num_suppliers, }
+    if dataORparity:
+        return matrix[blockNum][dataORparity].tolist()
+    return matrix[blockNum].todict()
+
+
 def GetLocalMatrix(backupID, blockNum):
     """
+    Returns a copy of "local" info for a single block: dictionary with "D" and "P" lists.
     """
-    customer_idurl = packetid.CustomerIDURL(backupID)
-    if backupID not in local_files():
-        return {'D': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl),
-                'P': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl), }
-    if blockNum not in local_files()[backupID]:
-        return {'D': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl),
-                'P': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl), }
-    return local_files()[backupID][blockNum]
+    return _GetBlockInfo(local_matrix(backupID), backupID, blockNum)
 
 
 def GetLocalDataArray(backupID, blockNum):
@@ -1501,12 +1600,7 @@ def GetLocalDataArray(backupID, blockNum):
     Get "local" info for a single block of given backup, this is for "Data"
     surface.
     """
-    customer_idurl = packetid.CustomerIDURL(backupID)
-    if backupID not in local_files():
-        return [0, ] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    if blockNum not in local_files()[backupID]:
-        return [0, ] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    return local_files()[backupID][blockNum]['D']
+    return _GetBlockInfo(local_matrix(backupID), backupID, blockNum, 'D')
 
 
 def GetLocalParityArray(backupID, blockNum):
@@ -1514,25 +1608,14 @@ def GetLocalParityArray(backupID, blockNum):
     Get "local" info for a single block of given backup, this is for "Parity"
     surface.
     """
-    customer_idurl = packetid.CustomerIDURL(backupID)
-    if backupID not in local_files():
-        return [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    if blockNum not in local_files()[backupID]:
-        return [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    return local_files()[backupID][blockNum]['P']
+    return _GetBlockInfo(local_matrix(backupID), backupID, blockNum, 'P')
 
 
 def GetRemoteMatrix(backupID, blockNum):
     """
+    Returns a copy of "remote" info for a single block: dictionary with "D" and "P" lists.
     """
-    customer_idurl = packetid.CustomerIDURL(backupID)
-    if backupID not in remote_files():
-        return {'D': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl),
-                'P': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl), }
-    if blockNum not in remote_files()[backupID]:
-        return {'D': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl),
-                'P': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl), }
-    return remote_files()[backupID][blockNum]
+    return _GetBlockInfo(remote_matrix(backupID), backupID, blockNum)
 
 
 def GetRemoteDataArray(backupID, blockNum):
@@ -1540,12 +1623,7 @@ def GetRemoteDataArray(backupID, blockNum):
     Get "remote" info for a single block of given backup, this is for "Data"
     surface.
     """
-    customer_idurl = packetid.CustomerIDURL(backupID)
-    if backupID not in remote_files():
-        return [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    if blockNum not in remote_files()[backupID]:
-        return [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    return remote_files()[backupID][blockNum]['D']
+    return _GetBlockInfo(remote_matrix(backupID), backupID, blockNum, 'D')
 
 
 def GetRemoteParityArray(backupID, blockNum):
@@ -1553,12 +1631,7 @@ def GetRemoteParityArray(backupID, blockNum):
     Get "remote" info for a single block of given backup, this is for "Parity"
     surface.
     """
-    customer_idurl = packetid.CustomerIDURL(backupID)
-    if backupID not in remote_files():
-        return [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    if blockNum not in remote_files()[backupID]:
-        return [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    return remote_files()[backupID][blockNum]['P']
+    return _GetBlockInfo(remote_matrix(backupID), backupID, blockNum, 'P')
 
 
 def GetSupplierStats(supplierNum, customer_idurl=None):
@@ -1567,22 +1640,34 @@ def GetSupplierStats(supplierNum, customer_idurl=None):
     """
     result = {}
     files = total = 0
-    for backupID in remote_files().keys():
+    for backupID, matrix in remote_files().items():
         if customer_idurl != packetid.CustomerIDURL(backupID):
             continue
-        result[backupID] = {'data': 0, 'parity': 0, 'total': 0, }
-        for blockNum in remote_files()[backupID].keys():
-            if remote_files()[backupID][blockNum]['D'][supplierNum] == 1:
-                result[backupID]['data'] += 1
-                files += 1
-            if remote_files()[backupID][blockNum]['P'][supplierNum] == 1:
-                result[backupID]['parity'] += 1
-                files += 1
-            result[backupID]['total'] += 2
-            total += 2
+        data = matrix.count('D', supplierNum)
+        parity = matrix.count('P', supplierNum)
+        result[backupID] = {'data': data, 'parity': parity, 'total': 2 * len(matrix), }
+        files += data + parity
+        total += 2 * len(matrix)
     return files, total, result
 
 
+def _FindWeakBlock(matrix, suppliers, supplierCount, stop):
+    """
+    Returns a tuple (blockNum, goodSuppliers) for the first block where less of given suppliers keeps
+    both Data and Parity pieces, those who are not in ``suppliers`` list are counted as "bad" for every block.
+    """
+    if stop <= 0:
+        return -1, supplierCount
+    badCounts = matrix.incomplete_blocks(suppliers, stop)
+    worst = max(badCounts.values()) if badCounts else 0
+    lessSuppliers = len(suppliers) - worst
+    if lessSuppliers >= supplierCount:
+        return -1, supplierCount
+    if not worst:
+        return 0, lessSuppliers
+    return min(blockNum for blockNum, count in badCounts.items() if count == worst), lessSuppliers
+
+
 def GetWeakLocalBlock(backupID):
     """
     Scan all "local" blocks for given backup and find the most "weak" block.
@@ -1592,18 +1677,11 @@ def GetWeakLocalBlock(backupID):
     if backupID not in local_files():
         return -1, 0, supplierCount
     maxBlockNum = GetKnownMaxBlockNum(backupID)
-    weakBlockNum = -1
-    lessSuppliers = supplierCount
-    for blockNum in range(maxBlockNum + 1):
-        if blockNum not in list(local_files()[backupID].keys()):
-            return blockNum, 0, supplierCount
-        goodSuppliers = supplierCount
-        for supplierNum in range(supplierCount):
-            if local_files()[backupID][blockNum]['D'][supplierNum] != 1 or local_files()[backupID][blockNum]['P'][supplierNum] != 1:
-                goodSuppliers -= 1
-        if goodSuppliers < lessSuppliers:
-            lessSuppliers = goodSuppliers
-            weakBlockNum = blockNum
+    matrix = local_matrix(backupID)
+    unknownBlocks = matrix.unknown_blocks(maxBlockNum + 1)
+    if unknownBlocks:
+        return unknownBlocks[0], 0, supplierCount
+    weakBlockNum, lessSuppliers = _FindWeakBlock(matrix, list(range(supplierCount)), supplierCount, maxBlockNum + 1)
     return weakBlockNum, lessSuppliers, supplierCount
 
 
@@ -1617,22 +1695,13 @@ def GetWeakRemoteBlock(backupID):
     if backupID not in remote_files():
         return -1, 0, supplierCount
     maxBlockNum = GetKnownMaxBlockNum(backupID)
-    weakBlockNum = -1
-    lessSuppliers = supplierCount
+    matrix = remote_matrix(backupID)
+    unknownBlocks = matrix.unknown_blocks(maxBlockNum + 1)
+    if unknownBlocks:
+        return unknownBlocks[0], 0, supplierCount
     activeArray = GetActiveArray(customer_idurl=customer_idurl)
-    for blockNum in range(maxBlockNum + 1):
-        if blockNum not in list(remote_files()[backupID].keys()):
-            return blockNum, 0, supplierCount
-        goodSuppliers = supplierCount
-        for supplierNum in range(supplierCount):
-            if activeArray[supplierNum] != 1:
-                goodSuppliers -= 1
-                continue
-            if remote_files()[backupID][blockNum]['D'][supplierNum] != 1 or remote_files()[backupID][blockNum]['P'][supplierNum] != 1:
-                goodSuppliers -= 1
-        if goodSuppliers < lessSuppliers:
-            lessSuppliers = goodSuppliers
-            weakBlockNum = blockNum
+    suppliers = [supplierNum for supplierNum in range(supplierCount) if activeArray[supplierNum] == 1]
+    weakBlockNum, lessSuppliers = _FindWeakBlock(matrix, suppliers, supplierCount, maxBlockNum + 1)
     return weakBlockNum, lessSuppliers, supplierCount
 
 #------------------------------------------------------------------------------
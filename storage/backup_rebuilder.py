@@ -370,16 +370,9 @@ class BackupRebuilder(automat.Automat):
         # this mean this is only local backup!
         from storage import backup_matrix
         if self.currentBackupID not in backup_matrix.remote_files():
-            backup_matrix.remote_files()[self.currentBackupID] = {}
             # we create empty remote info for every local block
-            # range(0) should return []
-            for blockNum in range(
-                backup_matrix.local_max_block_numbers().get(
-                    self.currentBackupID, -1) + 1):
-                backup_matrix.remote_files()[
-                    self.currentBackupID][blockNum] = {
-                    'D': [0] * contactsdb.num_suppliers(),
-                    'P': [0] * contactsdb.num_suppliers()}
+            backup_matrix.remote_matrix(self.currentBackupID, create=True).touch(
+                0, backup_matrix.local_max_block_numbers().get(self.currentBackupID, -1) + 1)
         # detect missing blocks from remote info
         self.workingBlocksQueue = backup_matrix.ScanMissingBlocks(self.currentBackupID)
         # find the correct max block number for this backup
@@ -392,12 +385,7 @@ class BackupRebuilder(automat.Automat):
         # now need to remember this biggest block number
         # remote info may have less blocks - need to create empty info for
         # missing blocks
-        for blockNum in range(backupMaxBlock + 1):
-            if blockNum in backup_matrix.remote_files()[self.currentBackupID]:
-                continue
-            backup_matrix.remote_files()[self.currentBackupID][blockNum] = {
-                'D': [0] * contactsdb.num_suppliers(),
-                'P': [0] * contactsdb.num_suppliers()}
+        backup_matrix.remote_matrix(self.currentBackupID).touch(0, backupMaxBlock + 1)
         # clear requesting queue, remove old packets for this backup, we will
         # send them again
         from stream import io_throttle
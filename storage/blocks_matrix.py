@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# blocks_matrix.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (blocks_matrix.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+
+"""
+..
+
+module:: blocks_matrix
+
+Compact storage of "remote" or "local" info for a single backup, used by ``storage.backup_matrix``.
+
+Every surface ("D" for Data and "P" for Parity) is a single ``bytearray`` of blocks x suppliers,
+one byte per piece. Cell value is stored with +1 offset, so -1 (missing), 0 (no info) and 1 (exist)
+are kept as bytes 0, 1 and 2. Another ``bytearray`` remembers which blocks are known at all.
+
+Scans are done column by column: a column of a supplier is taken with extended slice
+and searched with ``bytes.count()`` or a compiled regular expression, so all heavy loops run in C.
+
+The object still behaves like the old dictionary of blocks, so this code keeps working::
+
+    matrix[blockNum]['D'][supplierNum] = 1
+    matrix[blockNum] = {'D': [0, 0], 'P': [0, 0], }
+    if blockNum in matrix: ...
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+#------------------------------------------------------------------------------
+
+import re
+
+from collections import Counter
+
+#------------------------------------------------------------------------------
+
+MISSING = b'\x00'
+UNKNOWN = b'\x01'
+EXIST = b'\x02'
+
+_NotExistRegex = re.compile(b'[^\x02]')
+_ExistRegex = re.compile(b'\x02')
+_NotKnownRegex = re.compile(b'\x00')
+
+_MinCapacity = 16
+
+#------------------------------------------------------------------------------
+
+
+def encode(value):
+    return value + 1
+
+
+def decode(cell):
+    return cell - 1
+
+#------------------------------------------------------------------------------
+
+
+class BlockRow(object):
+    """
+    List-like view on a single block of one surface, reading and writing goes directly into the matrix.
+    """
+
+    __slots__ = ('matrix', 'surface', 'block_num', )
+
+    def __init__(self, matrix, surface, block_num):
+        self.matrix = matrix
+        self.surface = surface
+        self.block_num = block_num
+
+    def __len__(self):
+        return self.matrix.width
+
+    def __getitem__(self, supplier_num):
+        if supplier_num < 0:
+            supplier_num += self.matrix.width
+        if supplier_num < 0 or supplier_num >= self.matrix.width:
+            raise IndexError('supplier position out of range')
+        return self.matrix.get(self.surface, self.block_num, supplier_num)
+
+    def __setitem__(self, supplier_num, value):
+        if supplier_num < 0:
+            raise IndexError('supplier position out of range')
+        self.matrix.set(self.surface, self.block_num, supplier_num, value)
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __contains__(self, value):
+        return encode(value) in self.matrix.row(self.surface, self.block_num)
+
+    def __eq__(self, other):
+        return self.tolist() == list(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def tolist(self):
+        return [decode(c) for c in bytearray(self.matrix.row(self.surface, self.block_num))]
+
+
+class BlockView(object):
+    """
+    Dictionary-like view on a single block: ``{'D': BlockRow, 'P': BlockRow}``.
+    """
+
+    __slots__ = ('matrix', 'block_num', )
+
+    def __init__(self, matrix, block_num):
+        self.matrix = matrix
+        self.block_num = block_num
+
+    def __getitem__(self, surface):
+        if surface not in ('D', 'P', ):
+            raise KeyError(surface)
+        return BlockRow(self.matrix, surface, self.block_num)
+
+    def __setitem__(self, surface, values):
+        if surface not in ('D', 'P', ):
+            raise KeyError(surface)
+        self.matrix.set_row(surface, self.block_num, values)
+
+    def __contains__(self, surface):
+        return surface in ('D', 'P', )
+
+    def keys(self):
+        return ['D', 'P', ]
+
+    def __repr__(self):
+        return repr(self.todict())
+
+    def todict(self):
+        return {
+            'D': self['D'].tolist(),
+            'P': self['P'].tolist(),
+        }
+
+#------------------------------------------------------------------------------
+
+
+class BlocksMatrix(object):
+    """
+    All known blocks of a single backup, keyed by block number like a dictionary.
+    """
+
+    __slots__ = ('width', 'capacity', 'known', 'D', 'P', 'known_count', )
+
+    def __init__(self, width=0):
+        self.width = width
+        self.capacity = 0
+        self.known = bytearray()
+        self.D = bytearray()
+        self.P = bytearray()
+        self.known_count = 0
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + self.known.__sizeof__() + self.D.__sizeof__() + self.P.__sizeof__()
+
+    def __repr__(self):
+        return '<BlocksMatrix %d blocks x %d suppliers>' % (self.known_count, self.width, )
+
+    #------------------------------------------------------------------------------
+
+    def __len__(self):
+        return self.known_count
+
+    def __contains__(self, block_num):
+        return 0 <= block_num < self.capacity and self.known[block_num] != 0
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, block_num):
+        if block_num not in self:
+            raise KeyError(block_num)
+        return BlockView(self, block_num)
+
+    def __setitem__(self, block_num, value):
+        self.touch(block_num)
+        self.set_row('D', block_num, value.get('D') or [])
+        self.set_row('P', block_num, value.get('P') or [])
+
+    def __delitem__(self, block_num):
+        if block_num not in self:
+            raise KeyError(block_num)
+        pos = block_num * self.width
+        self.D[pos:pos + self.width] = UNKNOWN * self.width
+        self.P[pos:pos + self.width] = UNKNOWN * self.width
+        self.known[block_num] = 0
+        self.known_count -= 1
+
+    def get_block(self, block_num, default=None):
+        if block_num not in self:
+            return default
+        return BlockView(self, block_num)
+
+    def size(self):
+        """
+        Max known block number + 1.
+        """
+        return self.known.rfind(b'\x01') + 1
+
+    def keys(self):
+        return [m.start() for m in re.finditer(b'\x01', bytes(self.known))]
+
+    #------------------------------------------------------------------------------
+
+    def _grow(self, block_num):
+        if block_num < self.capacity:
+            return
+        capacity = max(_MinCapacity, self.capacity * 2, block_num + 1)
+        extra = capacity - self.capacity
+        self.known.extend(b'\x00' * extra)
+        self.D.extend(UNKNOWN * (extra * self.width))
+        self.P.extend(UNKNOWN * (extra * self.width))
+        self.capacity = capacity
+
+    def widen(self, width):
+        """
+        Suppliers number was increased, add more columns to all blocks.
+        """
+        if width <= self.width:
+            return
+        pad = UNKNOWN * (width - self.width)
+        for surface in ('D', 'P', ):
+            old = getattr(self, surface)
+            rows = [bytes(old[i * self.width:(i + 1) * self.width]) + pad for i in range(self.capacity)]
+            setattr(self, surface, bytearray(b''.join(rows)))
+        self.width = width
+
+    def touch(self, block_num, stop=None):
+        """
+        Mark given block (or range of blocks up to ``stop``) as known, all new cells will keep 0 value.
+        """
+        if stop is None:
+            stop = block_num + 1
+        if stop <= block_num:
+            return
+        self._grow(stop - 1)
+        before = self.known[block_num:stop].count(b'\x01')
+        self.known[block_num:stop] = b'\x01' * (stop - block_num)
+        self.known_count += (stop - block_num) - before
+
+    #------------------------------------------------------------------------------
+
+    def get(self, surface, block_num, supplier_num):
+        if supplier_num >= self.width or block_num >= self.capacity:
+            return 0
+        return decode(getattr(self, surface)[block_num * self.width + supplier_num])
+
+    def set(self, surface, block_num, supplier_num, value):
+        if supplier_num >= self.width:
+            self.widen(supplier_num + 1)
+        if block_num not in self:
+            self.touch(block_num)
+        getattr(self, surface)[block_num * self.width + supplier_num] = encode(value)
+
+    def row(self, surface, block_num):
+        if block_num >= self.capacity:
+            return UNKNOWN * self.width
+        pos = block_num * self.width
+        return bytes(getattr(self, surface)[pos:pos + self.width])
+
+    def set_row(self, surface, block_num, values):
+        values = list(values)
+        if len(values) > self.width:
+            self.widen(len(values))
+        if block_num not in self:
+            self.touch(block_num)
+        values.extend([0, ] * (self.width - len(values)))
+        pos = block_num * self.width
+        getattr(self, surface)[pos:pos + self.width] = bytearray([encode(v) for v in values])
+
+    def column(self, surface, supplier_num, stop=None):
+        """
+        Returns cells of one supplier for blocks from 0 up to ``stop``, every byte is an encoded value.
+        """
+        if stop is None:
+            stop = self.size()
+        if stop <= 0:
+            return b''
+        if supplier_num >= self.width:
+            return UNKNOWN * stop
+        col = bytes(getattr(self, surface)[supplier_num:min(stop, self.capacity) * self.width:self.width])
+        if stop > self.capacity:
+            col += UNKNOWN * (stop - self.capacity)
+        return col
+
+    def set_column(self, surface, supplier_num, cells, start=0):
+        """
+        Writes encoded cells of one supplier starting from block ``start``, blocks become known.
+        """
+        stop = start + len(cells)
+        if supplier_num >= self.width:
+            self.widen(supplier_num + 1)
+        self.touch(start, stop)
+        getattr(self, surface)[start * self.width + supplier_num:stop * self.width:self.width] = cells
+
+    def clear_column(self, supplier_num, value=0):
+        """
+        Set same value for given supplier in all blocks, returns number of cells which were 1 before.
+        """
+        if supplier_num >= self.width or not self.capacity:
+            return 0
+        counter = 0
+        for surface in ('D', 'P', ):
+            counter += self.column(surface, supplier_num, self.capacity).count(EXIST)
+            getattr(self, surface)[supplier_num::self.width] = bytes(bytearray([encode(value), ])) * self.capacity
+        return counter
+
+    #------------------------------------------------------------------------------
+
+    def count(self, surface, supplier_num, value=1, stop=None):
+        return self.column(surface, supplier_num, stop).count(bytes(bytearray([encode(value), ])))
+
+    def unknown_blocks(self, stop):
+        """
+        Block numbers from 0 up to ``stop`` which are not present in the matrix.
+        """
+        known = bytes(self.known[:stop])
+        result = [m.start() for m in _NotKnownRegex.finditer(known)]
+        if stop > len(known):
+            result.extend(range(len(known), stop))
+        return result
+
+    def blocks_where(self, surface, supplier_num, value=1, negate=False, stop=None):
+        """
+        Block numbers where given supplier has (or has not, if ``negate`` is True) a piece with that value.
+        """
+        if value == 1:
+            regex = _NotExistRegex if negate else _ExistRegex
+        else:
+            cell = re.escape(bytes(bytearray([encode(value), ])))
+            regex = re.compile((b'[^' + cell + b']') if negate else cell)
+        for m in regex.finditer(self.column(surface, supplier_num, stop)):
+            yield m.start()
+
+    def incomplete_blocks(self, suppliers, stop):
+        """
+        Counts for every block how many of given suppliers do not have both Data and Parity pieces.
+        Returns a ``Counter`` object, healthy blocks are not present there.
+        """
+        bad = Counter()
+        for supplier_num in suppliers:
+            found = set(self.blocks_where('D', supplier_num, 1, negate=True, stop=stop))
+            found.update(self.blocks_where('P', supplier_num, 1, negate=True, stop=stop))
+            bad.update(found)
+        return bad
+
+    def complete_blocks(self, stop):
+        """
+        Block numbers where all suppliers have both Data and Parity pieces.
+        """
+        if not self.width:
+            return []
+        bad = set(self.unknown_blocks(stop))
+        for supplier_num in range(self.width):
+            bad.update(self.blocks_where('D', supplier_num, 1, negate=True, stop=stop))
+            bad.update(self.blocks_where('P', supplier_num, 1, negate=True, stop=stop))
+        return [block_num for block_num in range(stop) if block_num not in bad]
+
+    def todict(self):
+        return dict((block_num, self[block_num].todict()) for block_num in self.keys())
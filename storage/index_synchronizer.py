@@ -112,6 +112,7 @@ from system import bpio
 
 from userid import my_id
 from userid import global_id
+from userid import id_url
 
 from contacts import contactsdb
 
@@ -199,8 +200,12 @@ class IndexSynchronizer(automat.Automat):
         self.requests_packets_sent = []
         self.requested_suppliers_number = 0
         self.sending_suppliers = set()
+        self.sending_packets = {}
+        self.sending_base_revision = -1
         self.sent_suppliers_number = 0
         self.outgoing_packets_ids = []
+        self.suppliers_base_revisions = {}
+        self.suppliers_index_revisions = {}
         self.last_time_in_sync = -1
         self.PushAgain = False
 
@@ -357,6 +362,7 @@ class IndexSynchronizer(automat.Automat):
         else:
             self.current_local_revision = -1
         self.latest_supplier_revision = -1
+        self.suppliers_index_revisions.clear()
         self.requesting_suppliers.clear()
         self.requested_suppliers_number = 0
         self.requests_packets_sent = []
@@ -372,24 +378,18 @@ class IndexSynchronizer(automat.Automat):
         """
         if _Debug:
             lg.out(_DebugLevel, 'index_synchronizer.doSuppliersSendIndexFile')
-        packetID = global_id.MakeGlobalID(
-            customer=my_id.getGlobalID(key_alias='master'),
-            path=settings.BackupIndexFileName(),
-        )
+        index_packet_id = self._make_packet_id(settings.BackupIndexFileName())
+        journal_packet_id = self._make_packet_id(settings.BackupIndexJournalFileName())
         self.sending_suppliers.clear()
+        self.sending_packets.clear()
         self.outgoing_packets_ids = []
         self.sent_suppliers_number = 0
+        self.sending_base_revision = -1
+        if driver.is_on('service_backups'):
+            from storage import backup_control
+            self.sending_base_revision = backup_control.base_revision()
         localID = my_id.getLocalID()
-        b = encrypted.Block(
-            CreatorID=localID,
-            BackupID=packetID,
-            BlockNumber=0,
-            SessionKey=key.NewSessionKey(session_key_type=key.SessionKeyType()),
-            SessionKeyType=key.SessionKeyType(),
-            LastBlock=True,
-            Data=bpio.ReadBinaryFile(settings.BackupIndexFilePath()),
-        )
-        Payload = b.Serialize()
+        payloads = {}
         for supplier_idurl in contactsdb.suppliers():
             if not supplier_idurl:
                 continue
@@ -398,24 +398,38 @@ class IndexSynchronizer(automat.Automat):
                 continue
             if online_status.isOffline(supplier_idurl):
                 continue
-            newpacket, pkt_out = p2p_service.SendData(
-                raw_data=Payload,
-                ownerID=localID,
-                creatorID=localID,
-                remoteID=supplier_idurl,
-                packetID=packetID,
-                callbacks={
-                    commands.Ack(): self._on_supplier_acked,
-                    commands.Fail(): self._on_supplier_acked,
-                },
-            )
-            if pkt_out:
+            packets_ids = [journal_packet_id, ]
+            if self.sending_base_revision < 0 or self.suppliers_base_revisions.get(id_url.to_bin(supplier_idurl)) != self.sending_base_revision:
+                # supplier do not have same index file yet, sending only recent changes is not enough
+                packets_ids.insert(0, index_packet_id)
+            for packetID in packets_ids:
+                if packetID not in payloads:
+                    if packetID == index_packet_id:
+                        payloads[packetID] = self._make_payload(packetID, settings.BackupIndexFilePath())
+                    else:
+                        payloads[packetID] = self._make_payload(packetID, settings.BackupIndexJournalFilePath())
+                if not payloads[packetID]:
+                    continue
+                newpacket, pkt_out = p2p_service.SendData(
+                    raw_data=payloads[packetID],
+                    ownerID=localID,
+                    creatorID=localID,
+                    remoteID=supplier_idurl,
+                    packetID=packetID,
+                    callbacks={
+                        commands.Ack(): self._on_supplier_acked,
+                        commands.Fail(): self._on_supplier_acked,
+                    },
+                )
+                if pkt_out:
+                    self.sending_packets.setdefault(id_url.to_bin(supplier_idurl), set()).add(packetID)
+                    self.outgoing_packets_ids.append(packetID)
+                if _Debug:
+                    lg.out(_DebugLevel, '    %s sending to %s' %
+                           (newpacket, nameurl.GetName(supplier_idurl)))
+            if id_url.to_bin(supplier_idurl) in self.sending_packets:
                 self.sending_suppliers.add(supplier_idurl)
                 self.sent_suppliers_number += 1
-                self.outgoing_packets_ids.append(packetID)
-            if _Debug:
-                lg.out(_DebugLevel, '    %s sending to %s' %
-                       (newpacket, nameurl.GetName(supplier_idurl)))
 
     def doCancelSendings(self, *args, **kwargs):
         """
@@ -471,8 +485,23 @@ class IndexSynchronizer(automat.Automat):
             return
         supplier_idurl = wrapped_packet.RemoteID
         from storage import backup_control
-        supplier_revision = backup_control.IncomingSupplierBackupIndex(wrapped_packet)
-        self.requesting_suppliers.discard(supplier_idurl)
+        if self._get_file_name(newpacket.PacketID) == settings.BackupIndexJournalFileName():
+            supplier_revision = None
+            result = backup_control.IncomingSupplierBackupIndexJournal(wrapped_packet)
+            if result is not None:
+                journal_base_revision, latest_revision = result
+                if journal_base_revision == self.suppliers_index_revisions.get(id_url.to_bin(supplier_idurl)):
+                    # journal is based on the index file stored on same supplier
+                    supplier_revision = latest_revision
+            self.requesting_suppliers.discard(supplier_idurl)
+        else:
+            supplier_revision = backup_control.IncomingSupplierBackupIndex(wrapped_packet)
+            if supplier_revision is not None:
+                self.suppliers_index_revisions[id_url.to_bin(supplier_idurl)] = supplier_revision
+                self.suppliers_base_revisions[id_url.to_bin(supplier_idurl)] = supplier_revision
+            # supplier also keeps the journal with changes made after that index file was stored
+            if supplier_revision is None or not self._do_retrieve_journal(supplier_idurl):
+                self.requesting_suppliers.discard(supplier_idurl)
         if supplier_revision is not None:
             reactor.callLater(0, self.automat, 'index-file-received', (newpacket, supplier_revision, ))  # @UndefinedVariable
         if _Debug:
@@ -493,7 +522,16 @@ class IndexSynchronizer(automat.Automat):
             reactor.callLater(0, self.automat, 'all-responded')  # @UndefinedVariable
 
     def _on_supplier_acked(self, newpacket, info):
-        self.sending_suppliers.discard(newpacket.OwnerID)
+        pending_packets = self.sending_packets.get(id_url.to_bin(newpacket.OwnerID), set())
+        pending_packets.discard(newpacket.PacketID)
+        if newpacket.Command == commands.Ack():
+            if self._get_file_name(newpacket.PacketID) == settings.BackupIndexFileName():
+                self.suppliers_base_revisions[id_url.to_bin(newpacket.OwnerID)] = self.sending_base_revision
+        else:
+            # older suppliers do not accept the journal file, so the whole index file must be sent next time
+            self.suppliers_base_revisions.pop(id_url.to_bin(newpacket.OwnerID), None)
+        if not pending_packets:
+            self.sending_suppliers.discard(newpacket.OwnerID)
         if newpacket.PacketID in self.outgoing_packets_ids:
             self.outgoing_packets_ids.remove(newpacket.PacketID)
         sc = supplier_connector.by_idurl(newpacket.OwnerID)
@@ -507,11 +545,52 @@ class IndexSynchronizer(automat.Automat):
         if len(self.sending_suppliers) == 0:
             reactor.callLater(0, self.automat, 'all-acked')  # @UndefinedVariable
 
-    def _do_retrieve(self, x=None):
-        packetID = global_id.MakeGlobalID(
+    def _make_packet_id(self, file_name):
+        return global_id.MakeGlobalID(
             customer=my_id.getGlobalID(key_alias='master'),
-            path=settings.BackupIndexFileName(),
+            path=file_name,
         )
+
+    def _get_file_name(self, packet_id):
+        return global_id.ParseGlobalID(packet_id).get('path')
+
+    def _make_payload(self, packetID, filepath):
+        data = bpio.ReadBinaryFile(filepath)
+        if not data:
+            return None
+        localID = my_id.getLocalID()
+        b = encrypted.Block(
+            CreatorID=localID,
+            BackupID=packetID,
+            BlockNumber=0,
+            SessionKey=key.NewSessionKey(session_key_type=key.SessionKeyType()),
+            SessionKeyType=key.SessionKeyType(),
+            LastBlock=True,
+            Data=data,
+        )
+        return b.Serialize()
+
+    def _do_retrieve_journal(self, supplier_idurl):
+        packetID = self._make_packet_id(settings.BackupIndexJournalFileName())
+        localID = my_id.getLocalID()
+        pkt_out = p2p_service.SendRetreive(
+            ownerID=localID,
+            creatorID=localID,
+            packetID=packetID,
+            remoteID=supplier_idurl,
+            response_timeout=60*2,
+            callbacks={
+                commands.Data(): self._on_supplier_response,
+                commands.Fail(): self._on_supplier_fail,
+            }
+        )
+        if not pkt_out:
+            return False
+        self.requests_packets_sent.append((packetID, supplier_idurl))
+        return True
+
+    def _do_retrieve(self, x=None):
+        packetID = self._make_packet_id(settings.BackupIndexFileName())
         localID = my_id.getLocalID()
         for supplier_idurl in contactsdb.suppliers():
             if not supplier_idurl:
@@ -42,9 +42,17 @@ EVENTS:
     * :red:`timer-5sec`
 
 
-At least for now we will work one block at a time, though packets in parallel.
+We work one block at a time, though packets in parallel.
 We ask transport_control for all the data packets for a block then see if we
-get them all or need to ask for some parity packets.  We do this till we have
+get them all or need to ask for some parity packets.
+While current block is received and restored, the data packets for a few next blocks
+are already requested, see ``services/restores/prefetch-blocks`` option.
+So network round-trips of the next blocks are overlapped with RAID reading and decryption,
+but blocks are still restored and written to the output one by one, in order.
+
+With ``services/restores/in-memory-enabled`` option received pieces are kept in memory
+and the block is reconstructed directly from them, pieces are only written
+to the local backups folder when ``services/backups/keep-local-copies-enabled`` is set.  We do this till we have
 gotten a block with the "LastBlock" flag set.  If we have tried several times
 and not gotten data packets from a supplier we can flag him as suspect-bad
 and start requesting a parity packet to cover him right away.
@@ -96,6 +104,7 @@ except:
     sys.exit('Error initializing twisted.internet.reactor in restore.py')
 
 from twisted.internet.defer import Deferred
+from twisted.internet import threads
 
 #------------------------------------------------------------------------------
 
@@ -126,6 +135,7 @@ from stream import data_receiver
 
 from raid import raid_worker
 from raid import eccmap
+from raid import read
 
 from services import driver
 
@@ -145,6 +155,8 @@ class RestoreWorker(automat.Automat):
                  OutputFile,
                  KeyID=None,
                  ecc_map=None,
+                 prefetch_blocks=None,
+                 in_memory=None,
                  debug_level=_DebugLevel,
                  log_events=False,
                  log_transitions=_Debug,
@@ -177,6 +189,13 @@ class RestoreWorker(automat.Automat):
         self.RequestFails = []
         self.block_requests = {}
         self.AlreadyRequestedCounts = {}
+        # requests for Data packets of the next blocks: packetID -> [block_number, result, payload, filename]
+        self.prefetch_requests = {}
+        self.prefetch_blocks = settings.getRestorePrefetchBlocks() if prefetch_blocks is None else prefetch_blocks
+        # received pieces of current block: (dataORparity, supplier number) -> payload
+        self.in_memory = settings.getRestoreInMemory() if in_memory is None else in_memory
+        self.block_segments = {}
+        self.restored_block_data = None
         # For anyone who wants to know when we finish
         self.MyDeferred = Deferred()
         self.packetInCallback = None
@@ -406,6 +425,8 @@ class RestoreWorker(automat.Automat):
         self.RequestFails = []
         self.block_requests = {}
         self.AlreadyRequestedCounts = {}
+        self.block_segments = {}
+        self._do_take_prefetched_requests()
 
     def doPingOfflineSuppliers(self, *args, **kwargs):
         """
@@ -432,13 +453,22 @@ class RestoreWorker(automat.Automat):
             customerID, remotePath = packetid.SplitPacketID(PacketID)
             self.OnHandParity[SupplierNumber] = bool(os.path.exists(os.path.join(
                 settings.getLocalBackupsDir(), customerID, remotePath)))
+        for dataORparity, SupplierNumber in self.block_segments.keys():
+            if dataORparity == 'Data':
+                self.OnHandData[SupplierNumber] = True
+            else:
+                self.OnHandParity[SupplierNumber] = True
 
     def doRestoreBlock(self, *args, **kwargs):
         """
         Action method.
         """
         filename = args[0]
-        blockbits = bpio.ReadBinaryFile(filename)
+        if filename is None:
+            blockbits = self.restored_block_data
+            self.restored_block_data = None
+        else:
+            blockbits = bpio.ReadBinaryFile(filename)
         if not blockbits:
             self.automat('block-failed')
             return
@@ -465,6 +495,7 @@ class RestoreWorker(automat.Automat):
         Action method.
         """
         self._do_check_run_requests()
+        self._do_prefetch_next_blocks()
 
     def doSavePacket(self, *args, **kwargs):
         """
@@ -473,7 +504,6 @@ class RestoreWorker(automat.Automat):
         if not args or not args[0]:
             raise Exception('no input found')
         NewPacket, PacketID = args[0]
-        glob_path = global_id.ParseGlobalID(PacketID, detect_version=True)
         packetID = global_id.CanonicalID(PacketID)
         customer_id, _, _, _, SupplierNumber, dataORparity = packetid.SplitFull(packetID)
         if dataORparity == 'Data':
@@ -483,26 +513,17 @@ class RestoreWorker(automat.Automat):
         if not NewPacket:
             lg.warn('packet %r already exists locally' % packetID)
             return
-        filename = os.path.join(settings.getLocalBackupsDir(), customer_id, glob_path['path'])
-        dirpath = os.path.dirname(filename)
-        if not os.path.exists(dirpath):
-            try:
-                bpio._dirs_make(dirpath)
-            except:
-                lg.exc()
-        # either way the payload of packet is saved
-        if not bpio.WriteBinaryFile(filename, NewPacket.Payload):
-            lg.err("unable to write to %s" % filename)
-            return
-        if self.packetInCallback is not None:
-            self.packetInCallback(self.backup_id, NewPacket)
-        if _Debug:
-            lg.out(_DebugLevel, "restore_worker.doSavePacket %s saved to %s" % (packetID, filename))
+        if self.in_memory:
+            self.block_segments[(dataORparity, SupplierNumber, )] = NewPacket.Payload
+        self._do_write_packet(NewPacket, PacketID)
 
     def doReadRaid(self, *args, **kwargs):
         """
         Action method.
         """
+        if self.in_memory:
+            self._do_read_raid_in_memory()
+            return
         _, outfilename = tmpfile.make(
             'restore',
             extension='.raid',
@@ -517,6 +538,7 @@ class RestoreWorker(automat.Automat):
         """
         Action method.
         """
+        self.block_segments = {}
         if not args or not len(args) > 1:
             return
         filename = args[1]
@@ -576,6 +598,7 @@ class RestoreWorker(automat.Automat):
         """
         from stream import io_throttle
         io_throttle.DeleteBackupRequests(self.backup_id)
+        self._do_remove_prefetched_packets()
 
     def doReportDone(self, *args, **kwargs):
         """
@@ -620,6 +643,9 @@ class RestoreWorker(automat.Automat):
         self.RequestFails = []
         self.AlreadyRequestedCounts = None
         self.block_requests = None
+        self.prefetch_requests = None
+        self.block_segments = None
+        self.restored_block_data = None
         self.MyDeferred = None
         self.output_stream = None
         self.destroy()
@@ -632,6 +658,112 @@ class RestoreWorker(automat.Automat):
         from storage import backup_rebuilder
         backup_rebuilder.UnBlockBackup(self.backup_id)
 
+    def _do_write_packet(self, NewPacket, PacketID):
+        if self.in_memory and not settings.getBackupsKeepLocalCopies():
+            # payload is kept in memory only
+            if self.packetInCallback is not None:
+                self.packetInCallback(self.backup_id, NewPacket)
+            return True
+        glob_path = global_id.ParseGlobalID(PacketID, detect_version=True)
+        packetID = global_id.CanonicalID(PacketID)
+        customer_id, _, _, _, _, _ = packetid.SplitFull(packetID)
+        filename = os.path.join(settings.getLocalBackupsDir(), customer_id, glob_path['path'])
+        dirpath = os.path.dirname(filename)
+        if not os.path.exists(dirpath):
+            try:
+                bpio._dirs_make(dirpath)
+            except:
+                lg.exc()
+        # either way the payload of packet is saved
+        if not bpio.WriteBinaryFile(filename, NewPacket.Payload):
+            lg.err("unable to write to %s" % filename)
+            return False
+        if self.packetInCallback is not None:
+            self.packetInCallback(self.backup_id, NewPacket)
+        if _Debug:
+            lg.out(_DebugLevel, "restore_worker._do_write_packet %s saved to %s" % (packetID, filename))
+        return True
+
+    def _do_take_prefetched_requests(self):
+        """
+        Requests for the new current block which are still in progress are now tracked as regular block requests.
+        Finished requests are forgotten: received packets are already on the disk and failed will be requested again.
+        """
+        for packetID, (block_number, result, payload, _) in list(self.prefetch_requests.items()):
+            if block_number > self.block_number:
+                continue
+            self.prefetch_requests.pop(packetID)
+            if block_number != self.block_number:
+                continue
+            if result is None:
+                self.block_requests[packetID] = None
+            elif result is True and payload is not None:
+                SupplierNumber = packetid.SplitFull(global_id.CanonicalID(packetID))[4]
+                self.block_segments[('Data', SupplierNumber, )] = payload
+
+    def _do_remove_prefetched_packets(self):
+        """
+        Restore is finished or stopped: packets of the next blocks which were already saved
+        to the disk will never be restored, so they must not be left in the local backups folder.
+        Only files written here are removed, pieces which existed before were not requested at all.
+        """
+        if not self.prefetch_requests:
+            return
+        count = 0
+        for _, _, _, filename in self.prefetch_requests.values():
+            if not filename or not os.path.isfile(filename):
+                continue
+            try:
+                os.remove(filename)
+            except:
+                lg.exc()
+                continue
+            count += 1
+        self.prefetch_requests.clear()
+        if _Debug:
+            lg.out(_DebugLevel, 'restore_worker._do_remove_prefetched_packets %d files were removed' % count)
+
+    def _do_prefetch_next_blocks(self):
+        if self.prefetch_blocks <= 0:
+            return
+        from stream import io_throttle
+        from storage import backup_matrix
+        known_max_block_num = backup_matrix.GetKnownMaxBlockNum(self.backup_id)
+        if known_max_block_num < 0:
+            # number of blocks in that backup is unknown, only current block can be requested
+            return
+        last_block_number = min(self.block_number + self.prefetch_blocks, known_max_block_num)
+        requests_made = 0
+        for block_number in range(self.block_number + 1, last_block_number + 1):
+            for SupplierNumber in range(self.EccMap.datasegments):
+                packetID = packetid.MakePacketID(self.backup_id, block_number, SupplierNumber, 'Data')
+                if packetID in self.prefetch_requests:
+                    continue
+                customerID, remotePath = packetid.SplitPacketID(packetID)
+                if os.path.exists(os.path.join(settings.getLocalBackupsDir(), customerID, remotePath)):
+                    continue
+                SupplierID = contactsdb.supplier(SupplierNumber, customer_idurl=self.customer_idurl)
+                if not SupplierID:
+                    continue
+                if online_status.isOffline(SupplierID):
+                    continue
+                if io_throttle.HasPacketInRequestQueue(SupplierID, packetID):
+                    continue
+                self.prefetch_requests[packetID] = [block_number, None, None, None, ]
+                if io_throttle.QueueRequestFile(
+                    callOnReceived=self._on_packet_request_result,
+                    creatorID=self.creator_id,
+                    packetID=packetID,
+                    ownerID=self.creator_id,
+                    remoteID=SupplierID,
+                ):
+                    requests_made += 1
+                else:
+                    self.prefetch_requests.pop(packetID)
+        if _Debug:
+            lg.out(_DebugLevel, 'restore_worker._do_prefetch_next_blocks requested %d packets for blocks %d-%d' % (
+                requests_made, self.block_number + 1, last_block_number, ))
+
     def _do_check_run_requests(self):
         if _Debug:
             lg.out(_DebugLevel, 'restore_worker._do_check_run_requests for %s at block %d' % (self.backup_id, self.block_number, ))
@@ -725,6 +857,42 @@ class RestoreWorker(automat.Automat):
             lg.out(_DebugLevel, "        all requests finished for block %d : %r" % (self.block_number, current_block_requests_results, ))
         reactor.callLater(0, self.automat, 'request-finished', None)  # @UndefinedVariable
 
+    def _do_read_raid_in_memory(self):
+        data_segments = {}
+        parity_segments = {}
+        for dataORparity, segments, count in (
+            ('Data', data_segments, self.EccMap.datasegments, ),
+            ('Parity', parity_segments, self.EccMap.paritysegments, ),
+        ):
+            for SupplierNumber in range(count):
+                payload = self.block_segments.get((dataORparity, SupplierNumber, ))
+                if payload is None:
+                    # this piece was stored locally before
+                    PacketID = packetid.MakePacketID(self.backup_id, self.block_number, SupplierNumber, dataORparity)
+                    customerID, remotePath = packetid.SplitPacketID(PacketID)
+                    filename = os.path.join(settings.getLocalBackupsDir(), customerID, remotePath)
+                    if os.path.isfile(filename):
+                        payload = bpio.ReadBinaryFile(filename)
+                if payload:
+                    segments[SupplierNumber] = memoryview(payload)
+        d = threads.deferToThread(read.read_in_memory, self.EccMap.name, data_segments, parity_segments)  # @UndefinedVariable
+        d.addCallback(self._on_block_restored_in_memory)
+        d.addErrback(lambda err: self._on_block_restored_in_memory(None))
+
+    def _on_block_restored_in_memory(self, result):
+        if self.block_segments is None:
+            # restore was already stopped
+            return None
+        if _Debug:
+            lg.out(_DebugLevel, 'restore_worker._on_block_restored_in_memory for block %d with %s good segments' % (
+                self.block_number, result[0] if result else None))
+        if result is None:
+            self.automat('raid-failed', (None, None, ))
+        else:
+            self.restored_block_data = result[1]
+            self.automat('raid-done', None)
+        return None
+
     def _on_block_restored(self, restored_blocks, filename):
         if _Debug:
             lg.out(_DebugLevel, 'restore_worker._on_block_restored at %s with result: %s' % (filename, restored_blocks))
@@ -743,6 +911,13 @@ class RestoreWorker(automat.Automat):
             packet_id = getattr(NewPacketOrPacketID, 'PacketID', None)
         if not packet_id:
             raise Exception('packet ID is unknown from %r' % NewPacketOrPacketID)
+        if self.block_requests is None:
+            if _Debug:
+                lg.dbg(_DebugLevel, 'restore worker already finished, skip result for %r' % packet_id)
+            return
+        if packet_id not in self.block_requests and packet_id in self.prefetch_requests:
+            self._on_prefetch_request_result(NewPacketOrPacketID, packet_id, result)
+            return
         if packet_id not in self.block_requests:
             if _Debug:
                 lg.args(_DebugLevel, block_requests=self.block_requests)
@@ -763,6 +938,21 @@ class RestoreWorker(automat.Automat):
             self.RequestFails.append(packet_id)
             reactor.callLater(0, self.automat, 'request-failed', packet_id)  # @UndefinedVariable
 
+    def _on_prefetch_request_result(self, NewPacketOrPacketID, packet_id, result):
+        if result == 'in queue':
+            return
+        if result not in ['received', 'exist', ]:
+            self.prefetch_requests[packet_id][1] = False
+            return
+        self.prefetch_requests[packet_id][1] = True
+        if result == 'received':
+            if self.in_memory:
+                self.prefetch_requests[packet_id][2] = NewPacketOrPacketID.Payload
+            if self._do_write_packet(NewPacketOrPacketID, packet_id):
+                if not self.in_memory or settings.getBackupsKeepLocalCopies():
+                    customer_id, remotePath = packetid.SplitPacketID(global_id.CanonicalID(packet_id))
+                    self.prefetch_requests[packet_id][3] = os.path.join(settings.getLocalBackupsDir(), customer_id, remotePath)
+
     def _on_data_receiver_state_changed(self, oldstate, newstate, event_string, *args, **kwargs):
         if newstate == 'RECEIVING' and oldstate != 'RECEIVING':
             self.automat('data-receiving-started', newstate)
@@ -0,0 +1,430 @@
+#!/usr/bin/env python
+# message_log.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (message_log.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+#
+#
+#
+
+"""
+.. module:: message_log.
+
+
+Storage of messages of a single queue kept by ``message_peddler()``:
+
+    + messages are appended as JSON lines to segment files "<number>.log", a new segment
+      is started when the current one is bigger than SEGMENT_MAX_SIZE bytes
+    + position of every message in the segments is kept in memory, so a message is read
+      with a single seek and messages after given sequence_id are found with bisect
+    + delivery attempts and "processed" marks are appended to a small "journal" file,
+      the journal is rewritten from memory when it is opened and when it grows too much
+    + erased messages are only marked in the journal, segment file is removed when all
+      of its messages were erased, until then the "erase" records are kept in the journal
+
+A broken line at the end of a segment or of the journal (for example after a crash) is dropped.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import os
+import bisect
+
+from collections import OrderedDict
+
+#------------------------------------------------------------------------------
+
+from logs import lg
+
+from lib import jsn
+from lib import strng
+from lib import utime
+
+from system import bpio
+
+#------------------------------------------------------------------------------
+
+SEGMENT_MAX_SIZE = 1024 * 1024
+JOURNAL_MIN_COMPACT_LINES = 1000
+
+#------------------------------------------------------------------------------
+
+class MessageLog(object):
+    """
+    Segmented append-only log of messages in one queue with an in-memory offset index.
+    """
+
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self.journal_path = os.path.join(log_dir, 'journal')
+        # sequence_id -> (segment number, offset, length)
+        self.index = {}
+        self.sequence_ids = []
+        # segment number -> [size in bytes, number of not erased messages]
+        self.segments = OrderedDict()
+        # segment number -> set of erased sequence_id which are still present in the segment file
+        self.erased = {}
+        self.attempts = {}
+        self.processed = {}
+        self.active_segment = None
+        self.active_file = None
+        self.journal_file = None
+        self.journal_lines = 0
+
+    def __repr__(self):
+        return 'MessageLog(%s, messages=%d, segments=%d)' % (self.log_dir, len(self.sequence_ids), len(self.segments))
+
+    def segment_path(self, segment):
+        return os.path.join(self.log_dir, '%d.log' % segment)
+
+    #------------------------------------------------------------------------------
+
+    def open(self):
+        if not os.path.isdir(self.log_dir):
+            bpio._dirs_make(self.log_dir)
+        segments = []
+        for filename in os.listdir(self.log_dir):
+            if filename.endswith('.log') and filename[:-4].isdigit():
+                segments.append(int(filename[:-4]))
+        for segment in sorted(segments):
+            self._load_segment(segment)
+        self._load_journal()
+        for segment, info in list(self.segments.items()):
+            if info[1] == 0:
+                self._remove_segment(segment)
+        if self.segments:
+            self.active_segment = next(reversed(self.segments))
+        self._write_journal()
+        if _Debug:
+            lg.args(_DebugLevel, log=self)
+        return True
+
+    def close(self):
+        if self.active_file:
+            self.active_file.close()
+            self.active_file = None
+        if self.journal_file:
+            self.journal_file.close()
+            self.journal_file = None
+
+    #------------------------------------------------------------------------------
+
+    def append(self, stored_json_message):
+        """
+        Writes message at the end of the log, delivery state of the message is written to the journal.
+        """
+        sequence_id = int(stored_json_message['sequence_id'])
+        record = {k: v for k, v in stored_json_message.items() if k not in ('attempts', 'processed', )}
+        line = strng.to_bin(jsn.dumps(record)) + b'\n'
+        if self.active_segment is None or self.segments[self.active_segment][0] >= SEGMENT_MAX_SIZE:
+            self._start_segment()
+        if not self.active_file:
+            self.active_file = open(self.segment_path(self.active_segment), 'ab')
+        self.active_file.write(line)
+        self.active_file.flush()
+        os.fsync(self.active_file.fileno())
+        info = self.segments[self.active_segment]
+        if sequence_id in self.index:
+            # same message was stored again, previous copy is not used anymore
+            previous_segment = self.index[sequence_id][0]
+            self.segments[previous_segment][1] -= 1
+            if previous_segment != self.active_segment:
+                self.erased.setdefault(previous_segment, set()).add(sequence_id)
+            if self.segments[previous_segment][1] == 0:
+                self._remove_segment(previous_segment)
+        else:
+            bisect.insort(self.sequence_ids, sequence_id)
+        self.index[sequence_id] = (self.active_segment, info[0], len(line), )
+        info[0] += len(line)
+        info[1] += 1
+        self.attempts.pop(sequence_id, None)
+        self.processed.pop(sequence_id, None)
+        if stored_json_message.get('attempts') or stored_json_message.get('processed'):
+            self._journal_state(sequence_id, stored_json_message.get('attempts') or [], stored_json_message.get('processed'))
+        return True
+
+    def erase(self, sequence_id):
+        if sequence_id not in self.index:
+            return False
+        segment = self._forget(sequence_id)
+        self._journal({'o': 'erase', 's': sequence_id, 'g': segment, })
+        self._check_compact()
+        return True
+
+    def register_delivery(self, sequence_id, message_id):
+        if sequence_id not in self.index:
+            return False
+        started = utime.get_sec1970()
+        self.attempts.setdefault(sequence_id, []).append({
+            'message_id': message_id,
+            'started': started,
+            'finished': None,
+            'failed_consumers': [],
+        })
+        self._journal({'o': 'start', 's': sequence_id, 'm': message_id, 't': started, })
+        return True
+
+    def unregister_delivery(self, sequence_id, message_id, failed_consumers):
+        attempt = None
+        for one_attempt in reversed(self.attempts.get(sequence_id, [])):
+            if one_attempt['message_id'] == message_id:
+                attempt = one_attempt
+                break
+        if attempt is None:
+            return False
+        finished = utime.get_sec1970()
+        attempt.update({
+            'finished': finished,
+            'failed_consumers': failed_consumers,
+        })
+        self._journal({'o': 'finish', 's': sequence_id, 'm': message_id, 't': finished, 'f': failed_consumers, })
+        return True
+
+    def set_processed(self, sequence_id, processed=None):
+        if sequence_id not in self.index:
+            return False
+        if processed is None:
+            processed = utime.get_sec1970()
+        self.processed[sequence_id] = processed
+        self._journal({'o': 'processed', 's': sequence_id, 't': processed, })
+        return True
+
+    #------------------------------------------------------------------------------
+
+    def has(self, sequence_id):
+        return sequence_id in self.index
+
+    def is_processed(self, sequence_id):
+        return bool(self.processed.get(sequence_id))
+
+    def list_sequence_ids(self):
+        return list(self.sequence_ids)
+
+    def read(self, sequence_id_list):
+        """
+        Returns stored messages in the same order, missing messages are skipped.
+        """
+        result = []
+        files = {}
+        try:
+            for sequence_id in sequence_id_list:
+                position = self.index.get(sequence_id)
+                if position is None:
+                    lg.err('message %r not found in %r' % (sequence_id, self, ))
+                    continue
+                segment, offset, length = position
+                if segment not in files:
+                    if segment == self.active_segment and self.active_file:
+                        self.active_file.flush()
+                    files[segment] = open(self.segment_path(segment), 'rb')
+                files[segment].seek(offset)
+                try:
+                    stored_json_message = jsn.loads_text(files[segment].read(length))
+                except:
+                    lg.exc()
+                    continue
+                stored_json_message['processed'] = self.processed.get(sequence_id)
+                result.append(stored_json_message)
+        finally:
+            for f in files.values():
+                f.close()
+        return result
+
+    def read_after(self, last_sequence_id, max_messages_count=100):
+        """
+        Returns up to ``max_messages_count`` messages stored after given ``last_sequence_id``.
+        """
+        pos = bisect.bisect_right(self.sequence_ids, last_sequence_id)
+        return self.read(self.sequence_ids[pos:pos + max_messages_count])
+
+    #------------------------------------------------------------------------------
+
+    def _start_segment(self):
+        if self.active_file:
+            self.active_file.close()
+            self.active_file = None
+        previous = self.active_segment
+        self.active_segment = 0 if previous is None else previous + 1
+        self.segments[self.active_segment] = [0, 0, ]
+        if previous is not None and self.segments.get(previous, [0, 1, ])[1] == 0:
+            self._remove_segment(previous)
+
+    def _remove_segment(self, segment):
+        if segment == self.active_segment:
+            return
+        self.segments.pop(segment, None)
+        self.erased.pop(segment, None)
+        try:
+            os.remove(self.segment_path(segment))
+        except:
+            lg.exc()
+        if _Debug:
+            lg.args(_DebugLevel, segment=segment, log=self)
+
+    def _forget(self, sequence_id):
+        segment = self.index.pop(sequence_id)[0]
+        pos = bisect.bisect_left(self.sequence_ids, sequence_id)
+        del self.sequence_ids[pos]
+        self.attempts.pop(sequence_id, None)
+        self.processed.pop(sequence_id, None)
+        self.segments[segment][1] -= 1
+        self.erased.setdefault(segment, set()).add(sequence_id)
+        if self.segments[segment][1] == 0:
+            self._remove_segment(segment)
+        return segment
+
+    def _load_segment(self, segment):
+        path = self.segment_path(segment)
+        with open(path, 'rb') as f:
+            raw_data = f.read()
+        self.segments[segment] = [0, 0, ]
+        offset = 0
+        while offset < len(raw_data):
+            end = raw_data.find(b'\n', offset)
+            if end < 0:
+                break
+            try:
+                sequence_id = int(jsn.loads_text(raw_data[offset:end])['sequence_id'])
+            except:
+                break
+            if sequence_id in self.index:
+                previous_segment = self.index[sequence_id][0]
+                self.segments[previous_segment][1] -= 1
+                if previous_segment != segment:
+                    self.erased.setdefault(previous_segment, set()).add(sequence_id)
+            else:
+                bisect.insort(self.sequence_ids, sequence_id)
+            self.index[sequence_id] = (segment, offset, end + 1 - offset, )
+            self.segments[segment][1] += 1
+            offset = end + 1
+        if offset < len(raw_data):
+            lg.warn('broken record found in %s at position %d, segment was truncated' % (path, offset, ))
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+        self.segments[segment][0] = offset
+
+    def _load_journal(self):
+        if not os.path.isfile(self.journal_path):
+            return
+        with open(self.journal_path, 'rb') as f:
+            raw_lines = f.read().split(b'\n')
+        for raw_line in raw_lines:
+            if not raw_line:
+                continue
+            try:
+                self._replay(jsn.loads_text(raw_line))
+            except:
+                lg.warn('broken record found in %s' % self.journal_path)
+                break
+
+    def _replay(self, record):
+        sequence_id = int(record['s'])
+        if sequence_id not in self.index:
+            return
+        if record['o'] == 'erase':
+            if record.get('g') is not None and self.index[sequence_id][0] != int(record['g']):
+                # erased copy was stored again later in another segment
+                return
+            self._forget(sequence_id)
+        elif record['o'] == 'state':
+            self.attempts[sequence_id] = record['a']
+            if record.get('p'):
+                self.processed[sequence_id] = record['p']
+        elif record['o'] == 'start':
+            self.attempts.setdefault(sequence_id, []).append({
+                'message_id': record['m'],
+                'started': record['t'],
+                'finished': None,
+                'failed_consumers': [],
+            })
+        elif record['o'] == 'finish':
+            for attempt in reversed(self.attempts.get(sequence_id, [])):
+                if attempt['message_id'] == record['m']:
+                    attempt.update({
+                        'finished': record['t'],
+                        'failed_consumers': record['f'],
+                    })
+                    break
+        elif record['o'] == 'processed':
+            self.processed[sequence_id] = record['t']
+        else:
+            raise ValueError('unknown journal record: %r' % record)
+
+    def _journal(self, record):
+        if not self.journal_file:
+            self.journal_file = open(self.journal_path, 'ab')
+        self.journal_file.write(strng.to_bin(jsn.dumps(record)) + b'\n')
+        self.journal_file.flush()
+        self.journal_lines += 1
+
+    def _journal_state(self, sequence_id, attempts, processed):
+        self.attempts[sequence_id] = [dict(a) for a in attempts]
+        if processed:
+            self.processed[sequence_id] = processed
+        self._journal({'o': 'state', 's': sequence_id, 'a': attempts, 'p': processed, })
+
+    def _check_compact(self):
+        if self.journal_lines < JOURNAL_MIN_COMPACT_LINES:
+            return
+        if self.journal_lines < 2 * (len(self.attempts) + len(self.processed) + sum(map(len, self.erased.values()))):
+            return
+        self._write_journal()
+
+    def _write_journal(self):
+        """
+        Rewrites the journal with current delivery state of all stored messages.
+        Erased messages are still present in the segment files which were not removed yet,
+        so "erase" records for them are written first.
+        """
+        if self.journal_file:
+            self.journal_file.close()
+            self.journal_file = None
+        lines = []
+        for segment, erased_ids in self.erased.items():
+            for sequence_id in sorted(erased_ids):
+                lines.append(strng.to_bin(jsn.dumps({
+                    'o': 'erase',
+                    's': sequence_id,
+                    'g': segment,
+                })) + b'\n')
+        for sequence_id in self.sequence_ids:
+            if sequence_id in self.attempts or sequence_id in self.processed:
+                lines.append(strng.to_bin(jsn.dumps({
+                    'o': 'state',
+                    's': sequence_id,
+                    'a': self.attempts.get(sequence_id, []),
+                    'p': self.processed.get(sequence_id),
+                })) + b'\n')
+        temp_path = self.journal_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(b''.join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_path, self.journal_path)
+        self.journal_lines = len(lines)
@@ -99,6 +99,7 @@ from storage import archive_writer
 from stream import p2p_queue
 from stream import queue_keeper
 from stream import message
+from stream import message_log
 
 from userid import global_id
 from userid import id_url
@@ -110,6 +111,7 @@ _MessagePeddler = None
 
 _ActiveStreams = {}
 _ActiveCustomers = {}
+_QueueLogs = {}
 
 #------------------------------------------------------------------------------
 
@@ -122,6 +124,11 @@ def customers():
     global _ActiveCustomers
     return _ActiveCustomers
 
+
+def queue_logs():
+    global _QueueLogs
+    return _QueueLogs
+
 #------------------------------------------------------------------------------
 
 def register_stream(queue_id):
@@ -434,12 +441,52 @@ def increment_sequence_id(queue_id):
 
 #------------------------------------------------------------------------------
 
+def queue_log(queue_id):
+    """
+    Returns ``message_log.MessageLog`` object where messages of given queue are stored, opens it if needed.
+    """
+    if queue_id not in queue_logs():
+        service_dir = settings.ServiceDir('service_message_broker')
+        queues_dir = os.path.join(service_dir, 'queues')
+        queue_dir = os.path.join(queues_dir, queue_id)
+        one_queue_log = message_log.MessageLog(os.path.join(queue_dir, 'log'))
+        one_queue_log.open()
+        queue_logs()[queue_id] = one_queue_log
+    return queue_logs()[queue_id]
+
+
+def close_queue_log(queue_id):
+    one_queue_log = queue_logs().pop(queue_id, None)
+    if one_queue_log:
+        one_queue_log.close()
+
+
+def close_queue_logs():
+    for queue_id in list(queue_logs().keys()):
+        close_queue_log(queue_id)
+
+
+def migrate_stored_messages(queue_id, messages_dir):
+    """
+    Moves messages stored by older versions one per file in the "messages" folder into the queue log.
+    """
+    all_stored_queue_messages = os.listdir(messages_dir)
+    all_stored_queue_messages.sort(key=lambda i: int(i))
+    migrated = 0
+    for _sequence_id in all_stored_queue_messages:
+        message_path = os.path.join(messages_dir, _sequence_id)
+        stored_json_message = jsn.loads_text(local_fs.ReadTextFile(message_path))
+        if stored_json_message:
+            queue_log(queue_id).append(stored_json_message)
+            migrated += 1
+        else:
+            lg.err('failed reading message %s from %r' % (_sequence_id, queue_id, ))
+    bpio.rmdir_recursive(messages_dir, ignore_errors=True)
+    lg.info('migrated %d messages of %r into the queue log' % (migrated, queue_id, ))
+    return migrated
+
+
 def store_message(queue_id, sequence_id, producer_id, payload, created, processed=None):
-    service_dir = settings.ServiceDir('service_message_broker')
-    queues_dir = os.path.join(service_dir, 'queues')
-    queue_dir = os.path.join(queues_dir, queue_id)
-    messages_dir = os.path.join(queue_dir, 'messages')
-    message_path = os.path.join(messages_dir, strng.to_text(sequence_id))
     stored_json_message = {
         'sequence_id': sequence_id,
         'created': created,
@@ -456,7 +503,10 @@ def store_message(queue_id, sequence_id, producer_id, payload, created, processe
             'failed_consumers': [],
         })
         stored_json_message['processed'] = processed
-    if not local_fs.WriteTextFile(message_path, jsn.dumps(stored_json_message)):
+    try:
+        queue_log(queue_id).append(stored_json_message)
+    except:
+        lg.exc()
         lg.err('failed to store message %d in %r from %r' % (sequence_id, queue_id, producer_id, ))
         return None
     if _Debug:
@@ -467,80 +517,29 @@ def store_message(queue_id, sequence_id, producer_id, payload, created, processe
 def update_processed_message(queue_id, sequence_id):
     if _Debug:
         lg.args(_DebugLevel, queue_id=queue_id, sequence_id=sequence_id)
-    service_dir = settings.ServiceDir('service_message_broker')
-    queues_dir = os.path.join(service_dir, 'queues')
-    queue_dir = os.path.join(queues_dir, queue_id)
-    messages_dir = os.path.join(queue_dir, 'messages')
-    message_path = os.path.join(messages_dir, strng.to_text(sequence_id))
-    stored_json_message = jsn.loads_text(local_fs.ReadTextFile(message_path))
-    if not stored_json_message:
+    if not queue_log(queue_id).set_processed(sequence_id):
         lg.err('failed reading message %d from %r' % (sequence_id, queue_id, ))
         return False
-    stored_json_message['processed'] = utime.get_sec1970()
-    if not local_fs.WriteTextFile(message_path, jsn.dumps(stored_json_message)):
-        return False
     return True
 
 
 def erase_message(queue_id, sequence_id):
     if _Debug:
         lg.args(_DebugLevel, queue_id=queue_id, sequence_id=sequence_id)
-    service_dir = settings.ServiceDir('service_message_broker')
-    queues_dir = os.path.join(service_dir, 'queues')
-    queue_dir = os.path.join(queues_dir, queue_id)
-    messages_dir = os.path.join(queue_dir, 'messages')
-    message_path = os.path.join(messages_dir, strng.to_text(sequence_id))
-    try:
-        os.remove(message_path)
-    except:
-        lg.exc()
+    if not queue_log(queue_id).erase(sequence_id):
+        lg.err('message %d not found in %r' % (sequence_id, queue_id, ))
         return False
     return True
 
 
 def read_messages(queue_id, sequence_id_list=[]):
-    service_dir = settings.ServiceDir('service_message_broker')
-    queues_dir = os.path.join(service_dir, 'queues')
-    queue_dir = os.path.join(queues_dir, queue_id)
-    messages_dir = os.path.join(queue_dir, 'messages')
     if not sequence_id_list:
-        sequence_id_list = sorted([int(sequence_id) for sequence_id in os.listdir(messages_dir)])
-    result = []
-    for sequence_id in sequence_id_list:
-        message_path = os.path.join(messages_dir, strng.to_text(sequence_id))
-        stored_json_message = jsn.loads_text(local_fs.ReadTextFile(message_path))
-        if not stored_json_message:
-            lg.err('failed reading message %d from %r' % (sequence_id, queue_id, ))
-            continue
-        stored_json_message.pop('attempts')
-        result.append(stored_json_message)
-    return result
+        sequence_id_list = queue_log(queue_id).list_sequence_ids()
+    return queue_log(queue_id).read(sequence_id_list)
 
 
 def get_messages_for_consumer(queue_id, consumer_id, consumer_last_sequence_id, max_messages_count=100):
-    service_dir = settings.ServiceDir('service_message_broker')
-    queues_dir = os.path.join(service_dir, 'queues')
-    queue_dir = os.path.join(queues_dir, queue_id)
-    messages_dir = os.path.join(queue_dir, 'messages')
-    all_stored_queue_messages = os.listdir(messages_dir)
-    all_stored_queue_messages.sort(key=lambda i: int(i))
-    result = []
-    for sequence_id in all_stored_queue_messages:
-        if consumer_last_sequence_id >= int(sequence_id):
-            continue
-        message_path = os.path.join(messages_dir, strng.to_text(sequence_id))
-        try:
-            stored_json_message = jsn.loads_text(local_fs.ReadTextFile(message_path))
-        except:
-            lg.exc()
-            continue
-        if not stored_json_message:
-            lg.err('failed reading message %d from %r' % (sequence_id, queue_id, ))
-            continue
-        stored_json_message.pop('attempts')
-        result.append(stored_json_message)
-        if len(result) >= max_messages_count:
-            break
+    result = queue_log(queue_id).read_after(consumer_last_sequence_id, max_messages_count=max_messages_count)
     if _Debug:
         lg.args(_DebugLevel, queue_id=queue_id, consumer_id=consumer_id,
                 consumer_last_sequence_id=consumer_last_sequence_id, result=len(result))
@@ -551,52 +550,16 @@ def get_messages_for_consumer(queue_id, consumer_id, consumer_last_sequence_id,
 def register_delivery(queue_id, sequence_id, message_id):
     if _Debug:
         lg.args(_DebugLevel, queue_id=queue_id, sequence_id=sequence_id, message_id=message_id)
-    service_dir = settings.ServiceDir('service_message_broker')
-    queues_dir = os.path.join(service_dir, 'queues')
-    queue_dir = os.path.join(queues_dir, queue_id)
-    messages_dir = os.path.join(queue_dir, 'messages')
-    message_path = os.path.join(messages_dir, strng.to_text(sequence_id))
-    stored_json_message = jsn.loads_text(local_fs.ReadTextFile(message_path))
-    if not stored_json_message:
+    if not queue_log(queue_id).register_delivery(sequence_id, message_id):
         lg.err('failed reading message %d from %r' % (sequence_id, queue_id, ))
         return False
-    stored_json_message['attempts'].append({
-        'message_id': message_id,
-        'started': utime.get_sec1970(),
-        'finished': None,
-        'failed_consumers': [],
-    })
-    if not local_fs.WriteTextFile(message_path, jsn.dumps(stored_json_message)):
-        return False
     return True
 
 
 def unregister_delivery(queue_id, sequence_id, message_id, failed_consumers):
     if _Debug:
         lg.args(_DebugLevel, queue_id=queue_id, sequence_id=sequence_id, message_id=message_id, failed_consumers=failed_consumers)
-    service_dir = settings.ServiceDir('service_message_broker')
-    queues_dir = os.path.join(service_dir, 'queues')
-    queue_dir = os.path.join(queues_dir, queue_id)
-    messages_dir = os.path.join(queue_dir, 'messages')
-    message_path = os.path.join(messages_dir, strng.to_text(sequence_id))
-    stored_json_message = jsn.loads_text(local_fs.ReadTextFile(message_path))
-    if not stored_json_message:
-        lg.err('failed reading message %d from %r' % (sequence_id, queue_id, ))
-        return False
-    found_attempt_number = None
-    for attempt_number in range(len(stored_json_message['attempts'])-1, -1, -1):
-        if stored_json_message['attempts'][attempt_number]['message_id'] == message_id:
-            found_attempt_number = attempt_number
-            break
-    if found_attempt_number is None:
-        return False
-    stored_json_message['attempts'][found_attempt_number].update({
-        'finished': utime.get_sec1970(),
-        'failed_consumers': failed_consumers,
-    })
-    if not local_fs.WriteTextFile(message_path, jsn.dumps(stored_json_message)):
-        return False
-    return True
+    return queue_log(queue_id).unregister_delivery(sequence_id, message_id, failed_consumers)
 
 #------------------------------------------------------------------------------
 
@@ -632,22 +595,17 @@ def load_streams():
                 continue
             loaded_queues += 1
         last_sequence_id = -1
-        all_stored_queue_messages = os.listdir(messages_dir)
-        all_stored_queue_messages.sort(key=lambda i: int(i))
-        for _sequence_id in all_stored_queue_messages:
-            sequence_id = int(_sequence_id)
-            stored_json_message = jsn.loads_text(local_fs.ReadTextFile(os.path.join(messages_dir, strng.to_text(_sequence_id))))
-            if stored_json_message:
-                if stored_json_message.get('processed'):
-                    streams()[queue_id]['archive'].append(sequence_id)
-                    loaded_archive_messages += 1
-                else:
-                    streams()[queue_id]['messages'].append(sequence_id)
-                if sequence_id >= last_sequence_id:
-                    last_sequence_id = sequence_id
-                loaded_messages += 1
+        if os.path.isdir(messages_dir):
+            migrate_stored_messages(queue_id, messages_dir)
+        one_queue_log = queue_log(queue_id)
+        for sequence_id in one_queue_log.list_sequence_ids():
+            if one_queue_log.is_processed(sequence_id):
+                streams()[queue_id]['archive'].append(sequence_id)
+                loaded_archive_messages += 1
             else:
-                lg.err('failed reading message %d from %r' % (sequence_id, queue_id, ))
+                streams()[queue_id]['messages'].append(sequence_id)
+            last_sequence_id = sequence_id
+            loaded_messages += 1
         streams()[queue_id]['last_sequence_id'] = last_sequence_id
         for consumer_id in os.listdir(consumers_dir):
             if consumer_id in streams()[queue_id]['consumers']:
@@ -712,14 +670,14 @@ def save_stream(queue_id):
     service_dir = settings.ServiceDir('service_message_broker')
     queues_dir = os.path.join(service_dir, 'queues')
     queue_dir = os.path.join(queues_dir, queue_id)
-    messages_dir = os.path.join(queue_dir, 'messages')
+    log_dir = os.path.join(queue_dir, 'log')
     consumers_dir = os.path.join(queue_dir, 'consumers')
     producers_dir = os.path.join(queue_dir, 'producers')
     stream_info = streams()[queue_id]
     if _Debug:
         lg.args(_DebugLevel, queue_id=queue_id, typ=type(queue_id))
-    if not os.path.isdir(messages_dir):
-        bpio._dirs_make(messages_dir)
+    if not os.path.isdir(log_dir):
+        bpio._dirs_make(log_dir)
     if not os.path.isdir(consumers_dir):
         bpio._dirs_make(consumers_dir)
     if not os.path.isdir(producers_dir):
@@ -736,6 +694,7 @@ def erase_stream(queue_id):
     queues_dir = os.path.join(service_dir, 'queues')
     queue_dir = os.path.join(queues_dir, queue_id)
     erased_files = 0
+    close_queue_log(queue_id)
     if os.path.isdir(queue_dir):
         erased_files += bpio.rmdir_recursive(queue_dir, ignore_errors=True)
     if _Debug:
@@ -1256,6 +1215,7 @@ class MessagePeddler(automat.Automat):
         global _MessagePeddler
         message.clear_consumer_callbacks(self.name)
         events.remove_subscriber(self._on_identity_url_changed, 'identity-url-changed')
+        close_queue_logs()
         self.destroy()
         _MessagePeddler = None
 
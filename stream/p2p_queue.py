@@ -37,6 +37,8 @@ Methods to establish a messages queue between two or more nodes.:
     + Queue is only stored on given node: both producer and consumer must be connected to that machine
     + Global queue ID is unique : queue_alias&alice@somehost.net&bob@anotherhost.com
     + Queue size is limited by a parameter, you can not publish when queue is overloaded
+    + There is no polling: a consumer is marked as ready for a queue when new message was written there
+      or one of his notifications was finished, ready consumers are processed in the next reactor turn
 
 """
 
@@ -98,15 +100,13 @@ from userid import id_url
 
 MAX_QUEUE_LENGTH = 100
 MAX_CONSUMER_PENDING_MESSAGES = int( MAX_QUEUE_LENGTH / 2 )
-
-MIN_PROCESS_QUEUES_DELAY = 0.1
-MAX_PROCESS_QUEUES_DELAY = 2.0
+# consumers are processing messages one by one and expect them to arrive in order
+MAX_CONSUMER_IN_FLIGHT_MESSAGES = 1
 
 #------------------------------------------------------------------------------
 
-_ProcessQueuesDelay = 0.1
 _ProcessQueuesTask = None
-_ProcessQueuesLastTime = 0
+_ReadyConsumers = OrderedDict()
 
 _ActiveQueues = {}
 
@@ -178,7 +178,7 @@ def producer(producer_id=None):
 def start():
     if _Debug:
         lg.out(_DebugLevel, 'p2p_queue.start')
-    reactor.callLater(0, process_queues)  # @UndefinedVariable
+    touch_queues()
     return True
 
 
@@ -186,6 +186,7 @@ def stop():
     if _Debug:
         lg.out(_DebugLevel, 'p2p_queue.stop')
     global _ProcessQueuesTask
+    _ReadyConsumers.clear()
     if _ProcessQueuesTask:
         if _ProcessQueuesTask.active():
             _ProcessQueuesTask.cancel()
@@ -194,29 +195,44 @@ def stop():
     return False
 
 
-def process_queues(interested_consumers=None):
-    global _ProcessQueuesDelay
+def process_queues():
+    """
+    Delivers messages to all consumers marked as ready, there is no polling:
+    consumer is marked as ready by ``mark_ready()`` when a new message was written to the queue
+    or one of his notifications was finished.
+    """
     global _ProcessQueuesTask
-    global _ProcessQueuesLastTime
-    has_activity = do_consume(interested_consumers=interested_consumers)
-    _ProcessQueuesLastTime = time.time()
-    if _ProcessQueuesTask is None or _ProcessQueuesTask.called:
-        _ProcessQueuesDelay = misc.LoopAttenuation(
-            _ProcessQueuesDelay, has_activity,
-            MIN_PROCESS_QUEUES_DELAY,
-            MAX_PROCESS_QUEUES_DELAY,
-        )
-        # attenuation
-        _ProcessQueuesTask = reactor.callLater(_ProcessQueuesDelay, process_queues)  # @UndefinedVariable
+    _ProcessQueuesTask = None
+    if not _ReadyConsumers:
+        return False
+    ready_pairs = list(_ReadyConsumers.keys())
+    _ReadyConsumers.clear()
+    return do_consume(ready_pairs)
 
 
-def touch_queues(interested_consumers=None):
-    global _ProcessQueuesDelay
+def mark_ready(consumer_id, queue_id):
+    """
+    Remember that consumer may have new messages to be delivered from given queue,
+    delivery will start in the next reactor turn.
+    """
     global _ProcessQueuesTask
-    global _ProcessQueuesLastTime
-    if time.time() - _ProcessQueuesLastTime < MIN_PROCESS_QUEUES_DELAY:
-        return False
-    reactor.callLater(0, process_queues, interested_consumers=interested_consumers)  # @UndefinedVariable
+    _ReadyConsumers[(consumer_id, queue_id, )] = None
+    if _ProcessQueuesTask is None:
+        _ProcessQueuesTask = reactor.callLater(0, process_queues)  # @UndefinedVariable
+    return True
+
+
+def touch_queues(interested_consumers=None):
+    """
+    Mark all queues of given consumers (or of all known consumers) as ready.
+    """
+    if not interested_consumers:
+        interested_consumers = list(consumer().keys())
+    for consumer_id in interested_consumers:
+        if consumer_id not in consumer():
+            continue
+        for queue_id in consumer(consumer_id).queues:
+            mark_ready(consumer_id, queue_id)
     return True
 
 #------------------------------------------------------------------------------
@@ -320,6 +336,7 @@ def add_callback_method(consumer_id, callback_method):
     if callback_method in consumer(consumer_id).commands:
         raise Exception('callback method already exist')
     consumer(consumer_id).commands.append(callback_method)
+    touch_queues(interested_consumers=[consumer_id, ])
     return True
 
 
@@ -481,6 +498,7 @@ def start_notification(consumer_id, queue_id, message_id, callback_object):
     queue(queue_id)[message_id].state = 'SENT'
     queue(queue_id)[message_id].notifications[consumer_id] = callback_object
     consumer(consumer_id).consumed_messages += 1
+    consumer(consumer_id).pending_notifications += 1
     callback_object.addCallback(on_notification_succeed, consumer_id, queue_id, message_id)
     callback_object.addErrback(on_notification_failed, consumer_id, queue_id, message_id)
     if _Debug:
@@ -522,10 +540,29 @@ def finish_notification(consumer_id, queue_id, message_id, success):
 
 #------------------------------------------------------------------------------
 
+def on_notification_finished(consumer_id, queue_id):
+    """
+    Consumer can receive one more message now, it is marked as ready for that queue.
+    If the consumer reached MAX_CONSUMER_IN_FLIGHT_MESSAGES limit before, his other queues were
+    skipped by ``do_consume()`` and all of them are marked as ready again.
+    """
+    if consumer_id not in consumer():
+        return False
+    limit_reached = consumer(consumer_id).pending_notifications >= MAX_CONSUMER_IN_FLIGHT_MESSAGES
+    consumer(consumer_id).pending_notifications -= 1
+    if limit_reached:
+        for consumer_queue_id in consumer(consumer_id).queues:
+            mark_ready(consumer_id, consumer_queue_id)
+    elif queue_id in consumer(consumer_id).queues:
+        mark_ready(consumer_id, queue_id)
+    return True
+
+
 def on_notification_succeed(result, consumer_id, queue_id, message_id):
     if _Debug:
         lg.out(_DebugLevel, 'p2p_queue.on_notification_succeed : message %s delivered to consumer %s from queue %s' % (
             message_id, consumer_id, queue_id))
+    on_notification_finished(consumer_id, queue_id)
     if is_queue_exist(queue_id):
         try:
             reactor.callLater(0, finish_notification, consumer_id, queue_id, message_id, success=True)  # @UndefinedVariable
@@ -540,6 +577,7 @@ def on_notification_failed(err, consumer_id, queue_id, message_id):
     if _Debug:
         lg.out(_DebugLevel, 'p2p_queue.on_notification_failed : FAILED message %s delivery to consumer %s from queue %s : %s' % (
             message_id, consumer_id, queue_id, err.getErrorMessage()))
+    on_notification_finished(consumer_id, queue_id)
     if is_queue_exist(queue_id):
         try:
             reactor.callLater(0, finish_notification, consumer_id, queue_id, message_id, success=False)  # @UndefinedVariable
@@ -564,8 +602,8 @@ def write_message(producer_id, queue_id, data, creation_time=None):
     queue(queue_id)[new_message.message_id].state = 'PUSHED'
     if _Debug:
         lg.out(_DebugLevel, 'p2p_queue.write_message  %r added to queue %s' % (new_message.message_id, queue_id, ))
-    # reactor.callLater(0, touch_queues)  # @UndefinedVariable
-    touch_queues()
+    for consumer_id in new_message.consumers:
+        mark_ready(consumer_id, queue_id)
     return new_message
 
 
@@ -817,62 +855,35 @@ def do_notify(callback_method, consumer_id, queue_id, message_id):
     return ret
 
 
-def do_consume(interested_consumers=None):
-    if not interested_consumers:
-        interested_consumers = list(consumer().keys())
-    disconnected_consumers = []
-    to_be_consumed = []
-    for consumer_id in interested_consumers:
-        if len(consumer(consumer_id).queues) == 0:
-            # skip, consumer is not subscribed to any queues
+def do_consume(ready_pairs):
+    """
+    Sends pending messages to given (consumer_id, queue_id) pairs, every consumer can have
+    at most MAX_CONSUMER_IN_FLIGHT_MESSAGES not finished notifications.
+    """
+    notifications_count = 0
+    consumers_affected = set()
+    for consumer_id, queue_id in ready_pairs:
+        if consumer_id not in consumer():
+            continue
+        if queue_id not in consumer(consumer_id).queues:
+            # skip, consumer is not subscribed to that queue anymore
             continue
         if len(consumer(consumer_id).commands) == 0:
             # skip, no available notification methods found for given consumer
-            disconnected_consumers.append(consumer_id)
             continue
-        interested_queues = set()
-        for queue_id in consumer(consumer_id).queues:
-            if queue_id not in queue():
-                # if _Debug:
-                #     lg.out(_DebugLevel, 'p2p_queue.do_consume consumer queue %s was not found' % queue_id)
-                continue
-            if len(queue(queue_id)) == 0:
-                # no messages in the queue
-                continue
-            interested_queues.add(queue_id)
-        if len(interested_queues) == 0:
-            # skip, no new messages in the queues which consumer subscribed on
+        if queue_id not in queue():
             continue
-        for queue_id in interested_queues:
-            to_be_consumed.append((consumer_id, queue_id, ))
-    # if _Debug:
-    #     lg.args(_DebugLevel, to_be_consumed=to_be_consumed, interested_consumers=interested_consumers)
-    if not to_be_consumed:
-        # nothing to consume
-        return False
-    notifications_count = 0
-    consumers_affected = []
-    for _consumer_id, _queue_id in to_be_consumed:
-        if _consumer_id in consumers_affected:
-            # only one message per consumer at a time
-            continue
-        _message_id = lookup_pending_message(_consumer_id, _queue_id)
-        if _message_id is None:
-            # no new messages found for that consumer
-            continue
-        for callback_method in consumer(_consumer_id).commands:
-            do_notify(callback_method, _consumer_id, _queue_id, _message_id, )
+        while consumer(consumer_id).pending_notifications < MAX_CONSUMER_IN_FLIGHT_MESSAGES:
+            message_id = lookup_pending_message(consumer_id, queue_id)
+            if message_id is None:
+                # no new messages found for that consumer
+                break
+            do_notify(consumer(consumer_id).commands[0], consumer_id, queue_id, message_id)
             notifications_count += 1
-            consumers_affected.append(_consumer_id)
-            break
+            consumers_affected.add(consumer_id)
     if _Debug:
-        lg.args(_DebugLevel, notifications_count=notifications_count, consumers_affected=consumers_affected)
-    del to_be_consumed
-    del consumers_affected
-    if notifications_count == 0:
-        # nothing was sent
-        return False
-    return True
+        lg.args(_DebugLevel, notifications_count=notifications_count, consumers_affected=len(consumers_affected))
+    return notifications_count > 0
 
 
 def do_cleanup(target_queues=None):
@@ -953,6 +964,7 @@ class ConsumerInfo(object):
         self.consumed_messages = 0
         self.success_notifications = 0
         self.failed_notifications = 0
+        self.pending_notifications = 0
 
 #------------------------------------------------------------------------------
 
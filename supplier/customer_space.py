@@ -75,6 +75,7 @@ from stream import p2p_queue
 
 from supplier import list_files
 from supplier import local_tester
+from supplier import files_manifest
 
 from userid import global_id
 from userid import id_url
@@ -216,7 +217,8 @@ def make_valid_filename(customerIDURL, glob_path):
         if packetID not in [settings.BackupInfoFileName(),
                             settings.BackupInfoFileNameOld(),
                             settings.BackupInfoEncryptedFileName(),
-                            settings.BackupIndexFileName()]:
+                            settings.BackupIndexFileName(),
+                            settings.BackupIndexJournalFileName()]:
             lg.warn('invalid file path')
             return ''
     if not contactsdb.is_customer(customerIDURL):  # SECURITY
@@ -266,6 +268,7 @@ def on_data(newpacket):
             lg.err("can not create sub dir %s" % dirname)
             p2p_service.SendFail(newpacket, 'write error', remote_idurl=authorized_idurl)
             return False
+    # stored packets are always written in JSON format, so older versions can still read them after a downgrade
     data = newpacket.Serialize()
     donated_bytes = settings.getDonatedBytes()
     accounting.check_create_customers_quotas(donated_bytes)
@@ -290,6 +293,7 @@ def on_data(newpacket):
         p2p_service.SendFail(newpacket, 'write error', remote_idurl=authorized_idurl)
         return False
     # Here Data() packet was stored as it is on supplier node (current machine)
+    files_manifest.on_file_written(filename, len(data))
     del data
     p2p_service.SendAck(newpacket, response=strng.to_text(len(newpacket.Payload)), remote_idurl=authorized_idurl)
     reactor.callLater(0, local_tester.TestSpaceTime)  # @UndefinedVariable
@@ -375,7 +379,7 @@ def on_retrieve(newpacket):
         OwnerID=stored_packet.OwnerID,
         CreatorID=my_id.getLocalID(),
         PacketID=stored_packet.PacketID,
-        Payload=stored_packet.Serialize(),
+        Payload=stored_packet.Serialize(binary=signed.IsBinaryFormatSupported(recipient_idurl)),
         RemoteID=recipient_idurl,
     )
     if recipient_idurl == stored_packet.OwnerID:
@@ -421,6 +425,7 @@ def on_list_files(newpacket):
         key_id=key_id,
         remote_idurl=newpacket.OwnerID,  # send back to the requesting node
         query_items=json_query['items'],
+        manifest=json_query.get('manifest'),
     )
     return True
 
@@ -460,12 +465,14 @@ def on_delete_file(newpacket):
                 filescount += 1
             except:
                 lg.exc()
+            files_manifest.on_path_removed(filename)
         elif os.path.isdir(filename):
             try:
                 bpio._dir_remove(filename)
                 dirscount += 1
             except:
                 lg.exc()
+            files_manifest.on_path_removed(filename, is_dir=True)
         else:
             lg.warn("path not found %s" % filename)
 #         if self.publish_event_supplier_file_modified:
@@ -515,12 +522,14 @@ def on_delete_backup(newpacket):
                 count += 1
             except:
                 lg.exc()
+            files_manifest.on_path_removed(filename, is_dir=True)
         elif os.path.isfile(filename):
             try:
                 os.remove(filename)
                 count += 1
             except:
                 lg.exc()
+            files_manifest.on_path_removed(filename)
         else:
             lg.warn("path not found %s" % filename)
 #         if self.publish_event_supplier_file_modified:
@@ -670,6 +679,8 @@ def on_identity_url_changed(evt):
                 lg.warn('removed %r' % old_owner_dir)
         except:
             lg.exc()
+    files_manifest.forget(old_customer_dirname)
+    files_manifest.forget(new_customer_dirname)
     # update customer idurl in "spaceused" file
     local_tester.TestSpaceTime()
     return True
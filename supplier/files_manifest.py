@@ -0,0 +1,680 @@
+#!/usr/bin/env python
+# files_manifest.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (files_manifest.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+
+"""
+..
+
+module:: files_manifest
+
+Keeps in memory a summary of all files stored for every customer on that supplier,
+so ``list_files`` do not need to walk the whole customer folder for every ListFiles() request.
+
+The manifest of a customer is built from disk only once, when it is needed for the first time,
+and after that is updated by ``customer_space`` when Data() packets are stored or removed
+and by ``local_tester`` when ``bptester`` removed something.
+
+Manifests are written into "servicedata/supplier/manifests/" folder when service is stopped
+and loaded back on next start. Stored file is removed right after it was loaded,
+so if the process crashed manifest will be built again from the disk.
+
+Every change increments the revision of the customer manifest and is recorded in a limited change log.
+Customer can send back the "epoch" and revision it already knows and receive only the lines
+which were changed since that revision, see ``CustomerManifest.delta()``.
+The "epoch" is generated every time manifest is built from scratch, so it is not possible
+to mix up revisions of two different manifests.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from io import StringIO
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import os
+import bisect
+import binascii
+
+#------------------------------------------------------------------------------
+
+from logs import lg
+
+from system import bpio
+
+from lib import strng
+from lib import jsn
+from lib import packetid
+from lib import misc
+
+from main import settings
+
+#------------------------------------------------------------------------------
+
+_Manifests = {}
+_MaxChanges = 20000
+
+#------------------------------------------------------------------------------
+
+def init():
+    if _Debug:
+        lg.out(_DebugLevel, 'files_manifest.init')
+
+
+def shutdown():
+    if _Debug:
+        lg.out(_DebugLevel, 'files_manifest.shutdown')
+    save_all()
+    _Manifests.clear()
+
+#------------------------------------------------------------------------------
+
+def manifests_dir():
+    return os.path.join(settings.ServiceDir('service_supplier'), 'manifests')
+
+
+def manifest_filepath(customer_dir_name):
+    return os.path.join(manifests_dir(), customer_dir_name)
+
+#------------------------------------------------------------------------------
+
+class VersionPieces(object):
+    """
+    Info about all Data and Parity pieces stored inside of one version folder.
+    For every supplier position keeps sizes of pieces and a total size of all of them.
+    """
+
+    def __init__(self):
+        self.suppliers = {}
+        self.max_block = -1
+
+    def add(self, block_num, supplier_num, data_or_parity, size):
+        pos = 0 if data_or_parity == 'Data' else 1
+        if supplier_num not in self.suppliers:
+            self.suppliers[supplier_num] = [{}, {}, 0, ]
+        pieces = self.suppliers[supplier_num]
+        pieces[2] += size - pieces[pos].get(block_num, 0)
+        pieces[pos][block_num] = size
+        if self.max_block is not None and block_num > self.max_block:
+            self.max_block = block_num
+
+    def remove(self, block_num, supplier_num, data_or_parity):
+        pos = 0 if data_or_parity == 'Data' else 1
+        pieces = self.suppliers.get(supplier_num)
+        if not pieces or block_num not in pieces[pos]:
+            return False
+        pieces[2] -= pieces[pos].pop(block_num)
+        if not pieces[0] and not pieces[1]:
+            self.suppliers.pop(supplier_num)
+        if block_num == self.max_block:
+            # will be calculated again when needed
+            self.max_block = None
+        return True
+
+    def get_max_block(self):
+        if self.max_block is None:
+            self.max_block = -1
+            for data, parity, _ in self.suppliers.values():
+                if data:
+                    self.max_block = max(self.max_block, max(data))
+                if parity:
+                    self.max_block = max(self.max_block, max(parity))
+        return self.max_block
+
+    def summary(self, subpath, out):
+        """
+        Writes "V" lines in the same format ``list_files.TreeSummary()`` does.
+        """
+        max_block = self.get_max_block()
+        for supplier_num in sorted(self.suppliers.keys()):
+            data, parity, total = self.suppliers[supplier_num]
+            version_string = '%s %d 0-%d %d' % (subpath, supplier_num, max_block, total)
+            data_missing = None
+            parity_missing = None
+            if len(data) <= max_block:
+                data_missing = [b for b in range(max_block + 1) if b not in data]
+            if len(parity) <= max_block:
+                parity_missing = [b for b in range(max_block + 1) if b not in parity]
+            if data_missing or parity_missing:
+                version_string += ' missing'
+                if data_missing:
+                    version_string += ' Data:' + (','.join(map(str, data_missing)))
+                if parity_missing:
+                    version_string += ' Parity:' + (','.join(map(str, parity_missing)))
+            out.write(u'V%s\n' % version_string)
+
+    def serialize(self):
+        return {strng.to_text(str(supplier_num)): [
+            {strng.to_text(str(b)): s for b, s in data.items()},
+            {strng.to_text(str(b)): s for b, s in parity.items()},
+        ] for supplier_num, (data, parity, _) in self.suppliers.items()}
+
+    def unserialize(self, dct):
+        self.suppliers.clear()
+        self.max_block = -1
+        for supplier_num, pieces in dct.items():
+            for pos, data_or_parity in enumerate(('Data', 'Parity', )):
+                for block_num, size in pieces[pos].items():
+                    self.add(int(block_num), int(supplier_num), data_or_parity, size)
+        return self
+
+
+class KeyAliasTree(object):
+    """
+    Summary of one key alias folder of the customer.
+
+    Only those files and folders are kept which are visible to ``list_files.TreeSummary()``:
+    folders outside of versions, version folders with their pieces, folders and files
+    directly inside of a version folder. Paths are relative to the key alias folder.
+
+    If ``on_change`` callback is set it is executed for every path which
+    will be reported differently after the modification.
+    """
+
+    def __init__(self):
+        self.dirs = set()
+        self.files = {}
+        self.versions = {}
+        self.versions_parents = {}
+        self.on_change = None
+
+    def __len__(self):
+        return len(self.dirs) + len(self.files)
+
+    def _changed(self, subpath, removed=False):
+        if self.on_change:
+            self.on_change(subpath, removed)
+
+    def _first_version(self, parts):
+        for i, name in enumerate(parts):
+            if packetid.IsCanonicalVersion(name):
+                return i
+        return None
+
+    def _add_version(self, subpath):
+        self.versions[subpath] = VersionPieces()
+        parent = subpath.rpartition('/')[0]
+        self.versions_parents[parent] = self.versions_parents.get(parent, 0) + 1
+        self._changed(parent)
+
+    def _remove_version(self, subpath):
+        self.versions.pop(subpath)
+        parent = subpath.rpartition('/')[0]
+        self.versions_parents[parent] -= 1
+        if not self.versions_parents[parent]:
+            self.versions_parents.pop(parent)
+        self._changed(parent)
+
+    def add_dir(self, parts):
+        """
+        Registers folder with all parent folders, returns True if content of that folder
+        is also visible in the summary.
+        """
+        first_version = self._first_version(parts)
+        limit = len(parts)
+        if first_version is not None:
+            limit = min(limit, first_version + 2)
+        for i in range(1, limit + 1):
+            subpath = '/'.join(parts[:i])
+            if subpath in self.dirs:
+                continue
+            self.dirs.add(subpath)
+            self._changed(subpath)
+            if first_version is not None and i == first_version + 1:
+                self._add_version(subpath)
+        return first_version is None or first_version == len(parts) - 1
+
+    def add_file(self, parts, size):
+        if len(parts) > 1:
+            if not self.add_dir(parts[:-1]):
+                return False
+        subpath = '/'.join(parts)
+        if len(parts) > 1:
+            version_subpath = '/'.join(parts[:-1])
+            if version_subpath in self.versions:
+                piece = self._parse_piece(subpath)
+                if piece:
+                    self.versions[version_subpath].add(piece[0], piece[1], piece[2], size)
+                    self._changed(version_subpath)
+                    return True
+        self.files[subpath] = size
+        self._changed(subpath)
+        return True
+
+    def remove_file(self, parts):
+        subpath = '/'.join(parts)
+        if self.files.pop(subpath, None) is not None:
+            self._changed(subpath, removed=True)
+            return True
+        version_subpath = '/'.join(parts[:-1])
+        if version_subpath not in self.versions:
+            return False
+        piece = self._parse_piece(subpath)
+        if not piece:
+            return False
+        if not self.versions[version_subpath].remove(piece[0], piece[1], piece[2]):
+            return False
+        self._changed(version_subpath)
+        return True
+
+    def remove_dir(self, parts):
+        if not parts:
+            self.dirs.clear()
+            self.files.clear()
+            self.versions.clear()
+            self.versions_parents.clear()
+            self._changed('', removed=True)
+            return True
+        subpath = '/'.join(parts)
+        prefix = subpath + '/'
+        self.dirs = set(d for d in self.dirs if d != subpath and not d.startswith(prefix))
+        self.files = {f: s for f, s in self.files.items() if not f.startswith(prefix)}
+        for version_subpath in [v for v in self.versions.keys() if v == subpath or v.startswith(prefix)]:
+            self._remove_version(version_subpath)
+        self._changed(subpath, removed=True)
+        return True
+
+    def _parse_piece(self, subpath):
+        if not packetid.Valid(subpath):
+            return None
+        _, pathID, versionName, blockNum, supplierNum, dataORparity = packetid.SplitFull(subpath)
+        if None in [pathID, versionName, blockNum, supplierNum, dataORparity]:
+            return None
+        if dataORparity != 'Data' and dataORparity != 'Parity':
+            return None
+        return blockNum, supplierNum, dataORparity
+
+    def exists(self, subpath):
+        return subpath in self.dirs or subpath in self.files
+
+    def summary_item(self, subpath, out):
+        """
+        Writes lines about single file or folder, returns False if it is not known.
+        """
+        if subpath in self.files:
+            out.write(u'F%s %d\n' % (subpath, self.files[subpath]))
+            return True
+        if subpath not in self.dirs:
+            return False
+        if subpath.rpartition('/')[0] in self.versions:
+            out.write(u'D%s\n' % subpath)
+        elif subpath in self.versions:
+            self.versions[subpath].summary(subpath, out)
+        elif subpath in self.versions_parents:
+            out.write(u'F%s -1\n' % subpath)
+        else:
+            out.write(u'D%s\n' % subpath)
+        return True
+
+    def summary(self, out):
+        for subpath in sorted(list(self.dirs) + list(self.files.keys())):
+            self.summary_item(subpath, out)
+
+    def serialize(self):
+        return {
+            'dirs': sorted(self.dirs),
+            'files': self.files,
+            'versions': {v: p.serialize() for v, p in self.versions.items()},
+        }
+
+    def unserialize(self, dct):
+        self.dirs = set(dct.get('dirs') or [])
+        self.files = dict(dct.get('files') or {})
+        self.versions = {}
+        self.versions_parents = {}
+        for version_subpath, pieces in (dct.get('versions') or {}).items():
+            self._add_version(version_subpath)
+            self.versions[version_subpath].unserialize(pieces)
+        return self
+
+
+class CustomerManifest(object):
+    """
+    All key alias trees of one customer together with current revision and the log of recent changes.
+    """
+
+    def __init__(self, customer_dir_name, epoch=None):
+        self.customer_dir_name = customer_dir_name
+        self.epoch = epoch or strng.to_text(binascii.hexlify(os.urandom(6)))
+        self.revision = 0
+        self.base_revision = 0
+        self.changes = []
+        self.changes_revisions = []
+        self.trees = {}
+
+    def tree(self, key_alias, create=True):
+        if key_alias not in self.trees:
+            if not create:
+                return None
+            self.set_tree(key_alias, KeyAliasTree())
+            self.log_change(key_alias, '')
+        return self.trees[key_alias]
+
+    def set_tree(self, key_alias, tree):
+        tree.on_change = lambda subpath, removed: self.log_change(key_alias, subpath, removed)
+        self.trees[key_alias] = tree
+
+    def remove_tree(self, key_alias):
+        if self.trees.pop(key_alias, None) is None:
+            return False
+        self.log_change(key_alias, '', removed=True)
+        return True
+
+    def log_change(self, key_alias, subpath, removed=False):
+        self.revision += 1
+        self.changes.append((key_alias, subpath, removed, ))
+        self.changes_revisions.append(self.revision)
+        if len(self.changes) > _MaxChanges:
+            # older changes are forgotten, customer will have to request all files again
+            cut = int(_MaxChanges / 2)
+            self.base_revision = self.changes_revisions[cut - 1]
+            self.changes = self.changes[cut:]
+            self.changes_revisions = self.changes_revisions[cut:]
+
+    def delta(self, since_revision, key_alias_filter=None):
+        """
+        Returns text with lines for all items which were changed after given revision,
+        or None if that revision is too old or unknown.
+
+        Line "X<path>" means that path and everything inside it was removed,
+        "X*" means the whole key alias was removed.
+        Removed or changed versions are always reported with "X" line followed by fresh "V" lines.
+        """
+        if since_revision < self.base_revision or since_revision > self.revision:
+            return None
+        pos = bisect.bisect_right(self.changes_revisions, since_revision)
+        changed = {}
+        for key_alias, subpath, removed in self.changes[pos:]:
+            if key_alias_filter and not key_alias_filter(key_alias):
+                continue
+            if key_alias not in changed:
+                changed[key_alias] = {}
+            changed[key_alias][subpath] = changed[key_alias].get(subpath, False) or removed
+        out = StringIO()
+        for key_alias in sorted(changed.keys()):
+            out.write(u'K%s\n' % key_alias)
+            tree = self.trees.get(key_alias)
+            for subpath in sorted(changed[key_alias].keys()):
+                if subpath == '':
+                    if changed[key_alias][subpath]:
+                        out.write(u'X*\n')
+                    continue
+                if changed[key_alias][subpath] or (tree is not None and subpath in tree.versions):
+                    out.write(u'X%s\n' % subpath)
+                if tree is not None:
+                    tree.summary_item(subpath, out)
+        src = out.getvalue()
+        out.close()
+        return src
+
+    def serialize(self):
+        return {
+            'customer': self.customer_dir_name,
+            'epoch': self.epoch,
+            'revision': self.revision,
+            'base_revision': self.base_revision,
+            'changes': [[r, ] + list(c) for r, c in zip(self.changes_revisions, self.changes)],
+            'aliases': {key_alias: tree.serialize() for key_alias, tree in self.trees.items()},
+        }
+
+    def unserialize(self, dct):
+        self.epoch = dct['epoch']
+        for key_alias, tree in dct['aliases'].items():
+            self.set_tree(key_alias, KeyAliasTree().unserialize(tree))
+        # changes made while loading were not real
+        self.revision = dct['revision']
+        self.base_revision = dct['base_revision']
+        self.changes = [tuple(c[1:]) for c in dct['changes']]
+        self.changes_revisions = [c[0] for c in dct['changes']]
+        return self
+
+#------------------------------------------------------------------------------
+
+def is_loaded(customer_dir_name):
+    return customer_dir_name in _Manifests
+
+
+def manifest(customer_dir_name):
+    """
+    Returns ``CustomerManifest`` object for given customer folder name,
+    loads stored manifest or builds it from disk if it was not done yet.
+    """
+    if customer_dir_name in _Manifests:
+        return _Manifests[customer_dir_name]
+    if load(customer_dir_name):
+        return _Manifests[customer_dir_name]
+    return rebuild(customer_dir_name)
+
+
+def load(customer_dir_name):
+    filepath = manifest_filepath(customer_dir_name)
+    if not os.path.isfile(filepath):
+        return False
+    try:
+        dct = jsn.loads_text(bpio.ReadTextFile(filepath))
+        m = CustomerManifest(customer_dir_name).unserialize(dct)
+    except:
+        lg.exc()
+        m = None
+    # the stored copy is not valid anymore when new changes are made in memory
+    try:
+        os.remove(filepath)
+    except:
+        lg.exc()
+    if m is None:
+        return False
+    _Manifests[customer_dir_name] = m
+    if _Debug:
+        lg.args(_DebugLevel, customer=customer_dir_name, aliases=list(m.trees.keys()), revision=m.revision)
+    return True
+
+
+def save(customer_dir_name):
+    m = _Manifests.get(customer_dir_name)
+    if m is None:
+        return False
+    if not os.path.isdir(manifests_dir()):
+        bpio._dirs_make(manifests_dir())
+    return bpio.WriteTextFile(manifest_filepath(customer_dir_name), jsn.dumps(m.serialize()))
+
+
+def save_all():
+    for customer_dir_name in list(_Manifests.keys()):
+        try:
+            save(customer_dir_name)
+        except:
+            lg.exc()
+
+
+def forget(customer_dir_name):
+    """
+    Drop manifest of the customer from memory and from disk,
+    it will be built from disk again when requested next time.
+    """
+    _Manifests.pop(customer_dir_name, None)
+    filepath = manifest_filepath(customer_dir_name)
+    if os.path.isfile(filepath):
+        try:
+            os.remove(filepath)
+        except:
+            lg.exc()
+    if _Debug:
+        lg.args(_DebugLevel, customer=customer_dir_name)
+
+
+def rebuild(customer_dir_name):
+    """
+    Walk customer folder and build manifest from scratch.
+    """
+    m = CustomerManifest(customer_dir_name)
+    owner_dir = os.path.join(settings.getCustomersFilesDir(), customer_dir_name)
+    if os.path.isdir(owner_dir):
+        for key_alias in os.listdir(owner_dir):
+            key_alias_dir = os.path.join(owner_dir, key_alias)
+            if not os.path.isdir(key_alias_dir):
+                continue
+            m.set_tree(key_alias, build_tree(key_alias_dir))
+    _Manifests[customer_dir_name] = m
+    if _Debug:
+        lg.args(_DebugLevel, customer=customer_dir_name, aliases=list(m.trees.keys()), epoch=m.epoch)
+    return m
+
+
+def rebuild_all():
+    """
+    Build again manifests of all customers, returns dictionary with number of items for every customer.
+    """
+    _Manifests.clear()
+    results = {}
+    customers_dir = settings.getCustomersFilesDir()
+    if os.path.isdir(customers_dir):
+        for customer_dir_name in os.listdir(customers_dir):
+            if not os.path.isdir(os.path.join(customers_dir, customer_dir_name)):
+                continue
+            forget(customer_dir_name)
+            m = rebuild(customer_dir_name)
+            results[customer_dir_name] = sum(map(len, m.trees.values()))
+    lg.info('rebuilt files manifests for %d customers' % len(results))
+    return results
+
+
+def build_tree(key_alias_dir):
+    tree = KeyAliasTree()
+
+    def cb(realpath, subpath, name):
+        if not os.access(realpath, os.R_OK):
+            return False
+        parts = subpath.split('/')
+        if os.path.isfile(realpath):
+            try:
+                filesz = os.path.getsize(realpath)
+            except:
+                filesz = -1
+            tree.add_file(parts, filesz)
+            return False
+        return tree.add_dir(parts)
+
+    bpio.traverse_dir_recursive(cb, key_alias_dir)
+    return tree
+
+#------------------------------------------------------------------------------
+
+def split_path(path):
+    """
+    Returns tuple (customer folder name, key alias, list of path items inside key alias folder)
+    for absolute path inside of customers folder, or None.
+    """
+    customers_dir = settings.getCustomersFilesDir()
+    relpath = os.path.relpath(path, customers_dir).replace('\\', '/')
+    if relpath == '.' or relpath.startswith('..'):
+        return None
+    parts = [p for p in relpath.split('/') if p]
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0], None, []
+    return parts[0], parts[1], parts[2:]
+
+
+def _manifest_to_update(customer_dir_name):
+    if customer_dir_name not in _Manifests:
+        # if manifest was never built it will be done from disk later anyway
+        if not load(customer_dir_name):
+            return None
+    return _Manifests[customer_dir_name]
+
+
+def on_file_written(filename, size):
+    splitted = split_path(filename)
+    if not splitted or not splitted[1] or not splitted[2]:
+        return False
+    customer_dir_name, key_alias, parts = splitted
+    m = _manifest_to_update(customer_dir_name)
+    if m is None:
+        return False
+    return m.tree(key_alias).add_file(parts, size)
+
+
+def on_path_removed(path, is_dir=False):
+    splitted = split_path(path)
+    if not splitted:
+        return False
+    customer_dir_name, key_alias, parts = splitted
+    if not key_alias:
+        forget(customer_dir_name)
+        return True
+    m = _manifest_to_update(customer_dir_name)
+    if m is None:
+        return False
+    if not parts:
+        return m.remove_tree(key_alias)
+    tree = m.tree(key_alias)
+    if is_dir:
+        return tree.remove_dir(parts)
+    if not tree.remove_file(parts):
+        # not sure what it was, so make sure nothing left from that path
+        tree.remove_dir(parts)
+    return True
+
+
+def on_paths_removed(paths):
+    for path in paths:
+        try:
+            on_path_removed(path)
+        except:
+            lg.exc()
+
+#------------------------------------------------------------------------------
+
+def tree_summary(customer_dir_name, key_alias_dir_name, key_alias=None):
+    """
+    Same result as ``list_files.TreeSummary()`` gives for the key alias folder of the customer,
+    but rendered from the manifest.
+    """
+    out = StringIO()
+    if key_alias is not None:
+        out.write(u'K%s\n' % key_alias)
+    tree = manifest(customer_dir_name).tree(key_alias_dir_name, create=False)
+    if tree is not None:
+        tree.summary(out)
+    src = out.getvalue()
+    out.close()
+    return src
+
+
+def changes_summary(customer_dir_name, epoch, since_revision):
+    """
+    Returns tuple (epoch, revision, text) where text contains only lines changed after ``since_revision``
+    for all valid key aliases, text is None if changes are not available and full list must be sent.
+    """
+    m = manifest(customer_dir_name)
+    if epoch != m.epoch or since_revision is None:
+        return m.epoch, m.revision, None
+    try:
+        since_revision = int(since_revision)
+    except:
+        return m.epoch, m.revision, None
+    return m.epoch, m.revision, m.delta(since_revision, key_alias_filter=lambda k: misc.ValidKeyAlias(strng.to_text(k)))
@@ -60,9 +60,11 @@ from contacts import identitycache
 from userid import my_id
 from userid import global_id
 
+from supplier import files_manifest
+
 #------------------------------------------------------------------------------
 
-def send(customer_idurl, packet_id, format_type, key_id, remote_idurl, query_items=[]):
+def send(customer_idurl, packet_id, format_type, key_id, remote_idurl, query_items=[], manifest=None):
     if not query_items:
         query_items = ['*', ]
     parts = global_id.ParseGlobalID(key_id)
@@ -78,14 +80,17 @@ def send(customer_idurl, packet_id, format_type, key_id, remote_idurl, query_ite
             customer_idurl, key_id, ))
         return p2p_service.SendFailNoRequest(customer_idurl, packet_id, response='key not registered')
     if _Debug:
-        lg.out(_DebugLevel, "list_files.send to %s, customer_idurl=%s, key_id=%s, query_items=%r" % (
-            remote_idurl, customer_idurl, key_id, query_items, ))
+        lg.out(_DebugLevel, "list_files.send to %s, customer_idurl=%s, key_id=%s, query_items=%r, manifest=%r" % (
+            remote_idurl, customer_idurl, key_id, query_items, manifest, ))
     ownerdir = settings.getCustomerFilesDir(customer_idurl)
     plaintext = ''
     if os.path.isdir(ownerdir):
         try:
-            for query_path in query_items:
-                plaintext += process_query_item(query_path, parts['key_alias'], ownerdir)
+            if manifest is not None and query_items == ['*', ]:
+                plaintext += process_manifest_query(manifest, parts['key_alias'], ownerdir)
+            else:
+                for query_path in query_items:
+                    plaintext += process_query_item(query_path, parts['key_alias'], ownerdir)
         except:
             lg.exc()
             return p2p_service.SendFailNoRequest(customer_idurl, packet_id, response='list files query processing error')
@@ -116,6 +121,24 @@ def send(customer_idurl, packet_id, format_type, key_id, remote_idurl, query_ite
     return newpacket
 
 
+def process_manifest_query(manifest, key_alias, ownerdir):
+    """
+    Customer knows revision of our files manifest and wants to receive only recent changes.
+    First line "R<epoch> <revision> <since revision>" is added if only changes are sent,
+    otherwise "R<epoch> <revision>" line is followed by the full list of files.
+    """
+    epoch, revision, changes = files_manifest.changes_summary(
+        customer_dir_name=os.path.basename(ownerdir),
+        epoch=manifest.get('epoch'),
+        since_revision=manifest.get('revision'),
+    )
+    if changes is not None:
+        if _Debug:
+            lg.args(_DebugLevel, epoch=epoch, revision=revision, since=manifest.get('revision'), result_bytes=len(changes))
+        return 'R%s %d %d\nQ*\n%s' % (epoch, revision, int(manifest.get('revision')), changes)
+    return 'R%s %d\n%s' % (epoch, revision, process_query_item('*', key_alias, ownerdir))
+
+
 def process_query_item(query_path, key_alias, ownerdir):
     ret = ''
     ret += 'Q%s\n' % query_path
@@ -123,8 +146,7 @@ def process_query_item(query_path, key_alias, ownerdir):
         for one_key_alias in os.listdir(ownerdir):
             if not misc.ValidKeyAlias(strng.to_text(one_key_alias)):
                 continue
-            key_alias_dir = os.path.join(ownerdir, one_key_alias)
-            ret += TreeSummary(key_alias_dir, key_alias=one_key_alias)
+            ret += files_manifest.tree_summary(os.path.basename(ownerdir), one_key_alias, key_alias=one_key_alias)
         if _Debug:
             lg.args(_DebugLevel, query_path=query_path, result_bytes=len(ret))
         return ret
@@ -137,7 +159,11 @@ def process_query_item(query_path, key_alias, ownerdir):
         lg.warn('local file or folder not exist: %r' % local_path)
         return ''
     if os.path.isdir(local_path):
-        ret += TreeSummary(local_path, key_alias=key_alias)
+        if len(path_items) == 2:
+            # the whole key alias folder was requested, so manifest can be used
+            ret += files_manifest.tree_summary(os.path.basename(ownerdir), path_items[1], key_alias=key_alias)
+        else:
+            ret += TreeSummary(local_path, key_alias=key_alias)
     if _Debug:
         lg.args(_DebugLevel, query_path=query_path, local_path=local_path, result_bytes=len(ret))
     return ret
@@ -176,6 +202,10 @@ def UnpackListFiles(payload, method):
 #------------------------------------------------------------------------------
 
 def TreeSummary(ownerdir, key_alias=None):
+    """
+    Walks given folder on disk and builds summary of all stored files.
+    Same info for the whole key alias folder is also available in ``files_manifest`` module.
+    """
     out = StringIO()
     if key_alias is not None:
         out.write('K%s\n' % key_alias)
@@ -243,10 +273,10 @@ def TreeSummary(ownerdir, key_alias=None):
             dataMissing[supplierNum] = set(range(maxBlock + 1))
             parityMissing[supplierNum] = set(range(maxBlock + 1))
             for blockNum in range(maxBlock + 1):
-                if blockNum in list(dataBlocks[supplierNum].keys()):
+                if blockNum in dataBlocks[supplierNum]:
                     versionSize[supplierNum] += dataBlocks[supplierNum][blockNum]
                     dataMissing[supplierNum].discard(blockNum)
-                if blockNum in list(parityBlocks[supplierNum].keys()):
+                if blockNum in parityBlocks[supplierNum]:
                     versionSize[supplierNum] += parityBlocks[supplierNum][blockNum]
                     parityMissing[supplierNum].discard(blockNum)
         suppliers = set(list(dataBlocks.keys()) + list(parityBlocks.keys()))
@@ -163,7 +163,10 @@ def _popTester():
 
 def on_thread_finished(ret, cmd):
     global _CurrentProcess
+    from main import bptester
+    from supplier import files_manifest
     _CurrentProcess = None
+    files_manifest.on_paths_removed(bptester.pop_removed_paths())
     if _Debug:
         lg.out(_DebugLevel, 'local_tester.on_thread_finished %r with %r' % (cmd, ret))
 
@@ -30,6 +30,16 @@
 Keep track of temporary files created in the program. The temp folder is
 placed in the BitDust data directory. All files are divided into several
 sub folders.
+
+Some sub folders (see ``_SharedMemorySubDirs``) can be also placed in the
+shared memory location of the OS (``/dev/shm`` on Linux), so files created there
+never touch the HDD and can be mapped into memory by other processes.
+
+Small files can be also kept completely in memory, see ``make_in_memory()``.
+Such file get a unique path inside the sub folder, but nothing is written to the disk.
+Use ``open_file()``, ``file_size()`` and ``file_exists()`` to access both kinds of files.
+In-memory file is erased when its owner and every user registered with ``hold()``
+have called ``release()``, the collector still removes it after the sub folder lifetime.
 """
 
 #------------------------------------------------------------------------------
@@ -44,8 +54,10 @@ _DebugLevel = 10
 #------------------------------------------------------------------------------
 
 import os
-import tempfile
 import time
+import hashlib
+import itertools
+import tempfile
 
 from twisted.internet import task  # @UnresolvedImport
 
@@ -53,12 +65,18 @@ from twisted.internet import task  # @UnresolvedImport
 
 from logs import lg
 
+from io import BytesIO
+
 from system import bpio
 
 #------------------------------------------------------------------------------
 
 _TempDirPath = None
+_SharedMemoryDirPath = None
 _FilesDict = {}
+_MemoryFiles = {}
+_MemoryFilesUsers = {}
+_MemoryFilesCounter = itertools.count(1)
 _CollectorTask = None
 _SubDirs = {
 
@@ -104,6 +122,10 @@ _SubDirs = {
 
 }
 
+_SharedMemorySubDirs = [
+    'raid',
+]
+
 #------------------------------------------------------------------------------
 
 
@@ -119,6 +141,7 @@ def init(temp_dir_path=''):
     if _Debug:
         lg.out(_DebugLevel, 'tmpfile.init')
     global _TempDirPath
+    global _SharedMemoryDirPath
     global _SubDirs
     global _FilesDict
     global _CollectorTask
@@ -144,6 +167,11 @@ def init(temp_dir_path=''):
             _TempDirPath = temp_dir
         lg.out(6, 'tmpfile.init  _TempDirPath=' + _TempDirPath)
 
+    if _SharedMemoryDirPath is None:
+        _SharedMemoryDirPath = detect_shared_memory_dir(_TempDirPath)
+        if _SharedMemoryDirPath:
+            lg.out(6, 'tmpfile.init  _SharedMemoryDirPath=' + _SharedMemoryDirPath)
+
     for name in _SubDirs.keys():
         if not os.path.exists(subdir(name)):
             try:
@@ -152,6 +180,15 @@ def init(temp_dir_path=''):
                 lg.out(2, 'tmpfile.init ERROR can not create ' + subdir(name))
                 lg.exc()
 
+    if _SharedMemoryDirPath:
+        for name in _SharedMemorySubDirs:
+            if not os.path.exists(shared_subdir(name)):
+                try:
+                    os.makedirs(shared_subdir(name))
+                except:
+                    lg.out(2, 'tmpfile.init ERROR can not create ' + shared_subdir(name))
+                    lg.exc()
+
     for name in _SubDirs.keys():
         if name not in _FilesDict:
             _FilesDict[name] = {}
@@ -186,6 +223,29 @@ def subdir(name):
     return os.path.join(_TempDirPath, name)
 
 
+def detect_shared_memory_dir(temp_dir_path):
+    """
+    Return a location in the shared memory of the OS to be used together with given temp folder
+    or None if such location is not available on that machine.
+    """
+    if not os.path.isdir('/dev/shm') or not os.access('/dev/shm', os.W_OK):
+        return None
+    return os.path.join('/dev/shm', 'bitdust_' + hashlib.md5(temp_dir_path.encode('utf-8')).hexdigest()[:12])
+
+
+def shared_subdir(name):
+    """
+    Return a path to given sub folder in the shared memory or None if not available.
+    """
+    global _TempDirPath
+    global _SharedMemoryDirPath
+    if _TempDirPath is None:
+        init()
+    if not _SharedMemoryDirPath or name not in _SharedMemorySubDirs:
+        return None
+    return os.path.join(_SharedMemoryDirPath, name)
+
+
 def register(filepath):
     """
     You can create a temp file in another place and call this method to be able
@@ -199,11 +259,14 @@ def register(filepath):
     _FilesDict[name][filepath] = time.time()
 
 
-def make(name, extension='', prefix='', close_fd=False):
+def make(name, extension='', prefix='', close_fd=False, shared_memory=False):
     """
     Make a new binary file under sub folder ``name`` and return a tuple of it's file
     descriptor and path.
 
+    If ``shared_memory`` is True and the sub folder is available in the shared memory
+    the file will be created there instead of the HDD.
+
     .. warning::    Remember you need to close the file descriptor by your own.
     The ``tmpfile`` module will remove it later - do not worry.
     This is a job for our collector.
@@ -216,13 +279,21 @@ def make(name, extension='', prefix='', close_fd=False):
         init()
     if name not in list(_FilesDict.keys()):
         name = 'all'
-    try:
-        fd, filename = tempfile.mkstemp(extension, prefix, subdir(name))
-        _FilesDict[name][filename] = time.time()
-    except:
-        lg.out(1, 'tmpfile.make ERROR creating file in sub folder ' + name)
-        lg.exc()
-        return None, ''
+    fd = None
+    if shared_memory and shared_subdir(name):
+        try:
+            fd, filename = tempfile.mkstemp(extension, prefix, shared_subdir(name))
+        except (IOError, OSError) as exc:
+            lg.warn('failed creating file in shared memory, sub folder %s : %r' % (name, exc, ))
+            fd = None
+    if fd is None:
+        try:
+            fd, filename = tempfile.mkstemp(extension, prefix, subdir(name))
+        except:
+            lg.out(1, 'tmpfile.make ERROR creating file in sub folder ' + name)
+            lg.exc()
+            return None, ''
+    _FilesDict[name][filename] = time.time()
     if close_fd:
         os.close(fd)
     if _Debug:
@@ -230,6 +301,38 @@ def make(name, extension='', prefix='', close_fd=False):
     return fd, filename
 
 
+def make_from_chunks(name, chunks, extension='', prefix='', shared_memory=False):
+    """
+    Make a new file under sub folder ``name``, write given chunks of data into it and return it's path.
+
+    If ``shared_memory`` is True the file is created in the shared memory first, but when there is
+    not enough space there it is removed and written again on the HDD.
+    Returns None if the file was not written at all.
+    """
+    fd, filename = make(name, extension=extension, prefix=prefix, shared_memory=shared_memory)
+    if fd is None:
+        return None
+    try:
+        _write_chunks(fd, chunks)
+    except (IOError, OSError) as exc:
+        os.close(fd)
+        erase(name, filename, 'failed to write : %r' % exc)
+        if not shared_memory:
+            lg.err('failed writing file in sub folder %s : %r' % (name, exc, ))
+            return None
+        lg.warn('failed writing file in shared memory, sub folder %s : %r' % (name, exc, ))
+        return make_from_chunks(name, chunks, extension=extension, prefix=prefix, shared_memory=False)
+    os.close(fd)
+    return filename
+
+
+def _write_chunks(fd, chunks):
+    for chunk in chunks:
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(fd, view):]
+
+
 def make_dir(name, extension='', prefix=''):
     """
     """
@@ -251,6 +354,91 @@ def make_dir(name, extension='', prefix=''):
     return dirname
 
 
+def make_in_memory(name, data, extension='', prefix=''):
+    """
+    Keep given ``data`` in memory and return a unique path for it inside sub folder ``name``.
+    No file is created on the disk, but the path can be used same way as for other
+    temporary files: ``open_file()``, ``file_size()``, ``erase()``, ``throw_out()``.
+    """
+    global _FilesDict
+    global _MemoryFiles
+    if _TempDirPath is None:
+        init()
+    if name not in list(_FilesDict.keys()):
+        name = 'all'
+    filename = os.path.join(subdir(name), '%smem%d_%d%s' % (prefix, os.getpid(), next(_MemoryFilesCounter), extension))
+    _MemoryFiles[filename] = data
+    # the caller is the first user of that file
+    _MemoryFilesUsers[filename] = 1
+    _FilesDict[name][filename] = time.time()
+    if _Debug:
+        lg.out(_DebugLevel, 'tmpfile.make_in_memory %s with %d bytes' % (filename, len(data)))
+    return filename
+
+
+def is_in_memory(filename):
+    """
+    Return True if given temporary file is kept in memory.
+    """
+    return filename in _MemoryFiles
+
+
+def hold(filename):
+    """
+    Register one more user of in-memory file, so it is not erased until the user calls ``release()``.
+    """
+    if filename in _MemoryFiles:
+        _MemoryFilesUsers[filename] = _MemoryFilesUsers.get(filename, 0) + 1
+
+
+def release(name, filename, why='no reason'):
+    """
+    Called by every user of in-memory file when it is not needed anymore,
+    file is erased after the last user released it.
+    """
+    if filename not in _MemoryFiles:
+        return
+    users = _MemoryFilesUsers.get(filename, 1) - 1
+    if users > 0:
+        _MemoryFilesUsers[filename] = users
+        return
+    erase(name, filename, why)
+
+
+def file_exists(filename):
+    return filename in _MemoryFiles or os.path.isfile(filename)
+
+
+def file_size(filename):
+    """
+    Return size of the temporary file, it also can be located in memory.
+    """
+    data = _MemoryFiles.get(filename)
+    if data is not None:
+        return len(data)
+    return os.path.getsize(filename)
+
+
+def open_file(filename):
+    """
+    Opens temporary file for reading in binary mode, it also can be located in memory.
+    """
+    data = _MemoryFiles.get(filename)
+    if data is not None:
+        return BytesIO(data)
+    return open(filename, 'rb')
+
+
+def read_file(filename):
+    """
+    Return whole content of the temporary file, it also can be located in memory.
+    """
+    data = _MemoryFiles.get(filename)
+    if data is not None:
+        return data
+    return bpio.ReadBinaryFile(filename)
+
+
 def erase(name, filename, why='no reason'):
     """
     However you can remove not needed file immediately, this is a good way
@@ -267,6 +455,12 @@ def erase(name, filename, why='no reason'):
     else:
         lg.warn('we do not know sub folder: %s, we tried because %s' % (name, why))
 
+    _MemoryFilesUsers.pop(filename, None)
+    if _MemoryFiles.pop(filename, None) is not None:
+        if _Debug:
+            lg.out(_DebugLevel, 'tmpfile.erase in-memory [%s] : "%s"' % (filename, why))
+        return
+
     if not os.path.exists(filename):
         lg.warn('[%s] not exist' % filename)
         return
@@ -351,14 +545,19 @@ def startup_clean():
         lg.out(_DebugLevel - 4, 'tmpfile.startup_clean in %s' % _TempDirPath)
     if _TempDirPath is None:
         return
-    counter = 0
-    limit_counts = 200
+    folders = []
     for name in os.listdir(_TempDirPath):
         # we want to scan only our folders
         # do not want to be responsible of other files
         if name not in list(_SubDirs.keys()):
             continue
-
+        folders.append((name, subdir(name)))
+    for name in _SharedMemorySubDirs:
+        if shared_subdir(name) and os.path.isdir(shared_subdir(name)):
+            folders.append((name, shared_subdir(name)))
+    counter = 0
+    limit_counts = 200
+    for name, dirpath in folders:
         # for data and parity files we have special rules
         # we do not want to remove Data or Parity here.
         # backup_monitor should take care of this.
@@ -369,8 +568,8 @@ def startup_clean():
             lifetime = _SubDirs.get(name, 0)
             if lifetime == 0:
                 continue
-            for filename in os.listdir(subdir(name)):
-                filepath = os.path.join(subdir(name), filename)
+            for filename in os.listdir(dirpath):
+                filepath = os.path.join(dirpath, filename)
                 if os.path.isfile(filepath):
                     filetime = os.stat(filepath).st_ctime
                     if time.time() - filetime > lifetime:
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# backup_fs_benchmark.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (backup_fs_benchmark.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+
+"""
+..
+
+module:: backup_fs_benchmark
+
+Measures memory footprint of the catalog index and speed of ``backup_fs.Calculate()``.
+
+A synthetic tree of folders and files with a few versions each is created in the index, then:
+
+    1. memory used by all ``backup_fs.FSItemInfo`` objects is compared with same items
+       kept the old way: a regular object with ``__dict__`` and a dictionary of version lists
+    2. ``backup_fs.Calculate()`` is timed on the whole tree and again after a single file was changed
+
+Results are printed as JSON. Run it from the root folder of the project:
+
+    python tests/backup_fs_benchmark.py --files=100000 --output=/tmp/backup_fs_benchmark.json
+
+This module is not collected by the test runner.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+#------------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import json
+import argparse
+import platform
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
+
+#------------------------------------------------------------------------------
+
+from lib import getsizeof
+
+from storage import backup_fs
+
+#------------------------------------------------------------------------------
+
+_Customer = 'benchmark'
+_KeyID = 'master$alice@127.0.0.1_8084'
+
+#------------------------------------------------------------------------------
+
+class LegacyItem(object):
+    """
+    Same fields as ``backup_fs.FSItemInfo`` had before it was made compact.
+    """
+
+    def __init__(self, item):
+        self.unicodename = '%s' % item.unicodename
+        self.path_id = '%s' % item.path_id
+        self.type = item.type
+        self.size = item.size
+        self.key_id = None if item.key_id is None else '%s' % item.key_id
+        self.versions = dict(('%s' % v, list(info)) for v, info in item.versions.items())
+
+
+def process_peak_rss():
+    """
+    Return peak resident set size of the whole process since it was started in bytes, or None if not available.
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # on macOS value is already in bytes
+        return maxrss
+    return maxrss * 1024
+
+
+def _timed(func, *args, **kwargs):
+    started = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - started
+
+
+def build_tree(num_files, files_per_folder=50, versions_per_file=2):
+    """
+    Creates synthetic items in a separate part of the index and returns (iter, iterID, path_ids).
+    """
+    backup_fs._FileSystemIndexByName[_Customer] = {}
+    backup_fs._FileSystemIndexByID[_Customer] = {}
+    iter = backup_fs._FileSystemIndexByName[_Customer]
+    iterID = backup_fs._FileSystemIndexByID[_Customer]
+    path_ids = []
+    backup_fs.SuspendJournal()
+    try:
+        for file_num in range(num_files):
+            folder_num = file_num // files_per_folder
+            path = '/home/user/data/folder%d/sub%d/file%d.txt' % (folder_num // 100, folder_num, file_num)
+            path_id, _, _ = backup_fs.AddFile(path, iter=iter, iterID=iterID, key_id=_KeyID)
+            item = backup_fs.GetByID(path_id, iterID=iterID)
+            item.set_size(1024 + file_num)
+            for v in range(versions_per_file):
+                item.set_version_info('F2020010101%02d%02dAM' % (v // 60, v % 60), 3, 4096)
+            path_ids.append(path_id)
+    finally:
+        backup_fs.ResumeJournal()
+    return iter, iterID, path_ids
+
+
+def measure_memory(iterID):
+    """
+    Returns memory used by all items of the tree: (current, legacy).
+    """
+    items = []
+    backup_fs.TraverseByID(lambda path_id, path, info: items.append(info), iterID=iterID)
+    current = getsizeof.total_size(items, handlers={
+        backup_fs.FSItemInfo: lambda i: (i.unicodename, i.path_id, i.key_id, i._versions, i._totals, ),
+    })
+    legacy = getsizeof.total_size([LegacyItem(i) for i in items], handlers={
+        LegacyItem: lambda i: (i.__dict__, ),
+    })
+    return current, legacy, len(items)
+
+
+def run(num_files=10000, files_per_folder=50, versions_per_file=2):
+    """
+    Runs benchmark and returns a dictionary with all results.
+    """
+    try:
+        (_, iterID, path_ids), seconds_build = _timed(build_tree, num_files, files_per_folder, versions_per_file)
+        current, legacy, num_items = measure_memory(iterID)
+        total_size, seconds_full = _timed(backup_fs.Calculate, iterID)
+        item = backup_fs.GetByID(path_ids[len(path_ids) // 2], iterID=iterID)
+        item.set_size(item.size + 1)
+        total_size_changed, seconds_changed = _timed(backup_fs.Calculate, iterID)
+    finally:
+        backup_fs._FileSystemIndexByName.pop(_Customer, None)
+        backup_fs._FileSystemIndexByID.pop(_Customer, None)
+        backup_fs.ResetChanges()
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'started': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'files': num_files,
+        'items': num_items,
+        'versions_per_file': versions_per_file,
+        'build_seconds': round(seconds_build, 6),
+        'memory_bytes': current,
+        'legacy_memory_bytes': legacy,
+        'memory_ratio': round(float(legacy) / current, 3) if current else None,
+        'calculate_full_seconds': round(seconds_full, 6),
+        'calculate_changed_seconds': round(seconds_changed, 6),
+        'calculate_ok': total_size_changed == total_size + 1,
+        'process_peak_rss': process_peak_rss(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark of memory usage and Calculate() speed of the catalog index')
+    parser.add_argument('--files', type=int, default=100000, help='number of files in the synthetic tree')
+    parser.add_argument('--files-per-folder', type=int, default=50, help='number of files in every folder')
+    parser.add_argument('--versions', type=int, default=2, help='number of versions of every file')
+    parser.add_argument('--output', default='', help='also write JSON results into that file')
+    args = parser.parse_args()
+    result = run(
+        num_files=args.files,
+        files_per_folder=args.files_per_folder,
+        versions_per_file=args.versions,
+    )
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    return 0 if result['calculate_ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
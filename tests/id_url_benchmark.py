@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# id_url_benchmark.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (id_url_benchmark.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+
+"""
+..
+
+module:: id_url_benchmark
+
+Measures speed of ``id_url.field()`` and of comparing / hashing ``id_url.ID_URL_FIELD`` objects.
+
+A synthetic set of users with two identity sources each is placed into the in-memory index, then:
+
+    1. ``id_url.field()`` with interned objects is compared with creating a new ``ID_URL_FIELD`` every time
+    2. equality check and ``in`` operator for a list and a dictionary are compared with the old way:
+       reading and comparing / hashing full public keys
+
+Results are printed as JSON. Run it from the root folder of the project:
+
+    python tests/id_url_benchmark.py --users=1000 --output=/tmp/id_url_benchmark.json
+
+This module is not collected by the test runner.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+#------------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import json
+import argparse
+import platform
+
+#------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
+
+#------------------------------------------------------------------------------
+
+from lib import strng
+
+from userid import id_url
+
+#------------------------------------------------------------------------------
+
+class LegacyField(id_url.ID_URL_FIELD):
+    """
+    Compares and hashes the full public key the same way ``ID_URL_FIELD`` did before digests were cached.
+    """
+
+    def to_digest(self, raise_error=True):
+        return self.to_public_key(raise_error=raise_error)
+
+    def __hash__(self):
+        return self.to_public_key().__hash__()
+
+
+def _timed(func, *args, **kwargs):
+    started = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - started
+
+
+def build_index(num_users):
+    """
+    Populates in-memory index of `id_url` module with synthetic users and returns list of their IDURL's.
+    """
+    idurls = []
+    for user_num in range(num_users):
+        pub_key = 'ssh-rsa %s' % (('%08d' % user_num) * 45)
+        first = strng.to_bin('http://first-%d.com/user%d.xml' % (user_num % 10, user_num))
+        second = strng.to_bin('http://second-%d.net/user%d.xml' % (user_num % 10, user_num))
+        id_url._KnownIDURLs[first] = pub_key
+        id_url._KnownIDURLs[second] = pub_key
+        id_url._MergedIDURLs[pub_key] = {0: first, 1: second, }
+        idurls.append(first)
+        idurls.append(second)
+    return idurls
+
+
+def make_fields(idurls, rounds):
+    for _ in range(rounds):
+        for idurl in idurls:
+            id_url.field(idurl)
+
+
+def make_legacy_fields(idurls, rounds):
+    for _ in range(rounds):
+        for idurl in idurls:
+            LegacyField(idurl)
+
+
+def compare_all(fields, rounds):
+    matched = 0
+    for _ in range(rounds):
+        for i in range(0, len(fields), 2):
+            if fields[i] == fields[i + 1]:
+                matched += 1
+    return matched
+
+
+def search_in(fields, container):
+    found = 0
+    for f in fields:
+        if f in container:
+            found += 1
+    return found
+
+
+def run(num_users=1000, rounds=10, list_size=50):
+    """
+    Runs benchmark and returns a dictionary with all results.
+    """
+    id_url.shutdown()
+    try:
+        idurls = build_index(num_users)
+        _, seconds_field = _timed(make_fields, idurls, rounds)
+        _, seconds_legacy_field = _timed(make_legacy_fields, idurls, rounds)
+        fields = [id_url.field(idurl) for idurl in idurls]
+        legacy_fields = [LegacyField(idurl) for idurl in idurls]
+        matched, seconds_compare = _timed(compare_all, fields, rounds)
+        legacy_matched, seconds_legacy_compare = _timed(compare_all, legacy_fields, rounds)
+        # contacts list is small but searched very often
+        contacts = fields[1:list_size * 2:2]
+        legacy_contacts = legacy_fields[1:list_size * 2:2]
+        found_list, seconds_list = _timed(search_in, fields, contacts)
+        legacy_found_list, seconds_legacy_list = _timed(search_in, legacy_fields, legacy_contacts)
+        found_dict, seconds_dict = _timed(search_in, fields, dict.fromkeys(contacts))
+        legacy_found_dict, seconds_legacy_dict = _timed(search_in, legacy_fields, dict.fromkeys(legacy_contacts))
+    finally:
+        id_url.shutdown()
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'started': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'users': num_users,
+        'rounds': rounds,
+        'list_size': list_size,
+        'field_seconds': round(seconds_field, 6),
+        'legacy_field_seconds': round(seconds_legacy_field, 6),
+        'compare_seconds': round(seconds_compare, 6),
+        'legacy_compare_seconds': round(seconds_legacy_compare, 6),
+        'search_list_seconds': round(seconds_list, 6),
+        'legacy_search_list_seconds': round(seconds_legacy_list, 6),
+        'search_dict_seconds': round(seconds_dict, 6),
+        'legacy_search_dict_seconds': round(seconds_legacy_dict, 6),
+        'results_ok': (
+            matched == legacy_matched == num_users * rounds and
+            found_list == legacy_found_list == found_dict == legacy_found_dict == min(list_size, num_users) * 2
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark of id_url.field() and ID_URL_FIELD comparison speed')
+    parser.add_argument('--users', type=int, default=1000,
+                        help='number of synthetic users with two identity sources each')
+    parser.add_argument('--rounds', type=int, default=10, help='how many times every operation is repeated')
+    parser.add_argument('--list-size', type=int, default=50, help='number of users in the contacts list')
+    parser.add_argument('--output', default='', help='also write JSON results into that file')
+    args = parser.parse_args()
+    result = run(
+        num_users=args.users,
+        rounds=args.rounds,
+        list_size=args.list_size,
+    )
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    return 0 if result['results_ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# raid_benchmark.py
+#
+# Copyright (C) 2008 Veselin Penev, https://bitdust.io
+#
+# This file (raid_benchmark.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+
+"""
+..
+
+module:: raid_benchmark
+
+Measures throughput of the RAID code on synthetic blocks for every known ecc map.
+
+For each ecc map a random block is generated and the following steps are timed:
+
+    1. ``raid.make.do_in_memory()`` splits the block into Data and Parity pieces
+    2. ``raid.read.raidread()`` restores the block while some Data pieces are missing
+    3. ``raid.rebuild.rebuild()`` reconstructs the same missing pieces as a supplier rebuilder does
+
+Results are printed as JSON, every step reports MB/s and current RSS of the process,
+the peak RSS of the whole run is reported once at the end.
+Run it from the root folder of the project:
+
+    python tests/raid_benchmark.py --block-size=8 --missing=1 --output=/tmp/raid_benchmark.json
+
+This module is not collected by the test runner.
+"""
+
+#------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+#------------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import argparse
+import platform
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
+
+#------------------------------------------------------------------------------
+
+from raid import eccmap
+from raid import make
+from raid import read
+from raid import rebuild
+
+#------------------------------------------------------------------------------
+
+_Customer = 'master$alice@127.0.0.1_8084'
+_Version = '1/0/F20200101010101AM'
+
+#------------------------------------------------------------------------------
+
+def process_peak_rss():
+    """
+    Return peak resident set size of the whole process since it was started in bytes, or None if not available.
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # on macOS value is already in bytes
+        return maxrss
+    return maxrss * 1024
+
+
+def current_rss():
+    """
+    Return current resident set size of the process in bytes, only available on Linux.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+    except:
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def _timed(func, *args, **kwargs):
+    started = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - started
+
+
+def _step_report(nbytes, seconds, ok):
+    return {
+        'ok': bool(ok),
+        'seconds': round(seconds, 6),
+        'mb_per_sec': round(nbytes / (1024.0 * 1024.0) / seconds, 3) if seconds > 0 else None,
+        'rss': current_rss(),
+    }
+
+
+def _remove_data_pieces(block_dir, block_number, missing):
+    for supplier_number in missing:
+        os.remove(os.path.join(block_dir, '%d-%d-Data' % (block_number, supplier_number)))
+
+
+def bench_eccmap(ecc_map_name, block_size, num_missing, work_dir, block_number=0):
+    """
+    Runs all steps for one ecc map and returns a dictionary with results.
+    """
+    myeccmap = eccmap.eccmap(ecc_map_name)
+    suppliers = myeccmap.datasegments
+    missing = list(range(min(num_missing, suppliers)))
+    backups_dir = os.path.join(work_dir, 'backups')
+    block_dir = os.path.join(backups_dir, _Customer, _Version)
+    os.makedirs(block_dir)
+    source_path = os.path.join(work_dir, 'source')
+    with open(source_path, 'wb') as f:
+        f.write(os.urandom(block_size))
+    report = {
+        'ecc_map': ecc_map_name,
+        'suppliers': suppliers,
+        'block_size': block_size,
+        'missing': len(missing),
+    }
+
+    # 1. make
+    (data_num, parity_num), seconds = _timed(make.do_in_memory, source_path, ecc_map_name, _Version, block_number, block_dir)
+    report['make'] = _step_report(block_size, seconds, data_num == suppliers and parity_num == suppliers)
+    with open(source_path, 'rb') as f:
+        # the source file was padded by raid.make
+        source_data = f.read()
+
+    # 2. read with some Data pieces missing
+    _remove_data_pieces(block_dir, block_number, missing)
+    restored_path = os.path.join(work_dir, 'restored')
+    good_segments, seconds = _timed(read.raidread, restored_path, ecc_map_name, _Version, block_number, os.path.join(backups_dir, _Customer))
+    ok = False
+    if good_segments == suppliers:
+        with open(restored_path, 'rb') as f:
+            ok = (f.read() == source_data)
+    report['read'] = _step_report(block_size, seconds, ok)
+
+    # 3. rebuild same pieces again, like the supplier rebuilder does
+    _remove_data_pieces(block_dir, block_number, missing)
+    local_data = [0 if i in missing else 1 for i in range(suppliers)]
+    local_parity = [1, ] * suppliers
+    remote_data = [-1 if i in missing else 1 for i in range(suppliers)]
+    remote_parity = [1, ] * suppliers
+    result, seconds = _timed(
+        rebuild.rebuild,
+        backupID='%s:%s' % (_Customer.replace('master$', ''), _Version),
+        blockNum=block_number,
+        eccMap=ecc_map_name,
+        availableSuppliers=[1, ] * suppliers,
+        remoteMatrix={'D': remote_data, 'P': remote_parity, },
+        localMatrix={'D': local_data, 'P': local_parity, },
+        localBackupsDir=backups_dir,
+    )
+    ok = bool(result) and all(result[1])
+    report['rebuild'] = _step_report(block_size, seconds, ok)
+    shutil.rmtree(block_dir, ignore_errors=True)
+    return report
+
+
+def run(ecc_map_names=None, block_size=8 * 1024 * 1024, num_missing=1, repeat=1):
+    """
+    Runs benchmark for given ecc maps (all known by default) and returns a dictionary with all results.
+    """
+    if not ecc_map_names:
+        ecc_map_names = eccmap.EccMapNames()
+    results = []
+    work_dir = tempfile.mkdtemp(prefix='raid_benchmark_')
+    try:
+        for ecc_map_name in ecc_map_names:
+            for attempt in range(repeat):
+                attempt_dir = os.path.join(work_dir, '%s_%d' % (ecc_map_name.replace('/', '_'), attempt))
+                os.makedirs(attempt_dir)
+                report = bench_eccmap(ecc_map_name, block_size, num_missing, attempt_dir)
+                report['attempt'] = attempt
+                results.append(report)
+                shutil.rmtree(attempt_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'started': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'block_size': block_size,
+        'missing': num_missing,
+        'repeat': repeat,
+        'results': results,
+        'process_peak_rss': process_peak_rss(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark of raid make/read/rebuild for all ecc maps')
+    parser.add_argument('--block-size', type=float, default=8, help='size of the synthetic block in megabytes')
+    parser.add_argument('--missing', type=int, default=1, help='number of Data pieces to be removed before read and rebuild')
+    parser.add_argument('--repeat', type=int, default=1, help='how many times to run every ecc map')
+    parser.add_argument('--ecc-maps', default='', help='comma separated list of ecc maps, all known ecc maps by default')
+    parser.add_argument('--output', default='', help='also write JSON results into that file')
+    args = parser.parse_args()
+    ecc_map_names = [e.strip() for e in args.ecc_maps.split(',') if e.strip()]
+    result = run(
+        ecc_map_names=ecc_map_names,
+        block_size=int(args.block_size * 1024 * 1024),
+        num_missing=args.missing,
+        repeat=args.repeat,
+    )
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    failed = [r['ecc_map'] for r in result['results'] if not (r['make']['ok'] and r['read']['ok'] and r['rebuild']['ok'])]
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
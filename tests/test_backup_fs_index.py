@@ -0,0 +1,67 @@
+from unittest import TestCase
+
+from storage import backup_fs
+
+from tests import backup_fs_benchmark
+
+
+class TestBackupFSIndex(TestCase):
+
+    def setUp(self):
+        backup_fs._FileSystemIndexByName.clear()
+        backup_fs._FileSystemIndexByID.clear()
+        backup_fs._FileSystemIndexByName['alice'] = {}
+        backup_fs._FileSystemIndexByID['alice'] = {}
+        backup_fs.ResetChanges()
+
+    def tearDown(self):
+        backup_fs._FileSystemIndexByName.clear()
+        backup_fs._FileSystemIndexByID.clear()
+        backup_fs.ResetChanges()
+
+    def test_versions(self):
+        item = backup_fs.FSItemInfo(name='a.txt', path_id='0/1', typ=backup_fs.FILE)
+        self.assertFalse(item.any_version())
+        self.assertEqual(item.versions, {})
+        item.add_version('F20200101000000AM')
+        item.set_version_info('F20200102000000AM', 5, 1000)
+        item.set_version_info('F20200101000000AM', 2, 300)
+        self.assertEqual(item.get_version_info('F20200101000000AM'), (2, 300, ))
+        self.assertEqual(item.get_version_info('F20200103000000AM'), (-1, -1, ))
+        self.assertEqual(item.list_versions(sorted=True), ['F20200101000000AM', 'F20200102000000AM', ])
+        self.assertEqual(item.versions, {'F20200101000000AM': (2, 300, ), 'F20200102000000AM': (5, 1000, ), })
+        item.delete_version('F20200102000000AM')
+        self.assertFalse(item.has_version('F20200102000000AM'))
+        self.assertEqual(item.pack_versions(), 'F20200101000000AM:2:300')
+        copy = backup_fs.FSItemInfo()
+        copy.unserialize(item.serialize())
+        self.assertEqual(copy.serialize(), item.serialize())
+        item.delete_version('F20200101000000AM')
+        self.assertIsNone(item._versions)
+        with self.assertRaises(AttributeError):
+            item.some_field = 1
+
+    def test_calculate_incremental(self):
+        iter = backup_fs._FileSystemIndexByName['alice']
+        iterID = backup_fs._FileSystemIndexByID['alice']
+        path_id1, _, _ = backup_fs.AddFile('/a/b/c.txt', iter=iter, iterID=iterID)
+        path_id2, _, _ = backup_fs.AddFile('/a/d.txt', iter=iter, iterID=iterID)
+        backup_fs.AddFile('/e.txt', iter=iter, iterID=iterID)
+        backup_fs.GetByID(path_id1, iterID=iterID).set_size(100)
+        backup_fs.GetByID(path_id2, iterID=iterID).set_size(20)
+        self.assertEqual(backup_fs.Calculate(iterID), 120)
+        self.assertEqual(backup_fs.numberfiles(), 3)
+        backup_fs.GetByID(path_id1, iterID=iterID).set_size(200)
+        backup_fs.GetByID(path_id2, iterID=iterID).set_version_info('F20200101000000AM', 1, 500)
+        self.assertEqual(backup_fs.Calculate(iterID), 220)
+        self.assertEqual(backup_fs.sizebackups(), 500)
+        self.assertEqual(backup_fs.GetByID(path_id1.rpartition('/')[0], iterID=iterID).size, 200)
+        backup_fs.DeleteByID(path_id1, iter=iter, iterID=iterID)
+        self.assertEqual(backup_fs.Calculate(iterID), 20)
+        self.assertEqual(backup_fs.numberfiles(), 2)
+        self.assertEqual(backup_fs.GetByID(path_id1.rpartition('/')[0], iterID=iterID).size, 0)
+
+    def test_benchmark(self):
+        result = backup_fs_benchmark.run(num_files=2000)
+        self.assertTrue(result['calculate_ok'])
+        self.assertGreater(result['legacy_memory_bytes'], result['memory_bytes'])
@@ -0,0 +1,96 @@
+from unittest import TestCase
+
+from storage import backup_fs
+
+
+class TestBackupFSJournal(TestCase):
+
+    def setUp(self):
+        backup_fs._FileSystemIndexByName.clear()
+        backup_fs._FileSystemIndexByID.clear()
+        backup_fs._FileSystemIndexByName['alice'] = {}
+        backup_fs._FileSystemIndexByID['alice'] = {}
+        backup_fs._FileSystemIndexByName['bob'] = {}
+        backup_fs._FileSystemIndexByID['bob'] = {}
+        backup_fs.ResetChanges()
+
+    def tearDown(self):
+        backup_fs._FileSystemIndexByName.clear()
+        backup_fs._FileSystemIndexByID.clear()
+        backup_fs.ResetChanges()
+
+    def _replay(self, changes):
+        backup_fs.SuspendJournal()
+        try:
+            for _, record in changes:
+                self.assertTrue(backup_fs.ApplyChange(
+                    record,
+                    iter=backup_fs._FileSystemIndexByName['bob'],
+                    iterID=backup_fs._FileSystemIndexByID['bob'],
+                ))
+        finally:
+            backup_fs.ResumeJournal()
+
+    def _compare(self):
+        src = backup_fs.Serialize(iterID=backup_fs._FileSystemIndexByID['alice'], to_json=True)
+        dst = backup_fs.Serialize(iterID=backup_fs._FileSystemIndexByID['bob'], to_json=True)
+        self.assertEqual(src, dst)
+
+    def test_replay_changes(self):
+        iter = backup_fs._FileSystemIndexByName['alice']
+        iterID = backup_fs._FileSystemIndexByID['alice']
+        path_id1, _, _ = backup_fs.AddFile('/a/b/c.txt', iter=iter, iterID=iterID)
+        path_id2, _, _ = backup_fs.AddFile('/a/d.txt', iter=iter, iterID=iterID)
+        self.assertTrue(backup_fs.HasChanges())
+        changes = backup_fs.PopChanges()
+        self.assertFalse(backup_fs.HasChanges())
+        self.assertEqual(len(changes), 4)
+        self._replay(changes)
+        self._compare()
+        backup_fs.GetByID(path_id1, iterID=iterID).add_version('F20200101000000AM')
+        backup_fs.GetByID(path_id1, iterID=iterID).set_version_info('F20200101000000AM', 3, 12345)
+        backup_fs.DeleteByID(path_id2, iter=iter, iterID=iterID)
+        changes = backup_fs.PopChanges()
+        self.assertEqual([r['o'] for _, r in changes], ['del', 'put', ])
+        self._replay(changes)
+        self._compare()
+        self.assertEqual(backup_fs.PopChanges(), [])
+
+    def test_not_root_delete_breaks_journal(self):
+        iter = backup_fs._FileSystemIndexByName['alice']
+        iterID = backup_fs._FileSystemIndexByID['alice']
+        path_id, sub_iter, sub_iterID = backup_fs.AddFile('/a/b.txt', iter=iter, iterID=iterID)
+        backup_fs.PopChanges()
+        backup_fs.DeleteByID(path_id.split('/')[-1], iter=sub_iter, iterID=sub_iterID)
+        self.assertTrue(backup_fs.HasChanges())
+        self.assertIsNone(backup_fs.PopChanges())
+        self.assertFalse(backup_fs.HasChanges())
+
+    def test_size_change_is_journaled(self):
+        iter = backup_fs._FileSystemIndexByName['alice']
+        iterID = backup_fs._FileSystemIndexByID['alice']
+        path_id, _, _ = backup_fs.AddFile('/a/b.txt', iter=iter, iterID=iterID)
+        self._replay(backup_fs.PopChanges())
+        backup_fs.GetByID(path_id, iterID=iterID).set_size(12345)
+        self.assertTrue(backup_fs.HasChanges())
+        changes = backup_fs.PopChanges()
+        self.assertEqual([r['o'] for _, r in changes], ['put', ])
+        self._replay(changes)
+        self._compare()
+        self.assertEqual(backup_fs.GetByID(path_id, iterID=backup_fs._FileSystemIndexByID['bob']).size, 12345)
+
+    def test_read_journal_stops_at_skipped_record(self):
+        from main import settings
+        from system import bpio
+        from storage import backup_control
+        settings.init(base_dir='/tmp/.bitdust_tmp')
+        self.addCleanup(bpio.rmdir_recursive, '/tmp/.bitdust_tmp', ignore_errors=True)
+        self.addCleanup(settings.shutdown)
+        records = [
+            {'r': 5, },
+            {'r': 6, 'o': 'del', 'i': '0', 'c': 'carol@unknown.host.net', },
+            {'r': 7, },
+        ]
+        self.assertEqual(backup_control.ReadIndexJournal(records, known_revision=4), 5)
+        self.assertEqual(backup_control.ReadIndexJournal(records[:1] + records[2:], known_revision=4), 7)
+        self.assertEqual(backup_control.ReadIndexJournal(records, known_revision=6), 7)
@@ -0,0 +1,72 @@
+from unittest import TestCase
+
+from lib import getsizeof
+
+from storage import blocks_matrix
+
+
+class TestBlocksMatrix(TestCase):
+
+    def test_dict_compatibility(self):
+        m = blocks_matrix.BlocksMatrix(4)
+        self.assertNotIn(0, m)
+        m[2] = {'D': [1, 0, -1, 1], 'P': [1, 1, 1, 1], }
+        self.assertEqual(m.keys(), [2, ])
+        self.assertEqual(len(m), 1)
+        self.assertEqual(m[2]['D'], [1, 0, -1, 1])
+        self.assertIn(-1, m[2]['D'])
+        self.assertNotIn(0, m[2]['P'])
+        m.set('P', 5, 3, -1)
+        self.assertEqual(m.keys(), [2, 5, ])
+        self.assertEqual(m[5].todict(), {'D': [0, 0, 0, 0], 'P': [0, 0, 0, -1], })
+        m[2]['D'][1] = 1
+        self.assertEqual(list(m[2]['D']), [1, 1, -1, 1])
+        del m[2]
+        self.assertEqual(m.keys(), [5, ])
+        self.assertEqual(m.get('D', 2, 0), 0)
+        with self.assertRaises(KeyError):
+            m[2]
+
+    def test_widen(self):
+        m = blocks_matrix.BlocksMatrix(2)
+        m[0] = {'D': [1, 1], 'P': [-1, 1], }
+        m[1] = {'D': [1, 0], 'P': [1, 1], }
+        m.set('D', 1, 3, 1)
+        self.assertEqual(m.width, 4)
+        self.assertEqual(m[0].todict(), {'D': [1, 1, 0, 0], 'P': [-1, 1, 0, 0], })
+        self.assertEqual(m[1].todict(), {'D': [1, 0, 0, 1], 'P': [1, 1, 0, 0], })
+
+    def test_scans(self):
+        m = blocks_matrix.BlocksMatrix(3)
+        m.set_column('D', 0, blocks_matrix.EXIST * 10)
+        m.set_column('P', 0, blocks_matrix.EXIST * 10)
+        m.set_column('D', 1, blocks_matrix.EXIST * 10)
+        m.set_column('P', 1, blocks_matrix.EXIST * 10)
+        m.set_column('D', 2, blocks_matrix.EXIST * 10)
+        m.set_column('P', 2, blocks_matrix.EXIST * 10)
+        m.set('D', 4, 1, -1)
+        m.set('P', 4, 2, 0)
+        m.set('P', 7, 2, -1)
+        self.assertEqual(m.count('D', 1), 9)
+        self.assertEqual(m.count('D', 1, value=-1), 1)
+        self.assertEqual(list(m.blocks_where('P', 2, 1, negate=True)), [4, 7, ])
+        self.assertEqual(dict(m.incomplete_blocks([0, 1, 2, ], 10)), {4: 2, 7: 1, })
+        self.assertEqual(dict(m.incomplete_blocks([0, 1, 2, ], 12)), {4: 2, 7: 1, 10: 3, 11: 3, })
+        self.assertEqual(m.complete_blocks(10), [0, 1, 2, 3, 5, 6, 8, 9, ])
+        self.assertEqual(m.unknown_blocks(12), [10, 11, ])
+        self.assertEqual(m.clear_column(1), 19)
+        self.assertEqual(m.count('D', 1), 0)
+        self.assertEqual(m[4]['D'], [1, 0, 1])
+
+    def test_memory_usage(self):
+        suppliers = 4
+        blocks = 10000
+        old_style = {}
+        for block_num in range(blocks):
+            old_style[block_num] = {'D': [1, ] * suppliers, 'P': [1, ] * suppliers, }
+        m = blocks_matrix.BlocksMatrix(suppliers)
+        for supplier_num in range(suppliers):
+            m.set_column('D', supplier_num, blocks_matrix.EXIST * blocks)
+            m.set_column('P', supplier_num, blocks_matrix.EXIST * blocks)
+        self.assertEqual(m.todict(), old_style)
+        self.assertGreater(getsizeof.total_size(old_style), 10 * getsizeof.total_size(m))
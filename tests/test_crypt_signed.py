@@ -142,6 +142,7 @@ class Test(TestCase):
         identitycache.UpdateAfterChecking(idurl=self.bob_ident.getIDURL(), xml_src=_another_identity_xml)
 
     def tearDown(self):
+        signed._ContactsBinaryFormats.clear()
         key.ForgetMyKey()
         my_id.forgetLocalIdentity()
         settings.shutdown()
@@ -166,3 +167,117 @@ class Test(TestCase):
             raw1 = p1.Serialize()
             p2 = signed.Unserialize(raw1)
             self.assertTrue(p2.Valid())
+
+    def test_signed_packet_binary(self):
+        key.InitMyKey()
+        payload_size = 1024
+        data1 = os.urandom(payload_size)
+        p1 = signed.Packet(
+            'Data',
+            my_id.getLocalID(),
+            my_id.getLocalID(),
+            'SomeID',
+            data1,
+            self.bob_ident.getIDURL(),
+        )
+        raw_json = p1.Serialize()
+        raw_binary = p1.Serialize(binary=True)
+        self.assertFalse(signed.IsBinary(raw_json))
+        self.assertTrue(signed.IsBinary(raw_binary))
+        self.assertTrue(len(raw_binary) < len(raw_json))
+        self.assertTrue(len(raw_binary) < payload_size + 1024)
+        p2 = signed.Unserialize(raw_binary)
+        self.assertTrue(p2.Valid())
+        self.assertEqual(p2.Payload, data1)
+        self.assertEqual(p2.Serialize(), raw_json)
+        self.assertIsNone(signed.Unserialize(raw_binary[:-10]))
+
+    def test_binary_format_negotiation(self):
+        key.InitMyKey()
+        p1 = signed.Packet(
+            'Data',
+            my_id.getLocalID(),
+            my_id.getLocalID(),
+            'SomeID',
+            b'abc',
+            self.bob_ident.getIDURL(),
+        )
+        self.assertFalse(signed.IsBinaryFormatSupported(my_id.getLocalID()))
+        p2 = signed.Unserialize(p1.Serialize())
+        self.assertEqual(p2.BinaryFormat, 0)
+        signed.RegisterBinaryFormat(p2.CreatorID, p2.SupportedBinaryFormat)
+        self.assertTrue(signed.IsBinaryFormatSupported(my_id.getLocalID()))
+        signed.RegisterBinaryFormat(p2.CreatorID, 0)
+        self.assertFalse(signed.IsBinaryFormatSupported(my_id.getLocalID()))
+
+    def test_legacy_hash_base(self):
+        key.InitMyKey()
+        p1 = signed.Packet(
+            'Data',
+            my_id.getLocalID(),
+            my_id.getLocalID(),
+            'SomeID',
+            b'abc',
+            self.bob_ident.getIDURL(),
+            Date='2020/01/01 01:00:00 AM',
+        )
+        # remote peer did not tell us yet that he supports binary format, so packet is signed as before
+        self.assertEqual(p1.BinaryFormat, 0)
+        self.assertEqual(p1.GenerateHashBase(), b'-'.join([
+            b'Data',
+            my_id.getLocalID().original(),
+            my_id.getLocalID().original(),
+            b'SomeID',
+            b'2020/01/01 01:00:00 AM',
+            b'abc',
+            self.bob_ident.getIDURL().original(),
+            my_id.getGlobalID(key_alias='master').encode(),
+        ]))
+        raw_json = p1.Serialize()
+        self.assertNotIn(b'"b"', raw_json)
+        self.assertIn(b'"a"', raw_json)
+        p2 = signed.Unserialize(raw_json)
+        self.assertTrue(p2.Valid())
+        self.assertEqual(p2.SupportedBinaryFormat, 1)
+
+    def test_binary_format_is_signed(self):
+        key.InitMyKey()
+        signed.RegisterBinaryFormat(self.bob_ident.getIDURL(), 1)
+        p1 = signed.Packet(
+            'Data',
+            my_id.getLocalID(),
+            my_id.getLocalID(),
+            'SomeID',
+            b'abc',
+            self.bob_ident.getIDURL(),
+            Date='2020/01/01 01:00:00 AM',
+        )
+        self.assertEqual(p1.BinaryFormat, 1)
+        p2 = signed.Unserialize(p1.Serialize(binary=True))
+        self.assertEqual(p2.BinaryFormat, 1)
+        self.assertTrue(p2.Valid())
+        # somebody changed the format version of a packet on the way
+        p2.BinaryFormat = 0
+        self.assertFalse(p2.Valid())
+        p3 = signed.Unserialize(p2.Serialize())
+        self.assertEqual(p3.BinaryFormat, 0)
+        self.assertFalse(p3.Valid())
+        # packets created by older nodes do not carry the format version and are hashed as before
+        p4 = signed.Packet(
+            'Data',
+            my_id.getLocalID(),
+            my_id.getLocalID(),
+            'SomeID',
+            b'abc',
+            self.bob_ident.getIDURL(),
+            Date='2020/01/01 01:00:00 AM',
+            BinaryFormat=0,
+            SupportedBinaryFormat=0,
+        )
+        self.assertNotIn(b'"b"', p4.Serialize())
+        self.assertNotIn(b'"a"', p4.Serialize())
+        self.assertEqual(p4.GenerateHashBase() + b'-1', p1.GenerateHashBase())
+        p5 = signed.Unserialize(p4.Serialize(binary=True))
+        self.assertEqual(p5.BinaryFormat, 0)
+        self.assertTrue(p5.Valid())
+
@@ -0,0 +1,55 @@
+from unittest import TestCase
+
+from twisted.internet import task
+
+from lib import deadlines
+
+
+class _Item(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class TestDeadlineScheduler(TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.fired = []
+        self.scheduler = deadlines.DeadlineScheduler(callback=self.fired.append, clock=self.clock)
+
+    def test_fires_only_expired(self):
+        items = [_Item(i) for i in range(1000)]
+        for i, item in enumerate(items):
+            self.scheduler.register(item, 10 + i * 0.1)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(10.25)
+        self.assertEqual([i.name for i in self.fired], [0, 1, 2, ])
+        self.assertEqual(len(self.scheduler), 997)
+        self.clock.advance(100)
+        self.assertEqual(len(self.fired), 1000)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 0)
+
+    def test_unregister_and_replace(self):
+        a, b, c = _Item('a'), _Item('b'), _Item('c')
+        self.scheduler.register(a, 1)
+        self.scheduler.register(b, 2)
+        self.scheduler.register(c, 3)
+        self.assertTrue(self.scheduler.unregister(a))
+        self.assertFalse(self.scheduler.unregister(a))
+        self.scheduler.register(b, 5)
+        self.clock.advance(3)
+        self.assertEqual(self.fired, [c, ])
+        self.clock.advance(2)
+        self.assertEqual(self.fired, [c, b, ])
+        self.assertEqual(len(self.clock.getDelayedCalls()), 0)
+
+    def test_earlier_deadline_reschedules(self):
+        a, b = _Item('a'), _Item('b')
+        self.scheduler.register(a, 10)
+        self.scheduler.register(b, 0.5)
+        self.clock.advance(0.5)
+        self.assertEqual(self.fired, [b, ])
+        self.scheduler.stop()
+        self.clock.advance(20)
+        self.assertEqual(self.fired, [b, ])
@@ -0,0 +1,74 @@
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+
+from unittest import TestCase
+
+from dht.entangled.kademlia import datastore
+
+
+class TestSQLiteVersionedJsonDataStore(TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='dht_datastore_')
+        self.db_file = os.path.join(self.work_dir, 'db_0')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_set_item(self):
+        store = datastore.SQLiteVersionedJsonDataStore(dbFile=self.db_file)
+        store.setItem('abc', {'a': 1}, 100, 90, 'node1', expireSeconds=60)
+        self.assertIn('abc', store)
+        self.assertNotIn('abcd', store)
+        self.assertEqual(store.revision('abc'), 1)
+        store.setItem('abc', {'a': 2}, 200, 90, 'node1', expireSeconds=60)
+        store.setItem('abc', {'a': 3}, 300, 90, 'node1', expireSeconds=60)
+        self.assertEqual(store.getItem('abc'), {
+            'key': 'abc',
+            'value': {'a': 3},
+            'lastPublished': 300,
+            'originallyPublished': 90,
+            'originalPublisherID': 'node1',
+            'expireSeconds': 60,
+            'revision': 3,
+        })
+        store.setItem('abc', {'a': 4}, 400, 90, None, revision=10)
+        self.assertEqual(store.revision('abc'), 10)
+        self.assertEqual(store['abc'], {'a': 4})
+        self.assertIsNone(store.originalPublisherID('abc'))
+        self.assertEqual(store.keys(), ['abc', ])
+        del store['abc']
+        self.assertIsNone(store.getItem('abc'))
+
+    def test_iter_items(self):
+        store = datastore.SQLiteVersionedJsonDataStore()
+        store.setItem('k1', 'v1', 100, 10, 'node1')
+        store.setItem('k2', 'v2', 500, 20, 'node1')
+        store.setItem('k3', 'v3', 600, 600, 'node1')
+        self.assertEqual(sorted(i['key'] for i in store.iterItems()), ['k1', 'k2', 'k3', ])
+        self.assertEqual(sorted(i['key'] for i in store.iterItems(originallyPublishedBefore=15, lastPublishedBefore=550)), ['k1', 'k2', ])
+        self.assertEqual([i['value'] for i in store.iterItems(lastPublishedBefore=100)], ['v1', ])
+        self.assertEqual(sorted(i['value'] for i in store.getAllItems()), ['v1', 'v2', 'v3', ])
+
+    def test_migrate_old_table(self):
+        db = sqlite3.connect(self.db_file)
+        db.execute('CREATE TABLE data(key, value, lastPublished, originallyPublished, originalPublisherID, expireSeconds, revision)')
+        for revision, key in ((1, 'k1'), (1, 'k2'), (2, 'k1'), ):
+            db.execute('INSERT INTO data VALUES (?, ?, ?, ?, ?, ?, ?)', (
+                key, json.dumps({'k': key, 'd': 'value%d' % revision, 'v': 1}), 100, 100, 'node1', 60, revision, ))
+        db.commit()
+        db.close()
+        store = datastore.SQLiteVersionedJsonDataStore(dbFile=self.db_file)
+        self.assertEqual(sorted(store.keys()), ['k1', 'k2', ])
+        self.assertEqual(store.getItem('k1')['value'], 'value2')
+        self.assertEqual(store.revision('k1'), 2)
+        store.setItem('k1', 'value3', 200, 100, 'node1')
+        self.assertEqual(store.revision('k1'), 3)
+        plan = store._db.execute('EXPLAIN QUERY PLAN SELECT value FROM data WHERE key=?', ('k1', )).fetchall()
+        self.assertIn('USING INDEX', ' '.join(str(r) for r in plan))
+        store._db.close()
+        store = datastore.SQLiteVersionedJsonDataStore(dbFile=self.db_file)
+        self.assertEqual(store.revision('k1'), 3)
@@ -0,0 +1,106 @@
+import os
+from unittest import TestCase
+
+from main import settings
+
+from system import bpio
+
+from logs import lg
+
+from supplier import list_files
+from supplier import files_manifest
+
+
+_Customer = 'alice@127.0.0.1_8084'
+
+
+class TestFilesManifest(TestCase):
+
+    def setUp(self):
+        try:
+            bpio.rmdir_recursive('/tmp/.bitdust_tmp')
+        except Exception:
+            pass
+        lg.set_debug_level(30)
+        settings.init(base_dir='/tmp/.bitdust_tmp')
+        self.key_alias_dir = os.path.join(settings.getCustomersFilesDir(), _Customer, 'master')
+        os.makedirs(self.key_alias_dir)
+
+    def tearDown(self):
+        files_manifest._Manifests.clear()
+        settings.shutdown()
+        bpio.rmdir_recursive('/tmp/.bitdust_tmp', ignore_errors=True)
+
+    def _write(self, subpath, size):
+        filename = os.path.join(self.key_alias_dir, *subpath.split('/'))
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'wb') as f:
+            f.write(b'x' * size)
+        files_manifest.on_file_written(filename, size)
+        return filename
+
+    def _check_same_as_disk(self):
+        from_disk = list_files.TreeSummary(self.key_alias_dir, key_alias='master')
+        from_manifest = files_manifest.tree_summary(_Customer, 'master', key_alias='master')
+        self.assertEqual(sorted(from_disk.splitlines()), sorted(from_manifest.splitlines()))
+        return from_manifest
+
+    def test_incremental_updates(self):
+        files_manifest.rebuild(_Customer)
+        self._write('.index', 100)
+        self._write('0/1/F20200101010101AM/0-0-Data', 10)
+        self._write('0/1/F20200101010101AM/0-0-Parity', 11)
+        self._write('0/1/F20200101010101AM/2-0-Data', 12)
+        self._write('0/1/F20200101010101AM/1-1-Parity', 13)
+        self._write('0/1/F20200101010101AM/readme', 5)
+        self._write('0/1/F20200101010101AM/sub/deep/0-0-Data', 5)
+        self._write('0/2/F20200101010101PM/0-0-Data', 20)
+        result = self._check_same_as_disk()
+        self.assertIn('V0/1/F20200101010101AM 0 0-2 33 missing Data:1 Parity:1,2', result)
+        self.assertIn('F0/1 -1', result)
+        self.assertIn('D0/1/F20200101010101AM/sub', result)
+        self.assertNotIn('deep', result)
+        os.remove(os.path.join(self.key_alias_dir, '0', '1', 'F20200101010101AM', '2-0-Data'))
+        files_manifest.on_path_removed(os.path.join(self.key_alias_dir, '0', '1', 'F20200101010101AM', '2-0-Data'))
+        result = self._check_same_as_disk()
+        self.assertIn('V0/1/F20200101010101AM 0 0-1 21 missing Data:1 Parity:1', result)
+        bpio._dir_remove(os.path.join(self.key_alias_dir, '0', '2'))
+        files_manifest.on_path_removed(os.path.join(self.key_alias_dir, '0', '2'), is_dir=True)
+        self._check_same_as_disk()
+
+    def test_save_and_load(self):
+        self._write('0/F20200101010101AM/0-3-Data', 7)
+        self._write('0/F20200101010101AM/1-3-Parity', 8)
+        before = files_manifest.tree_summary(_Customer, 'master', key_alias='master')
+        files_manifest.shutdown()
+        self.assertTrue(os.path.isfile(files_manifest.manifest_filepath(_Customer)))
+        self.assertFalse(files_manifest.is_loaded(_Customer))
+        after = files_manifest.tree_summary(_Customer, 'master', key_alias='master')
+        self.assertEqual(before, after)
+        self.assertFalse(os.path.isfile(files_manifest.manifest_filepath(_Customer)))
+        self._check_same_as_disk()
+
+    def test_changes_since_revision(self):
+        self._write('0/F20200101010101AM/0-3-Data', 7)
+        m = files_manifest.manifest(_Customer)
+        epoch, revision, changes = files_manifest.changes_summary(_Customer, m.epoch, m.revision)
+        self.assertEqual(changes, '')
+        self._write('0/F20200101010101AM/0-3-Parity', 8)
+        self._write('1/F20200101010101PM/0-3-Data', 9)
+        epoch, new_revision, changes = files_manifest.changes_summary(_Customer, m.epoch, revision)
+        self.assertGreater(new_revision, revision)
+        self.assertEqual(changes.splitlines(), [
+            'Kmaster',
+            'X0/F20200101010101AM',
+            'V0/F20200101010101AM 3 0-0 15',
+            'F1 -1',
+            'X1/F20200101010101PM',
+            'V1/F20200101010101PM 3 0-0 9 missing Parity:0',
+        ])
+        bpio._dir_remove(os.path.join(self.key_alias_dir, '1'))
+        files_manifest.on_path_removed(os.path.join(self.key_alias_dir, '1'), is_dir=True)
+        _, _, changes = files_manifest.changes_summary(_Customer, m.epoch, new_revision)
+        self.assertEqual(changes.splitlines(), ['Kmaster', 'X1', ])
+        _, _, changes = files_manifest.changes_summary(_Customer, 'another_epoch', new_revision)
+        self.assertIsNone(changes)
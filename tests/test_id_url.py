@@ -15,7 +15,6 @@ from lib import strng
 from userid import id_url
 from userid import identity
 
-
 alice_bin = b'http://127.0.0.1:8084/alice.xml'
 alice_text = 'http://127.0.0.1:8084/alice.xml'
 bob = 'http://127.0.0.1/bob.xml'
@@ -522,6 +521,68 @@ class TestIDURL(TestCase):
         self.assertEqual(id_url.field(hans2).original(), strng.to_bin(hans2))
         self.assertEqual(id_url.field(hans3).original(), strng.to_bin(hans3))
 
+    def test_interned_fields(self):
+        self.assertIsNot(id_url.field(alice_bin), id_url.field(alice_bin))
+        self._cache_identity('alice')
+        self.assertIs(id_url.field(alice_bin), id_url.field(alice_text))
+        self.assertIsNot(id_url.field(alice_bin), id_url.ID_URL_FIELD(alice_bin))
+        self._cache_identity('hans1')
+        hans_field = id_url.field(hans1)
+        self.assertIs(id_url.field(hans1), hans_field)
+        self.assertEqual(hans_field.to_text(), hans1)
+        digest = hans_field.to_digest()
+        self.assertEqual(len(digest), 8)
+        self._cache_identity('hans2')
+        self.assertIsNot(id_url.field(hans1), hans_field)
+        self.assertEqual(id_url.field(hans1).to_text(), hans2)
+        self.assertEqual(id_url.field(hans1).to_digest(), digest)
+        self.assertEqual(id_url.field(hans1), hans_field)
+        self.assertEqual(hash(id_url.field(hans2)), hash(hans_field))
+        self.assertIn(id_url.field(hans2), [id_url.field(alice_bin), hans_field, ])
+        self.assertIn(id_url.field(hans2), {hans_field: None})
+        self.assertNotEqual(id_url.field(alice_bin), hans_field)
+        self.assertNotIn(id_url.field(alice_bin), {hans_field: None})
+        self.assertEqual(id_url.field('').to_digest(), b'')
+
+    def test_snapshot(self):
+        self._cache_identity('alice')
+        self._cache_identity('hans1')
+        self._cache_identity('hans2')
+        self.assertTrue(id_url._SnapshotSaveTask.active())
+        history_dir = id_url._IdentityHistoryDir
+        snapshot_file = id_url._IdentityHistorySnapshotFile
+        known = (dict(id_url._KnownUsers), dict(id_url._KnownIDURLs), {k: dict(v) for k, v in id_url._MergedIDURLs.items()}, )
+        id_url.shutdown()
+        self.assertTrue(os.path.isfile(snapshot_file))
+        scan_history = id_url.scan_history
+        scanned = []
+        id_url.scan_history = lambda: scanned.append(1) or scan_history()
+        try:
+            id_url._IdentityHistoryDir = history_dir
+            id_url.init()
+            self.assertEqual(scanned, [])
+            self.assertEqual((id_url._KnownUsers, id_url._KnownIDURLs, id_url._MergedIDURLs, ), known)
+            self.assertEqual(id_url.field(hans1).to_text(), hans2)
+            id_url.shutdown()
+            with open(snapshot_file, 'r+b') as f:
+                f.seek(-5, os.SEEK_END)
+                f.write(b'xxxxx')
+            id_url._IdentityHistoryDir = history_dir
+            id_url.init()
+            self.assertEqual(scanned, [1, ])
+            self.assertEqual((id_url._KnownUsers, id_url._KnownIDURLs, id_url._MergedIDURLs, ), known)
+            id_url.shutdown()
+            for user_dir in os.listdir(history_dir):
+                if user_dir.startswith('hans@'):
+                    os.remove(os.path.join(history_dir, user_dir, '1'))
+            id_url._IdentityHistoryDir = history_dir
+            id_url.init()
+            self.assertEqual(scanned, [1, 1, ])
+            self.assertIn(strng.to_bin(hans2), id_url._KnownIDURLs)
+            self.assertNotIn(strng.to_bin(hans3), id_url._KnownIDURLs)
+        finally:
+            id_url.scan_history = scan_history
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,69 @@
+from unittest import TestCase
+
+from twisted.internet import reactor
+
+from main import settings
+
+from system import bpio
+
+from p2p import commands
+
+from userid import global_id
+from userid import id_url
+
+from customer import supplier_connector
+
+from storage import index_synchronizer
+
+
+_SupplierIDURL = 'http://127.0.0.1:8084/bob.xml'
+
+
+class _Packet(object):
+
+    def __init__(self, Command, PacketID):
+        self.Command = Command
+        self.PacketID = PacketID
+        self.OwnerID = _SupplierIDURL
+
+
+class TestIndexSynchronizerAcks(TestCase):
+
+    def setUp(self):
+        settings.init(base_dir='/tmp/.bitdust_tmp')
+        # supplier connectors are not running here
+        by_idurl = supplier_connector.by_idurl
+        supplier_connector.by_idurl = lambda idurl: None
+        self.addCleanup(setattr, supplier_connector, 'by_idurl', by_idurl)
+        self.isync = index_synchronizer.IndexSynchronizer(name='test_index_synchronizer', state='SENDING')
+        self.index_packet_id = global_id.MakeGlobalID(customer='alice@127.0.0.1_8084', path=settings.BackupIndexFileName())
+        self.journal_packet_id = global_id.MakeGlobalID(customer='alice@127.0.0.1_8084', path=settings.BackupIndexJournalFileName())
+
+    def tearDown(self):
+        for delayed_call in reactor.getDelayedCalls():
+            delayed_call.cancel()
+        self.isync.destroy()
+        settings.shutdown()
+        bpio.rmdir_recursive('/tmp/.bitdust_tmp', ignore_errors=True)
+
+    def _send(self, *packets_ids):
+        self.isync.sending_base_revision = 5
+        self.isync.sending_suppliers.add(_SupplierIDURL)
+        self.isync.sending_packets[id_url.to_bin(_SupplierIDURL)] = set(packets_ids)
+
+    def test_journal_failed(self):
+        self._send(self.index_packet_id, self.journal_packet_id)
+        self.isync._on_supplier_acked(_Packet(commands.Ack(), self.index_packet_id), None)
+        self.isync._on_supplier_acked(_Packet(commands.Ack(), self.journal_packet_id), None)
+        self.assertEqual(self.isync.suppliers_base_revisions, {id_url.to_bin(_SupplierIDURL): 5, })
+        # only the journal is sent next time, but supplier is not able to store it
+        self._send(self.journal_packet_id)
+        self.isync._on_supplier_acked(_Packet(commands.Fail(), self.journal_packet_id), None)
+        self.assertEqual(self.isync.suppliers_base_revisions, {})
+        self.assertEqual(self.isync.sending_suppliers, set())
+
+    def test_index_failed(self):
+        self._send(self.index_packet_id, self.journal_packet_id)
+        self.isync._on_supplier_acked(_Packet(commands.Fail(), self.index_packet_id), None)
+        self.isync._on_supplier_acked(_Packet(commands.Ack(), self.journal_packet_id), None)
+        self.assertEqual(self.isync.suppliers_base_revisions, {})
@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+from stream import message_log
+
+
+class TestMessageLog(TestCase):
+
+    def setUp(self):
+        self.log_dir = os.path.join(tempfile.mkdtemp(prefix='message_log_'), 'log')
+        self.segment_max_size = message_log.SEGMENT_MAX_SIZE
+        message_log.SEGMENT_MAX_SIZE = 500
+
+    def tearDown(self):
+        message_log.SEGMENT_MAX_SIZE = self.segment_max_size
+        shutil.rmtree(os.path.dirname(self.log_dir), ignore_errors=True)
+
+    def _open(self):
+        ml = message_log.MessageLog(self.log_dir)
+        ml.open()
+        return ml
+
+    def _append(self, ml, sequence_id):
+        ml.append({
+            'sequence_id': sequence_id,
+            'created': 1000 + sequence_id,
+            'producer_id': 'alice',
+            'payload': {'text': 'message %d' % sequence_id},
+            'attempts': [],
+            'processed': None,
+        })
+
+    def test_append_read_erase(self):
+        ml = self._open()
+        for sequence_id in range(20):
+            self._append(ml, sequence_id)
+        self.assertGreater(len(ml.segments), 2)
+        messages = ml.read_after(4, max_messages_count=3)
+        self.assertEqual([m['sequence_id'] for m in messages], [5, 6, 7, ])
+        self.assertEqual(messages[0]['payload'], {'text': 'message 5'})
+        self.assertIsNone(messages[0]['processed'])
+        self.assertEqual(ml.read_after(19), [])
+        self.assertTrue(ml.register_delivery(15, 'msg15'))
+        self.assertTrue(ml.unregister_delivery(15, 'msg15', ['bob', ]))
+        self.assertFalse(ml.unregister_delivery(15, 'msg16', []))
+        self.assertTrue(ml.set_processed(2, processed=12345))
+        first_segment_path = ml.segment_path(0)
+        first_segment_messages = [s for s, pos in ml.index.items() if pos[0] == 0]
+        for sequence_id in first_segment_messages:
+            self.assertTrue(ml.erase(sequence_id))
+        self.assertFalse(os.path.exists(first_segment_path))
+        self.assertFalse(ml.erase(first_segment_messages[0]))
+        ml.close()
+        with open(ml.segment_path(ml.active_segment), 'ab') as f:
+            f.write(b'{"sequence_id": 20, "crea')
+        ml2 = self._open()
+        self.assertEqual(ml2.list_sequence_ids(), list(range(max(first_segment_messages) + 1, 20)))
+        self.assertEqual(ml2.attempts[15], ml.attempts[15])
+        self.assertEqual(ml2.attempts[15][0]['failed_consumers'], ['bob', ])
+        self._append(ml2, 20)
+        self.assertEqual([m['sequence_id'] for m in ml2.read_after(18)], [19, 20, ])
+        ml2.close()
+
+    def test_delivery_state_reopen(self):
+        ml = self._open()
+        self._append(ml, 0)
+        self._append(ml, 1)
+        ml.register_delivery(1, 'm1')
+        ml.unregister_delivery(1, 'm1', [])
+        ml.set_processed(1, processed=555)
+        ml.close()
+        ml2 = self._open()
+        self.assertTrue(ml2.is_processed(1))
+        self.assertFalse(ml2.is_processed(0))
+        self.assertEqual(ml2.read([1, ])[0]['processed'], 555)
+        self.assertEqual(ml2.attempts[1][0]['message_id'], 'm1')
+        self.assertEqual(ml2.journal_lines, 1)
+        ml2.close()
+
+    def test_erased_message_stays_erased_after_restarts(self):
+        ml = self._open()
+        for sequence_id in (1, 2, 3, ):
+            self._append(ml, sequence_id)
+        self.assertTrue(ml.erase(1))
+        ml.close()
+        for _ in range(3):
+            ml = self._open()
+            self.assertEqual(ml.list_sequence_ids(), [2, 3, ])
+            self.assertEqual(ml.erased, {0: {1, }, })
+            ml.close()
+        self._append(ml, 1)
+        self.assertTrue(ml.erase(1))
+        ml.close()
+        ml = self._open()
+        self.assertEqual(ml.list_sequence_ids(), [2, 3, ])
+        ml.close()
@@ -0,0 +1,115 @@
+from unittest import TestCase
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+
+from main import settings
+
+from system import bpio
+
+from stream import p2p_queue
+
+from userid import global_id
+
+
+class TestP2PQueueReadySet(TestCase):
+
+    def setUp(self):
+        settings.init(base_dir='/tmp/.bitdust_tmp')
+        self.queue_id = global_id.MakeGlobalQueueID('event-test', 'alice@127.0.0.1_8084', 'bob@127.0.0.1_8084')
+        self.consumer_id = 'carol@127.0.0.1_8084'
+        self.producer_id = 'dave@127.0.0.1_8084'
+        self.notified = []
+        self.results = []
+        p2p_queue.open_queue(self.queue_id)
+        p2p_queue.add_consumer(self.consumer_id)
+        p2p_queue.subscribe_consumer(self.consumer_id, self.queue_id)
+        p2p_queue.add_producer(self.producer_id)
+        p2p_queue.connect_producer(self.producer_id, self.queue_id)
+
+    def tearDown(self):
+        for result in self.results:
+            if not result.called:
+                result.callback(True)
+        p2p_queue.stop()
+        for delayed_call in reactor.getDelayedCalls():
+            if delayed_call.func is p2p_queue.finish_notification:
+                delayed_call.cancel()
+        p2p_queue.close_queue(self.queue_id)
+        p2p_queue.remove_consumer(self.consumer_id)
+        p2p_queue.remove_producer(self.producer_id)
+        settings.shutdown()
+        bpio.rmdir_recursive('/tmp/.bitdust_tmp', ignore_errors=True)
+
+    def _callback(self, message_info):
+        self.notified.append(message_info['payload'])
+        result = Deferred()
+        self.results.append(result)
+        return result
+
+    def test_write_message_marks_consumer_ready(self):
+        p2p_queue.write_message(self.producer_id, self.queue_id, {'n': 1})
+        # consumer has no callback methods yet, message stays in the queue
+        self.assertFalse(p2p_queue.process_queues())
+        self.assertIsNone(p2p_queue._ProcessQueuesTask)
+        p2p_queue.add_callback_method(self.consumer_id, self._callback)
+        self.assertIn((self.consumer_id, self.queue_id, ), p2p_queue._ReadyConsumers)
+        p2p_queue.write_message(self.producer_id, self.queue_id, {'n': 2})
+        self.assertTrue(p2p_queue.process_queues())
+        self.assertEqual(self.notified, [{'n': 1}, ])
+        self.assertEqual(p2p_queue.consumer(self.consumer_id).pending_notifications, 1)
+        # second message is delivered only after the first one was finished
+        self.assertFalse(p2p_queue.process_queues())
+        self.results[0].callback(True)
+        self.assertTrue(p2p_queue.process_queues())
+        self.assertEqual(self.notified, [{'n': 1}, {'n': 2}, ])
+        # idle: nothing is ready and no timer is running
+        self.assertFalse(p2p_queue.process_queues())
+        self.assertEqual(len(p2p_queue._ReadyConsumers), 0)
+
+    def test_pending_notifications_limit(self):
+        p2p_queue.add_callback_method(self.consumer_id, self._callback)
+        for n in range(p2p_queue.MAX_CONSUMER_IN_FLIGHT_MESSAGES + 1):
+            p2p_queue.write_message(self.producer_id, self.queue_id, {'n': n})
+        p2p_queue.process_queues()
+        self.assertEqual(len(self.notified), p2p_queue.MAX_CONSUMER_IN_FLIGHT_MESSAGES)
+        self.assertEqual(len(p2p_queue._ReadyConsumers), 0)
+        self.results[0].callback(True)
+        self.assertEqual(p2p_queue.consumer(self.consumer_id).pending_notifications, p2p_queue.MAX_CONSUMER_IN_FLIGHT_MESSAGES - 1)
+        self.assertIn((self.consumer_id, self.queue_id, ), p2p_queue._ReadyConsumers)
+        p2p_queue.process_queues()
+        self.assertEqual(len(self.notified), p2p_queue.MAX_CONSUMER_IN_FLIGHT_MESSAGES + 1)
+
+    def test_pending_notifications_limit_other_queue(self):
+        other_queue_id = global_id.MakeGlobalQueueID('event-other', 'alice@127.0.0.1_8084', 'bob@127.0.0.1_8084')
+        p2p_queue.open_queue(other_queue_id)
+        p2p_queue.subscribe_consumer(self.consumer_id, other_queue_id)
+        p2p_queue.connect_producer(self.producer_id, other_queue_id)
+        try:
+            p2p_queue.add_callback_method(self.consumer_id, self._callback)
+            for n in range(p2p_queue.MAX_CONSUMER_IN_FLIGHT_MESSAGES):
+                p2p_queue.write_message(self.producer_id, self.queue_id, {'n': n})
+            p2p_queue.write_message(self.producer_id, other_queue_id, {'other': 1})
+            p2p_queue.process_queues()
+            self.assertEqual(len(self.notified), p2p_queue.MAX_CONSUMER_IN_FLIGHT_MESSAGES)
+            self.assertNotIn({'other': 1}, self.notified)
+            for result in list(self.results):
+                result.callback(True)
+            self.assertIn((self.consumer_id, other_queue_id, ), p2p_queue._ReadyConsumers)
+            p2p_queue.process_queues()
+            self.assertIn({'other': 1}, self.notified)
+        finally:
+            p2p_queue.unsubscribe_consumer(self.consumer_id, other_queue_id)
+            p2p_queue.disconnect_producer(self.producer_id, other_queue_id)
+            p2p_queue.close_queue(other_queue_id)
+
+    def test_delivery_order(self):
+        p2p_queue.add_callback_method(self.consumer_id, self._callback)
+        for n in range(5):
+            p2p_queue.write_message(self.producer_id, self.queue_id, {'n': n})
+        p2p_queue.process_queues()
+        while len(self.notified) < 5:
+            self.assertEqual(p2p_queue.consumer(self.consumer_id).pending_notifications, 1)
+            self.results[-1].callback(True)
+            self.assertTrue(p2p_queue.process_queues())
+        self.assertEqual(self.notified, [{'n': n} for n in range(5)])
@@ -0,0 +1,43 @@
+from unittest import TestCase
+
+from transport import packet_out
+
+
+class _OutPacket(object):
+
+    def __init__(self, PacketID, Command):
+        self.PacketID = PacketID
+        self.Command = Command
+
+
+class _PacketOut(object):
+
+    def __init__(self, packet_id, command, remote_idurl):
+        self.outpacket = _OutPacket(packet_id, command)
+        self.remote_idurl = remote_idurl
+        self.filename = None
+        self.items = []
+
+
+class TestOutboxIndex(TestCase):
+
+    def tearDown(self):
+        for p in list(packet_out.queue()):
+            packet_out.index_remove(p)
+        del packet_out.queue()[:]
+
+    def _add(self, *args):
+        p = _PacketOut(*args)
+        packet_out.queue().append(p)
+        packet_out.index_add(p)
+        return p
+
+    def test_queue_order(self):
+        packets = [self._add('same_id', 'Data', 'http://127.0.0.1/bob_%d.xml' % n) for n in range(20)]
+        self._add('another_id', 'Data', 'http://127.0.0.1/bob_0.xml')
+        self.assertEqual(packet_out.search_by_packet_id('same_id'), packets)
+        self.assertEqual(packet_out._candidates(packet_id='SAME_ID'), packets)
+        packet_out.index_remove(packets[3])
+        packet_out.queue().remove(packets[3])
+        self.assertEqual(packet_out.search_by_packet_id('same_id'), packets[:3] + packets[4:])
+        self.assertEqual(packet_out._OutboxPositions.get(packets[3]), None)
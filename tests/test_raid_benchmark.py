@@ -0,0 +1,14 @@
+from unittest import TestCase
+
+from tests import raid_benchmark
+
+
+class TestRaidBenchmark(TestCase):
+
+    def test_small_block(self):
+        result = raid_benchmark.run(ecc_map_names=['ecc/2x2', 'ecc/7x7', ], block_size=64 * 1024, num_missing=1)
+        self.assertEqual(len(result['results']), 2)
+        for report in result['results']:
+            for step in ('make', 'read', 'rebuild', ):
+                self.assertTrue(report[step]['ok'], (report['ecc_map'], step))
+                self.assertIn('mb_per_sec', report[step])
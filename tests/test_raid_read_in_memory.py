@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+from raid import eccmap
+from raid import make
+from raid import read
+
+
+class TestReadInMemory(TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='raid_read_in_memory_')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _test_eccmap(self, ecc_map_name, missing):
+        block_dir = os.path.join(self.work_dir, ecc_map_name.replace('/', '_'), 'version')
+        os.makedirs(block_dir)
+        source_path = os.path.join(self.work_dir, 'source')
+        with open(source_path, 'wb') as f:
+            f.write(os.urandom(200 * 1024 + 17))
+        make.do_in_memory(source_path, ecc_map_name, 'version', 0, block_dir)
+        with open(source_path, 'rb') as f:
+            source_data = f.read()
+        myeccmap = eccmap.eccmap(ecc_map_name)
+        for seg_num in missing:
+            os.remove(os.path.join(block_dir, '0-%d-Data' % seg_num))
+        data_segments = {}
+        parity_segments = {}
+        for seg_num in range(myeccmap.datasegments):
+            if seg_num not in missing:
+                with open(os.path.join(block_dir, '0-%d-Data' % seg_num), 'rb') as f:
+                    data_segments[seg_num] = memoryview(f.read())
+        for seg_num in range(myeccmap.paritysegments):
+            with open(os.path.join(block_dir, '0-%d-Parity' % seg_num), 'rb') as f:
+                parity_segments[seg_num] = f.read()
+        good_segments, data = read.read_in_memory(ecc_map_name, data_segments, parity_segments)
+        self.assertEqual(good_segments, myeccmap.datasegments)
+        self.assertEqual(data, source_data)
+        restored_path = os.path.join(self.work_dir, 'restored')
+        read.raidread(restored_path, ecc_map_name, 'version', 0, os.path.dirname(block_dir))
+        with open(restored_path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_ecc_2x2(self):
+        self._test_eccmap('ecc/2x2', [1, ])
+
+    def test_ecc_7x7(self):
+        self._test_eccmap('ecc/7x7', [0, 3, ])
+
+    def test_ecc_18x18(self):
+        self._test_eccmap('ecc/18x18', [2, 5, 11, ])
+
+    def test_cancelled_make_closes_mapping(self):
+        source_path = os.path.join(self.work_dir, 'source')
+        with open(source_path, 'wb') as f:
+            f.write(os.urandom(200 * 1024 + 17))
+        mapped = []
+        original_mmap = make.mmap.mmap
+
+        def _mmap(*args, **kwargs):
+            mapped.append(original_mmap(*args, **kwargs))
+            return mapped[-1]
+
+        make.mmap.mmap = _mmap
+        try:
+            result = make.do_in_memory(source_path, 'ecc/7x7', 'version', 0, self.work_dir, threshold_control=lambda chunklen: False)
+        finally:
+            make.mmap.mmap = original_mmap
+        self.assertEqual(result, (-1, -1, ))
+        self.assertEqual(len(mapped), 1)
+        self.assertTrue(mapped[0].closed)
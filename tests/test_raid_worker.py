@@ -295,7 +295,7 @@ class _Helper(object):
         os.system('rm -rf /tmp/destination.txt')
         os.system('rm -rf /tmp/raidtest')
         os.system("mkdir -p '/tmp/raidtest/master$alice@somehost.com/0/F12345678'")
-        open('/tmp/source1.txt', 'w').write(base64.b64encode(os.urandom(1000000)).decode())
+        open('/tmp/source1.txt', 'w').write(base64.b64encode(os.urandom(30000000)).decode())
         reactor.callWhenRunning(raid_worker.A, 'init')  # @UndefinedVariable
 
         def _task_failed(c, t, r):
@@ -314,6 +314,69 @@ class _Helper(object):
 
         return test_result
 
+    def test_make_batch(self):
+        test_result = Deferred()
+        results = {}
+        # with a single CPU all tasks added while the first one is running are joined into a batch
+        original_detect_number_of_cpu_cores = bpio.detect_number_of_cpu_cores
+        bpio.detect_number_of_cpu_cores = lambda: 1
+        self.addCleanup(setattr, bpio, 'detect_number_of_cpu_cores', original_detect_number_of_cpu_cores)
+        os.system('rm -rf /tmp/raidtest')
+        for i in range(5):
+            os.system("mkdir -p '/tmp/raidtest/master$alice@somehost.com/0/F12345678/%d'" % i)
+            open('/tmp/raidtest/source%d.txt' % i, 'wb').write(base64.b64encode(os.urandom(1000 + i)))
+        reactor.callWhenRunning(raid_worker.A, 'init')  # @UndefinedVariable
+
+        def _make_done(cmd, taskdata, result):
+            results[taskdata[0]] = result
+            if len(results) < 5:
+                return
+            os.system('rm -rf /tmp/raidtest')
+            reactor.callLater(0, raid_worker.A, 'shutdown')  # @UndefinedVariable
+            stats = raid_worker.get_stats()
+            if [list(r) for r in results.values()] != [[4, 4], ] * 5:
+                reactor.callLater(0.1, test_result.errback, Exception('wrong results: %r' % results))  # @UndefinedVariable
+            elif stats['make']['count'] < 5 or stats['make']['max_batch'] < 2 or stats['make']['batched'] < 2:
+                reactor.callLater(0.1, test_result.errback, Exception('wrong stats: %r' % stats))  # @UndefinedVariable
+            else:
+                reactor.callLater(0.1, test_result.callback, True)  # @UndefinedVariable
+
+        def _add_tasks():
+            for i in range(5):
+                raid_worker.add_task('make', (
+                    '/tmp/raidtest/source%d.txt' % i, 'ecc/4x4', 'F12345678', str(i), '/tmp/raidtest/master$alice@somehost.com/0/F12345678/%d' % i), _make_done)
+
+        reactor.callLater(0.5, _add_tasks)  # @UndefinedVariable
+        return test_result
+
+    def test_cancel_task_in_batch(self):
+        cancelled_jobs = []
+
+        class _Processor(object):
+            def cancel(self, tid):
+                cancelled_jobs.append(tid)
+
+        batch_job = raid_worker.RaidTaskInfo(1)
+        single_job = raid_worker.RaidTaskInfo(2)
+        worker = raid_worker.RaidWorker(name='raid_worker_test_cancel', state='WORK')
+        worker.processor = _Processor()
+        worker.activetasks = {
+            10: (batch_job, 'make', ('/tmp/block10', )),
+            11: (batch_job, 'make', ('/tmp/block11', )),
+            12: (single_job, 'make', ('/tmp/block12', )),
+        }
+        original_worker = raid_worker._RaidWorker
+        raid_worker._RaidWorker = worker
+        try:
+            self.assertTrue(raid_worker.cancel_task('make', '/tmp/block11'))
+            self.assertEqual(cancelled_jobs, [])
+            self.assertEqual(worker.cancelled_tasks, set([11, ]))
+            self.assertTrue(raid_worker.cancel_task('make', '/tmp/block12'))
+            self.assertEqual(cancelled_jobs, [2, ])
+        finally:
+            raid_worker._RaidWorker = original_worker
+            worker.destroy()
+
 
 
 class TestRaidWorkerWithParallelP(_Helper, TestCase):
@@ -0,0 +1,57 @@
+import os
+from unittest import TestCase
+
+from raid import raidutils
+
+
+def _xor_bytewise(buffers, length):
+    result = bytearray(length)
+    for b in buffers:
+        for i in range(length):
+            result[i] ^= bytearray(b)[i]
+    return bytes(result)
+
+
+class TestXORBuffers(TestCase):
+
+    def _check(self, sizes):
+        for length in sizes:
+            buffers = [os.urandom(length) for _ in range(5)]
+            self.assertEqual(raidutils.xor_buffers(buffers), _xor_bytewise(buffers, length))
+            self.assertEqual(raidutils.xor_buffers([bytearray(b) for b in buffers], length), _xor_bytewise(buffers, length))
+
+    def test_xor_buffers(self):
+        self._check([0, 1, 7, 8, 9, 63, 64, 1001])
+
+    def test_xor_buffers_pure_python(self):
+        _numpy = raidutils.numpy
+        raidutils.numpy = None
+        try:
+            self._check([0, 1, 7, 8, 9, 63, 64, 1001])
+        finally:
+            raidutils.numpy = _numpy
+
+    def test_xor_buffers_too_short(self):
+        with self.assertRaises(Exception):
+            raidutils.xor_buffers([b'abcd', b'ab'])
+
+
+class TestBuildParity(TestCase):
+
+    def test_build_parity(self):
+        from raid import eccmap
+        for name in ('ecc/2x2', 'ecc/18x18', 'ecc/64x64'):
+            myeccmap = eccmap.eccmap(name)
+            seglength = 40
+            sds = {seg_num: os.urandom(seglength) for seg_num in range(myeccmap.datasegments)}
+            psds_list = raidutils.build_parity(sds, seglength, myeccmap, chunksize=16)
+            self.assertEqual(len(psds_list), myeccmap.paritysegments)
+            for PSegNum, Map in enumerate(myeccmap.ParityToData):
+                self.assertEqual(psds_list[PSegNum], _xor_bytewise([sds[d] for d in Map], seglength))
+
+    def test_build_parity_cancelled(self):
+        from raid import eccmap
+        myeccmap = eccmap.eccmap('ecc/4x4')
+        sds = {seg_num: os.urandom(64) for seg_num in range(myeccmap.datasegments)}
+        with self.assertRaises(Exception):
+            raidutils.build_parity(sds, 64, myeccmap, threshold_control=lambda more_bytes: False)
@@ -0,0 +1,116 @@
+import os
+
+import mock
+
+from unittest import TestCase
+
+from main import settings
+
+from system import bpio
+
+from lib import packetid
+
+from raid import eccmap
+
+from stream import io_throttle
+
+from storage import restore_worker
+
+
+_BackupID = 'master$alice@127.0.0.1_8084:1/2/F20200101010101AM'
+
+
+class _Packet(object):
+
+    def __init__(self, PacketID, Payload):
+        self.PacketID = PacketID
+        self.Payload = Payload
+
+
+class TestRestoreWorkerPrefetch(TestCase):
+
+    def setUp(self):
+        settings.init(base_dir='/tmp/.bitdust_tmp')
+        self.known_max_block_num = 10
+        self.requested = []
+        patches = [
+            mock.patch('storage.backup_matrix.GetKnownMaxBlockNum', lambda backupID: self.known_max_block_num),
+            mock.patch('contacts.contactsdb.supplier', lambda num, customer_idurl=None: 'http://127.0.0.1/s%d.xml' % num),
+            mock.patch('p2p.online_status.isOffline', lambda idurl: False),
+            mock.patch('stream.io_throttle.HasPacketInRequestQueue', lambda supplier_idurl, packetID: False),
+            mock.patch('stream.io_throttle.QueueRequestFile', self._queue_request_file),
+            mock.patch('stream.io_throttle.DeleteBackupRequests'),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        # state machine is not started here, only the prefetch logic is tested
+        self.worker = restore_worker.RestoreWorker.__new__(restore_worker.RestoreWorker)
+        self.worker.backup_id = _BackupID
+        self.worker.creator_id = 'http://127.0.0.1/alice.xml'
+        self.worker.customer_idurl = 'http://127.0.0.1/alice.xml'
+        self.worker.EccMap = eccmap.eccmap('ecc/2x2')
+        self.worker.block_number = 0
+        self.worker.prefetch_blocks = 2
+        self.worker.prefetch_requests = {}
+        self.worker.block_requests = {}
+        self.worker.block_segments = {}
+        self.worker.in_memory = False
+        self.worker.packetInCallback = None
+
+    def tearDown(self):
+        settings.shutdown()
+        bpio.rmdir_recursive('/tmp/.bitdust_tmp', ignore_errors=True)
+
+    def _queue_request_file(self, callOnReceived, creatorID, packetID, ownerID, remoteID):
+        self.requested.append(packetID)
+        return True
+
+    def _blocks_requested(self):
+        return sorted(set(packetid.BlockNumber(packetID) for packetID in self.requested))
+
+    def _local_path(self, packetID):
+        customer_id, remote_path = packetid.SplitPacketID(packetID)
+        return os.path.join(settings.getLocalBackupsDir(), customer_id, remote_path)
+
+    def test_prefetch_window(self):
+        self.worker._do_prefetch_next_blocks()
+        self.assertEqual(self._blocks_requested(), [1, 2, ])
+        self.assertEqual(len(self.requested), 4)
+        # same packets are not requested twice
+        self.worker._do_prefetch_next_blocks()
+        self.assertEqual(len(self.requested), 4)
+
+    def test_prefetch_known_range(self):
+        self.known_max_block_num = 1
+        self.worker._do_prefetch_next_blocks()
+        self.assertEqual(self._blocks_requested(), [1, ])
+        self.requested = []
+        self.worker.prefetch_requests.clear()
+        self.known_max_block_num = -1
+        self.worker._do_prefetch_next_blocks()
+        self.assertEqual(self.requested, [])
+
+    def test_prefetched_requests_taken(self):
+        self.worker._do_prefetch_next_blocks()
+        received_id = packetid.MakePacketID(_BackupID, 1, 0, 'Data')
+        pending_id = packetid.MakePacketID(_BackupID, 1, 1, 'Data')
+        self.worker._on_packet_request_result(_Packet(received_id, b'data'), 'received')
+        self.assertTrue(os.path.isfile(self._local_path(received_id)))
+        # block 1 becomes current one
+        self.worker.block_number = 1
+        self.worker._do_take_prefetched_requests()
+        self.assertEqual(self.worker.block_requests, {pending_id: None, })
+        self.assertEqual(sorted(set(v[0] for v in self.worker.prefetch_requests.values())), [2, ])
+        # received piece stays on the disk for the current block
+        self.assertTrue(os.path.isfile(self._local_path(received_id)))
+
+    def test_prefetched_packets_removed_when_stopped(self):
+        self.worker._do_prefetch_next_blocks()
+        received_id = packetid.MakePacketID(_BackupID, 2, 0, 'Data')
+        self.worker._on_packet_request_result(_Packet(received_id, b'data'), 'received')
+        self.assertTrue(os.path.isfile(self._local_path(received_id)))
+        self.worker.doDeleteAllRequests()
+        io_throttle.DeleteBackupRequests.assert_called_once_with(_BackupID)
+        self.assertFalse(os.path.isfile(self._local_path(received_id)))
+        self.assertEqual(self.worker.prefetch_requests, {})
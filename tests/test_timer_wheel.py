@@ -0,0 +1,104 @@
+from unittest import TestCase
+
+from twisted.internet import task
+
+from automats import automat
+
+from lib import timer_wheel
+
+
+class _Machine(automat.Automat):
+
+    timers = {
+        'timer-1sec': (1.0, ['READY', ]),
+        'timer-5sec': (5.0, ['READY', 'BUSY', ]),
+    }
+
+    def init(self):
+        self.fired = []
+
+    def A(self, event, *args, **kwargs):
+        if event.startswith('timer-'):
+            self.fired.append((event, self.state, ))
+        elif event == 'busy':
+            self.state = 'BUSY'
+        elif event == 'ready':
+            self.state = 'READY'
+
+
+class TestTimerWheel(TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.clock.advance(1000000.123)
+        self.wheel = timer_wheel.TimerWheel(clock=self.clock)
+
+    def test_periodic_timers(self):
+        intervals = [0.01, 0.1, 1.0, 2.0, 3.0, 10.0, 30.0, 60.0, 300.0, 3600.0, ]
+        fired = {}
+        for interval in intervals:
+            fired[interval] = 0
+            self.wheel.start(timer_wheel.Timer(lambda i: fired.__setitem__(i, fired[i] + 1), interval), interval)
+        self.assertEqual(len(self.wheel), len(intervals))
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.pump([0.05] * 2 * 3600 * 20)
+        for interval in intervals:
+            # same as LoopingCall : calls missed because of a delay are skipped
+            self.assertEqual(fired[interval], int(round(2 * 3600 / max(interval, 0.05))))
+        stats = self.wheel.get_stats()
+        self.assertEqual(stats['timers'], len(intervals))
+        self.assertEqual(stats['fired'], sum(fired.values()))
+        self.assertLess(stats['lag_max'], 0.05 + 0.001)
+        # timers expiring at the same tick are fired at one wake up
+        self.assertLess(stats['wakeups'], stats['fired'])
+
+    def test_restart_and_stop(self):
+        fired = []
+        t1 = timer_wheel.Timer(fired.append, 't1')
+        t2 = timer_wheel.Timer(fired.append, 't2')
+        self.wheel.start(t1, 10)
+        self.wheel.start(t2, 100)
+        self.clock.advance(9.5)
+        self.wheel.start(t1, 10)
+        self.clock.advance(9.5)
+        self.assertEqual(fired, [])
+        self.clock.advance(0.5)
+        self.assertEqual(fired, ['t1', ])
+        self.assertTrue(self.wheel.stop(t1))
+        self.assertFalse(self.wheel.stop(t1))
+        self.assertFalse(t1.active())
+        self.clock.advance(81)
+        self.assertEqual(fired, ['t1', 't2', ])
+        self.wheel.stop(t2)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 0)
+        self.clock.advance(5000)
+        self.wheel.start(t2, 1)
+        self.clock.advance(1)
+        self.assertEqual(fired, ['t1', 't2', 't2', ])
+        self.assertLess(self.wheel.get_stats()['wakeups'], 10)
+        self.wheel.clear()
+        self.assertEqual(len(self.clock.getDelayedCalls()), 0)
+
+    def test_automat_timers(self):
+        old_wheel = automat._TimerWheel
+        automat._TimerWheel = self.wheel
+        try:
+            m = _Machine('test_timer_wheel', 'READY')
+            self.assertEqual(sorted(m.getTimers().keys()), ['timer-1sec', 'timer-5sec', ])
+            self.clock.pump([0.1] * 25)
+            self.assertEqual(m.fired, [('timer-1sec', 'READY', ), ('timer-1sec', 'READY', ), ])
+            timers = dict(m._timers)
+            m.automat('busy')
+            self.assertEqual(list(m.getTimers().keys()), ['timer-5sec', ])
+            self.clock.pump([0.1] * 49)
+            self.assertEqual(len(m.fired), 2)
+            self.clock.pump([0.1, 0.1, ])
+            self.assertEqual(m.fired[-1], ('timer-5sec', 'BUSY', ))
+            m.automat('ready')
+            self.assertEqual(m._timers, timers)
+            self.assertIs(m._timers['timer-1sec'], timers['timer-1sec'])
+            m.destroy()
+            self.assertEqual(len(self.wheel), 0)
+            self.assertEqual(len(self.clock.getDelayedCalls()), 0)
+        finally:
+            automat._TimerWheel = old_wheel
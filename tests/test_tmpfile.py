@@ -0,0 +1,64 @@
+import os
+import errno
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+from system import tmpfile
+
+
+class TestInMemoryFiles(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='tmpfile_')
+        self.old_temp_dir = tmpfile._TempDirPath
+        tmpfile._TempDirPath = None
+        tmpfile.init(temp_dir_path=self.temp_dir)
+
+    def tearDown(self):
+        tmpfile.shutdown()
+        tmpfile._TempDirPath = self.old_temp_dir
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_release_after_last_user(self):
+        filename = tmpfile.make_in_memory('outbox', b'abcd', extension='.out')
+        self.assertTrue(tmpfile.file_exists(filename))
+        self.assertEqual(tmpfile.file_size(filename), 4)
+        # two transports are sending the same file
+        tmpfile.hold(filename)
+        tmpfile.hold(filename)
+        tmpfile.release('outbox', filename, 'owner destroyed')
+        self.assertEqual(tmpfile.read_file(filename), b'abcd')
+        tmpfile.release('outbox', filename, 'first transport finished')
+        self.assertTrue(tmpfile.is_in_memory(filename))
+        tmpfile.release('outbox', filename, 'second transport finished')
+        self.assertFalse(tmpfile.is_in_memory(filename))
+        self.assertFalse(tmpfile.file_exists(filename))
+        # released twice by mistake
+        tmpfile.release('outbox', filename, 'again')
+        self.assertFalse(filename in tmpfile._MemoryFilesUsers)
+
+    def test_shared_memory_full(self):
+        shared_dir = tempfile.mkdtemp(prefix='tmpfile_shm_')
+        self.addCleanup(shutil.rmtree, shared_dir, ignore_errors=True)
+        os.makedirs(os.path.join(shared_dir, 'raid'))
+        self.addCleanup(setattr, tmpfile, '_SharedMemoryDirPath', tmpfile._SharedMemoryDirPath)
+        tmpfile._SharedMemoryDirPath = shared_dir
+        write_chunks = tmpfile._write_chunks
+        self.addCleanup(setattr, tmpfile, '_write_chunks', write_chunks)
+        attempts = []
+
+        def _write_chunks(fd, chunks):
+            attempts.append(fd)
+            if len(attempts) == 1:
+                raise OSError(errno.ENOSPC, 'No space left on device')
+            return write_chunks(fd, chunks)
+
+        tmpfile._write_chunks = _write_chunks
+        filename = tmpfile.make_from_chunks('raid', [b'5:', b'abcde', ], extension='.raid', shared_memory=True)
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(os.listdir(os.path.join(shared_dir, 'raid')), [])
+        self.assertEqual(os.path.dirname(filename), tmpfile.subdir('raid'))
+        with open(filename, 'rb') as f:
+            self.assertEqual(f.read(), b'5:abcde')
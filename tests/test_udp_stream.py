@@ -0,0 +1,261 @@
+import io
+import os
+import time
+import struct
+
+from unittest import TestCase
+
+from transport.udp import udp_stream
+
+
+class FakeSession(object):
+    peer_id = 'bob'
+    min_rtt = 0.01
+    datagram_size = udp_stream.UDP_DATAGRAM_SIZE
+
+
+class FakeProducer(object):
+
+    def __init__(self):
+        self.session = FakeSession()
+        self.sent_blocks = []
+
+    def do_send_data(self, stream_id, consumer, output):
+        self.sent_blocks.append(struct.unpack('i', output[:4])[0])
+        return True
+
+    def do_send_ack(self, stream_id, consumer, ack_data):
+        return True
+
+    def on_close_consumer(self, consumer):
+        pass
+
+    def on_close_stream(self, stream_id):
+        pass
+
+
+class FakeConsumer(object):
+    size = 100 * udp_stream.BLOCK_SIZE
+
+    def set_stream_callback(self, stream_callback):
+        self.stream_callback = stream_callback
+
+    def clear_stream_callback(self):
+        self.stream_callback = None
+
+    def on_sent_raw_data(self, bytes_delivered):
+        return False
+
+
+class TestUDPStream(TestCase):
+
+    def setUp(self):
+        self.output_limit = udp_stream.get_global_output_limit_bytes_per_sec()
+        udp_stream.set_global_output_limit_bytes_per_sec(0)
+        self.producer = FakeProducer()
+        self.stream = udp_stream.create(1, FakeConsumer(), self.producer)
+        self.stream.creation_time -= 10.0
+
+    def tearDown(self):
+        self.stream.automat('close')
+        udp_stream.stop_process_streams()
+        udp_stream.streams().clear()
+        udp_stream.set_global_output_limit_bytes_per_sec(self.output_limit)
+
+    def _ack(self, *block_ids):
+        self.stream.on_ack_received(io.BytesIO(struct.pack('?', False) + b''.join([struct.pack('i', b) for b in block_ids])))
+
+    def test_congestion_window(self):
+        self.stream.on_consume(b'x' * (40 * udp_stream.BLOCK_SIZE))
+        self.assertEqual(self.stream.state, 'SENDING')
+        self.assertEqual(self.producer.sent_blocks, list(range(1, udp_stream.INITIAL_CWND + 1)))
+        self.assertTrue(self.stream.iteration_task.active())
+        self._ack(*range(1, 9))
+        self.assertEqual(self.stream.output_cwnd, udp_stream.INITIAL_CWND + 8)
+        self.assertEqual(self.stream.output_blocks_in_flight, udp_stream.INITIAL_CWND + 8)
+        self.assertEqual(self.producer.sent_blocks, list(range(1, udp_stream.INITIAL_CWND + 8 + 8 + 1)))
+
+    def test_fast_retransmit(self):
+        self.stream.on_consume(b'x' * (40 * udp_stream.BLOCK_SIZE))
+        del self.producer.sent_blocks[:]
+        self._ack(2)
+        self._ack(3)
+        self.assertNotIn(1, self.producer.sent_blocks)
+        self._ack(4)
+        self.assertIn(1, self.producer.sent_blocks)
+        self.assertEqual(self.stream.output_blocks[1][3], 2)
+        self.assertEqual(self.stream.output_cwnd, (udp_stream.INITIAL_CWND + 3) / 2.0)
+        self.assertEqual(self.stream.output_ssthresh, self.stream.output_cwnd)
+
+    def test_no_housekeeping_without_streams(self):
+        udp_stream.stop_process_streams()
+        udp_stream.process_streams()
+        self.assertIsNotNone(udp_stream._ProcessStreamsTask)
+        udp_stream.stop_process_streams()
+        udp_stream.streams().clear()
+        udp_stream.process_streams()
+        self.assertIsNone(udp_stream._ProcessStreamsTask)
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class FakeLink(object):
+    """
+    Delivers datagrams between two streams through a queue, some data blocks are dropped once.
+    """
+
+    def __init__(self, drop_blocks=()):
+        self.queue = []
+        self.drop_blocks = set(drop_blocks)
+        self.datagrams = 0
+        self.sender = None
+        self.receiver = None
+
+
+class FakeLinkProducer(FakeProducer):
+
+    def __init__(self, link, datagram_size):
+        FakeProducer.__init__(self)
+        self.link = link
+        self.session.datagram_size = datagram_size
+
+    def do_send_data(self, stream_id, consumer, output):
+        block_id = struct.unpack('i', output[:4])[0]
+        self.link.datagrams += 1
+        if block_id in self.link.drop_blocks:
+            self.link.drop_blocks.discard(block_id)
+            return True
+        self.link.queue.append((self.link.receiver.on_block_received, output))
+        return True
+
+    def do_send_ack(self, stream_id, consumer, ack_data):
+        self.link.queue.append((self.link.sender.on_ack_received, ack_data))
+        return True
+
+    def on_outbox_file_done(self, stream_id):
+        pass
+
+    def on_inbox_file_done(self, stream_id):
+        pass
+
+
+class FakeOutbox(FakeConsumer):
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+        self.position = 0
+        self.bytes_delivered = 0
+        self.status = None
+
+    def process(self):
+        while self.position < self.size and self.stream_callback:
+            chunk = self.data[self.position:self.position + udp_stream.CHUNK_SIZE]
+            try:
+                self.stream_callback(chunk)
+            except udp_stream.BufferOverflow:
+                break
+            self.position += len(chunk)
+
+    def is_done(self):
+        return self.bytes_delivered == self.size
+
+    def on_sent_raw_data(self, bytes_delivered):
+        self.bytes_delivered += bytes_delivered
+        if self.is_done():
+            return True
+        self.process()
+        return False
+
+
+class FakeInbox(FakeConsumer):
+
+    def __init__(self, size):
+        self.size = size
+        self.bytes_received = 0
+        self.received = []
+
+    def on_received_raw_data(self, newdata):
+        self.received.append(bytes(newdata))
+        self.bytes_received += len(newdata)
+        return self.bytes_received == self.size
+
+
+class TestInputBuffer(TestCase):
+
+    def test_out_of_order(self):
+        buf = udp_stream.InputBuffer(data_size=25, max_blocks=3)
+        self.assertTrue(buf.put(2, b'bbbbb'))
+        self.assertFalse(buf.put(2, b'bbbbb'))
+        self.assertIsNone(buf.pop())
+        self.assertTrue(buf.put(1, b'aaaaa'))
+        self.assertEqual(buf.slots, 3)
+        self.assertEqual(bytes(buf.pop()), b'aaaaabbbbb')
+        self.assertEqual(buf.last_block_id, 2)
+        self.assertIsNone(buf.put(6, b'fffff'))
+        self.assertTrue(buf.put(4, b'ddddd'))
+        self.assertTrue(buf.put(5, b'ee'))
+        self.assertEqual(buf.pending, 2)
+        self.assertTrue(buf.put(3, b'ccccc'))
+        self.assertEqual(bytes(buf.pop()), b'ccccc')
+        self.assertEqual(bytes(buf.pop()), b'dddddee')
+        self.assertIsNone(buf.pop())
+        self.assertFalse(buf.put(4, b'ddddd'))
+        self.assertEqual(buf.pending, 0)
+
+
+class TestUDPStreamTransfer(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        udp_stream.time = self.clock
+
+    def tearDown(self):
+        for s in list(udp_stream.streams().values()):
+            s._cancel_iteration()
+        udp_stream.stop_process_streams()
+        udp_stream.streams().clear()
+        udp_stream.time = time
+
+    def _transfer(self, data, datagram_size, drop_blocks=()):
+        link = FakeLink(drop_blocks)
+        outbox = FakeOutbox(data)
+        inbox = FakeInbox(len(data))
+        link.sender = udp_stream.create(1, outbox, FakeLinkProducer(link, datagram_size))
+        link.receiver = udp_stream.create(2, inbox, FakeLinkProducer(link, datagram_size))
+        outbox.process()
+        for _ in range(100000):
+            if link.queue:
+                callback, payload = link.queue.pop(0)
+                callback(io.BytesIO(payload))
+                continue
+            if link.sender.state != 'SENDING':
+                break
+            #--- nothing on the wire, let some time pass and fire the timers
+            self.clock.now += 0.05
+            for s in (link.sender, link.receiver, ):
+                if s.iteration_task and s.iteration_task.active():
+                    s._cancel_iteration()
+                    s._on_iteration_task()
+        self.assertEqual(link.sender.state, 'COMPLETION')
+        self.assertEqual(b''.join(inbox.received), data)
+        return link
+
+    def test_transfer_with_losses(self):
+        data = os.urandom(300 * 1024 + 17)
+        link = self._transfer(data, udp_stream.UDP_DATAGRAM_SIZE, drop_blocks=(1, 5, 50, 51, 52, 300, ))
+        self.assertEqual(link.sender.block_size, udp_stream.BLOCK_SIZE)
+        self.assertEqual(link.datagrams, (len(data) + udp_stream.BLOCK_SIZE - 1) // udp_stream.BLOCK_SIZE + 6)
+
+    def test_big_datagrams(self):
+        data = os.urandom(300 * 1024 + 17)
+        link = self._transfer(data, 1472, drop_blocks=(2, 100, ))
+        self.assertEqual(link.sender.block_size, 1472 - udp_stream.DATAGRAM_HEADER_SIZE)
+        self.assertEqual(link.datagrams, (len(data) + 1457) // 1458 + 2)
@@ -103,6 +103,7 @@ from p2p import commands
 from lib import nameurl
 from lib import misc
 from lib import strng
+from lib import deadlines
 
 from system import bpio
 from system import tmpfile
@@ -133,7 +134,7 @@ _XMLRPCPort = None
 _XMLRPCURL = ''
 _LastTransferID = None
 _LastInboxPacketTime = 0
-_PacketsTimeOutTask = None
+_PacketsDeadlines = None
 _TransportStateChangedCallbacksList = []
 _TransportLogFile = None
 _TransportLogFilename = None
@@ -245,7 +246,7 @@ def start():
             else:
                 if _Debug:
                     lg.out(4, '    %r is ready' % transp)
-    reactor.callLater(5, packets_timeout_loop)  # @UndefinedVariable
+    start_packets_timeout_loop()
     return result
 
 
@@ -271,7 +272,7 @@ def cold_start():
             else:
                 if _Debug:
                     lg.out(4, '    %r is ready, try next one' % transp)
-    reactor.callLater(5, packets_timeout_loop)  # @UndefinedVariable
+    start_packets_timeout_loop()
     return result
 
 #------------------------------------------------------------------------------
@@ -578,6 +579,7 @@ def send_file(remote_idurl, proto, host, filename, description='', pkt_out=None)
     if not is_installed(proto):
         return fail(Exception('transport %r not installed' % proto))
     result_defer = transport(proto).call('send_file', remote_idurl, filename, host, description)
+    hold_outbox_file(filename, result_defer)
     callback.run_begin_file_sending_callbacks(result_defer, remote_idurl, proto, host, filename, description, pkt_out)
     return result_defer
 
@@ -590,10 +592,29 @@ def send_file_single(remote_idurl, proto, host, filename, description='', pkt_ou
     if not is_installed(proto):
         return fail(Exception('transport %r not installed' % proto))
     result_defer = transport(proto).call('send_file_single', remote_idurl, filename, host, description)
+    hold_outbox_file(filename, result_defer)
     callback.run_begin_file_sending_callbacks(result_defer, remote_idurl, proto, host, filename, description, pkt_out)
     return result_defer
 
 
+def hold_outbox_file(filename, result_defer):
+    """
+    In-memory outbox file must stay available until the transport finished sending it,
+    even if the packet_out() object was already destroyed.
+    If transport does not report the result, file will be removed by ``tmpfile.collect()``.
+    """
+    if not tmpfile.is_in_memory(filename):
+        return
+    tmpfile.hold(filename)
+    if isinstance(result_defer, Deferred):
+        result_defer.addBoth(release_outbox_file, filename)
+
+
+def release_outbox_file(result, filename):
+    tmpfile.release('outbox', filename, 'transport finished sending')
+    return result
+
+
 def send_keep_alive(proto, host):
     """
     """
@@ -740,33 +761,53 @@ def shutdown_all_inbox_packets():
 #------------------------------------------------------------------------------
 
 
-def packets_timeout_loop():
-    global _PacketsTimeOutTask
-    # lg.out(18, 'gateway.packets_timeout_loop')
-    delay = 5
-    # if _Debug:
-    #     delay = 1
-    _PacketsTimeOutTask = reactor.callLater(delay, packets_timeout_loop)  # @UndefinedVariable
-    for pkt_in in list(packet_in.inbox_items().values()):
-        if pkt_in.is_timed_out():
-            if _Debug:
-                lg.out(_DebugLevel, 'gateway.packets_timeout_loop %r is timed out: %s' % (pkt_in, pkt_in.timeout))
-            pkt_in.automat('cancel', 'timeout')
-    for pkt_out in packet_out.queue():
-        if pkt_out.is_timed_out():
-            if _Debug:
-                lg.out(_DebugLevel, 'gateway.packets_timeout_loop %r is timed out: %s' % (pkt_out, pkt_out.timeout))
-            pkt_out.automat('cancel', 'timeout')
-    # if _Debug and lg.is_debug(_DebugLevel):
-    #     monitoring()
+def start_packets_timeout_loop():
+    """
+    All `packet_in` and `packet_out` instances register their deadlines here,
+    only expired packets are visited.
+    """
+    global _PacketsDeadlines
+    if _PacketsDeadlines is not None:
+        return
+    _PacketsDeadlines = deadlines.DeadlineScheduler(callback=on_packet_timeout)
+    for pkt in list(packet_in.inbox_items().values()) + list(packet_out.queue()):
+        if pkt.time is not None and pkt.timeout is not None:
+            _PacketsDeadlines.register(pkt, pkt.time + pkt.timeout)
 
 
 def stop_packets_timeout_loop():
-    global _PacketsTimeOutTask
-    if _PacketsTimeOutTask:
-        if _PacketsTimeOutTask.active():
-            _PacketsTimeOutTask.cancel()
-        _PacketsTimeOutTask = None
+    global _PacketsDeadlines
+    if _PacketsDeadlines:
+        _PacketsDeadlines.stop()
+        _PacketsDeadlines = None
+
+
+def register_packet_timeout(pkt, deadline):
+    """
+    Called from `packet_in` and `packet_out` when timeout for the packet is known.
+    """
+    if _PacketsDeadlines is None:
+        return False
+    _PacketsDeadlines.register(pkt, deadline)
+    return True
+
+
+def unregister_packet_timeout(pkt):
+    if _PacketsDeadlines is None:
+        return False
+    return _PacketsDeadlines.unregister(pkt)
+
+
+def on_packet_timeout(pkt):
+    if not pkt.is_timed_out():
+        if pkt.state != 'RESPONSE?' and pkt.time is not None and pkt.timeout is not None:
+            if pkt.time + pkt.timeout >= time.time():
+                # deadline was moved forward after registration
+                register_packet_timeout(pkt, pkt.time + pkt.timeout + 0.01)
+        return
+    if _Debug:
+        lg.out(_DebugLevel, 'gateway.on_packet_timeout %r is timed out: %s' % (pkt, pkt.timeout))
+    pkt.automat('cancel', 'timeout')
 
 #------------------------------------------------------------------------------
 
@@ -84,6 +84,8 @@ from userid import id_url
 from contacts import contactsdb
 from contacts import identitycache
 
+from crypt import signed
+
 from services import driver
 
 from p2p import commands
@@ -260,6 +262,8 @@ def handle(newpacket, info):
         lg.warn('signature is not valid for %r from %r|%r to %r' % (
             newpacket, newpacket.OwnerID, newpacket.CreatorID, newpacket.RemoteID))
         return None
+    # now we know which format the creator is able to read
+    signed.RegisterBinaryFormat(newpacket.CreatorID, newpacket.SupportedBinaryFormat)
     try:
         if not commands.IsRelay(newpacket.Command):
             for p in packet_out.search_by_response_packet(newpacket, info.proto, info.host):
@@ -436,6 +440,8 @@ class PacketIn(automat.Automat):
             self.timeout = int(self.size / float(settings.SendingSpeedLimit()))
         else:
             self.timeout = 300
+        from transport import gateway
+        gateway.register_packet_timeout(self, self.time + self.timeout)
         if not self.sender_idurl:
             lg.warn('sender_idurl is None: %s' % str(*args, **kwargs))
         reactor.callLater(0, callback.run_begin_file_receiving_callbacks, self)  # @UndefinedVariable
@@ -553,6 +559,8 @@ class PacketIn(automat.Automat):
         """
         Remove all references to the state machine object to destroy it.
         """
+        from transport import gateway
+        gateway.unregister_packet_timeout(self)
         inbox_items().pop(self.transfer_id)
         self.destroy()
 
@@ -89,6 +89,8 @@ from system import tmpfile
 from contacts import contactsdb
 from contacts import identitycache
 
+from crypt import signed
+
 from userid import my_id
 from userid import global_id
 from userid import id_url
@@ -102,6 +104,13 @@ from transport import callback
 #------------------------------------------------------------------------------
 
 _OutboxQueue = []
+_OutboxByPacketID = {}
+_OutboxByFilename = {}
+_OutboxByTransferID = {}
+_OutboxByRemoteID = {}
+_OutboxByCommand = {}
+_OutboxPositions = {}
+_OutboxPositionsCounter = 0
 _PacketsCounter = 0
 
 #------------------------------------------------------------------------------
@@ -140,6 +149,86 @@ def queue():
     return _OutboxQueue
 
 
+def index_add(p):
+    """
+    Register outgoing packet in the lookup indexes, called right after `PacketOut` object was created.
+    """
+    global _OutboxPositionsCounter
+    _OutboxPositionsCounter += 1
+    _OutboxPositions[p] = _OutboxPositionsCounter
+    _OutboxByPacketID.setdefault(p.outpacket.PacketID.lower(), set()).add(p)
+    _OutboxByRemoteID.setdefault(id_url.to_original(p.remote_idurl), set()).add(p)
+    _OutboxByCommand.setdefault(p.outpacket.Command, set()).add(p)
+
+
+def index_remove(p):
+    """
+    Remove outgoing packet from all lookup indexes, called when `PacketOut` object is about to be destroyed.
+    """
+    for index, key in (
+        (_OutboxByPacketID, p.outpacket.PacketID.lower()),
+        (_OutboxByRemoteID, id_url.to_original(p.remote_idurl)),
+        (_OutboxByCommand, p.outpacket.Command),
+    ):
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.discard(p)
+            if not bucket:
+                index.pop(key)
+    _OutboxPositions.pop(p, None)
+    if p.filename and _OutboxByFilename.get(p.filename) is p:
+        _OutboxByFilename.pop(p.filename)
+    for i in p.items:
+        index_remove_transfer_id(i)
+
+
+def index_filename(p):
+    _OutboxByFilename[p.filename] = p
+
+
+def index_transfer_id(p, item):
+    _OutboxByTransferID[item.transfer_id] = (p, item, )
+
+
+def index_remove_transfer_id(item):
+    if item.transfer_id and item.transfer_id in _OutboxByTransferID:
+        if _OutboxByTransferID[item.transfer_id][1] is item:
+            _OutboxByTransferID.pop(item.transfer_id)
+
+
+def _candidates(packet_id=None, filename=None, command=None, remote_idurl=None):
+    """
+    Returns smallest known set of outgoing packets matching one of given keys in the queue order,
+    or the whole queue if no keys were provided.
+    Caller must still check every candidate against all of the keys.
+    """
+    buckets = []
+    if packet_id:
+        buckets.append(_OutboxByPacketID.get(packet_id.lower(), set()))
+    if filename:
+        p = _OutboxByFilename.get(filename)
+        buckets.append([p, ] if p else [])
+    if command:
+        buckets.append(_OutboxByCommand.get(command, set()))
+    if remote_idurl:
+        bucket = set()
+        known_idurls = set(id_url.list_known_idurls(remote_idurl, num_revisions=100))
+        known_idurls.add(id_url.to_original(remote_idurl))
+        for another_idurl in known_idurls:
+            bucket.update(_OutboxByRemoteID.get(another_idurl, set()))
+        buckets.append(bucket)
+    if not buckets:
+        return list(queue())
+    return _queue_order(min(buckets, key=len))
+
+
+def _queue_order(packets):
+    """
+    Sort outgoing packets by their position in the queue, same as they were found by iterating the queue.
+    """
+    return sorted(packets, key=lambda p: _OutboxPositions.get(p, 0))
+
+
 def create(outpacket, wide, callbacks, target=None, route=None, response_timeout=None, keep_alive=True, skip_ack=False):
     """
     """
@@ -149,6 +238,7 @@ def create(outpacket, wide, callbacks, target=None, route=None, response_timeout
             outpacket.Command, outpacket.PacketID, target, route, list(callbacks.keys())))
     p = PacketOut(outpacket, wide, callbacks, target, route, response_timeout, keep_alive, skip_ack=skip_ack)
     queue().append(p)
+    index_add(p)
     p.automat('run')
     return p
 
@@ -156,9 +246,8 @@ def create(outpacket, wide, callbacks, target=None, route=None, response_timeout
 
 
 def search(proto, host, filename, remote_idurl=None):
-    for p in queue():
-        if p.filename != filename:
-            continue
+    p = _OutboxByFilename.get(filename)
+    if p is not None:
         for i in p.items:
             if i.proto == proto:
                 if not remote_idurl:
@@ -173,18 +262,22 @@ def search(proto, host, filename, remote_idurl=None):
                         continue
                 return p, i
     if _Debug:
-        for p in queue():
-            if p.filename:
-                lg.out(_DebugLevel, '%s [%s]' % (os.path.basename(p.filename),
-                                                 ('|'.join(['%s:%s' % (i.proto, i.host) for i in p.items]))))
-            else:
-                lg.warn('%s was not initialized yet' % str(p))
+        lg.out(_DebugLevel, 'packet_out.search did not found %s://%s %s among %d outgoing packets' % (
+            proto, host, os.path.basename(filename or ''), len(queue())))
     return None, None
 
 
 def search_by_packet_id(packet_id):
+    """
+    Returns outgoing packets with given packet ID, found in the index by exact (case insensitive) match.
+    All callers pass a full packet ID, but if nothing was found there the whole queue is also checked
+    for packet IDs containing ``packet_id`` as before the index was introduced.
+    """
     result = []
-    for p in queue():
+    candidates = _candidates(packet_id=packet_id)
+    if not candidates:
+        candidates = queue()
+    for p in candidates:
         if p.outpacket.PacketID.count(packet_id):
             result.append(p)
     if _Debug:
@@ -201,7 +294,7 @@ def search_many(proto=None,
                 packet_id=None,
                 ):
     results = []
-    for p in queue():
+    for p in _candidates(packet_id=packet_id, filename=filename, command=command, remote_idurl=remote_idurl):
         # TODO: to be checked later - need to make sure we identify users correctly
         # if remote_idurl and p.remote_idurl.to_bin() != remote_idurl.to_bin():
         if remote_idurl and id_url.field(p.remote_idurl).to_bin() != id_url.field(remote_idurl).to_bin():
@@ -226,11 +319,9 @@ def search_many(proto=None,
 
 
 def search_by_transfer_id(transfer_id):
-    for p in queue():
-        for i in p.items:
-            if i.transfer_id and i.transfer_id == transfer_id:
-                return p, i
-    return None, None
+    if not transfer_id:
+        return None, None
+    return _OutboxByTransferID.get(transfer_id, (None, None, ))
 
 
 def search_by_response_packet(newpacket=None, proto=None, host=None, outgoing_command=None, incoming_command=None, incoming_packet_id=None,
@@ -247,9 +338,9 @@ def search_by_response_packet(newpacket=None, proto=None, host=None, outgoing_co
     if incoming_command is None and newpacket:
         incoming_command = newpacket.Command
     if _Debug:
-        lg.out(_DebugLevel, 'packet_out.search_by_response_packet for incoming [%s/%s/%s]:%s|%s(%s) from [%s://%s] :\n%s' % (
+        lg.out(_DebugLevel, 'packet_out.search_by_response_packet for incoming [%s/%s/%s]:%s|%s(%s) from [%s://%s], %d packets in outbox' % (
             nameurl.GetName(incoming_owner_idurl), nameurl.GetName(incoming_creator_idurl), nameurl.GetName(incoming_remote_idurl),
-            outgoing_command, incoming_command, incoming_packet_id, proto, host, ('\n'.join([strng.to_text(p.outpacket) for p in queue()]))))
+            outgoing_command, incoming_command, incoming_packet_id, proto, host, len(queue())))
     matching_packet_ids = []
     matching_packet_ids.append(incoming_packet_id.lower())
     if incoming_command and incoming_command in [commands.Data(), commands.Retrieve(), ] and id_url.is_cached(incoming_owner_idurl) and incoming_owner_idurl == my_id.getIDURL():
@@ -260,7 +351,10 @@ def search_by_response_packet(newpacket=None, proto=None, host=None, outgoing_co
                 matching_packet_ids.append(another_packet_id)
     if len(matching_packet_ids) > 1:
         lg.warn('multiple packet IDs expecting to match for that packet: %r' % matching_packet_ids)
-    for p in queue():
+    candidates = set()
+    for another_packet_id in matching_packet_ids:
+        candidates.update(_OutboxByPacketID.get(another_packet_id, set()))
+    for p in _queue_order(candidates):
         # TODO: investigate more
         if p.outpacket.PacketID.lower() not in matching_packet_ids:
             # PacketID of incoming packet not matching with that outgoing packet
@@ -687,17 +781,24 @@ class PacketOut(automat.Automat):
         if self.route:
             a_packet = self.route.get('packet', a_packet)
         try:
-            fileno, self.filename = tmpfile.make('outbox', extension='.out')
-            self.packetdata = a_packet.Serialize()
-            os.write(fileno, self.packetdata)
-            os.close(fileno)
+            self.packetdata = a_packet.Serialize(binary=signed.IsBinaryFormatSupported(self.remote_idurl))
             self.filesize = len(self.packetdata)
+            if self.filesize < settings.getOutboxInMemoryPacketSize():
+                # small packets are passed to the transports directly from memory
+                self.filename = tmpfile.make_in_memory('outbox', self.packetdata, extension='.out')
+            else:
+                fileno, self.filename = tmpfile.make('outbox', extension='.out')
+                os.write(fileno, self.packetdata)
+                os.close(fileno)
+            index_filename(self)
             if self.filesize < 1024 * 10:
                 self.timeout = 10
             elif self.filesize > 1024 * 1024:
                 self.timeout = int(self.filesize / float(settings.SendingSpeedLimit()))
             else:
                 self.timeout = 300
+            from transport import gateway
+            gateway.register_packet_timeout(self, self.time + self.timeout)
 #             self.timeout = min(
 #                 settings.SendTimeOut() * 3,
 #                 max(int(self.filesize/(settings.SendingSpeedLimit()/len(queue()))),
@@ -723,6 +824,8 @@ class PacketOut(automat.Automat):
         """
         Action method.
         """
+        for i in self.items:
+            index_remove_transfer_id(i)
         self.items = []
 
     def doSetTransferID(self, *args, **kwargs):
@@ -733,7 +836,9 @@ class PacketOut(automat.Automat):
         proto, host, filename, transfer_id = args[0]
         for i in range(len(self.items)):
             if self.items[i].proto == proto:  # and self.items[i].host == host:
+                index_remove_transfer_id(self.items[i])
                 self.items[i].transfer_id = transfer_id
+                index_transfer_id(self, self.items[i])
                 if _Debug:
                     lg.out(_DebugLevel, 'packet_out.doSetTransferID  %r:%r = %r' % (proto, host, transfer_id))
                 ok = True
@@ -919,7 +1024,13 @@ class PacketOut(automat.Automat):
         """
         Remove all references to the state machine object to destroy it.
         """
+        from transport import gateway
+        gateway.unregister_packet_timeout(self)
         queue().remove(self)
+        index_remove(self)
+        if self.filename and tmpfile.is_in_memory(self.filename):
+            # transports may still have that file in the queue, see gateway.send_file()
+            tmpfile.release('outbox', self.filename, 'packet_out destroyed')
         if self not in self.outpacket.Packets:
             lg.warn('packet_out not connected to the packet')
         else:
@@ -1123,6 +1234,7 @@ class PacketOut(automat.Automat):
             for i in self.items:
                 if i.transfer_id and i.transfer_id == transfer_id:
                     self.items.remove(i)
+                    index_remove_transfer_id(i)
                     i.status = status
                     i.error_message = error_message
                     i.bytes_sent = size
@@ -1137,6 +1249,7 @@ class PacketOut(automat.Automat):
             for i in self.items:
                 if i.proto == proto and i.host == host:
                     self.items.remove(i)
+                    index_remove_transfer_id(i)
                     i.status = 'failed'
                     i.error_message = err_msg
                     i.bytes_sent = size
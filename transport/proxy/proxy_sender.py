@@ -327,7 +327,9 @@ class ProxySender(automat.Automat):
                 lg.out(_DebugLevel, 'proxy_sender._do_send_packet_to_router SKIP, packet addressed to router and must be sent in a usual way')
             return None
         try:
-            raw_data = outpacket.Serialize()
+            # router must also read the packet to forward it, so both nodes must support binary format
+            use_binary = signed.IsBinaryFormatSupported(router_idurl) and signed.IsBinaryFormatSupported(outpacket.RemoteID)
+            raw_data = outpacket.Serialize(binary=use_binary)
         except:
             lg.exc('failed to Serialize %s' % outpacket)
             return None
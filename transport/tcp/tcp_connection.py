@@ -47,7 +47,6 @@ _DebugLevel = 10
 
 #------------------------------------------------------------------------------
 
-import os
 import time
 
 from twisted.protocols import basic  # @UnresolvedImport
@@ -61,6 +60,8 @@ from automats import automat
 from lib import strng
 from lib import net_misc
 
+from system import tmpfile
+
 #------------------------------------------------------------------------------
 
 FIRST_PRIORITY_SHORT_FILE_SIZE = 64 * 1024
@@ -469,13 +470,13 @@ class TCPConnection(automat.Automat, basic.Int32StringReceiver):
             # we have a queue of files to be sent
             # somehow file may be removed before we start sending it
             # so we check it here and skip not existed files
-            if not os.path.isfile(filename):
+            if not tmpfile.file_exists(filename):
                 self.failed_outbox_queue_item(filename, description, 'file not exist')
                 if not (keep_alive or self.force_keep_alive):
                     self.automat('shutdown')
                 continue
             try:
-                filesize = os.path.getsize(filename)
+                filesize = tmpfile.file_size(filename)
             except:
                 self.failed_outbox_queue_item(filename, description, 'can not get file size')
                 if not (keep_alive or self.force_keep_alive):
@@ -27,8 +27,7 @@
 #------------------------------------------------------------------------------
 
 from __future__ import absolute_import
-from io import open
-from io import StringIO
+from io import BytesIO
 
 #------------------------------------------------------------------------------
 
@@ -108,21 +107,16 @@ class FileQueue:
         #             import random
         #             if random.randint(1, 100) > 90:
         #                 return True
-        newoutput = ''.join((
-            struct.pack('i', stream_id),
-            struct.pack('i', outfile.size),
-            output))
-        return self.session.send_packet(udp.CMD_DATA, strng.to_bin(newoutput))
+        newoutput = struct.pack('ii', stream_id, outfile.size) + output
+        return self.session.send_packet(udp.CMD_DATA, newoutput)
 
     def do_send_ack(self, stream_id, infile, ack_data):
         #         if _Debug:
         #             import random
         #             if random.randint(1, 100) > 90:
         #                 return True
-        newoutput = ''.join((
-            struct.pack('i', stream_id),
-            ack_data))
-        return self.session.send_packet(udp.CMD_ACK, strng.to_bin(newoutput))
+        newoutput = struct.pack('i', stream_id) + strng.to_bin(ack_data)
+        return self.session.send_packet(udp.CMD_ACK, newoutput)
 
     def append_outbox_file(self, filename, description='', result_defer=None, keep_alive=True):
         from transport.udp import udp_session
@@ -151,11 +145,11 @@ class FileQueue:
             # we have a queue of files to be sent
             # somehow file may be removed before we start sending it
             # so I check it here and skip not existed files
-            if not os.path.isfile(filename):
+            if not tmpfile.file_exists(filename):
                 self.on_failed_outbox_queue_item(filename, description, 'file not exist', result_defer, keep_alive)
                 continue
             try:
-                filesize = os.path.getsize(filename)
+                filesize = tmpfile.file_size(filename)
             except:
                 self.on_failed_outbox_queue_item(filename, description, 'can not get file size', result_defer, keep_alive)
                 continue
@@ -246,7 +240,7 @@ class FileQueue:
     #-------------------------------------------------------------------------
 
     def on_received_data_packet(self, payload):
-        inp = StringIO(payload)
+        inp = BytesIO(payload)
         try:
             stream_id = int(struct.unpack('i', inp.read(4))[0])
             data_size = int(struct.unpack('i', inp.read(4))[0])
@@ -260,7 +254,7 @@ class FileQueue:
                 lg.warn('SEND ZERO ACK, peer id is unknown yet %s' % stream_id)
             self.do_send_ack(stream_id, None, '')
             return
-        if stream_id not in list(self.streams.keys()):
+        if stream_id not in self.streams:
             if stream_id in self.dead_streams:
                 inp.close()
                 # if _Debug:
@@ -286,7 +280,7 @@ class FileQueue:
         inp.close()
 
     def on_received_ack_packet(self, payload):
-        inp = StringIO(payload)
+        inp = BytesIO(payload)
         try:
             stream_id = int(struct.unpack('i', inp.read(4))[0])
         except:
@@ -294,7 +288,7 @@ class FileQueue:
             lg.exc()
             # self.session.automat('shutdown')
             return
-        if stream_id not in list(self.streams.keys()):
+        if stream_id not in self.streams:
             inp.close()
             # if not self.receivedFiles.has_key(stream_id):
             # lg.warn('unknown stream_id=%d in ACK packet from %s' % (
@@ -560,7 +554,7 @@ class OutboxFile():
         self.status = None
         self.error_message = ''
         self.started = time.time()
-        self.fileobj = open(self.filename, 'rb')
+        self.fileobj = tmpfile.open_file(self.filename)
         if _Debug:
             lg.out(18, 'udp_file_queue.OutboxFile.__init__ {%s} [%d] to %s with %d bytes' % (
                 os.path.basename(self.filename), self.stream_id, str(self.queue.session.peer_address), self.size))
@@ -70,6 +70,9 @@ _DebugLevel = 14
 MIN_PROCESS_SESSIONS_DELAY = 0.001
 MAX_PROCESS_SESSIONS_DELAY = 1.0
 
+DATAGRAM_SIZE_TO_PROBE = 1232  # fits into IPv6 minimum MTU, probed together with the max size from settings
+MAX_DATAGRAM_SIZE_PROBES = 3  # after that many attempts keep using the best confirmed size
+
 #------------------------------------------------------------------------------
 
 _SessionsDict = {}
@@ -297,6 +300,7 @@ class UDPSession(automat.Automat):
         Method to initialize additional variables and flags at creation of the
         state machine.
         """
+        from transport.udp import udp_stream
         if _Debug:
             self.log_events = True
             self.log_transitions = True
@@ -305,12 +309,25 @@ class UDPSession(automat.Automat):
         self.peer_rtt_id = '0'  # in
         self.rtts = {}
         self.min_rtt = None
+        self.datagram_size = udp_stream.UDP_DATAGRAM_SIZE
+        self.datagram_size_probes = 0
 
     def send_packet(self, command, payload):
         self.bytes_sent += len(payload)
         return udp.send_command(self.node.listen_port, command,
                                 payload, self.peer_address)
 
+    def on_datagram_size_failed(self):
+        """
+        Called by the stream when remote peer did not receive anything at all, go back to the safe size.
+        """
+        from transport.udp import udp_stream
+        if self.datagram_size > udp_stream.UDP_DATAGRAM_SIZE:
+            lg.warn('datagram size %d failed, fall back to %d bytes for %s' % (
+                self.datagram_size, udp_stream.UDP_DATAGRAM_SIZE, self.peer_address, ))
+            self.datagram_size = udp_stream.UDP_DATAGRAM_SIZE
+            self.datagram_size_probes = MAX_DATAGRAM_SIZE_PROBES
+
     def A(self, event, *args, **kwargs):
         #---AT_STARTUP---
         if self.state == 'AT_STARTUP':
@@ -342,8 +359,13 @@ class UDPSession(automat.Automat):
             elif event == 'datagram-received' and self.isPing(*args, **kwargs):
                 self.doAcceptPing(*args, **kwargs)
                 self.doGreeting(*args, **kwargs)
+            elif event == 'datagram-received' and self.isProbe(*args, **kwargs):
+                self.doAcceptProbe(*args, **kwargs)
+            elif event == 'datagram-received' and self.isProbeAck(*args, **kwargs):
+                self.doAcceptProbeAck(*args, **kwargs)
             elif event == 'send-keep-alive' or event == 'timer-10sec':
                 self.doAlive(*args, **kwargs)
+                self.doProbeDatagramSize(*args, **kwargs)
         #---PING---
         elif self.state == 'PING':
             if event == 'timer-1sec':
@@ -384,6 +406,7 @@ class UDPSession(automat.Automat):
                 self.doNotifyConnected(*args, **kwargs)
                 self.doCheckPendingFiles(*args, **kwargs)
                 self.doAlive(*args, **kwargs)
+                self.doProbeDatagramSize(*args, **kwargs)
             elif event == 'datagram-received' and self.isPing(*args, **kwargs):
                 self.doAcceptPing(*args, **kwargs)
                 self.doStartRTT(*args, **kwargs)
@@ -425,6 +448,20 @@ class UDPSession(automat.Automat):
         command = args[0][0][0]
         return (command == udp.CMD_ALIVE)
 
+    def isProbe(self, *args, **kwargs):
+        """
+        Condition method.
+        """
+        command = args[0][0][0]
+        return (command == udp.CMD_PROBE)
+
+    def isProbeAck(self, *args, **kwargs):
+        """
+        Condition method.
+        """
+        command = args[0][0][0]
+        return (command == udp.CMD_PROBE_ACK)
+
 #    def isGreetingOrAlive(self, *args, **kwargs):
 #        """
 #        Condition method.
@@ -490,6 +527,66 @@ class UDPSession(automat.Automat):
         # print 'doAlive', self.peer_rtt_id
         self.peer_rtt_id = '0'
 
+    def doProbeDatagramSize(self, *args, **kwargs):
+        """
+        Action method.
+        """
+        from main import settings
+        if self.datagram_size_probes >= MAX_DATAGRAM_SIZE_PROBES:
+            return
+        max_size = settings.getUDPMaxDatagramSize()
+        sizes = [sz for sz in set([max_size, DATAGRAM_SIZE_TO_PROBE, ]) if self.datagram_size < sz <= max_size]
+        if not sizes:
+            return
+        self.datagram_size_probes += 1
+        for sz in sorted(sizes, reverse=True):
+            header = strng.to_bin('%d ' % sz)
+            # 2 bytes are taken by software version and command identifier
+            udp.send_command(
+                self.node.listen_port,
+                udp.CMD_PROBE,
+                header + b'\x00' * (sz - 2 - len(header)),
+                self.peer_address,
+            )
+
+    def doAcceptProbe(self, *args, **kwargs):
+        """
+        Action method.
+        """
+        address, command, payload = self._dispatch_datagram(args[0])
+        try:
+            size = int(strng.to_text(payload[:payload.index(b' ')]))
+        except:
+            lg.exc()
+            return
+        if size != len(payload) + 2:
+            lg.warn('wrong probe datagram size %d from %s' % (size, self.peer_address, ))
+            return
+        udp.send_command(
+            self.node.listen_port,
+            udp.CMD_PROBE_ACK,
+            strng.to_bin(str(size)),
+            self.peer_address,
+        )
+
+    def doAcceptProbeAck(self, *args, **kwargs):
+        """
+        Action method.
+        """
+        from main import settings
+        address, command, payload = self._dispatch_datagram(args[0])
+        try:
+            size = int(strng.to_text(payload))
+        except:
+            lg.exc()
+            return
+        if size <= self.datagram_size or size > settings.getUDPMaxDatagramSize():
+            return
+        self.datagram_size = size
+        if _Debug:
+            lg.out(_DebugLevel, 'udp_session.doAcceptProbeAck datagram size is %d bytes for %s' % (
+                self.datagram_size, self.peer_address, ))
+
     def doAcceptPing(self, *args, **kwargs):
         """
         Action method.
@@ -47,7 +47,27 @@ EVENTS:
 
 
 
-TODO: Need to put small explanation here.
+Every stream drives itself, there is no polling loop:
+
+    + sender pushes new blocks when data is consumed from the file and when ACK arrives,
+      number of blocks in flight is limited by congestion window: it grows by one block
+      for every acked block (slow start) or by one block every RTT (congestion avoidance)
+      and is reduced when blocks are lost
+    + bandwidth limit is applied with a token bucket, when it is empty a timer is started
+      to continue sending exactly when enough tokens are collected
+    + a block is resent when it was not acked in RTO seconds or when later blocks were
+      acked DUPLICATED_ACKS_LIMIT times
+    + receiver sends ACK for every BLOCKS_PER_ACK blocks, immediately when some blocks are
+      missing and otherwise at most after ACK_DELAY seconds
+
+All blocks of the stream have same size except the last one: datagram size of the session
+(see ``udp_session``) minus DATAGRAM_HEADER_SIZE. Outgoing blocks are kept in ordered dictionaries,
+by block_id and by the time they were sent, so every ACK and every timer only touches blocks it
+needs. Incoming blocks are copied into a preallocated ``InputBuffer`` ring and passed to the file
+in contiguous pieces.
+
+``process_streams()`` only checks timeouts and balances limits every HOUSEKEEPING_INTERVAL
+seconds and stops when there are no streams, so idle node does not use CPU at all.
 
 Datagrams format:
 
@@ -80,14 +100,13 @@ Datagrams format:
 #------------------------------------------------------------------------------
 
 from __future__ import absolute_import
-from six.moves import map
-from io import StringIO
 
 #------------------------------------------------------------------------------
 
 import time
 import struct
-import bisect
+
+from collections import OrderedDict
 
 from twisted.internet import reactor  # @UnresolvedImport
 
@@ -104,21 +123,31 @@ _DebugLevel = 16
 
 #------------------------------------------------------------------------------
 
-POOLING_INTERVAL = 0.1   # smaller pooling size will increase CPU load
-UDP_DATAGRAM_SIZE = 508  # largest safe datagram size
-BLOCK_SIZE = UDP_DATAGRAM_SIZE - 14  # 14 bytes - BitDust header
+HOUSEKEEPING_INTERVAL = 1.0  # check timeouts and balance limits, only while streams exist
+PROGRESS_REPORT_INTERVAL = 5.0  # print stream progress in debug mode every N seconds
+UDP_DATAGRAM_SIZE = 508  # largest safe datagram size, bigger one can be used after a probe in udp_session
+DATAGRAM_HEADER_SIZE = 14  # 14 bytes - BitDust header
+BLOCK_SIZE = UDP_DATAGRAM_SIZE - DATAGRAM_HEADER_SIZE
 
 BLOCKS_PER_ACK = 8  # need to verify delivery get success
 # ack packets will be sent as response,
 # one output ack per every N data blocks received
-WINDOW_SIZE = 10  # do not send next group of blocks
-# until current group will be delivered
+ACK_DELAY = 0.02  # do not hold received blocks without ACK longer than that
+
+INITIAL_CWND = 2 * BLOCKS_PER_ACK  # congestion window of a new stream, in blocks
+MIN_CWND = 2  # congestion window never goes below that
+MAX_CWND = 2048  # ~1MB of data in flight per stream with smallest blocks
+INPUT_BUFFER_BLOCKS = MAX_CWND  # receiving side keeps that many blocks received out of order
+DUPLICATED_ACKS_LIMIT = 3  # block is lost if that many ACKs confirmed blocks sent after it
+PACING_BURST_INTERVAL = 0.01  # token bucket can hold that many seconds of sending
+PACING_MIN_DELAY = 0.001  # do not schedule sending timers shorter than that
 
 OUTPUT_BUFFER_SIZE = 16 * 1024  # how many bytes to read from file at once
 CHUNK_SIZE = BLOCK_SIZE * BLOCKS_PER_ACK  # so we know how much to read now
 
 RTT_MIN_LIMIT = 0.004  # round trip time, this adjust how fast we try to send
 RTT_MAX_LIMIT = 3.0    # set ack response timeout for sending
+RTO_MIN_LIMIT = 0.2    # do not resend blocks sooner than that
 MAX_RTT_COUNTER = 100  # used to calculate avarage RTT for this stream
 
 MAX_BLOCKS_INTERVAL = 3  # resending blocks at lease every N seconds
@@ -159,6 +188,7 @@ def create(stream_id, consumer, producer):
     streams()[s.stream_id] = s
     s.automat('init')
     reactor.callLater(0, balance_streams_limits)  # @UndefinedVariable
+    start_process_streams()
     return s
 
 
@@ -225,34 +255,45 @@ def sort_method(stream_instance):
     return stream_instance.input_bytes_per_sec_current
 
 def process_streams():
+    """
+    Housekeeping of all streams: checks timeouts and measures avarage sending rate.
+    Sending and acking is driven by the streams themselves, so this runs rarely
+    and stops completely when there are no streams.
+    """
     global _ProcessStreamsTask
     global _ProcessStreamsIterations
     global _CurrentSendingAvarageRate
-
-    for s in streams().values():
-        if s.state != 'RECEIVING':
-            continue
-        s.event('iterate')
+    _ProcessStreamsTask = None
+    _ProcessStreamsIterations += 1
 
     sending_streams_count = 0.0
     total_sending_rate = 0.0
-    for s in sorted(list(streams().values()), key=lambda s: s.output_blocks_last_delta):
-        if s.state != 'SENDING':
+    for s in list(streams().values()):
+        if s.state not in ('SENDING', 'RECEIVING', ):
             continue
         s.event('iterate')
+        if s.state != 'SENDING':
+            continue
         if s.get_output_limit_from_remote() > 0:
             continue
         total_sending_rate += s.get_current_output_speed()
         sending_streams_count += 1.0
 
-    if sending_streams_count > 0.0:
+    if sending_streams_count > 1.0:
+        #--- only share bandwidth between streams, single stream is limited by congestion window
         _CurrentSendingAvarageRate = total_sending_rate / sending_streams_count
     else:
         _CurrentSendingAvarageRate = 0.0
 
-    if _ProcessStreamsTask is None or _ProcessStreamsTask.called:
+    if streams():
+        start_process_streams()
+
+
+def start_process_streams():
+    global _ProcessStreamsTask
+    if _ProcessStreamsTask is None or not _ProcessStreamsTask.active():
         _ProcessStreamsTask = reactor.callLater(  # @UndefinedVariable
-            POOLING_INTERVAL, process_streams)
+            HOUSEKEEPING_INTERVAL, process_streams)
 
 
 def stop_process_streams():
@@ -269,6 +310,83 @@ class BufferOverflow(Exception):
 
 #------------------------------------------------------------------------------
 
+class InputBuffer(object):
+    """
+    Received blocks are written directly into a preallocated ``bytearray`` used as a ring of equal slots.
+    All blocks of a stream except the last one have same size, so it is taken from the first block.
+    Blocks received before the first one are kept aside in a dictionary until the size is known.
+    """
+
+    def __init__(self, data_size, max_blocks=INPUT_BUFFER_BLOCKS):
+        self.data_size = data_size
+        self.max_blocks = max_blocks
+        self.block_size = 0
+        self.slots = 0
+        self.buffer = None
+        self.lengths = None
+        self.early_blocks = {}
+        self.last_block_id = 0
+        self.pending = 0
+
+    def put(self, block_id, data):
+        """
+        Returns True if block was stored, False for a duplicated or old block
+        and None if block does not fit into the buffer and must not be acked.
+        """
+        if block_id <= self.last_block_id:
+            return False
+        if self.buffer is None:
+            if block_id != 1:
+                if block_id in self.early_blocks:
+                    return False
+                if block_id > self.max_blocks:
+                    return None
+                self.early_blocks[block_id] = data
+                self.pending += 1
+                return True
+            self._allocate(len(data))
+        if block_id - self.last_block_id > self.slots or len(data) > self.block_size:
+            return None
+        slot = (block_id - 1) % self.slots
+        if self.lengths[slot]:
+            return False
+        pos = slot * self.block_size
+        self.buffer[pos:pos + len(data)] = data
+        self.lengths[slot] = len(data)
+        self.pending += 1
+        return True
+
+    def pop(self):
+        """
+        Returns a ``memoryview`` with all data received in order since the last call, or None.
+        Data must be processed right away, because buffer is reused for the next blocks.
+        """
+        if self.buffer is None or not self.lengths[self.last_block_id % self.slots]:
+            return None
+        first_slot = slot = self.last_block_id % self.slots
+        size = 0
+        while slot < self.slots and self.lengths[slot]:
+            size += self.lengths[slot]
+            self.lengths[slot] = 0
+            slot += 1
+        self.last_block_id += slot - first_slot
+        self.pending -= slot - first_slot
+        pos = first_slot * self.block_size
+        return memoryview(self.buffer)[pos:pos + size]
+
+    def _allocate(self, block_size):
+        self.block_size = block_size
+        self.slots = max(1, min(self.max_blocks, (self.data_size + block_size - 1) // block_size))
+        self.buffer = bytearray(self.slots * block_size)
+        self.lengths = [0, ] * self.slots
+        early_blocks = self.early_blocks
+        self.early_blocks = {}
+        self.pending -= len(early_blocks)
+        for block_id, data in early_blocks.items():
+            self.put(block_id, data)
+
+#------------------------------------------------------------------------------
+
 class UDPStream(automat.Automat):
     """
     This class implements all the functionality of the ``udp_stream()`` state
@@ -306,11 +424,15 @@ class UDPStream(automat.Automat):
         self.output_iterations_results = {}
         self.output_ack_last_time = 0
         self.output_block_id_current = 0
+        self.output_block_id_sent = 0
         self.output_acked_block_id_current = 0
+        self.output_acked_block_id_max = 0
         self.output_acked_blocks_ids = set()
         self.output_block_last_time = 0
-        self.output_blocks = {}
-        self.output_blocks_ids = []
+        self.output_blocks = OrderedDict()
+        self.output_blocks_sent = OrderedDict()
+        self.output_tail = b''
+        self.output_bytes_pushed = 0
         self.output_blocks_counter = 0
         self.output_blocks_last_delta = 0
         self.output_blocks_reasons = {}
@@ -332,17 +454,27 @@ class UDPStream(automat.Automat):
         self.output_limit_iteration_last_time = 0
         self.output_rtt_avarage = 0.0
         self.output_rtt_counter = 1.0
+        self.output_rto_backoff = 1.0
+        self.output_cwnd = float(INITIAL_CWND)
+        self.output_ssthresh = float(MAX_CWND)
+        self.output_cwnd_reduced_time = 0.0
+        self.output_blocks_in_flight = 0
+        self.output_tokens = float(BLOCK_SIZE * BLOCKS_PER_ACK)
+        self.block_size = BLOCK_SIZE
+        self.output_tokens_time = 0.0
+        self.iteration_task = None
         self.input_ack_last_time = 0
         self.input_ack_error_last_check = 0
         self.input_acks_counter = 0
         self.input_acks_timeouts_counter = 0
         self.input_acks_garbage_counter = 0
-        self.input_blocks = {}
+        self.input_buffer = None
         self.input_block_id_current = 0
         self.input_block_last_time = 0
         self.input_block_id_last = 0
         self.input_blocks_counter = 0
         self.input_blocks_to_ack = []
+        self.input_blocks_to_ack_time = 0
         self.input_bytes_received = 0
         self.input_bytes_received_period = 0
         self.input_bytes_per_sec_current = 0
@@ -481,6 +613,7 @@ class UDPStream(automat.Automat):
         """
         self.creation_time = time.time()
         self.period_time = time.time()
+        self.block_size = self.producer.session.datagram_size - DATAGRAM_HEADER_SIZE
         self.output_limit_bytes_per_sec = get_global_output_limit_bytes_per_sec() / \
             len(streams())
         self.input_limit_bytes_per_sec = get_global_input_limit_bytes_per_sec() / \
@@ -567,6 +700,9 @@ class UDPStream(automat.Automat):
             self.consumer.error_message = 'sending failed'
         else:
             self.consumer.error_message = 'remote side stopped responding'
+        if self.output_bytes_acked == 0 and self.block_size > BLOCK_SIZE:
+            #--- big datagrams do not pass any more, next streams will use smallest size
+            self.producer.session.on_datagram_size_failed()
         self.consumer.status = 'failed'
         self.consumer.timeout = True
         self.producer.on_timeout_sending(self.stream_id)
@@ -634,10 +770,12 @@ class UDPStream(automat.Automat):
             ))
             lg.out(self.debug_level, '    ACK REASONS: %r' % self.output_acks_reasons)
             del pir_id
-        self.input_blocks.clear()
+        self._cancel_iteration()
+        self.input_buffer = None
         self.input_blocks_to_ack = []
         self.output_blocks.clear()
-        self.output_blocks_ids = []
+        self.output_blocks_sent.clear()
+        self.output_blocks_in_flight = 0
 
     def doUpdateLimits(self, *args, **kwargs):
         """
@@ -658,6 +796,7 @@ class UDPStream(automat.Automat):
         Action method.
         Remove all references to the state machine object to destroy it.
         """
+        self._cancel_iteration()
         self.consumer.clear_stream_callback()
         self.producer.on_close_consumer(self.consumer)
         self.consumer = None
@@ -685,43 +824,37 @@ class UDPStream(automat.Automat):
         self.input_blocks_counter += 1
         if block_id != -1:
             #--- not empty block received
+            if not self.input_blocks_to_ack:
+                self.input_blocks_to_ack_time = self.input_block_last_time
             self.input_bytes_received += len(data)
             self.input_block_id_last = block_id
             eof = False
-            raw_size = 0
-            if block_id in list(self.input_blocks.keys()):
-            #--- duplicated block received
-                self.input_duplicated_blocks += 1
-                self.input_duplicated_bytes += len(data)
-                bisect.insort(self.input_blocks_to_ack, block_id)
-            else:
-                if block_id < self.input_block_id_current:
+            if self.input_buffer is None:
+                self.input_buffer = InputBuffer(self.consumer.size)
+            stored = self.input_buffer.put(block_id, data)
+            if stored is not None:
+                self.input_blocks_to_ack.append(block_id)
+            #--- if block is too far ahead it is not acked, sender will resend it later
+            if stored is False:
+                if block_id <= self.input_block_id_current:
             #--- old block (already processed) received
                     self.input_old_blocks += 1
-                    self.input_duplicated_bytes += len(data)
-                    bisect.insort(self.input_blocks_to_ack, block_id)
                 else:
-            #--- GOOD BLOCK RECEIVED
-                    self.input_blocks[block_id] = data
-                    bisect.insort(self.input_blocks_to_ack, block_id)
+            #--- duplicated block received
+                    self.input_duplicated_blocks += 1
+                self.input_duplicated_bytes += len(data)
             if block_id == self.input_block_id_current + 1:
-            #--- receiving data and check every next block one by one
-                newdata = StringIO()
+            #--- GOOD BLOCK RECEIVED, pass all blocks received in order to the consumer
                 while True:
-                    next_block_id = self.input_block_id_current + 1
-                    try:
-                        blockdata = self.input_blocks.pop(next_block_id)
-                    except KeyError:
+                    newdata = self.input_buffer.pop()
+                    if newdata is None:
                         break
-                    newdata.write(blockdata)
-                    raw_size += len(blockdata)
-                    self.input_block_id_current = next_block_id
-                try:
+                    try:
             #--- consume data and get EOF state
-                    eof = self.consumer.on_received_raw_data(newdata.getvalue())
-                except:
-                    lg.exc()
-                newdata.close()
+                        eof = self.consumer.on_received_raw_data(newdata)
+                    except:
+                        lg.exc()
+                self.input_block_id_current = self.input_buffer.last_block_id
             #--- remember EOF state
             if eof and not self.eof:
                 self.eof = eof
@@ -794,13 +927,13 @@ class UDPStream(automat.Automat):
                     sz = -1
                 lg.out(self.debug_level, '    EOF state found in ACK %d acked:%d not acked:%d total:%d' % (
                     self.stream_id, self.output_bytes_acked, sum_not_acked_blocks, sz))
+        bytes_delivered = 0
+        acked_send_order = -1
         for block_id in acks:
             #--- mark this block as acked
-            if block_id >= self.output_acked_block_id_current:
-                if block_id not in self.output_acked_blocks_ids:
-                    # bisect.insort(self.output_acked_blocks_ids, block_id)
-                    self.output_acked_blocks_ids.add(block_id)
-            if block_id not in self.output_blocks_ids or block_id not in self.output_blocks:
+            if block_id > self.output_acked_block_id_current:
+                self.output_acked_blocks_ids.add(block_id)
+            if block_id not in self.output_blocks:
             #--- garbage, block was already acked
                 self.input_acks_garbage_counter += 1
                 if _Debug:
@@ -808,26 +941,34 @@ class UDPStream(automat.Automat):
                         block_id, self.stream_id))
                 continue
             #--- mark block as acked
-            self.output_blocks_ids.remove(block_id)
             outblock = self.output_blocks.pop(block_id)
+            acked_send_order = max(acked_send_order, self.output_blocks_sent.pop(block_id, -1))
+            if block_id > self.output_acked_block_id_max:
+                self.output_acked_block_id_max = block_id
             block_size = len(outblock[0])
+            bytes_delivered += block_size
             self.output_bytes_acked += block_size
             self.output_buffer_size -= block_size
             self.output_blocks_success_counter += 1.0
             self.output_quality_counter += 1.0
-            relative_time = time.time() - self.creation_time
-            last_ack_rtt = relative_time - outblock[1]
-            self.output_rtt_avarage += last_ack_rtt
-            self.output_rtt_counter += 1.0
+            if outblock[1] >= 0:
+                self.output_blocks_in_flight -= 1
+            self._on_block_acked()
+            if outblock[3] == 1:
+                #--- RTT is only measured for blocks sent once, the ACK of a resent block is ambiguous
+                relative_time = time.time() - self.creation_time
+                last_ack_rtt = relative_time - outblock[1]
+                self.output_rtt_avarage += last_ack_rtt
+                self.output_rtt_counter += 1.0
             #--- drop avarage RTT
             if self.output_rtt_counter > MAX_RTT_COUNTER:
                 rtt_avarage_dropped = self.output_rtt_avarage / self.output_rtt_counter
                 self.output_rtt_counter = round(MAX_RTT_COUNTER / 2.0, 0)
                 self.output_rtt_avarage = rtt_avarage_dropped * self.output_rtt_counter
-            #--- process delivered data
-            eof = self.consumer.on_sent_raw_data(block_size)
-        for block_id in self.output_blocks_ids:
-            #--- mark blocks was not acked at this time
+        for block_id, send_order in self.output_blocks_sent.items():
+            if send_order >= acked_send_order:
+                break
+            #--- mark blocks sent before the acked ones, but not acked yet
             self.output_blocks[block_id][2] += 1
         while True:
             next_block_id = self.output_acked_block_id_current + 1
@@ -837,6 +978,9 @@ class UDPStream(automat.Automat):
                 break
             self.output_acked_block_id_current = next_block_id
             self.output_blocks_acked += 1
+        if bytes_delivered:
+            #--- process delivered data, acked blocks are already counted so the consumer may push more
+            eof = self.consumer.on_sent_raw_data(bytes_delivered)
         eof = eof or eof_flag
         if not self.eof and eof:
             #--- remember EOF state
@@ -866,13 +1010,14 @@ class UDPStream(automat.Automat):
 
     def on_consume(self, data):
         if self.consumer:
-            if self.output_buffer_size + len(data) > OUTPUT_BUFFER_SIZE:
+            #--- keep enough data in the buffer to fill the whole congestion window
+            if self.output_buffer_size + len(data) > OUTPUT_BUFFER_SIZE + int(self.output_cwnd) * self.block_size:
                 raise BufferOverflow(self.output_buffer_size)
-            if self.output_quality_counter > BLOCKS_PER_ACK * WINDOW_SIZE:
+            if self.output_quality_counter > INITIAL_CWND:
                 error_rate = float(self.output_blocks_errors_counter) / (self.output_quality_counter)
                 if error_rate > ACCEPTABLE_ERRORS_RATE:
                     current_window = self.output_block_id_current - self.output_acked_block_id_current
-                    if current_window > BLOCKS_PER_ACK * WINDOW_SIZE:
+                    if current_window > self.output_cwnd:
                         raise BufferOverflow(self.output_buffer_size)
             self.event('consume', data)
 
@@ -884,21 +1029,25 @@ class UDPStream(automat.Automat):
             reactor.callLater(0, self.automat, 'close')  # @UndefinedVariable
 
     def _push_blocks(self, data):
-        outp = StringIO(data)
-        while True:
-            piece = outp.read(BLOCK_SIZE)
-            if not piece:
-                break
+        first_block_id = self.output_block_id_current + 1
+        self.output_bytes_pushed += len(data)
+        if self.output_tail:
+            data = self.output_tail + data
+        #--- all blocks must have same size except the last one, the rest is kept until more data comes
+        size = len(data)
+        if self.output_bytes_pushed < self.consumer.size:
+            size -= size % self.block_size
+        self.output_tail = data[size:]
+        for pos in range(0, size, self.block_size):
+            piece = data[pos:pos + self.block_size]
             self.output_block_id_current += 1
             #--- prepare block to be send
-            bisect.insort(self.output_blocks_ids, self.output_block_id_current)
             # data, time_sent, acks missed, number of attempts
             self.output_blocks[self.output_block_id_current] = [piece, -1, 0, 0]
             self.output_buffer_size += len(piece)
-        outp.close()
         if _Debug:
-            lg.out(self.debug_level + 6, 'PUSH %d [%s]' % (
-                self.output_block_id_current, ','.join(map(str, self.output_blocks_ids)), ))
+            lg.out(self.debug_level + 6, 'PUSH %d %d-%d' % (
+                self.stream_id, first_block_id, self.output_block_id_current, ))
 
     def _sending_loop(self):
         total_rate_out = 0.0
@@ -906,9 +1055,9 @@ class UDPStream(automat.Automat):
         if relative_time > 0:
             total_rate_out = self.output_bytes_sent / float(relative_time)
         if lg.is_debug(self.debug_level):
-            if self.output_quality_counter and relative_time - self.last_progress_report > POOLING_INTERVAL * 50.0:
+            if self.output_quality_counter and relative_time - self.last_progress_report > PROGRESS_REPORT_INTERVAL:
                 if _Debug:
-                    lg.out(self.debug_level, 'udp_stream[%d]|%d/%r%%|garb.:%d/%d|err.:%r%%/%r%%|%rbps|pkt:%d/%d|RTT:%r|lag:%d|last:%r/%r|buf:%d|N:%d' % (
+                    lg.out(self.debug_level, 'udp_stream[%d]|%d/%r%%|garb.:%d/%d|err.:%r%%/%r%%|%rbps|pkt:%d/%d|RTT:%r|lag:%d|cwnd:%d/%d|last:%r/%r|buf:%d|N:%d' % (
                         self.stream_id,
                         #--- current block acked/percent sent
                         self.output_acked_block_id_current,
@@ -928,6 +1077,9 @@ class UDPStream(automat.Automat):
                         round(self.output_rtt_avarage / self.output_rtt_counter, 4),
                         #--- current lag
                         (self.output_block_id_current - self.output_acked_block_id_current),
+                        #--- congestion window/blocks in flight
+                        int(self.output_cwnd),
+                        self.output_blocks_in_flight,
                         #--- last BLOCK sent/ACK received
                         round(relative_time - self.output_block_last_time, 4),
                         round(relative_time - self.input_ack_last_time, 4),
@@ -942,7 +1094,7 @@ class UDPStream(automat.Automat):
     def _receiving_loop(self):
         if lg.is_debug(self.debug_level):
             relative_time = time.time() - self.creation_time
-            if relative_time - self.last_progress_report > POOLING_INTERVAL * 50.0:
+            if relative_time - self.last_progress_report > PROGRESS_REPORT_INTERVAL:
                 if _Debug:
                     lg.out(self.debug_level, 'udp_stream[%d] | %d/%r%% | garb.:%d/%d/%r%% | %d bps | b.:%d/%d | pkt.:%d/%d | last: %r | buf: %d | N:%d' % (
                         self.stream_id,
@@ -964,7 +1116,7 @@ class UDPStream(automat.Automat):
                         #--- last BLOCK received
                         round(relative_time - self.input_block_last_time, 4),
                         #--- input buffer
-                        len(self.input_blocks),
+                        self.input_buffer.pending if self.input_buffer else 0,
                         #--- number of streams
                         len(streams()),
                     ))
@@ -982,23 +1134,6 @@ class UDPStream(automat.Automat):
             #--- nothing to send right now
             return
         relative_time = time.time() - self.creation_time
-        last_block_sent_delta = relative_time - self.output_block_last_time
-        current_limit = self.calculate_real_output_limit()
-        if current_limit > 0 and relative_time > 0:
-            possible_bytes_more = BLOCKS_PER_ACK * BLOCK_SIZE
-            current_rate = (self.output_bytes_sent + possible_bytes_more) / relative_time
-            if current_rate > current_limit and last_block_sent_delta < RTT_MAX_LIMIT / 2.0:
-            #--- skip sending : bandwidth limit reached
-                self.output_limit_iteration_last_time = relative_time
-                if _Debug:
-                    lg.out(self.debug_level + 6, 'SKIP RESENDING %d, bandwidth limit : %r>%r, factor: %r, remote: %r' % (
-                        self.stream_id,
-                        int(current_rate),
-                        int(self.output_limit_bytes_per_sec * self.output_limit_factor),
-                        self.output_limit_factor,
-                        self.output_limit_bytes_per_sec_from_remote))
-                self._add_iteration_result('limit')
-                return
         if self.state == 'SENDING' or self.state == 'PAUSE':
             sending_was_limited = relative_time - self.output_limit_iteration_last_time < SENDING_TIMEOUT
             input_ack_timed_out = relative_time - self.input_ack_last_time > SENDING_TIMEOUT
@@ -1019,188 +1154,83 @@ class UDPStream(automat.Automat):
                     lg.out(self.debug_level, '%r' % speeds)
                 reactor.callLater(0, self.automat, 'timeout')  # @UndefinedVariable
                 return
-        if self.input_acks_counter > 0:
-            if last_block_sent_delta < RTT_MAX_LIMIT:
-                current_out_in_rate = self.output_blocks_counter / float(self.input_acks_counter)
-                if current_out_in_rate > float(BLOCKS_PER_ACK) * 1.5:
-                #--- too many blocks sent but few acks, skip sending
-                    if _Debug:
-                        lg.out(self.debug_level + 6, 'SKIP SENDING %d, too few acks:%d blocks:%d' % (
-                            self.stream_id, self.input_acks_counter, self.output_blocks_counter))
-                    self._add_iteration_result('fewacks')
-                    return
-            #--- normal sending, check all pending blocks
-        rtt_current = self._rtt_current()
+        rto_current = self._rto_current()
+        window_available = int(self.output_cwnd) - self.output_blocks_in_flight
+        blocks_to_resend = []
         blocks_to_send_now = []
-        for block_id in self.output_blocks_ids:
-            if len(blocks_to_send_now) >= BLOCKS_PER_ACK:
-            #--- do not send too much blocks at once
-                break
-            time_sent = self.output_blocks[block_id][1]
-            if time_sent != -1:
-                continue
-            #--- send this block first time
-            blocks_to_send_now.append(block_id)
-        if len(blocks_to_send_now) >= BLOCKS_PER_ACK:
-            #--- full group of blocks sending first time, GO!
-            self._send_blocks(blocks_to_send_now)
-            self._add_iteration_result('fullgroup')
-            return
-        bytes_left = self.consumer.size - self.output_bytes_acked
-        if len(blocks_to_send_now) > 0 and bytes_left < BLOCKS_PER_ACK * BLOCK_SIZE:
-            #--- not full group, but almost finished
-            self._send_blocks(blocks_to_send_now)
-            self._add_iteration_result('finishing')
-            return
-        if last_block_sent_delta < RTT_MAX_LIMIT:
-            if self.input_acks_counter == 0:
-            #--- no acks received yet, skip sending
-                self._add_iteration_result('noackyet')
-                return
-            possible_blocks_out = self.output_blocks_counter + len(blocks_to_send_now)
-            possible_out_in_ratio = float(possible_blocks_out) / float(self.input_acks_counter)
-            if possible_out_in_ratio > float(BLOCKS_PER_ACK) * (1.0 + ACCEPTABLE_ERRORS_RATE):
-            #--- sent more blocks, than needed, skip sending
-                self._add_iteration_result('needmoreacks')
-                return
-            #--- last block was sent long ago, need to resend now
-        blocks_not_acked = sorted(self.output_blocks_ids)
-        block_position = 0
-        too_much_errors = False
-        for block_id in blocks_not_acked:
-            block_position += 1
-            if block_id in blocks_to_send_now:
-                continue
-            if len(blocks_to_send_now) >= BLOCKS_PER_ACK:
-                # do not send too much blocks at once
+        blocks_timed_out = False
+        next_timeout = None
+        for block_id, outblock in self.output_blocks.items():
+            if block_id >= self.output_acked_block_id_max:
                 break
-            time_sent = self.output_blocks[block_id][1]
-            if time_sent < 0:
-                continue
-            if relative_time - time_sent < block_position * rtt_current:
-                continue
-            error_rate = float(self.output_blocks_errors_counter + 1) / (self.output_quality_counter + 1.0)
-            if error_rate > ACCEPTABLE_ERRORS_RATE:
-                too_much_errors = True
+            if outblock[2] >= DUPLICATED_ACKS_LIMIT:
+                #--- blocks sent after that one were acked already, this one is lost
+                blocks_to_resend.append(block_id)
+        for block_id in self.output_blocks_sent:
+            #--- blocks are ordered by the time they were sent, so only the oldest needs to be checked
+            time_left = self.output_blocks[block_id][1] + rto_current - relative_time
+            if time_left > 0:
+                next_timeout = time_left
                 break
-            #--- this block was timed out, resending
-            blocks_to_send_now.insert(0, block_id)
-            self.output_blocks_errors_counter += 1
-            self.output_quality_counter += 1.0
-            self.output_error_last_time = relative_time
-        if len(blocks_to_send_now) >= BLOCKS_PER_ACK:
-            #--- full group of blocks with timeouts
-            self._send_blocks(blocks_to_send_now)
-            self._add_iteration_result('fullgroup2')
-            return
-        if len(blocks_to_send_now) > 0 and bytes_left < BLOCKS_PER_ACK * BLOCK_SIZE:
-            #--- not full group, but almost finished
-            self._send_blocks(blocks_to_send_now)
-            self._add_iteration_result('finishing2')
-            return
-        if too_much_errors and last_block_sent_delta < RTT_MAX_LIMIT / 2.0:
-            #--- too much errors, send not full group
-            self._send_blocks(blocks_to_send_now)
-            self._add_iteration_result('errors')
-            return
-        blocks_not_acked = sorted(
-            self.output_blocks_ids,
-            key=lambda bid: self.output_blocks[bid][2],
-            reverse=True,
-        )
-        for block_id in blocks_not_acked:
-            if block_id in blocks_to_send_now:
-                continue
-            if len(blocks_to_send_now) >= BLOCKS_PER_ACK:
-                # do not send too much blocks at once
-                break
-            missed_acks = self.output_blocks[block_id][2]
-            if missed_acks < int(WINDOW_SIZE):
-                continue
-            error_rate = float(self.output_blocks_errors_counter + 1) / float(self.output_quality_counter + 1.0)
-            if error_rate > ACCEPTABLE_ERRORS_RATE:
-                too_much_errors = True
+            if len(blocks_to_resend) >= int(self.output_cwnd):
+                #--- the rest of timed out blocks will be resent when ACKs arrive
                 break
-            blocks_to_send_now.insert(0, block_id)
-            self.output_blocks_errors_counter += 1
-            self.output_quality_counter += 1.0
-            self.output_error_last_time = relative_time
-        if len(blocks_to_send_now) >= BLOCKS_PER_ACK:
-            #--- full group of blocks with missed acks
-            self._send_blocks(blocks_to_send_now)
-            self._add_iteration_result('fullgroup3')
-            return
-            #--- no activity for some time, send some timed out blocks
-        if too_much_errors and last_block_sent_delta < RTT_MAX_LIMIT / 2.0:
-            #--- too much errors, send not full group
-            self._send_blocks(blocks_to_send_now)
-            self._add_iteration_result('errors2')
-            return
-        for block_id in blocks_not_acked:
-            if block_id in blocks_to_send_now:
-                continue
-            if len(blocks_to_send_now) >= BLOCKS_PER_ACK:
-                # do not send too much blocks at once
-                break
-            time_sent = self.output_blocks[block_id][1]
-            if time_sent < 0:
-                continue
-            if relative_time - time_sent < RTT_MAX_LIMIT:
-                continue
-            if self.output_error_last_time < RTT_MAX_LIMIT:
-                if self.output_quality_counter > BLOCKS_PER_ACK:
-                    error_rate = float(self.output_blocks_errors_counter) / float(self.output_quality_counter)
-                    if error_rate > ACCEPTABLE_ERRORS_RATE:
-                        too_much_errors = True
-                        break
-            blocks_to_send_now.insert(0, block_id)
-            self.output_blocks_errors_counter += 1
-            self.output_quality_counter += 1.0
-            self.output_error_last_time = relative_time
-        if len(blocks_to_send_now) >= BLOCKS_PER_ACK:
-            #--- full group of blocks with big timeouts
-            self._send_blocks(blocks_to_send_now)
-            self._add_iteration_result('fullgroup4')
-            return
-        if len(blocks_to_send_now) > 0:
-            #--- not full group, bad situation
-            self._send_blocks(blocks_to_send_now)
-            self._add_iteration_result('badgroup')
-            return
-        if last_block_sent_delta > RECEIVING_TIMEOUT / 3.0 and len(self.output_blocks_ids) > 0:
-            #--- keep alive, send one block
-            oldest_block_id = sorted(self.output_blocks_ids)[0]
-            self._send_blocks([oldest_block_id, ])
-            self._add_iteration_result('alive')
-            return
-            #--- skip sending, no blocks ready to be sent
-        self._add_iteration_result('skip')
+            if self.output_blocks[block_id][2] < DUPLICATED_ACKS_LIMIT:
+                #--- this block was timed out, resending
+                blocks_to_resend.append(block_id)
+                blocks_timed_out = True
+        #--- send next blocks first time if congestion window allows
+        next_block_id = self.output_block_id_sent + 1
+        while len(blocks_to_send_now) < window_available and next_block_id <= self.output_block_id_current:
+            blocks_to_send_now.append(next_block_id)
+            next_block_id += 1
+        if blocks_to_resend:
+            self._on_blocks_lost(relative_time, blocks_to_resend, blocks_timed_out)
+            self._add_iteration_result('timeout' if blocks_timed_out else 'lost')
+        if blocks_to_send_now:
+            self._add_iteration_result('window')
+        blocks_to_send = blocks_to_resend + blocks_to_send_now
+        delays = []
+        if next_timeout is not None:
+            delays.append(next_timeout)
+        if blocks_to_send:
+            blocks_sent = self._send_blocks(blocks_to_send)
+            if blocks_sent < len(blocks_to_send):
+            #--- bandwidth limit reached or socket is busy, continue a bit later
+                delays.append(self._pacing_delay())
+            if blocks_sent > 0:
+            #--- just sent blocks will time out after RTO
+                delays.append(rto_current)
+        if delays:
+            self._schedule_iteration(min(delays))
 
     def _send_blocks(self, blocks_to_send):
         relative_time = time.time() - self.creation_time
         current_limit = self.calculate_real_output_limit()
-        new_blocks_counter = 0
+        self._refill_tokens(relative_time, current_limit)
+        blocks_sent = 0
         for block_id in blocks_to_send:
             piece = self.output_blocks[block_id][0]
             data_size = len(piece)
-            if current_limit > 0 and relative_time > 0:
+            if current_limit > 0 and self.output_tokens < data_size:
             #--- limit sending, current rate is too big
-                current_rate = (self.output_bytes_sent + data_size) / relative_time
-                if current_rate > current_limit:
-                    last_block_sent_delta = relative_time - self.output_block_last_time
-                    if new_blocks_counter > 0 and last_block_sent_delta < RTT_MAX_LIMIT / 2.0:
-                        self._add_iteration_result('limit1')
-                        break
-                    last_ack_received_delta = relative_time - self.output_ack_last_time
-                    if last_ack_received_delta < RTT_MAX_LIMIT:
-                        self._add_iteration_result('limit3')
-                        break
-            output = ''.join((struct.pack('i', block_id), piece))
+                self.output_limit_iteration_last_time = relative_time
+                self._add_iteration_result('limit')
+                break
+            output = struct.pack('i', block_id) + piece
             #--- SEND DATA HERE!
             if not self.producer.do_send_data(self.stream_id, self.consumer, output):
-                self._add_iteration_result('limit4')
+                self._add_iteration_result('busy')
                 break
+            if current_limit > 0:
+                self.output_tokens -= data_size
             #--- mark block as sent
+            if self.output_blocks[block_id][1] < 0:
+                self.output_blocks_in_flight += 1
+                self.output_block_id_sent = block_id
+            else:
+                del self.output_blocks_sent[block_id]
+            self.output_blocks_sent[block_id] = self.output_blocks_counter
             self.output_blocks[block_id][1] = relative_time
             # erase acks missed for this block
             self.output_blocks[block_id][2] = 0
@@ -1209,7 +1239,7 @@ class UDPStream(automat.Automat):
             self.output_bytes_sent += data_size
             self.output_bytes_sent_period += data_size
             self.output_blocks_counter += 1
-            new_blocks_counter += 1
+            blocks_sent += 1
             self.output_block_last_time = relative_time
             if _Debug:
                 lg.out(self.debug_level + 8, '<-out BLOCK %d %r %r %d/%d' % (
@@ -1221,14 +1251,79 @@ class UDPStream(automat.Automat):
         if relative_time > 0:
             #--- recalculate current sending speed
             self.output_bytes_per_sec_current = self.output_bytes_sent / relative_time
-        return new_blocks_counter > 0
+        return blocks_sent
+
+    def _refill_tokens(self, relative_time, current_limit):
+        if current_limit <= 0:
+            return
+        bucket_size = max(self.block_size * BLOCKS_PER_ACK, current_limit * PACING_BURST_INTERVAL)
+        self.output_tokens += (relative_time - self.output_tokens_time) * current_limit
+        self.output_tokens = min(self.output_tokens, bucket_size)
+        self.output_tokens_time = relative_time
+
+    def _pacing_delay(self):
+        """
+        How long to wait until the token bucket will have enough bytes for one more block.
+        """
+        current_limit = self.calculate_real_output_limit()
+        if current_limit <= 0 or self.output_tokens >= self.block_size:
+            #--- socket is busy, try again soon
+            return RTT_MIN_LIMIT
+        return max(PACING_MIN_DELAY, (self.block_size - self.output_tokens) / current_limit)
+
+    def _on_block_acked(self):
+        self.output_rto_backoff = 1.0
+        if self.output_cwnd < self.output_ssthresh:
+            #--- slow start: window doubles every RTT
+            self.output_cwnd += 1.0
+        else:
+            #--- congestion avoidance: window grows by one block every RTT
+            self.output_cwnd += 1.0 / self.output_cwnd
+        self.output_cwnd = min(self.output_cwnd, float(MAX_CWND))
+
+    def _on_blocks_lost(self, relative_time, blocks_lost, timed_out):
+        self.output_blocks_errors_counter += len(blocks_lost)
+        self.output_quality_counter += float(len(blocks_lost))
+        self.output_error_last_time = relative_time
+        if relative_time - self.output_cwnd_reduced_time < self._rtt_current():
+            #--- window was already reduced for that group of lost blocks
+            return
+        self.output_ssthresh = max(self.output_cwnd / 2.0, float(MIN_CWND))
+        if timed_out:
+            self.output_rto_backoff = min(self.output_rto_backoff * 2.0, RTT_MAX_LIMIT / RTO_MIN_LIMIT)
+            self.output_cwnd = float(MIN_CWND)
+        else:
+            self.output_cwnd = self.output_ssthresh
+        self.output_cwnd_reduced_time = relative_time
+
+    def _schedule_iteration(self, delay):
+        """
+        Fire "iterate" event after given delay, earlier timer wins if there is one already.
+        """
+        delay = max(delay, PACING_MIN_DELAY)
+        if self.iteration_task and self.iteration_task.active():
+            if self.iteration_task.getTime() <= reactor.seconds() + delay:  # @UndefinedVariable
+                return
+            self.iteration_task.reset(delay)
+            return
+        self.iteration_task = reactor.callLater(delay, self._on_iteration_task)  # @UndefinedVariable
+
+    def _cancel_iteration(self):
+        if self.iteration_task and self.iteration_task.active():
+            self.iteration_task.cancel()
+        self.iteration_task = None
+
+    def _on_iteration_task(self):
+        self.iteration_task = None
+        if self.state in ('SENDING', 'RECEIVING', ):
+            self.event('iterate')
 
     def _resend_ack(self):
         if self.output_acks_counter == 0:
             #--- do send first ACK
             self._send_ack(self.input_blocks_to_ack)
             return
-        if self._block_period_avarage() == 0:
+        if self.input_blocks_counter == 0:
             #--- SKIP: block frequency is unknown
             # that means no input block was received yet
             return
@@ -1271,6 +1366,18 @@ class UDPStream(automat.Automat):
             #--- last ack has been long time ago, send ACK
             self._send_ack(self.input_blocks_to_ack, pause_time, why=4)
             return
+        if self.input_buffer and self.input_buffer.pending > 0 and len(self.input_blocks_to_ack) > 0:
+            #--- some blocks are missing, let the sender know about that quickly
+            self._send_ack(self.input_blocks_to_ack, pause_time, why=2)
+            return
+        if len(self.input_blocks_to_ack) > 0:
+            ack_delay_left = self.input_blocks_to_ack_time + ACK_DELAY - relative_time
+            if ack_delay_left <= 0:
+                #--- do not hold received blocks too long, send ACK
+                self._send_ack(self.input_blocks_to_ack, pause_time, why=5)
+                return
+            #--- wait a bit for more blocks to make a group
+            self._schedule_iteration(ack_delay_left)
         if _Debug and lg.is_debug(self.debug_level):
             why = 6
             if why not in self.output_acks_reasons:
@@ -1290,7 +1397,7 @@ class UDPStream(automat.Automat):
         #--- prepare EOF state in ACK
         ack_data = struct.pack('?', self.eof)
         #--- prepare ACKS
-        ack_data += ''.join([struct.pack('i', bid) for bid in acks])
+        ack_data += b''.join([struct.pack('i', bid) for bid in acks])
         if pause_time > 0:
         #--- add extra "PAUSE REQUIRED" ACK
             ack_data += struct.pack('i', -1)
@@ -1317,6 +1424,10 @@ class UDPStream(automat.Automat):
         rtt_current = self.output_rtt_avarage / self.output_rtt_counter
         return rtt_current
 
+    def _rto_current(self):
+        rto_current = max(RTO_MIN_LIMIT, self._rtt_current() * 2.0 + ACK_DELAY)
+        return min(RTT_MAX_LIMIT, rto_current * self.output_rto_backoff)
+
     def _block_period_avarage(self):
         if self.input_blocks_counter == 0:
             return 0
@@ -1339,7 +1450,11 @@ class UDPStream(automat.Automat):
         own_limit = self.get_output_limit()
         avarage_limit = _CurrentSendingAvarageRate * 1.5
         remote_limit = self.get_output_limit_from_remote()
-        return min(own_limit, avarage_limit, remote_limit)
+        #--- zero means "not limited"
+        limits = [l for l in (own_limit, avarage_limit, remote_limit, ) if l > 0]
+        if not limits:
+            return 0
+        return min(limits)
 
     def get_current_output_speed(self):
         relative_time = time.time() - self.creation_time
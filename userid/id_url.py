@@ -53,17 +53,28 @@ _DebugLevel = 12
 
 #------------------------------------------------------------------------------
 
+SNAPSHOT_VERSION = 1
+SNAPSHOT_SAVE_DELAY = 5
+
+#------------------------------------------------------------------------------
+
 import os
 import sys
+import hashlib
 import tempfile
 
 #------------------------------------------------------------------------------
 
+from twisted.internet import reactor  # @UnresolvedImport
+
+#------------------------------------------------------------------------------
+
 from logs import lg
 
 from system import bpio
 from system import local_fs
 
+from lib import jsn
 from lib import strng
 from lib import nameurl
 
@@ -72,11 +83,18 @@ from main import settings
 #------------------------------------------------------------------------------
 
 _IdentityHistoryDir = None
+_IdentityHistorySnapshotFile = None
+_SnapshotSaveTask = None
 # TODO: if this dictionary grow too much use CodernityDB instead of in-memory storage
 _KnownUsers = {}
 _KnownIDURLs = {}
 _MergedIDURLs = {}
 _Ready = False
+# canonical `ID_URL_FIELD` object for every known IDURL, see `field()`
+_FieldsCache = {}
+_PublicKeyDigests = {}
+# incremented every time some known IDURL starts pointing to another public key
+_DigestsEpoch = 0
 
 #------------------------------------------------------------------------------
 
@@ -84,20 +102,58 @@ def init():
     """
     """
     global _IdentityHistoryDir
-    global _KnownUsers
-    global _KnownIDURLs
-    global _MergedIDURLs
+    global _IdentityHistorySnapshotFile
     global _Ready
-    from userid import identity
     if _Debug:
         lg.out(_DebugLevel, "id_url.init")
+    forget_fields()
     if not _IdentityHistoryDir:
         _IdentityHistoryDir = settings.IdentityHistoryDir()
+    if not _IdentityHistorySnapshotFile:
+        _IdentityHistorySnapshotFile = settings.IdentityHistorySnapshotFile()
     if not os.path.exists(_IdentityHistoryDir):
         bpio._dir_make(_IdentityHistoryDir)
         lg.info('created new folder %r' % _IdentityHistoryDir)
     else:
         lg.info('using existing folder %r' % _IdentityHistoryDir)
+    if not load_snapshot():
+        scan_history()
+        save_snapshot()
+    _Ready = True
+
+
+def shutdown():
+    """
+    """
+    global _IdentityHistoryDir
+    global _KnownIDURLs
+    global _KnownUsers
+    global _Ready
+    global _MergedIDURLs
+    global _PublicKeyDigests
+    global _IdentityHistorySnapshotFile
+    if _SnapshotSaveTask:
+        save_snapshot()
+    _IdentityHistoryDir = None
+    _KnownUsers = {}
+    _KnownIDURLs = {}
+    _MergedIDURLs = {}
+    _PublicKeyDigests = {}
+    _Ready = False
+    forget_fields()
+    _IdentityHistorySnapshotFile = None
+
+#------------------------------------------------------------------------------
+
+def scan_history():
+    """
+    Reads and verifies all identity files in the `IdentityHistoryDir()` folder
+    and populates in-memory index of all known IDURL's.
+    """
+    global _KnownUsers
+    global _KnownIDURLs
+    global _MergedIDURLs
+    from userid import identity
     for one_user_dir in os.listdir(_IdentityHistoryDir):
         one_user_dir_path = os.path.join(_IdentityHistoryDir, one_user_dir)
         one_user_identity_files = []
@@ -153,22 +209,124 @@ def init():
                     if _Debug:
                         lg.out(_DebugLevel, '        revision %d merged with other %d known items' % (
                             one_revision, len(_MergedIDURLs[one_pub_key])))
-    _Ready = True
 
 
-def shutdown():
+def load_snapshot():
     """
+    Populates in-memory index of all known IDURL's from the snapshot file written by `save_snapshot()`.
+    Returns False if snapshot file not exist, was written by another version, is corrupted
+    or files in the `IdentityHistoryDir()` folder were changed after it was written.
+    Identity files are not verified here, that is done again in `identity_cached()` for every
+    user when his identity is received.
     """
-    global _IdentityHistoryDir
-    global _KnownIDURLs
     global _KnownUsers
-    global _Ready
+    global _KnownIDURLs
     global _MergedIDURLs
-    _IdentityHistoryDir = None
-    _KnownUsers = {}
-    _KnownIDURLs = {}
-    _MergedIDURLs = {}
-    _Ready = False
+    if not _IdentityHistorySnapshotFile:
+        return False
+    raw_data = local_fs.ReadBinaryFile(_IdentityHistorySnapshotFile)
+    if not raw_data:
+        return False
+    try:
+        header, _, body = raw_data.partition(b'\n')
+        header = jsn.loads_text(header)
+        if header['version'] != SNAPSHOT_VERSION:
+            lg.warn('identity history snapshot version %r is not supported' % header['version'])
+            return False
+        if header['checksum'] != hashlib.sha1(body).hexdigest():
+            lg.warn('identity history snapshot %r is corrupted' % _IdentityHistorySnapshotFile)
+            return False
+        snapshot = jsn.loads_text(body)
+        if snapshot['history_dir'] != _IdentityHistoryDir or snapshot['files'] != _history_files():
+            lg.warn('identity history snapshot is out-dated, files in %r were changed' % _IdentityHistoryDir)
+            return False
+        known_users = {}
+        merged_idurls = {}
+        pub_keys = []
+        for pub_key, user_dir, revisions in snapshot['keys']:
+            pub_key = strng.to_bin(pub_key)
+            pub_keys.append(pub_key)
+            if user_dir is not None:
+                known_users[pub_key] = os.path.join(_IdentityHistoryDir, user_dir)
+            merged_idurls[pub_key] = {int(rev): strng.to_bin(idurl) for rev, idurl in revisions.items()}
+        known_idurls = {strng.to_bin(idurl): pub_keys[pos] for idurl, pos in snapshot['idurls'].items()}
+    except:
+        lg.exc()
+        return False
+    _KnownUsers.update(known_users)
+    _KnownIDURLs.update(known_idurls)
+    _MergedIDURLs.update(merged_idurls)
+    lg.info('loaded %d known IDURLs of %d users from identity history snapshot' % (
+        len(_KnownIDURLs), len(_MergedIDURLs), ))
+    return True
+
+
+def save_snapshot():
+    """
+    Writes in-memory index of all known IDURL's to the snapshot file together with versions of all identity
+    files found in the `IdentityHistoryDir()` folder, so `load_snapshot()` can detect if it is out-dated.
+    """
+    global _SnapshotSaveTask
+    if _SnapshotSaveTask:
+        if _SnapshotSaveTask.active():
+            _SnapshotSaveTask.cancel()
+        _SnapshotSaveTask = None
+    if not _IdentityHistorySnapshotFile or not _IdentityHistoryDir:
+        return False
+    try:
+        pub_keys = list(_MergedIDURLs.keys())
+        pub_keys.extend(set(_KnownUsers.keys()).union(set(_KnownIDURLs.values())).difference(pub_keys))
+        positions = {pub_key: pos for pos, pub_key in enumerate(pub_keys)}
+        keys = []
+        for pub_key in pub_keys:
+            user_dir = _KnownUsers.get(pub_key)
+            keys.append([
+                strng.to_text(pub_key),
+                os.path.basename(user_dir) if user_dir else None,
+                {strng.to_text(rev): strng.to_text(idurl) for rev, idurl in _MergedIDURLs.get(pub_key, {}).items()},
+            ])
+        body = strng.to_bin(jsn.dumps({
+            'history_dir': _IdentityHistoryDir,
+            'files': _history_files(),
+            'keys': keys,
+            'idurls': {strng.to_text(idurl): positions[pub_key] for idurl, pub_key in _KnownIDURLs.items()},
+        }))
+        header = strng.to_bin(jsn.dumps({
+            'version': SNAPSHOT_VERSION,
+            'checksum': hashlib.sha1(body).hexdigest(),
+        }))
+    except:
+        lg.exc()
+        return False
+    if not local_fs.WriteBinaryFile(_IdentityHistorySnapshotFile, header + b'\n' + body):
+        return False
+    if _Debug:
+        lg.out(_DebugLevel, 'id_url.save_snapshot wrote %d known IDURLs to %r' % (
+            len(_KnownIDURLs), _IdentityHistorySnapshotFile, ))
+    return True
+
+
+def _schedule_snapshot():
+    global _SnapshotSaveTask
+    if not _IdentityHistorySnapshotFile:
+        return
+    if _SnapshotSaveTask and _SnapshotSaveTask.active():
+        return
+    _SnapshotSaveTask = reactor.callLater(SNAPSHOT_SAVE_DELAY, save_snapshot)  # @UndefinedVariable
+
+
+def _history_files():
+    """
+    Returns size and modification time of every file in the `IdentityHistoryDir()` folder.
+    """
+    result = {}
+    for one_user_dir in os.listdir(_IdentityHistoryDir):
+        one_user_dir_path = os.path.join(_IdentityHistoryDir, one_user_dir)
+        result[one_user_dir] = {}
+        for one_filename in os.listdir(one_user_dir_path):
+            one_stat = os.stat(os.path.join(one_user_dir_path, one_filename))
+            result[one_user_dir][one_filename] = [one_stat.st_size, one_stat.st_mtime, ]
+    return result
 
 #------------------------------------------------------------------------------
 
@@ -194,6 +352,7 @@ def identity_cached(new_id_obj):
     if _Debug:
         lg.args(_DebugLevel, user_name=user_name)
     is_identity_rotated = False
+    is_history_changed = False
     latest_id_obj = None
     latest_sources = []
     if pub_key not in _KnownUsers:
@@ -201,6 +360,7 @@ def identity_cached(new_id_obj):
         _KnownUsers[pub_key] = user_path
         first_identity_file_path = os.path.join(user_path, '0')
         local_fs.WriteBinaryFile(first_identity_file_path, new_id_obj.serialize())
+        is_history_changed = True
         if _Debug:
             lg.out(_DebugLevel, 'id_url.identity_cached wrote first item for user %r in identity history: %r' % (
                 user_name, first_identity_file_path))
@@ -246,6 +406,7 @@ def identity_cached(new_id_obj):
             new_sources = new_id_obj.getSources(as_originals=True)
             if latest_sources == new_sources:
                 local_fs.WriteBinaryFile(latest_identity_file_path, new_id_obj.serialize())
+                is_history_changed = True
                 if _Debug:
                     lg.out(_DebugLevel, 'id_url.identity_cached latest identity sources for user %r did not changed, updated file %r' % (
                         user_name, latest_identity_file_path))
@@ -253,21 +414,26 @@ def identity_cached(new_id_obj):
                 next_identity_file = user_identity_files[-1] + 1
                 next_identity_file_path = os.path.join(user_path, strng.to_text(next_identity_file))
                 local_fs.WriteBinaryFile(next_identity_file_path, new_id_obj.serialize())
+                is_history_changed = True
                 is_identity_rotated = True
                 if _Debug:
                     lg.out(_DebugLevel, 'id_url.identity_cached identity sources for user %r changed, wrote new item in the history: %r' % (
                         user_name, next_identity_file_path))
     new_revision = new_id_obj.getRevisionValue()
     new_sources = new_id_obj.getSources(as_originals=True)
+    merged_before = dict(_MergedIDURLs.get(pub_key, {}))
     for new_idurl in reversed(new_sources):
         if new_idurl not in _KnownIDURLs:
             _KnownIDURLs[new_idurl] = new_id_obj.getPublicKey()
+            is_history_changed = True
             if _Debug:
                 lg.out(_DebugLevel, 'id_url.identity_cached new IDURL added: %r' % new_idurl)
         else:
             if _KnownIDURLs[new_idurl] != new_id_obj.getPublicKey():
                 lg.warn('another user had same identity source: %r' % new_idurl)
                 _KnownIDURLs[new_idurl] = new_id_obj.getPublicKey()
+                forget_fields(all_digests=True)
+                is_history_changed = True
         if pub_key not in _MergedIDURLs:
             _MergedIDURLs[pub_key] = {}
             if _Debug:
@@ -285,6 +451,10 @@ def identity_cached(new_id_obj):
             if _Debug:
                 lg.out(_DebugLevel, 'id_url.identity_cached added new revision %d for user %r, total revisions %d: %r -> %r' % (
                     new_revision, user_name, len(_MergedIDURLs[pub_key]), prev_idurl, new_idurl))
+    if is_history_changed or _MergedIDURLs.get(pub_key) != merged_before:
+        _schedule_snapshot()
+    # latest IDURL of that user could be changed, interned fields must be created again
+    forget_fields(list(_MergedIDURLs.get(pub_key, {}).values()) + new_sources)
     if _Debug:
         lg.args(_DebugLevel, is_identity_rotated=is_identity_rotated, latest_id_obj=bool(latest_id_obj))
     if is_identity_rotated and latest_id_obj is not None:
@@ -338,13 +508,19 @@ def field(idurl):
     """
     Translates string into `ID_URL_FIELD` object.
     Also we try to read from local identity cache folder if do not know given "idurl".
+    Fields of already known IDURL's are interned: same object is returned every time
+    until identity of that user is cached again.
     """
     global _KnownIDURLs
+    global _FieldsCache
     if isinstance(idurl, ID_URL_FIELD):
         return idurl
     if idurl in [None, 'None', '', b'None', b'', False, ]:
         return ID_URL_FIELD(idurl)
     idurl = strng.to_bin(idurl.strip())
+    idurl_field = _FieldsCache.get(idurl)
+    if idurl_field is not None:
+        return idurl_field
     if idurl not in _KnownIDURLs:
         if _Debug:
             lg.out(_DebugLevel, 'id_url.field   will try to find %r in local identity cache' % idurl)
@@ -358,7 +534,39 @@ def field(idurl):
                 modul = os.path.basename(cod.co_filename).replace('.py', '')
                 caller = cod.co_name
                 lg.warn('unknown yet idurl %s, call from %s.%s' % (idurl, modul, caller, ))
-    return ID_URL_FIELD(idurl)
+    idurl_field = ID_URL_FIELD(idurl)
+    if idurl in _KnownIDURLs:
+        _FieldsCache[idurl] = idurl_field
+    return idurl_field
+
+
+def forget_fields(idurls=None, all_digests=False):
+    """
+    Removes interned `ID_URL_FIELD` objects of given IDURL's, or all of them if `idurls` is None.
+    With `all_digests=True` public key digests cached inside of every existing field are also invalidated.
+    """
+    global _FieldsCache
+    global _DigestsEpoch
+    if idurls is None:
+        _FieldsCache.clear()
+        all_digests = True
+    else:
+        for idurl in idurls:
+            _FieldsCache.pop(to_original(idurl), None)
+    if all_digests:
+        _DigestsEpoch += 1
+
+
+def public_key_digest(pub_key):
+    """
+    Returns short digest of the given public key, it is calculated only once for every key.
+    """
+    global _PublicKeyDigests
+    digest = _PublicKeyDigests.get(pub_key)
+    if digest is None:
+        digest = hashlib.sha1(strng.to_bin(pub_key)).digest()[:8]
+        _PublicKeyDigests[pub_key] = digest
+    return digest
 
 
 def fields_list(idurl_list):
@@ -622,6 +830,9 @@ class ID_URL_FIELD(object):
         self.latest_as_string = ''
         self.latest_id = ''
         self.latest_revision = -1
+        self.digest = None
+        self.digest_hash = None
+        self.digest_epoch = -1
         if isinstance(idurl, ID_URL_FIELD):
             self.current = idurl.current
         else:
@@ -648,6 +859,12 @@ class ID_URL_FIELD(object):
             lg.exc()
 
     def __eq__(self, idurl):
+        # fast path : both digests are already known and up to date
+        if self.digest and isinstance(idurl, ID_URL_FIELD) and idurl.digest and (
+            self.digest_epoch == idurl.digest_epoch == _DigestsEpoch
+        ):
+            return self.digest == idurl.digest
+
         # always check type : must be `ID_URL_FIELD`
         if not isinstance(idurl, ID_URL_FIELD):
             # to be able to compare with empty value lets make an exception
@@ -669,29 +886,35 @@ class ID_URL_FIELD(object):
             return not bool(self.latest)
 
         # check if we know both sources
-        my_pub_key = self.to_public_key(raise_error=False) 
-        other_pub_key = idurl.to_public_key(raise_error=False)
-        if my_pub_key is None or other_pub_key is None:
+        my_digest = self.to_digest(raise_error=False)
+        other_digest = idurl.to_digest(raise_error=False)
+        if my_digest is None or other_digest is None:
             # if we do not know some of the sources - so can't be sure
             caller_code = sys._getframe().f_back.f_code
             caller_method = caller_code.co_name
             caller_modul = os.path.basename(caller_code.co_filename).replace('.py', '')
             if caller_method.count('lambda') or caller_method.startswith('_'):
                 caller_method = sys._getframe(1).f_back.f_code.co_name
-            if my_pub_key is None:
+            if my_digest is None:
                 exc = KeyError('unknown idurl: %r' % self.current)
             else:
                 exc = KeyError('unknown idurl: %r' % idurl.current)
             lg.exc(msg='called from %s.%s()' % (caller_modul, caller_method), exc_value=exc)
             raise exc
 
-        # now compare based on public key
-        result = (other_pub_key == my_pub_key)
+        # now compare based on public key digest
+        result = (other_digest == my_digest)
         if _Debug:
             lg.args(_DebugLevel * 2, idurl=idurl, current=self.current, latest=self.latest, result=result)
         return result
 
     def __ne__(self, idurl):
+        # fast path : both digests are already known and up to date
+        if self.digest and isinstance(idurl, ID_URL_FIELD) and idurl.digest and (
+            self.digest_epoch == idurl.digest_epoch == _DigestsEpoch
+        ):
+            return self.digest != idurl.digest
+
         # always check type : must be `ID_URL_FIELD`
         if not isinstance(idurl, ID_URL_FIELD):
             # to be able to compare with empty value lets make an exception
@@ -713,24 +936,24 @@ class ID_URL_FIELD(object):
             return bool(self.latest)
 
         # check if we know both sources
-        my_pub_key = self.to_public_key(raise_error=True) 
-        other_pub_key = idurl.to_public_key(raise_error=True)
-        if my_pub_key is None or other_pub_key is None:
+        my_digest = self.to_digest(raise_error=True)
+        other_digest = idurl.to_digest(raise_error=True)
+        if my_digest is None or other_digest is None:
             # if we do not know some of the sources - so can't be sure
             caller_code = sys._getframe().f_back.f_code
             caller_method = caller_code.co_name
             caller_modul = os.path.basename(caller_code.co_filename).replace('.py', '')
             if caller_method.count('lambda') or caller_method.startswith('_'):
                 caller_method = sys._getframe(1).f_back.f_code.co_name
-            if my_pub_key is None:
+            if my_digest is None:
                 exc = KeyError('unknown idurl: %r' % self.current)
             else:
                 exc = KeyError('unknown idurl: %r' % idurl.current)
             lg.exc(msg='called from %s.%s()' % (caller_modul, caller_method), exc_value=exc)
             raise exc
 
-        # now compare based on public key
-        result = (other_pub_key != my_pub_key)
+        # now compare based on public key digest
+        result = (other_digest != my_digest)
         if _Debug:
             lg.args(_DebugLevel * 2, idurl=idurl, current=self.current, latest=self.latest, result=result)
         return result
@@ -740,8 +963,9 @@ class ID_URL_FIELD(object):
         # if idurl1 and idurl2 are different sources of same identity they both must be matching
         # so it must never happen like that: (idurl1 in some_dictionary) and (idurl2 in some_dictionary)
         # same check you can do in a different way: `id_url.is_in(idurl, some_dictionary)`
-        pub_key = self.to_public_key()
-        hsh = pub_key.__hash__()
+        if self.digest_epoch != _DigestsEpoch:
+            self.to_digest()
+        hsh = self.digest_hash
         if _Debug:
             lg.args(_DebugLevel * 2, current=self.current, latest=self.latest, hash=hsh)
         return hsh
@@ -772,11 +996,15 @@ class ID_URL_FIELD(object):
         return len(self.latest)
 
     def refresh(self, replace_original=True):
+        global _FieldsCache
         _latest, _latest_revision = get_latest_revision(self.current)
         if self.latest and self.latest == _latest:
             if _Debug:
                 lg.args(_DebugLevel, latest=self.latest_as_string, refreshed=False)
             return False
+        if _FieldsCache.get(self.current) is self:
+            # interned field must not change, otherwise all other holders will see that
+            _FieldsCache.pop(self.current)
         self.latest = _latest
         self.latest_revision = _latest_revision
         if not self.latest:
@@ -788,6 +1016,7 @@ class ID_URL_FIELD(object):
             self.current = self.latest
             self.current_as_string = self.latest_as_string
             self.current_id = self.latest_id
+            self.digest_epoch = -1
         if _Debug:
             lg.args(_DebugLevel, latest=self.latest_as_string, current=self.current_as_string, refreshed=True)
         return True
@@ -851,3 +1080,33 @@ class ID_URL_FIELD(object):
             raise exc
         pub_key = _KnownIDURLs[self.current]
         return pub_key
+
+    def to_digest(self, raise_error=True):
+        """
+        Returns short digest of the public key of that identity, empty string for empty field.
+        Value is cached inside the field and calculated again only after `forget_fields(all_digests=True)`.
+        If identity is not cached yet returns None or raises KeyError.
+        """
+        global _DigestsEpoch
+        if self.digest_epoch == _DigestsEpoch:
+            return self.digest
+        if not self.current:
+            digest = b''
+        else:
+            pub_key = _KnownIDURLs.get(self.current)
+            if pub_key is None:
+                if not raise_error:
+                    return None
+                caller_code = sys._getframe().f_back.f_code
+                caller_method = caller_code.co_name
+                caller_modul = os.path.basename(caller_code.co_filename).replace('.py', '')
+                if caller_method.count('lambda') or caller_method.startswith('_'):
+                    caller_method = sys._getframe(1).f_back.f_code.co_name
+                exc = KeyError('unknown idurl: %r' % self.current)
+                lg.exc(msg='called from %s.%s()' % (caller_modul, caller_method), exc_value=exc)
+                raise exc
+            digest = public_key_digest(pub_key)
+        self.digest = digest
+        self.digest_hash = hash(digest)
+        self.digest_epoch = _DigestsEpoch
+        return digest